@@ -1,23 +1,33 @@
 # app.py
+import time
+_import_started = time.perf_counter()
+
 import rumps
 import subprocess
 import os
 import signal
-import json
 import threading
-import time
-import re
 import sys
 import certifi
 import shutil
 import logging
 from datetime import datetime
-from google import genai
-from google.genai import types
 
-# --- Custom Recorder Import ---
-# Убедись, что recorder.py лежит рядом и обновлен (версия с двумя райтерами)
-from recorder import ScreenRecorder
+# Ядро (steno/) не зависит от rumps/PyObjC и тяжелых SDK: google.genai
+# подгружается только при генерации, recorder (ScreenCaptureKit) — при старте записи.
+from steno.config import ConfigManager, AI_MODELS, VIDEO_QUALITY_PRESETS, VIDEO_CODECS, CAPTURE_TARGETS, AUDIO_PROFILES, PROCESSING_MODES
+from steno.pipeline import process_video_with_ai
+from steno.jobs import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, ACTIVE_STATES, JobCancelled
+from steno.index import RecordingsIndex, RECORDING, PROTOCOL
+from steno.search import ProtocolSearch, format_item, ACTION
+from steno.ledger import Ledger, RECENT_COST_DAYS, estimate_table, format_estimate, report as usage_report
+from steno.media import MediaError, probe_media
+from steno.segments import find_unfinished, recover_recording
+from steno.live import LiveSession, cleanup_stale
+from steno.ui import (
+    UIStateMachine, ManualLoop, EV_START_REQUESTED, EV_STARTED, EV_START_FAILED, EV_STOP_REQUESTED,
+    EV_SAVED, EV_JOB_CHANGED, EV_FILES_CHANGED, EV_RECOVERED, EV_ALERT, TITLE_START, TITLE_STOP
+)
 
 messageAuthor = 'v1.3'
 APP_BUNDLE_ID = "com.sergeygalay.steno"
@@ -38,6 +48,7 @@ try:
     from UserNotifications import UNUserNotificationCenter, UNAuthorizationOptionAlert, UNAuthorizationOptionSound, UNAuthorizationOptionBadge
     from AppKit import NSMenu
     from Foundation import NSObject, NSURL, NSRunLoop, NSDate, NSBundle
+    from PyObjCTools import AppHelper
     HAS_PYOBJC = True
 except ImportError as e:
     print(f"PyObjC import error: {e}")
@@ -48,27 +59,29 @@ except Exception as e:
 
 # --- Настройка логирования ---
 LOG_DIR = os.path.expanduser("~/Library/Logs/Steno")
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(LOG_FILE, encoding='utf-8')
-    ]
-)
 logger = logging.getLogger("Steno")
 
-# --- SSL Configuration ---
-os.environ['SSL_CERT_FILE'] = certifi.where()
-os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
+def setup_environment():
+    """Логи в файл и SSL-сертификаты — только при запуске приложения, не при импорте."""
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler(LOG_FILE, encoding='utf-8')
+        ]
+    )
 
-# --- Константы и Настройки ---
-CONFIG_FILE = os.path.expanduser("~/.recorder_app_config.json")
+    # --- SSL Configuration ---
+    os.environ['SSL_CERT_FILE'] = certifi.where()
+    os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
 
+# --- Константы и Настройки ---
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 ASSETS_DIR = os.path.join(BASE_PATH, "assets")
 
@@ -77,65 +90,6 @@ ICON_RECORDING = os.path.join(ASSETS_DIR, "icon_recording.png")
 ICON_PROCESSING = os.path.join(ASSETS_DIR, "icon_processing.png")
 ICON_ERROR = os.path.join(ASSETS_DIR, "icon_error.png")
 
-AI_MODELS = [
-    "gemini-3-pro-preview",
-    "gemini-3-flash-preview",
-    "gemini-flash-lite-latest"
-]
-
-DEFAULT_CONFIG = {
-    "api_key": "",
-    "base_url": "https://gemini-warmup.galaypro.ru",
-    "video_device_idx": "0",
-    "video_device_name": "Main Screen",
-    "model_name": "gemini-3-flash-preview",
-    "prompt": "Ты — ИИ-ассистент для составления протоколов встреч. Твоя задача — проанализировать предоставленный медиафайл и вернуть ТОЛЬКО протокол в формате Markdown (оптимизированный для Confluence), строго без вступительных слов, приветствий и пояснений самой нейросети.\n\nИспользуй следующий шаблон:\n# Протокол встречи: [Сформулируй тему]\n**Дата:** [Дата из запроса]\n**Участники:** [Список имен или ролей]\n\n## 1. Саммари (Summary)\n[Краткое, структурированное содержание обсуждения без воды]\n\n## 2. Принятые решения\n* [Список конкретных решений]\n\n## 3. План действий (Action Items)\nОформи строго как таблицу:\n| Задача | Ответственный | Срок |\n| :--- | :--- | :--- |\n| [Описание задачи] | [Имя] | [Дедлайн или -] |",
-    "save_dir": os.path.expanduser("~/Movies/ScreenRecordings"),
-    "video_quality": "Medium",
-    "used_tokens": 0,
-    "last_request_tokens": 0
-}
-
-VIDEO_QUALITY_PRESETS = {
-    "Low": {"width": 960, "height": 540, "fps": 5, "bitrate": 1000000},
-    "Medium": {"width": 1280, "height": 720, "fps": 10, "bitrate": 3000000},
-    "High": {"width": 1920, "height": 1080, "fps": 30, "bitrate": 8000000},
-    "Ultra": {"width": 2560, "height": 1440, "fps": 60, "bitrate": 25000000}
-}
-
-# --- Утилиты ---
-def get_meeting_date(filename):
-    """
-    Алгоритм получения даты встречи:
-    1. Из названия файла (Meet_YYYY-MM-DD_HH-MM-SS.mp4)
-    2. Дата изменения файла
-    3. Дата создания файла
-    4. Текущая дата
-    """
-    # 1. Попытка распарсить из имени файла
-    # Ожидаемый формат от рекордера: Meet_DD.MM.YYYY_HH:MM:SS.mp4
-    basename = os.path.basename(filename)
-    match = re.search(r"Meet_(\d{2}\.\d{2}\.\d{4})_", basename)
-    if match:
-        return match.group(1)
-    
-    # 2. Дата изменения
-    try:
-        mtime = os.path.getmtime(filename)
-        return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d")
-    except:
-        pass
-
-    # 3. Дата создания
-    try:
-        ctime = os.path.getctime(filename)
-        return datetime.fromtimestamp(ctime).strftime("%Y-%m-%d")
-    except:
-        pass
-
-    # 4. Текущая дата
-    return datetime.now().strftime("%Y-%m-%d")
-
 class PermissionManager:
     @staticmethod
     def check_all():
@@ -153,162 +107,14 @@ class PermissionManager:
         options = UNAuthorizationOptionAlert | UNAuthorizationOptionSound | UNAuthorizationOptionBadge
         center.requestAuthorizationWithOptions_completionHandler_(options, lambda granted, error: logger.info(f"Notifications permission granted: {granted}"))
 
-class ConfigManager:
-    @staticmethod
-    def load():
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, "r") as f:
-                    return {**DEFAULT_CONFIG, **json.load(f)}
-            except: pass
-        return DEFAULT_CONFIG.copy()
-
-    @staticmethod
-    def save(config):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(config, f, indent=4)
-
-# --- Воркер ИИ (ОБНОВЛЕННЫЙ ПОД ДВА ФАЙЛА) ---
-def process_video_with_ai(video_path, config, app_instance):
-    try:
-        app_instance.is_processing = True
-        app_instance.update_ui_state()
-        app_instance.set_state_icon("processing")
-        logger.info(f"Starting AI processing logic for: {video_path}")
-        
-        api_key = config.get("api_key")
-        if not api_key:
-            logger.error("API Key is missing")
-            rumps.notification("AI Error", "Нет API ключа", "Настройте ключ в меню")
-            app_instance.is_processing = False
-            app_instance.update_ui_state()
-            if app_instance.is_recording:
-                app_instance.set_state_icon("recording")
-            else:
-                app_instance.set_state_icon("idle")
-            return
-
-        # 1. Определяем файлы для загрузки
-        # Основное видео + микрофон (MP4)
-        files_to_upload_paths = [video_path]
-        
-        # Ищем файл микрофона (M4A)
-        # Он должен лежать рядом с именем: имя_файла_mic.m4a
-        base_name = os.path.splitext(video_path)[0]
-        mic_audio_path = base_name + "_mic.m4a"
-        
-        if os.path.exists(mic_audio_path):
-            logger.info(f"Found microphone audio track: {mic_audio_path}")
-            files_to_upload_paths.append(mic_audio_path)
-        else:
-            logger.warning("Microphone audio file not found, processing video only.")
-
-        # 2. Инициализация клиента
-        client_kwargs = {"api_key": api_key}
-        base_url = config.get("base_url", "").strip()
-        if base_url:
-            if not base_url.startswith(("http://", "https://")):
-                base_url = "https://" + base_url
-            client_kwargs["http_options"] = {"baseUrl": base_url}
-        
-        client = genai.Client(**client_kwargs)
-
-        rumps.notification("AI Обработка", "Загрузка файлов...", f"Файлов: {len(files_to_upload_paths)}")
-        
-        # 3. Загрузка всех файлов
-        uploaded_files = []
-        try:
-            for path in files_to_upload_paths:
-                logger.info(f"Uploading {os.path.basename(path)}...")
-                uf = client.files.upload(file=path)
-                uploaded_files.append(uf)
-        except Exception as upload_err:
-            logger.exception("File upload failed")
-            raise Exception(f"Ошибка загрузки: {upload_err}")
-
-        # 4. Ожидание процессинга ВСЕХ файлов
-        ready_files = []
-        for uf in uploaded_files:
-            logger.info(f"Waiting for processing: {uf.name} ({uf.display_name})")
-            while uf.state.name == "PROCESSING":
-                time.sleep(3)
-                uf = client.files.get(name=uf.name)
-
-            if uf.state.name == "FAILED":
-                logger.error(f"Google failed to process file {uf.name}")
-                raise Exception(f"Google не смог обработать файл {uf.display_name}")
-            
-            ready_files.append(uf)
-            logger.info(f"File ready: {uf.name}")
-        
-        # 5. Генерация контента
-        logger.info(f"Generating protocol with model: {config.get('model_name')}")
+class MainThreadLoop:
+    """Цикл событий UIStateMachine: вызовы выполняются в главном потоке AppKit."""
 
-        # Формируем жесткий User Prompt с датой
-        meeting_date = get_meeting_date(video_path)
-        user_prompt_text = f"Составь протокол по прикрепленному файлу.\n\nДата встречи: {meeting_date}"
-        
-        # Системный промпт берем из конфига (редактируемый пользователем)
-        system_instruction = config.get("prompt")
-
-        # Собираем контент: [File1, File2, ..., UserPrompt]
-        contents = ready_files + [user_prompt_text]
-
-        response = client.models.generate_content(
-            model=config.get("model_name"),
-            contents=contents,
-            config=types.GenerateContentConfig(
-                http_options={"timeout": 600000},
-                system_instruction=system_instruction
-            )
-        )
+    def call_soon(self, fn, *args):
+        AppHelper.callAfter(fn, *args)
 
-        # --- Token Usage Tracking ---
-        if response.usage_metadata:
-            total_tokens = response.usage_metadata.total_token_count
-            config["used_tokens"] = config.get("used_tokens", 0) + total_tokens
-            config["last_request_tokens"] = total_tokens
-            ConfigManager.save(config)
-            try:
-                app_instance.update_token_stats()
-            except Exception as e:
-                logger.warning(f"Failed to update token stats in UI: {e}")
-        # ----------------------------
-
-        txt_path = base_name + "_protocol.txt"
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(response.text)
-
-        logger.info(f"Protocol saved to: {txt_path}")
-
-        # 6. Удаление файлов из облака
-        for uf in ready_files:
-            try: 
-                client.files.delete(name=uf.name)
-                logger.info(f"Remote file deleted: {uf.name}")
-            except Exception as delete_err: 
-                logger.warning(f"Could not delete remote file: {delete_err}")
-
-        rumps.notification("Готово!", "Протокол сохранен", f"Файл: {os.path.basename(txt_path)}")
-        app_instance.is_processing = False
-        app_instance.update_ui_state()
-        app_instance.refresh_files_menus()
-        
-        if app_instance.is_recording:
-            app_instance.set_state_icon("recording")
-        else:
-            app_instance.set_state_icon("idle")
-
-    except Exception as e:
-        logger.exception("AI worker failed")
-        rumps.notification("AI Ошибка", "Сбой обработки", str(e)[:50])
-        app_instance.flash_error()
-        app_instance.is_processing = False
-        app_instance.update_ui_state()
-        if app_instance.is_recording:
-            app_instance.set_state_icon("recording")
-        else:
-            app_instance.set_state_icon("idle")
+    def call_later(self, delay, fn, *args):
+        AppHelper.callLater(delay, fn, *args)
 
 # --- GUI Приложение ---
 class RecorderApp(rumps.App):
@@ -318,24 +124,41 @@ class RecorderApp(rumps.App):
         
         super(RecorderApp, self).__init__(name=title, icon=initial_icon, quit_button=None)
         self.config = ConfigManager.load()
-        self.is_recording = False
-        self.is_processing = False
+
+        # Состояние меню меняют только события в главном потоке (steno/ui.py)
+        self.ui = UIStateMachine(MainThreadLoop() if HAS_PYOBJC else ManualLoop(), self)
+
+        # Очередь ИИ-обработки (переживает перезапуск приложения)
+        self.jobs = JobQueue(
+            self.run_job,
+            max_concurrent=self.config.get("max_parallel_jobs", 2),
+            on_change=self.on_job_changed
+        )
         
         # Native Capture Properties
         self.recorder = None
+        # Загрузка кусков во время записи: путь записи -> LiveSession
+        self.live_sessions = {}
         self.current_filename = None
         self.mic_audio_filename = None
         
         if not os.path.exists(self.config["save_dir"]):
             os.makedirs(self.config["save_dir"])
 
+        # Индекс папки записей: меню перестраивается только при изменениях в ней
+        self.files_index = RecordingsIndex(self.config["save_dir"])
         self.recent_recordings_menu = rumps.MenuItem("Recent Recordings")
         self.recent_protocols_menu = rumps.MenuItem("Recent Protocols")
+        # Поиск по протоколам (SQLite, индекс дозаполняется в фоне при запуске)
+        self.protocol_search = ProtocolSearch()
+        self.search_menu = rumps.MenuItem("Search Protocols")
+        self.queue_menu = rumps.MenuItem("Processing Queue")
         self.build_menu()
-        
-        # Таймер для обновления меню (не слишком частый)
-        self.refresh_timer = threading.Timer(1.0, self.refresh_files_menus)
-        self.refresh_timer.start()
+        self.ui.render()
+        self.jobs.start()
+        threading.Thread(target=self.recover_recordings, daemon=True).start()
+        # Списки файлов заполнятся, когда запустится цикл событий
+        self.ui.post(EV_FILES_CHANGED)
         
         if HAS_PYOBJC:
             self._delegate = MenuDelegate.alloc().initWithApp_(self)
@@ -343,12 +166,13 @@ class RecorderApp(rumps.App):
         
         logger.info("Steno initialized (Dual-Stream Mode)")
 
-    @rumps.timer(30)
-    def auto_refresh_menu(self, _):
-        if not self.is_recording:
-            self.refresh_files_menus()
+    @property
+    def is_recording(self):
+        return self.ui.recording
 
-    def set_state_icon(self, state):
+    # --- Отрисовка состояния (вызывает UIStateMachine в главном потоке) ---
+
+    def show_icon(self, state):
         icons = {
             "idle": (ICON_IDLE, "Rec"),
             "recording": (ICON_RECORDING, "🔴 Rec"),
@@ -362,74 +186,119 @@ class RecorderApp(rumps.App):
         else:
             self.icon = None
             self.title = text
-            
-        # Trigger UI update whenever icon/state changes context
-        self.update_ui_state()
-
-    @rumps.timer(0.5)
-    def update_ui_state(self, _=None):
-        """
-        Updates the enabled/disabled state of menu items based on current app state.
-        Runs periodically on the main thread to ensure UI safety.
-        
-        Rules:
-        1. If Processing (is_processing=True):
-           - Disable "Recent Recordings" (prevent parallel AI)
-           - Disable "Start Recording" (prevent recording during AI) -> BUT allow "Stop" if recording.
-           
-        2. If Recording (is_recording=True):
-           - Disable "Recent Recordings" (prevent AI during recording)
-           - "Start Recording" becomes "Stop" and must remain enabled.
-        """
-        if not HAS_PYOBJC:
-            return
 
-        # Determine states
-        # Can we start a new recording? Only if not recording AND not processing
-        can_start_new_recording = not self.is_recording and not self.is_processing
-        
-        # Can we stop? Only if recording
-        can_stop = self.is_recording
-        
-        # Can we use Recent Recordings? Only if IDLE (not recording AND not processing)
-        can_use_recent = not (self.is_recording or self.is_processing)
+    def set_record_title(self, title):
+        # Ключ пункта в меню остается прежним, меняется только заголовок
+        for key in (TITLE_START, TITLE_STOP):
+            if key in self.menu:
+                self.menu[key].title = title
+                return
+
+    def refresh_queue(self):
+        self.refresh_queue_menu()
 
-        # 1. Update Recent Recordings Menu
-        if hasattr(self, 'recent_recordings_menu') and hasattr(self.recent_recordings_menu, '_menuitem'):
+    def refresh_files(self):
+        self.refresh_files_menus()
+
+    def update_tokens(self):
+        self.update_token_stats()
+
+    def notify(self, title, subtitle, message):
+        rumps.notification(title, subtitle, message)
+
+    def alert(self, title, message):
+        rumps.alert(title, message)
+
+    def recover_recordings(self):
+        """Записи, оборванные падением или выключением, склеиваются из кусков при запуске."""
+        cleanup_stale(self.config["save_dir"])
+        for segments_dir in find_unfinished(self.config["save_dir"]):
             try:
-                self.recent_recordings_menu._menuitem.setEnabled_(can_use_recent)
+                results = recover_recording(segments_dir)
             except Exception:
-                pass
+                logger.exception(f"Recovery failed: {segments_dir}")
+                continue
+            if "main" in results:
+                # Поток восстановления: уведомление и меню — через цикл главного потока
+                self.ui.post(EV_RECOVERED, name=os.path.basename(results["main"]))
+        # Протоколы, которых еще нет в поиске (старые, правленые руками)
+        try:
+            self.protocol_search.backfill(self.config["save_dir"])
+        except Exception:
+            logger.exception("Protocol search backfill failed")
+        # Длительности записей для индекса (ffmpeg) — в фоне, пока никто не ждет.
+        # RecordingsIndex потокобезопасен: refresh из меню подождет конца этого скана
+        self.files_index.refresh()
+        self.files_index.fill_durations(limit=20)
+
+    # --- Очередь обработки ---
+    def run_job(self, job):
+        live = self.live_sessions.pop(job.video_path, None)
+        if live is not None:
+            try:
+                return live.finish(job)
+            except JobCancelled:
+                raise
+            except Exception:
+                logger.exception("Live processing failed, processing the saved recording instead")
+        return process_video_with_ai(job.video_path, self.config, job)
+
+    def on_job_changed(self, job):
+        # Вызывается из рабочих потоков: меню трогает только главный поток
+        self.ui.post(
+            EV_JOB_CHANGED, state=job.state, name=job.name,
+            result=os.path.basename(job.result) if job.result else None,
+            error=job.error, active=len(self.jobs.active())
+        )
 
-        # 2. Update Start/Stop Button
-        # We need to find the item because its key changes ("Start Recording" <-> "Stop")
-        start_stop_item = None
-        if "Start Recording" in self.menu:
-            start_stop_item = self.menu["Start Recording"]
-            # If item is "Start Recording", enable only if can_start_new_recording
-            if hasattr(start_stop_item, '_menuitem'):
-                try:
-                    start_stop_item._menuitem.setEnabled_(can_start_new_recording)
-                except Exception:
-                    pass
-                
-        elif "Stop" in self.menu:
-            start_stop_item = self.menu["Stop"]
-            # If item is "Stop", it should generally be enabled if we are recording
-            if hasattr(start_stop_item, '_menuitem'):
-                try:
-                    start_stop_item._menuitem.setEnabled_(True)
-                except Exception:
-                    pass
+    def refresh_queue_menu(self):
+        for item_title in list(self.queue_menu.keys()):
+            del self.queue_menu[item_title]
 
-    def flash_error(self):
-        def blink():
-            for _ in range(6):
-                self.set_state_icon("error")
-                time.sleep(0.5)
-                self.set_state_icon("idle")
-                time.sleep(0.5)
-        threading.Thread(target=blink, daemon=True).start()
+        jobs = self.jobs.jobs()
+        active = [job for job in jobs if job.state in ACTIVE_STATES]
+        self.queue_menu.title = f"Processing Queue ({len(active)})" if active else "Processing Queue"
+        if not jobs:
+            self.queue_menu.add(rumps.MenuItem("Empty", callback=None))
+            return
+
+        marks = {JOB_QUEUED: "⏳", JOB_RUNNING: "⚙️", JOB_DONE: "✅", JOB_FAILED: "❌", JOB_CANCELLED: "⏹"}
+        for job in reversed(jobs):
+            text = f"{marks[job.state]} {job.name} — {job.stage}"
+            if job.state == JOB_RUNNING:
+                text += f" {job.progress:.0%}"
+            elif job.finished:
+                text += datetime.fromtimestamp(job.finished).strftime(" %H:%M")
+            item = rumps.MenuItem(text, callback=self.on_queue_item_clicked)
+            item.job_id = job.id
+            self.queue_menu.add(item)
+
+        if len(active) < len(jobs):
+            self.queue_menu.add(None)
+            self.queue_menu.add(rumps.MenuItem("Clear Finished", callback=self.clear_finished_jobs))
+
+    def on_queue_item_clicked(self, sender):
+        job = self.jobs.get(getattr(sender, "job_id", None))
+        if not job:
+            return
+        if job.state in ACTIVE_STATES:
+            if rumps.alert("Отменить обработку?", job.name, ok="Отменить", cancel="Нет") == 1:
+                self.jobs.cancel(job.id)
+        elif job.state == JOB_DONE and job.result and os.path.exists(job.result):
+            subprocess.call(["open", job.result])
+        elif rumps.alert("Обработка не завершена", job.error or job.stage, ok="Повторить", cancel="Закрыть") == 1:
+            self.jobs.submit(job.video_path)
+
+    def clear_finished_jobs(self, _):
+        self.jobs.clear_finished()
+        self.ui.send(EV_JOB_CHANGED)
+
+    def select_parallel_jobs(self, sender):
+        self.config["max_parallel_jobs"] = int(sender.title)
+        for item in self.parallel_menu.values():
+            item.state = 1 if item.title == sender.title else 0
+        ConfigManager.save(self.config)
+        self.jobs.set_max_concurrent(self.config["max_parallel_jobs"])
 
     def build_menu(self):
         self.model_menu = rumps.MenuItem("AI Model")
@@ -438,10 +307,14 @@ class RecorderApp(rumps.App):
             if model == self.config["model_name"]: item.state = 1
             self.model_menu.add(item)
 
+        self.fill_search_menu()
+
         self.menu = [
             "Start Recording",
             self.recent_recordings_menu,
             self.recent_protocols_menu,
+            self.search_menu,
+            self.queue_menu,
             None,
             "Settings",
             rumps.MenuItem("Open Output Folder", callback=self.open_folder),
@@ -458,7 +331,68 @@ class RecorderApp(rumps.App):
                 item.state = 1
             self.quality_menu.add(item)
 
+        # Processing Mode Menu
+        self.mode_menu = rumps.MenuItem("Processing Mode")
+        for mode, title in PROCESSING_MODES.items():
+            item = rumps.MenuItem(title, callback=self.select_processing_mode)
+            if mode == self.config.get("processing_mode", "audio"):
+                item.state = 1
+            self.mode_menu.add(item)
+
+        # Parallel Jobs Menu
+        self.parallel_menu = rumps.MenuItem("Parallel Jobs")
+        for n in range(1, 5):
+            item = rumps.MenuItem(str(n), callback=self.select_parallel_jobs)
+            if n == self.config.get("max_parallel_jobs", 2):
+                item.state = 1
+            self.parallel_menu.add(item)
+
+        # Video Codec Menu (поверх кодека из пресета)
+        self.codec_menu = rumps.MenuItem("Video Codec")
+        for codec, title in VIDEO_CODECS.items():
+            item = rumps.MenuItem(title, callback=self.select_video_codec)
+            if codec == self.config.get("video_codec", ""):
+                item.state = 1
+            self.codec_menu.add(item)
+
+        # Capture Target Menu: дисплей, приложение встречи или его окно
+        self.target_menu = rumps.MenuItem("Capture Target")
+        for name in CAPTURE_TARGETS.keys():
+            item = rumps.MenuItem(name, callback=self.select_capture_target)
+            if name == self.config.get("capture_target", "Main Display"):
+                item.state = 1
+            self.target_menu.add(item)
+
+        self.adaptive_item = rumps.MenuItem("Adaptive Frame Rate", callback=self.toggle_adaptive_capture)
+        self.adaptive_item.state = 1 if self.config.get("adaptive_capture", True) else 0
+
+        # Audio Menu: профили кодирования дорожек и речевая дорожка на лету
+        self.audio_menu = rumps.MenuItem("Audio")
+        self.audio_profile_menus = {}
+        for key, title in (("sys_audio_profile", "System Audio"), ("mic_audio_profile", "Microphone")):
+            submenu = rumps.MenuItem(title)
+            for name in AUDIO_PROFILES.keys():
+                item = rumps.MenuItem(name, callback=lambda sender, key=key: self.select_audio_profile(key, sender))
+                if name == self.config.get(key):
+                    item.state = 1
+                submenu.add(item)
+            self.audio_profile_menus[key] = submenu
+            self.audio_menu.add(submenu)
+        self.mixdown_item = rumps.MenuItem("Speech Track While Recording", callback=self.toggle_speech_mixdown)
+        self.mixdown_item.state = 1 if self.config.get("speech_mixdown", False) else 0
+        self.audio_menu.add(self.mixdown_item)
+
+        self.dual_track_item = rumps.MenuItem("Single File (Mic as Track)", callback=self.toggle_dual_track)
+        self.dual_track_item.state = 1 if self.config.get("dual_track", False) else 0
+
+        self.menu["Settings"].add(self.target_menu)
         self.menu["Settings"].add(self.quality_menu)
+        self.menu["Settings"].add(self.codec_menu)
+        self.menu["Settings"].add(self.adaptive_item)
+        self.menu["Settings"].add(self.dual_track_item)
+        self.menu["Settings"].add(self.audio_menu)
+        self.menu["Settings"].add(self.mode_menu)
+        self.menu["Settings"].add(self.parallel_menu)
         self.menu["Settings"].add(self.model_menu)
         self.menu["Settings"].add(rumps.MenuItem("Edit System Prompt...", callback=self.edit_prompt))
         self.menu["Settings"].add(rumps.MenuItem("Set API Key...", callback=self.set_api_key))
@@ -472,9 +406,13 @@ class RecorderApp(rumps.App):
         
         self.last_request_item = rumps.MenuItem(f"Last request: {last}", callback=None)
         self.total_tokens_item = rumps.MenuItem(f"Used tokens: {total}", callback=None)
+        self.cost_item = rumps.MenuItem(self.cost_title(), callback=None)
         
         self.menu["Settings"].add(self.last_request_item)
         self.menu["Settings"].add(self.total_tokens_item)
+        self.menu["Settings"].add(self.cost_item)
+        self.menu["Settings"].add(rumps.MenuItem("Usage Report...", callback=self.show_usage_report))
+        self.menu["Settings"].add(rumps.MenuItem("Estimate Cost...", callback=self.show_cost_estimate))
         
         self.menu["Settings"].add(None)
         self.menu["Settings"].add(messageAuthor)
@@ -483,6 +421,7 @@ class RecorderApp(rumps.App):
             try:
                 self.last_request_item._menuitem.setEnabled_(False)
                 self.total_tokens_item._menuitem.setEnabled_(False)
+                self.cost_item._menuitem.setEnabled_(False)
             except:
                 pass
 
@@ -493,6 +432,38 @@ class RecorderApp(rumps.App):
             self.last_request_item.title = f"Last request: {last}"
         if hasattr(self, 'total_tokens_item'):
             self.total_tokens_item.title = f"Used tokens: {total}"
+        if hasattr(self, 'cost_item'):
+            self.cost_item.title = self.cost_title()
+
+    # --- Учет токенов и стоимости (steno/ledger.py) ---
+
+    def cost_title(self):
+        # Итог ведет Ledger (дописанные строки), журнал не перечитывается на каждое обновление меню
+        return f"Cost ({RECENT_COST_DAYS} days): ~${Ledger().recent_cost():.2f}"
+
+    def show_usage_report(self, _):
+        rumps.alert("Расход токенов", usage_report(config=self.config))
+
+    def show_cost_estimate(self, _):
+        """Оценка стоимости последней записи во всех режимах и на всех моделях."""
+        names = self.files_index.recent(RECORDING, 1)
+        if not names:
+            rumps.alert("Оценка стоимости", "Нет записей")
+            return
+        # Длительности может не быть в индексе — ffmpeg не запускаем в главном потоке
+        threading.Thread(target=self._estimate_cost, args=(names[0],), daemon=True).start()
+
+    def _estimate_cost(self, name):
+        info = self.files_index.info(name) or {}
+        duration = info.get("duration")
+        if duration is None:
+            try:
+                duration = probe_media(os.path.join(self.config["save_dir"], name))["duration"]
+            except MediaError as e:
+                self.ui.post(EV_ALERT, title="Оценка стоимости", message=f"Не удалось определить длительность: {e}")
+                return
+        rows = estimate_table(duration, self.config)
+        self.ui.post(EV_ALERT, title=f"Оценка стоимости: {name}", message=format_estimate(duration, rows, self.config))
 
     def select_video_quality(self, sender):
         self.config["video_quality"] = sender.title
@@ -500,6 +471,49 @@ class RecorderApp(rumps.App):
             item.state = 1 if item.title == sender.title else 0
         ConfigManager.save(self.config)
 
+    def select_video_codec(self, sender):
+        for codec, title in VIDEO_CODECS.items():
+            if title == sender.title:
+                self.config["video_codec"] = codec
+        for item in self.codec_menu.values():
+            item.state = 1 if item.title == sender.title else 0
+        ConfigManager.save(self.config)
+
+    def select_capture_target(self, sender):
+        self.config["capture_target"] = sender.title
+        for item in self.target_menu.values():
+            item.state = 1 if item.title == sender.title else 0
+        ConfigManager.save(self.config)
+
+    def toggle_adaptive_capture(self, sender):
+        self.config["adaptive_capture"] = not self.config.get("adaptive_capture", True)
+        sender.state = 1 if self.config["adaptive_capture"] else 0
+        ConfigManager.save(self.config)
+
+    def select_audio_profile(self, key, sender):
+        self.config[key] = sender.title
+        for item in self.audio_profile_menus[key].values():
+            item.state = 1 if item.title == sender.title else 0
+        ConfigManager.save(self.config)
+
+    def toggle_speech_mixdown(self, sender):
+        self.config["speech_mixdown"] = not self.config.get("speech_mixdown", False)
+        sender.state = 1 if self.config["speech_mixdown"] else 0
+        ConfigManager.save(self.config)
+
+    def toggle_dual_track(self, sender):
+        self.config["dual_track"] = not self.config.get("dual_track", False)
+        sender.state = 1 if self.config["dual_track"] else 0
+        ConfigManager.save(self.config)
+
+    def select_processing_mode(self, sender):
+        for mode, title in PROCESSING_MODES.items():
+            if title == sender.title:
+                self.config["processing_mode"] = mode
+        for item in self.mode_menu.values():
+            item.state = 1 if item.title == sender.title else 0
+        ConfigManager.save(self.config)
+
     def select_ai_model(self, sender):
         self.config["model_name"] = sender.title
         for item in self.model_menu.values():
@@ -589,11 +603,6 @@ class RecorderApp(rumps.App):
 
     @rumps.clicked("Start Recording")
     def record_switch(self, sender):
-        # Protection against starting recording while processing
-        if self.is_processing and not self.is_recording:
-            rumps.alert("Busy", "Идет обработка видео. Пожалуйста, подождите.")
-            return
-
         if not self.is_recording:
             if not self.config.get("api_key"):
                 rumps.alert("API Key Required", "Пожалуйста, установите API ключ Google.")
@@ -603,6 +612,13 @@ class RecorderApp(rumps.App):
             self.stop_recording(sender)
 
     # --- START RECORDING (ОБНОВЛЕННЫЙ) ---
+    def capture_target(self):
+        """Цель захвата из конфига: название из CAPTURE_TARGETS или свой словарь."""
+        target = self.config.get("capture_target", "Main Display")
+        if isinstance(target, dict):
+            return target
+        return CAPTURE_TARGETS.get(target, CAPTURE_TARGETS["Main Display"])
+
     def start_recording(self, sender):
         timestamp = datetime.now().strftime("%d.%m.%Y_%H:%M:%S")
         
@@ -620,8 +636,21 @@ class RecorderApp(rumps.App):
             # Получаем настройки качества
             quality_key = self.config.get("video_quality", "Medium")
             preset = VIDEO_QUALITY_PRESETS.get(quality_key, VIDEO_QUALITY_PRESETS["Medium"])
+            preset = dict(
+                preset,
+                segment_seconds=int(self.config.get("segment_minutes", 5)) * 60,
+                codec=self.config.get("video_codec") or preset.get("codec", "h264"),
+                adaptive=self.config.get("adaptive_capture", True),
+                capture_target=self.capture_target(),
+                dual_track=self.config.get("dual_track", False),
+                sys_audio_profile=self.config.get("sys_audio_profile", "Music"),
+                mic_audio_profile=self.config.get("mic_audio_profile", "Speech Low"),
+                speech_mixdown=self.config.get("speech_mixdown", False),
+                telemetry_interval=self.config.get("telemetry_interval", 30)
+            )
 
             # ВАЖНО: Инициализация рекордера с двумя URL и конфигом
+            from recorder import ScreenRecorder
             self.recorder = ScreenRecorder.alloc().initWithOutputURLs_auxURL_videoConfig_(
                 url_main, url_mic, preset
             )
@@ -629,85 +658,165 @@ class RecorderApp(rumps.App):
             if not self.recorder:
                 raise Exception("Failed to initialize ScreenRecorder")
 
-            # Callback для обработки результата запуска записи
+            # Куски уходят в обработку, пока встреча идет
+            live = None
+            if self.config.get("live_processing", True) and self.config.get("api_key"):
+                live = LiveSession(self.current_filename, self.config)
+                self.recorder.manifest.on_segment = live.on_segment
+                self.live_sessions[self.current_filename] = live
+
+            # Результат запуска приходит из потока ScreenCaptureKit — в UI только событием
             def start_callback(success, error_msg):
-                if not success:
-                    logger.error(f"Failed to start recording: {error_msg}")
-                    rumps.alert("Recording Error", f"Не удалось начать запись: {error_msg}\n\nПроверьте права доступа в System Settings -> Privacy & Security -> Screen Recording.")
-                    # Сбрасываем UI в исходное состояние
-                    self.is_recording = False
-                    sender.title = "Start Recording"
-                    self.set_state_icon("idle")
-                    self.recorder = None
+                if success:
+                    self.ui.post(EV_STARTED)
+                    return
+                logger.error(f"Failed to start recording: {error_msg}")
+                self.recorder = None
+                if live is not None:
+                    self.live_sessions.pop(live.video_path, None)
+                    live.close()
+                self.ui.post(EV_START_FAILED, error=error_msg)
 
             self.recorder.startWithCallback_(start_callback)
-            
-            self.is_recording = True
-            sender.title = "Stop"
-            self.set_state_icon("recording")
+            self.ui.send(EV_START_REQUESTED)
             
         except Exception as e:
             logger.exception("Recording failed to start")
             rumps.alert("Error", str(e))
-            self.set_state_icon("error")
+            self.ui.flash()
 
     def stop_recording(self, sender):
         logger.info("Stopping native recording...")
+        name = os.path.basename(self.current_filename)
+        live = self.live_sessions.get(self.current_filename)
         if self.recorder:
-            self.recorder.stop()
-        
-        self.is_recording = False
-        sender.title = "Start Recording"
-        self.set_state_icon("idle")
-        
-        rumps.notification("Готово", "Файлы сохранены", os.path.basename(self.current_filename))
-        # Даем время на закрытие файлов
-        time.sleep(1.0)
-        self.refresh_files_menus()
+            # Писатели закрываются и куски склеиваются в фоне (finishWriting -> склейка);
+            # о готовых файлах главный поток узнает событием, без ожидания
+            def on_saved(results):
+                if live is not None:
+                    live.recording_stopped(results)
+                    # Задача встает в очередь, только когда запись склеена: если живая
+                    # обработка сорвется, обычной будет что обрабатывать. Большая часть
+                    # записи уже загружена — протокол будет готов почти сразу
+                    if "main" in results:
+                        self.jobs.submit(live.video_path)
+                    else:
+                        self.live_sessions.pop(live.video_path, None)
+                        live.close()
+                self.ui.post(EV_SAVED, name=name, ok="main" in results)
+            self.recorder.stopWithCallback_(on_saved)
+        elif live is not None:
+            self.live_sessions.pop(live.video_path, None)
+            live.close()
+
+        self.ui.send(EV_STOP_REQUESTED, pending=self.recorder is not None)
 
     # --- REFRESH MENU (С ФИЛЬТРАЦИЕЙ СИСТЕМНЫХ ФАЙЛОВ) ---
     def refresh_files_menus(self, _=None):
         try:
-            # Очистка меню видео
-            for item_title in list(self.recent_recordings_menu.keys()):
-                del self.recent_recordings_menu[item_title]
-            
-            save_dir = self.config["save_dir"]
-            if os.path.exists(save_dir):
-                # Показываем только .mp4 (основные файлы). 
-                # .m4a (системные) скрыты, они подтянутся автоматически при обработке.
-                files = [f for f in os.listdir(save_dir) if f.lower().endswith(".mp4")]
-                files.sort(key=lambda x: os.path.getmtime(os.path.join(save_dir, x)), reverse=True)
-                
-                if files:
-                    for f in files[:10]:
-                        self.recent_recordings_menu.add(rumps.MenuItem(f, callback=self.process_selected_file))
-                else:
-                    self.recent_recordings_menu.add(rumps.MenuItem("Empty", callback=None))
-
-            # Очистка меню протоколов
-            for item_title in list(self.recent_protocols_menu.keys()):
-                del self.recent_protocols_menu[item_title]
-
-            if os.path.exists(save_dir):
-                p_files = [f for f in os.listdir(save_dir) if f.endswith("_protocol.txt")]
-                p_files.sort(key=lambda x: os.path.getmtime(os.path.join(save_dir, x)), reverse=True)
-                if p_files:
-                    for f in p_files[:10]:
-                        self.recent_protocols_menu.add(rumps.MenuItem(f, callback=self.open_protocol_file))
-                else:
-                    self.recent_protocols_menu.add(rumps.MenuItem("Empty", callback=None))
+            # Папка не менялась — индекс отвечает одним stat, меню не трогаем
+            self.files_index.refresh()
+            self.sync_files_menu(self.recent_recordings_menu, self.files_index.recent(RECORDING), self.process_selected_file)
+            self.sync_files_menu(self.recent_protocols_menu, self.files_index.recent(PROTOCOL), self.open_protocol_file)
         except Exception as e:
             logger.warning(f"Menu refresh warning: {e}")
 
+    def sync_files_menu(self, menu, names, callback):
+        """Приводит подменю к списку names, трогая только изменившиеся пункты."""
+        current = list(menu.keys())
+        if current == names:
+            return
+        if not names:
+            for title in current:
+                del menu[title]
+            menu.add(rumps.MenuItem("Empty", callback=None))
+            return
+
+        for title in current:
+            if title not in names:
+                del menu[title]
+        kept = [title for title in menu.keys()]
+        if kept != [name for name in names if name in kept]:
+            # Старые пункты поменялись местами — проще собрать заново
+            for title in kept:
+                del menu[title]
+            kept = []
+        for i, name in enumerate(names):
+            if name in kept:
+                continue
+            item = rumps.MenuItem(name, callback=callback)
+            if i > 0:
+                menu.insert_after(names[i - 1], item)
+            elif kept:
+                menu.insert_before(kept[0], item)
+            else:
+                menu.add(item)
+            kept.append(name)
+
+    # --- Поиск по протоколам ---
+    def fill_search_menu(self, results=None, label=None):
+        for title in list(self.search_menu.keys()):
+            del self.search_menu[title]
+        self.search_menu.add(rumps.MenuItem("Search Text...", callback=self.search_protocols))
+        self.search_menu.add(rumps.MenuItem("Find Action Items...", callback=self.search_action_items))
+        if results is None:
+            return
+        self.search_menu.add(None)
+        self.search_menu.add(rumps.MenuItem(label, callback=None))
+        if not results:
+            self.search_menu.add(rumps.MenuItem("Nothing found", callback=None))
+        for text, path in results:
+            if text in self.search_menu:
+                continue
+            item = rumps.MenuItem(text, callback=self.open_search_result)
+            item.path = path
+            self.search_menu.add(item)
+
+    def ask_search_query(self, title, message):
+        w = rumps.Window(message, title, default_text=getattr(self, "last_search", ""), dimensions=(400, 24), cancel=True)
+        r = w.run()
+        if not r.clicked or not r.text.strip():
+            return None
+        self.last_search = r.text.strip()
+        return self.last_search
+
+    def search_protocols(self, _):
+        query = self.ask_search_query("Search Protocols", "Слова из протокола (тема, участники, текст):")
+        if query is None:
+            return
+        results = [
+            (f"{r['title'] or r['name']} — {r['date'] or r['name']}", r["path"])
+            for r in self.protocol_search.search(query, limit=20)
+        ]
+        self.fill_search_menu(results, f"Results for \"{query}\": {len(results)}")
+
+    def search_action_items(self, _):
+        query = self.ask_search_query("Find Action Items", "Задача или ответственный:")
+        if query is None:
+            return
+        results = [
+            (f"{format_item(r)} — {r['date'] or os.path.basename(r['path'])}", r["path"])
+            for r in self.protocol_search.items(query, kind=ACTION, limit=30)
+        ]
+        self.fill_search_menu(results, f"Action items for \"{query}\": {len(results)}")
+
+    def open_search_result(self, sender):
+        if os.path.exists(sender.path):
+            subprocess.call(["open", sender.path])
+
     def open_protocol_file(self, sender):
         subprocess.call(["open", os.path.join(self.config["save_dir"], sender.title)])
 
     def process_selected_file(self, sender):
         video_path = os.path.join(self.config["save_dir"], sender.title)
-        if os.path.exists(video_path):
-            # Запускаем в отдельном потоке
-            threading.Thread(target=process_video_with_ai, args=(video_path, self.config, self), daemon=True).start()
+        if not os.path.exists(video_path):
+            return
+        if not self.config.get("api_key"):
+            rumps.notification("AI Error", "Нет API ключа", "Настройте ключ в меню")
+            return
+        # Ставим в очередь: задачи выполняются в фоне, параллельно с записью
+        job = self.jobs.submit(video_path)
+        rumps.notification("AI Обработка", "Добавлено в очередь", job.name)
 
 if HAS_PYOBJC:
     class MenuDelegate(NSObject):
@@ -721,5 +830,7 @@ if HAS_PYOBJC:
                 self.app.refresh_files_menus()
 
 if __name__ == "__main__":
+    setup_environment()
+    logger.info(f"Modules loaded in {(time.perf_counter() - _import_started) * 1000:.0f} ms")
     PermissionManager.check_all()
     RecorderApp().run() 
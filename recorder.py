@@ -2,8 +2,10 @@
 import sys
 import os
 import objc
+import time
 import logging
-from Foundation import NSObject, NSLog
+import threading
+from Foundation import NSObject, NSLog, NSURL
 from AVFoundation import (
     AVAssetWriter, AVAssetWriterInput, AVMediaTypeVideo, AVMediaTypeAudio,
     AVFileTypeMPEG4, AVFileTypeAppleM4A, # <--- Добавили тип M4A
@@ -13,12 +15,25 @@ from AVFoundation import (
     AVFormatIDKey, AVNumberOfChannelsKey, AVSampleRateKey, AVEncoderBitRateKey,
     AVCaptureSession, AVCaptureDevice, AVCaptureDeviceInput, AVCaptureAudioDataOutput,
     AVCaptureConnection, AVVideoCodecTypeH264,
-    AVAssetWriterInputPixelBufferAdaptor
+    AVAssetWriterInputPixelBufferAdaptor, AVAssetWriterStatusCompleted,
+    AVVideoCodecTypeHEVC, AVVideoQualityKey, AVVideoMaxKeyFrameIntervalDurationKey,
+    AVVideoExpectedSourceFrameRateKey, AVMutableMetadataItem, AVMetadataCommonIdentifierTitle
 )
 import CoreMedia
 import Quartz
 import ScreenCaptureKit as SCK
 
+from steno.segments import SegmentManifest, SegmentClock, SEGMENT_SECONDS, stitch_segments
+from steno.avsync import TRACK_TITLES
+from steno.config import AUDIO_PROFILES
+from steno.media import MediaError, SpeechEncoder
+from steno.capture import (
+    AdaptiveFrameGate, CaptureTelemetry, SampleRing, SampleWorker, dirty_fraction,
+    MIN_DIRTY_FRACTION, DROP_NON_KEY, DROP_OLDEST,
+    CAPTURE_DISPLAY, CAPTURE_WINDOWS, plan_capture, fit_output_size,
+    SpeechMixer, pcm_to_mono
+)
+
 # --- Настройка логгера ---
 logger = logging.getLogger("RecorderCore")
 if not logger.handlers:
@@ -28,44 +43,279 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
 
-STREAM_SIGNATURE = b'v@:@@q' 
+STREAM_SIGNATURE = b'v@:@@q'
+
+# Писатели пишут фрагментированный MP4: кусок, оборванный падением,
+# читается до последнего фрагмента (см. steno.segments.recover_recording)
+FRAGMENT_SECONDS = 10
+
+# Очереди между колбэками захвата и потоками писателей. Видеокадры держат
+# буферы из пула SCK (глубина SCK_QUEUE_DEPTH), поэтому видео — всего несколько кадров
+SCK_QUEUE_DEPTH = 8
+VIDEO_QUEUE_FRAMES = 3
+AUDIO_QUEUE_BUFFERS = 64
+# Сколько поток писателя ждет готовности инпута, прежде чем сбросить сэмпл
+READY_TIMEOUT = 0.1
+READY_POLL = 0.002
+# Нижняя граница битрейта для маленьких окон
+MIN_BITRATE = 300000
+
+
+def make_writer(path, file_type, inputs):
+    """AVAssetWriter с добавленными инпутами, уже запущенный. None при ошибке."""
+    writer, err = AVAssetWriter.alloc().initWithURL_fileType_error_(
+        NSURL.fileURLWithPath_(path), file_type, None
+    )
+    if err or writer is None:
+        logger.error(f"Error creating writer {os.path.basename(path)}: {err}")
+        return None
+    try:
+        writer.setMovieFragmentInterval_(CoreMedia.CMTimeMake(FRAGMENT_SECONDS, 1))
+    except Exception as e:
+        logger.warning(f"Movie fragments not supported for {os.path.basename(path)}: {e}")
+    for inp in inputs:
+        if writer.canAddInput_(inp): writer.addInput_(inp)
+    if not writer.startWriting():
+        logger.error(f"Failed to start writer {os.path.basename(path)}: {writer.error()}")
+        return None
+    return writer
+
+
+def label_input(writer_input, title):
+    """Подпись дорожки (title) — по ней steno.avsync и ffmpeg отличают системный звук от микрофона."""
+    try:
+        item = AVMutableMetadataItem.metadataItem()
+        item.setIdentifier_(AVMetadataCommonIdentifierTitle)
+        item.setValue_(title)
+        writer_input.setMetadata_([item])
+    except Exception as e:
+        logger.warning(f"Cannot label track {title}: {e}")
+
+
+def audio_settings_for(profile):
+    """Настройки AAC из профиля (см. AUDIO_PROFILES)."""
+    return {
+        AVFormatIDKey: 1633772320, # kAudioFormatMPEG4AAC
+        AVNumberOfChannelsKey: int(profile.get("channels", 2)),
+        AVSampleRateKey: float(profile.get("sample_rate", 44100)),
+        AVEncoderBitRateKey: int(profile.get("bitrate", 128000)),
+    }
+
+
+def sample_pcm(sample_buffer):
+    """Звуковой сэмпл -> (моно float, частота) для SpeechMixer; None — формат не PCM."""
+    fmt = CoreMedia.CMSampleBufferGetFormatDescription(sample_buffer)
+    asbd = CoreMedia.CMAudioFormatDescriptionGetStreamBasicDescription(fmt)
+    if asbd is None:
+        return None
+    if not hasattr(asbd, "mSampleRate"):
+        asbd = asbd[0]  # указатель на AudioStreamBasicDescription
+    if asbd.mFormatID != 1819304813: # kAudioFormatLinearPCM
+        return None
+    block = CoreMedia.CMSampleBufferGetDataBuffer(sample_buffer)
+    if block is None:
+        return None
+    length = CoreMedia.CMBlockBufferGetDataLength(block)
+    status, data = CoreMedia.CMBlockBufferCopyDataBytes(block, 0, length, None)
+    if status != 0:
+        return None
+    samples = pcm_to_mono(
+        bytes(data), asbd.mChannelsPerFrame, asbd.mBitsPerChannel,
+        bool(asbd.mFormatFlags & 1),            # kAudioFormatFlagIsFloat
+        not asbd.mFormatFlags & (1 << 5)        # kAudioFormatFlagIsNonInterleaved
+    )
+    return samples, int(asbd.mSampleRate)
+
+
+def frame_info(sample_buffer):
+    """Статус кадра SCK и измененные области [(x, y, w, h)]; None — области неизвестны."""
+    try:
+        attachments = CoreMedia.CMSampleBufferGetSampleAttachmentsArray(sample_buffer, False)
+        if not attachments:
+            return SCK.SCFrameStatusComplete, None
+        info = attachments[0]
+        status = info.get(SCK.SCStreamFrameInfoStatus, SCK.SCFrameStatusComplete)
+        rects = info.get(SCK.SCStreamFrameInfoDirtyRects)
+        if rects is None:
+            return status, None
+        dirty = []
+        for rect_dict in rects:
+            ok, rect = Quartz.CGRectMakeWithDictionaryRepresentation(rect_dict, None)
+            if ok:
+                dirty.append((rect.origin.x, rect.origin.y, rect.size.width, rect.size.height))
+        return status, dirty
+    except Exception:
+        return SCK.SCFrameStatusComplete, None
+
+
+def video_settings_for(preset, codec=None):
+    """
+    Настройки кодера из пресета (см. VIDEO_QUALITY_PRESETS): кодек H.264/HEVC,
+    интервал ключевых кадров, постоянное качество (quality) или средний
+    битрейт (bitrate), подстройка под содержимое экрана (screen_content).
+    """
+    codec = codec or preset.get("codec", "h264")
+    fps = int(preset.get("fps", 10))
+    keyframe_interval = float(preset.get("keyframe_interval", 5))
+    if preset.get("screen_content"):
+        # Экран почти всегда статичен: ключевые кадры реже (не чаще куска записи),
+        # кадры переупорядочивать незачем
+        keyframe_interval = max(keyframe_interval, 10.0)
+
+    compression_props = {
+        AVVideoMaxKeyFrameIntervalDurationKey: keyframe_interval,
+        AVVideoExpectedSourceFrameRateKey: fps,
+        "AllowFrameReordering": False
+    }
+    if preset.get("quality") is not None:
+        # Постоянное качество: на статичном экране кодер не тратит биты впустую
+        compression_props[AVVideoQualityKey] = float(preset["quality"])
+    else:
+        compression_props[AVVideoAverageBitRateKey] = int(preset.get("bitrate", 3000000))
+
+    if codec == "hevc":
+        codec_type = AVVideoCodecTypeHEVC
+        compression_props[AVVideoProfileLevelKey] = "HEVC_Main_AutoLevel"
+    else:
+        codec_type = AVVideoCodecTypeH264
+        compression_props[AVVideoProfileLevelKey] = "H264_Main_AutoLevel"
+        compression_props[AVVideoH264EntropyModeKey] = AVVideoH264EntropyModeCABAC
+
+    return {
+        AVVideoCodecKey: codec_type,
+        AVVideoWidthKey: int(preset.get("width", 1280)),
+        AVVideoHeightKey: int(preset.get("height", 720)),
+        AVVideoCompressionPropertiesKey: compression_props
+    }
+
+
+def rect_tuple(rect):
+    return (rect.origin.x, rect.origin.y, rect.size.width, rect.size.height)
+
+
+def describe_content(content):
+    """SCShareableContent -> словари для steno.capture.plan_capture (ключ obj — исходный объект)."""
+    displays = [
+        {"id": d.displayID(), "frame": rect_tuple(d.frame()), "obj": d}
+        for d in content.displays()
+    ]
+    windows = []
+    for w in content.windows():
+        app = w.owningApplication()
+        if app is None or not w.isOnScreen():
+            continue
+        windows.append({
+            "id": w.windowID(),
+            "bundle_id": app.bundleIdentifier(),
+            "app_name": app.applicationName(),
+            "title": w.title(),
+            "frame": rect_tuple(w.frame()),
+            "obj": w,
+            "app": app,
+        })
+    return displays, windows
+
+
+def content_filter_for(plan):
+    """SCContentFilter под план захвата."""
+    display = plan["display"]["obj"]
+    windows = [w["obj"] for w in plan["windows"]]
+    if plan["kind"] == CAPTURE_DISPLAY:
+        return SCK.SCContentFilter.alloc().initWithDisplay_excludingWindows_(display, [])
+    if plan["kind"] == CAPTURE_WINDOWS and len(windows) == 1:
+        return SCK.SCContentFilter.alloc().initWithDesktopIndependentWindow_(windows[0])
+    if plan["kind"] == CAPTURE_WINDOWS:
+        return SCK.SCContentFilter.alloc().initWithDisplay_includingWindows_(display, windows)
+    # Приложение целиком: и окна, которые появятся во время записи
+    apps = list({w["bundle_id"]: w["app"] for w in plan["windows"]}.values())
+    return SCK.SCContentFilter.alloc().initWithDisplay_includingApplications_exceptingWindows_(display, apps, [])
+
+
+def pixel_scale(content_filter):
+    """Пикселей в точке у источника (Retina — 2). pointPixelScale есть с macOS 14."""
+    try:
+        return float(content_filter.pointPixelScale())
+    except Exception:
+        return 1.0
+
 
 class ScreenRecorder(NSObject):
-    
-    # Изменили сигнатуру: теперь принимаем main_url (Video+SysAudio) и aux_url (MicAudio)
+
+    # Изменили сигнатуру: теперь принимаем main_url (Video+SysAudio) и aux_url (MicAudio).
+    # Пишем кусками по segment_seconds в <main>.segments/, после stop куски
+    # склеиваются в main_url и aux_url.
     def initWithOutputURLs_auxURL_videoConfig_(self, main_url, aux_url, config):
         self = objc.super(ScreenRecorder, self).init()
         if self is None: return None
-        
+
         self.main_url = main_url
         self.aux_url = aux_url
         self.width = int(config.get("width", 1280))
         self.height = int(config.get("height", 720))
         self.fps = int(config.get("fps", 10))
         self.bitrate = int(config.get("bitrate", 3000000))
-        
+        self.preset = dict(config)
+        self.codec = config.get("codec", "h264")
+        self.capture_target = config.get("capture_target") or {"kind": CAPTURE_DISPLAY}
+        self.segment_seconds = int(config.get("segment_seconds", SEGMENT_SECONDS))
+        # Один файл: видео, системный звук и микрофон — отдельные подписанные
+        # дорожки Main Writer на общей шкале времени (aux_url не используется)
+        self.dual_track = bool(config.get("dual_track", False))
+
+        # Адаптивный захват: статичные кадры не пишем, при движении частота
+        # временно повышается (выходной файл — с переменной частотой кадров)
+        self.frame_gate = AdaptiveFrameGate(self.fps) if config.get("adaptive", True) else None
+        # Последнее полное изображение (держит один буфер из пула SCK) — для keepalive
+        self.last_pixel_buffer = None
+
+        # Счетчики по потокам, строка в лог раз в telemetry_interval секунд
+        capture_fps = self.frame_gate.boost_fps if self.frame_gate else self.fps
+        self.telemetry = CaptureTelemetry(capture_fps, interval=float(config.get("telemetry_interval", 30)), log=logger)
+
+        # Колбэки захвата только кладут сэмплы в ограниченные очереди, в писателей
+        # их передают отдельные потоки: медленный append не задерживает доставку кадров
+        self.video_ring = SampleRing(
+            int(config.get("video_queue_frames", VIDEO_QUEUE_FRAMES)), config.get("overflow_policy", DROP_NON_KEY)
+        )
+        self.sys_ring = SampleRing(AUDIO_QUEUE_BUFFERS, DROP_OLDEST)
+        self.mic_ring = SampleRing(AUDIO_QUEUE_BUFFERS, DROP_OLDEST)
+        self.telemetry["video"].queue = self.video_ring
+        self.telemetry["sys_audio"].queue = self.sys_ring
+        self.telemetry["mic"].queue = self.mic_ring
+        self.workers = []
+
         # --- WRITER 1: Main (Video + System Audio) ---
         self.main_writer = None
         self.video_input = None
         self.video_adaptor = None
         self.sys_input = None
-        
+
         # --- WRITER 2: Aux (Mic Audio Only) ---
         self.aux_writer = None
         self.mic_input = None
-        
+
         # --- Inputs & Sessions ---
         self.stream = None
         self.mic_session = None
         self.mic_queue = None
         self.video_queue = None
-        
+        self.audio_queue = None
+
         self.is_recording = False
-        
+        self.stop_callback = None
+
         # Флаги старта сессий (они теперь независимы)
-        self.main_session_started = False 
+        self.main_session_started = False
         self.aux_session_started = False
-        
+
+        # Ротация кусков: отдельные часы и блокировки для каждой дорожки
+        # (main_lock — писатель Main, общий для потоков видео и системного звука)
+        self.main_clock = SegmentClock(self.segment_seconds)
+        self.aux_clock = SegmentClock(self.segment_seconds)
+        self.main_lock = threading.Lock()
+        self.aux_lock = threading.Lock()
+        self.stitch_started = False
+
         # --- Cleanup Files ---
         for url in [main_url, aux_url]:
             path = url.path()
@@ -75,75 +325,211 @@ class ScreenRecorder(NSObject):
                 except OSError:
                     logger.error(f"Cannot remove existing file: {path}")
 
-        # ==========================================
-        # 1. Setup Main Writer (Video + Sys Audio) -> .mp4
-        # ==========================================
-        err_main = None
-        self.main_writer, err_main = AVAssetWriter.alloc().initWithURL_fileType_error_(
-            main_url, AVFileTypeMPEG4, None
-        )
-        if err_main:
-            logger.error(f"Error creating Main Writer: {err_main}")
-            return None
-            
+        outputs = {"main": main_url.path()}
+        if not self.dual_track:
+            outputs["mic"] = aux_url.path()
+        self.manifest = SegmentManifest.create(outputs, self.segment_seconds)
+
         # Video Settings
-        compression_props = {
-            AVVideoAverageBitRateKey: self.bitrate,
-            AVVideoProfileLevelKey: "H264_Main_AutoLevel",
-            AVVideoH264EntropyModeKey: AVVideoH264EntropyModeCABAC,
-            "AllowFrameReordering": False
-        }
-        video_settings = {
-            AVVideoCodecKey: AVVideoCodecTypeH264,
-            AVVideoWidthKey: self.width,
-            AVVideoHeightKey: self.height,
-            AVVideoCompressionPropertiesKey: compression_props
-        }
-        self.video_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
-            AVMediaTypeVideo, video_settings
-        )
-        self.video_input.setExpectsMediaDataInRealTime_(True)
-        self.video_adaptor = AVAssetWriterInputPixelBufferAdaptor.assetWriterInputPixelBufferAdaptorWithAssetWriterInput_sourcePixelBufferAttributes_(
-            self.video_input, None
+        self.video_settings = video_settings_for(self.preset, self.codec)
+
+        # Audio Settings: свой профиль у системного звука и у микрофона
+        self.sys_audio_settings = audio_settings_for(
+            AUDIO_PROFILES.get(config.get("sys_audio_profile"), AUDIO_PROFILES["Music"])
         )
-        
-        # Audio Settings (Common)
-        audio_settings = {
-            AVFormatIDKey: 1633772320, # kAudioFormatMPEG4AAC
-            AVNumberOfChannelsKey: 2,
-            AVSampleRateKey: 44100.0,
-            AVEncoderBitRateKey: 128000,
-        }
-        
-        # System Audio Input for Main Writer
-        self.sys_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
-            AVMediaTypeAudio, audio_settings
+        self.mic_audio_settings = audio_settings_for(
+            AUDIO_PROFILES.get(config.get("mic_audio_profile"), AUDIO_PROFILES["Music"])
         )
-        self.sys_input.setExpectsMediaDataInRealTime_(True)
-        
-        if self.main_writer.canAddInput_(self.video_input): self.main_writer.addInput_(self.video_input)
-        if self.main_writer.canAddInput_(self.sys_input): self.main_writer.addInput_(self.sys_input)
+
+        # Речевая дорожка на лету: оба источника сводятся в моно 16 кГц и
+        # кодируются в <запись>_speech.m4a (ее подхватит extract_speech_audio)
+        self.mixer = None
+        self.speech_encoder = None
+        if config.get("speech_mixdown"):
+            speech_path = os.path.splitext(main_url.path())[0] + "_speech.m4a"
+            try:
+                self.speech_encoder = SpeechEncoder(speech_path)
+                self.mixer = SpeechMixer(self.speech_encoder.write)
+            except MediaError as e:
+                logger.warning(f"Speech mixdown disabled: {e}")
 
         # ==========================================
-        # 2. Setup Aux Writer (Mic Audio) -> .m4a
+        # 1. Main Writer (Video + Sys Audio) -> .mp4 — в handle_content_,
+        #    когда известен размер источника
+        # 2. Setup Aux Writer (Mic Audio) -> .m4a (кроме режима dual_track)
         # ==========================================
-        err_aux = None
-        self.aux_writer, err_aux = AVAssetWriter.alloc().initWithURL_fileType_error_(
-            aux_url, AVFileTypeAppleM4A, None # Используем контейнер M4A для аудио
+        if not self.dual_track and not self.open_aux_segment(0):
+            return None
+
+        return self
+
+    @objc.python_method
+    def apply_output_size(self, source_width, source_height):
+        """
+        Размер кадра по источнику (пиксели) в пределах площади пресета.
+        Меньше пикселей — пропорционально меньше битрейт.
+        """
+        max_width, max_height = int(self.preset.get("width", 1280)), int(self.preset.get("height", 720))
+        self.width, self.height = fit_output_size(int(source_width), int(source_height), max_width, max_height)
+        share = (self.width * self.height) / float(max_width * max_height)
+        self.bitrate = max(MIN_BITRATE, int(self.bitrate * min(1.0, share)))
+        self.preset = dict(self.preset, width=self.width, height=self.height, bitrate=self.bitrate)
+        self.video_settings = video_settings_for(self.preset, self.codec)
+
+    # --- Куски ---
+
+    @objc.python_method
+    def open_main_segment(self, index, start=0.0):
+        """Новый писатель Main для куска index (start — секунды от начала записи). Старый закрывает вызывающий."""
+        path = self.manifest.segment_path("main", index, ".mp4")
+        try:
+            video_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
+                AVMediaTypeVideo, self.video_settings
+            )
+        except Exception as e:
+            if self.codec == "h264":
+                raise
+            # Кодер не принял настройки (нет HEVC, не поддерживается quality) — пишем H.264 по битрейту
+            logger.warning(f"{self.codec} encoder settings rejected ({e}), falling back to H.264")
+            self.codec = "h264"
+            self.video_settings = video_settings_for(dict(self.preset, quality=None), "h264")
+            video_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
+                AVMediaTypeVideo, self.video_settings
+            )
+        video_input.setExpectsMediaDataInRealTime_(True)
+        video_adaptor = AVAssetWriterInputPixelBufferAdaptor.assetWriterInputPixelBufferAdaptorWithAssetWriterInput_sourcePixelBufferAttributes_(
+            video_input, None
+        )
+        # System Audio Input for Main Writer
+        sys_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
+            AVMediaTypeAudio, self.sys_audio_settings
         )
-        if err_aux:
-             logger.error(f"Error creating Aux Audio Writer: {err_aux}")
-             return None
+        sys_input.setExpectsMediaDataInRealTime_(True)
+        inputs = [video_input, sys_input]
+
+        mic_input = None
+        if self.dual_track:
+            mic_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
+                AVMediaTypeAudio, self.mic_audio_settings
+            )
+            mic_input.setExpectsMediaDataInRealTime_(True)
+            inputs.append(mic_input)
+            for inp, key in zip(inputs, ("video", "sys_audio", "mic")):
+                label_input(inp, TRACK_TITLES[key])
 
+        writer = make_writer(path, AVFileTypeMPEG4, inputs)
+        if writer is None:
+            return False
+        self.main_writer = writer
+        self.video_input = video_input
+        self.video_adaptor = video_adaptor
+        self.sys_input = sys_input
+        if self.dual_track:
+            self.mic_input = mic_input
+        self.manifest.open_segment("main", index, path, start)
+        return True
+
+    @objc.python_method
+    def open_aux_segment(self, index, start=0.0):
+        path = self.manifest.segment_path("mic", index, ".m4a")
         # Mic Input for Aux Writer
-        self.mic_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
-            AVMediaTypeAudio, audio_settings
+        mic_input = AVAssetWriterInput.assetWriterInputWithMediaType_outputSettings_(
+            AVMediaTypeAudio, self.mic_audio_settings
         )
-        self.mic_input.setExpectsMediaDataInRealTime_(True)
-        
-        if self.aux_writer.canAddInput_(self.mic_input): self.aux_writer.addInput_(self.mic_input)
+        mic_input.setExpectsMediaDataInRealTime_(True)
 
-        return self
+        writer = make_writer(path, AVFileTypeAppleM4A, [mic_input]) # Используем контейнер M4A для аудио
+        if writer is None:
+            return False
+        self.aux_writer = writer
+        self.mic_input = mic_input
+        self.manifest.open_segment("mic", index, path, start)
+        return True
+
+    @objc.python_method
+    def rotate_main(self, pts, seconds):
+        """Кадр pts открывает следующий кусок; текущий закрывается в фоне."""
+        old = (self.main_writer, self.main_inputs())
+        index = self.main_clock.index
+        if not self.open_main_segment(index + 1, seconds - self.main_clock.origin):
+            # Не смогли открыть новый файл — дописываем в текущий, больше не режем
+            logger.error("Segment rotation failed, continuing in the current segment")
+            self.main_clock.segment_seconds = 0
+            return
+        _, duration = self.main_clock.rotate(seconds)
+        self.main_writer.startSessionAtSourceTime_(pts)
+        self.finish_segment(old[0], old[1], "main", index, duration, True)
+        logger.info(f"Main segment {index} closed ({duration:.0f}s)")
+
+    @objc.python_method
+    def main_inputs(self):
+        return [self.video_input, self.sys_input] + ([self.mic_input] if self.dual_track else [])
+
+    @objc.python_method
+    def rotate_aux(self, pts, seconds):
+        old = (self.aux_writer, [self.mic_input])
+        index = self.aux_clock.index
+        if not self.open_aux_segment(index + 1, seconds - self.aux_clock.origin):
+            logger.error("Mic segment rotation failed, continuing in the current segment")
+            self.aux_clock.segment_seconds = 0
+            return
+        _, duration = self.aux_clock.rotate(seconds)
+        self.aux_writer.startSessionAtSourceTime_(pts)
+        self.finish_segment(old[0], old[1], "mic", index, duration, True)
+        logger.info(f"Mic segment {index} closed ({duration:.0f}s)")
+
+    @objc.python_method
+    def finish_segment(self, writer, inputs, track, index, duration, session_started):
+        for inp in inputs:
+            if inp: inp.markAsFinished()
+
+        if not session_started:
+            # Данных не было — писателю нечего финализировать
+            writer.cancelWriting()
+            self.manifest.close_segment(track, index, 0.0, ok=False)
+            self.check_finished()
+            return
+
+        def completion():
+            ok = writer.status() == AVAssetWriterStatusCompleted
+            if not ok:
+                logger.error(f"Writer for {track} segment {index} failed: {writer.error()}")
+            self.manifest.close_segment(track, index, duration, ok=ok)
+            self.check_finished()
+
+        writer.finishWritingWithCompletionHandler_(completion)
+
+    @objc.python_method
+    def check_finished(self):
+        """Все писатели закрыты после stop — склеиваем куски в итоговые файлы (в фоне)."""
+        if self.stitch_started or not self.manifest.is_finished():
+            return
+        self.stitch_started = True
+
+        def stitch():
+            speech_path = self.speech_encoder.close() if self.speech_encoder else None
+            results = stitch_segments(self.manifest)
+            if speech_path:
+                # Речевая дорожка новее склеенных файлов — extract_speech_audio возьмет ее как есть
+                os.utime(speech_path)
+                results["speech"] = speech_path
+            logger.info(f"Recording saved: {', '.join(results.values()) or 'nothing recorded'}")
+            self.log_sizes(results)
+            if self.stop_callback:
+                self.stop_callback(results)
+
+        threading.Thread(target=stitch, daemon=True).start()
+
+    @objc.python_method
+    def log_sizes(self, results):
+        """Размер и средний битрейт итоговых файлов — видно, сколько дают профили звука."""
+        duration = self.main_clock.last_pts - self.main_clock.origin if self.main_clock.started else 0.0
+        if duration <= 0:
+            return
+        for track, path in results.items():
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                logger.info(f"  {track}: {size / 1e6:.1f} MB, {size * 8 / duration / 1000:.0f} kbit/s")
 
     def startWithCallback_(self, callback):
         self.start_callback = callback
@@ -159,22 +545,42 @@ class ScreenRecorder(NSObject):
                 self.start_callback(False, str(error))
             return
 
-        displays = content.displays()
+        displays, windows = describe_content(content)
         if not displays:
             logger.error("No displays found")
             if hasattr(self, 'start_callback') and self.start_callback:
                 self.start_callback(False, "No displays found")
             return
-        
+
+        # --- Цель захвата и размер кадра под источник ---
+        plan = plan_capture(self.capture_target, displays, windows, main_id=Quartz.CGMainDisplayID())
+        filter_ = content_filter_for(plan)
+        if plan["source_rect"] is not None:
+            source_size = plan["source_rect"][2:]
+        elif plan["kind"] == CAPTURE_WINDOWS:
+            source_size = plan["windows"][0]["frame"][2:]
+        else:
+            source_size = plan["display"]["frame"][2:]
+        scale = pixel_scale(filter_)
+        self.apply_output_size(source_size[0] * scale, source_size[1] * scale)
+        logger.info(
+            f"Capture target: {plan['kind']} ({len(plan['windows'])} window(s)) on display {plan['display']['id']}, "
+            f"source {int(source_size[0] * scale)}x{int(source_size[1] * scale)} -> {self.width}x{self.height}"
+        )
+        if not self.open_main_segment(0):
+            if hasattr(self, 'start_callback') and self.start_callback:
+                self.start_callback(False, "Cannot create video writer")
+            return
+
         # --- Микрофон (AVCapture) ---
         self.mic_session = AVCaptureSession.alloc().init()
         mic_device = AVCaptureDevice.defaultDeviceWithMediaType_(AVMediaTypeAudio)
-        
+
         if mic_device:
             mic_inp, err = AVCaptureDeviceInput.deviceInputWithDevice_error_(mic_device, None)
             if not err and self.mic_session.canAddInput_(mic_inp):
                 self.mic_session.addInput_(mic_inp)
-            
+
             try:
                 import dispatch
                 self.mic_queue = dispatch.dispatch_queue_create(b"mic_queue", dispatch.DISPATCH_QUEUE_SERIAL)
@@ -184,118 +590,277 @@ class ScreenRecorder(NSObject):
             mic_out.setSampleBufferDelegate_queue_(self, self.mic_queue if self.mic_queue else None)
             if self.mic_session.canAddOutput_(mic_out):
                 self.mic_session.addOutput_(mic_out)
-            
+
             self.mic_session.startRunning()
 
         # --- Экран + Sys Audio (SCK) ---
-        display = displays[0]
         config = SCK.SCStreamConfiguration.alloc().init()
         config.setWidth_(self.width)
         config.setHeight_(self.height)
+        if plan["source_rect"] is not None:
+            config.setSourceRect_(Quartz.CGRectMake(*plan["source_rect"]))
         config.setPixelFormat_(Quartz.kCVPixelFormatType_32BGRA)
         config.setCapturesAudio_(True)
-        config.setMinimumFrameInterval_(CoreMedia.CMTimeMake(1, self.fps))
-        config.setQueueDepth_(6)
+        capture_fps = self.frame_gate.boost_fps if self.frame_gate else self.fps
+        config.setMinimumFrameInterval_(CoreMedia.CMTimeMake(1, capture_fps))
+        config.setQueueDepth_(SCK_QUEUE_DEPTH)
 
-        filter_ = SCK.SCContentFilter.alloc().initWithDisplay_excludingWindows_(display, [])
         self.stream = SCK.SCStream.alloc().initWithFilter_configuration_delegate_(filter_, config, self)
-        
+
         try:
             import dispatch
             self.video_queue = dispatch.dispatch_queue_create(b"video_queue", dispatch.DISPATCH_QUEUE_SERIAL)
+            self.audio_queue = dispatch.dispatch_queue_create(b"audio_queue", dispatch.DISPATCH_QUEUE_SERIAL)
         except:
             self.video_queue = None
+            self.audio_queue = None
 
         # 0=Video, 1=Audio
         self.stream.addStreamOutput_type_sampleHandlerQueue_error_(self, 0, self.video_queue, None)
-        self.stream.addStreamOutput_type_sampleHandlerQueue_error_(self, 1, self.video_queue, None)
-        
-        # Стартуем обоих писателей
-        if self.main_writer.startWriting() and self.aux_writer.startWriting():
-            self.is_recording = True
-            logger.info("Both writers initialized. Waiting for data...")
-            
-            def stream_handler(err):
-                if err:
-                    logger.error(f"Stream error: {err}")
-                    if hasattr(self, 'start_callback') and self.start_callback:
-                        self.start_callback(False, str(err))
-                else:
-                    logger.info("Stream started")
-                    if hasattr(self, 'start_callback') and self.start_callback:
-                        self.start_callback(True, None)
-
-            self.stream.startCaptureWithCompletionHandler_(stream_handler)
-        else:
-            logger.error("Failed to start one of the writers")
-            if hasattr(self, 'start_callback') and self.start_callback:
-                self.start_callback(False, "Failed to start one of the writers")
+        self.stream.addStreamOutput_type_sampleHandlerQueue_error_(self, 1, self.audio_queue, None)
+
+        # Потоки писателей; оба писателя уже запущены (startWriting) при открытии первых кусков
+        self.workers = [
+            SampleWorker("video", self.video_ring, self.write_video, objc.autorelease_pool).start(),
+            SampleWorker("sys-audio", self.sys_ring, self.write_sys_audio, objc.autorelease_pool).start(),
+            SampleWorker("mic", self.mic_ring, self.write_mic, objc.autorelease_pool).start(),
+        ]
+        self.is_recording = True
+        logger.info(
+            f"{'Single dual-track writer' if self.dual_track else 'Both writers'} initialized "
+            f"({self.codec}, {self.segment_seconds}s segments). Waiting for data..."
+        )
+
+        def stream_handler(err):
+            if err:
+                logger.error(f"Stream error: {err}")
+                if hasattr(self, 'start_callback') and self.start_callback:
+                    self.start_callback(False, str(err))
+            else:
+                logger.info("Stream started")
+                if hasattr(self, 'start_callback') and self.start_callback:
+                    self.start_callback(True, None)
+
+        self.stream.startCaptureWithCompletionHandler_(stream_handler)
 
     def stop(self):
+        self.stopWithCallback_(None)
+
+    def stopWithCallback_(self, callback):
+        """callback(results) — после склейки кусков, results: {"main": путь, "mic": путь}."""
         logger.info("ScreenRecorder: stop called")
+        self.stop_callback = callback
         self.is_recording = False
-        
+
         if self.stream: self.stream.stopCaptureWithCompletionHandler_(lambda e: None)
         if self.mic_session: self.mic_session.stopRunning()
-            
-        # Маркируем инпуты как finished
-        if self.video_input: self.video_input.markAsFinished()
-        if self.mic_input: self.mic_input.markAsFinished()
-        if self.sys_input: self.sys_input.markAsFinished()
-        
-        # Закрываем Main Writer
-        if self.main_writer:
-            self.main_writer.finishWritingWithCompletionHandler_(lambda: logger.info("Main Writer finished"))
-            
-        # Закрываем Aux Writer
-        if self.aux_writer:
-            self.aux_writer.finishWritingWithCompletionHandler_(lambda: logger.info("Aux Audio Writer finished"))
+
+        # Потоки писателей дописывают то, что осталось в очередях
+        for worker in self.workers:
+            worker.stop()
+        self.last_pixel_buffer = None
+        if self.mixer: self.mixer.close()
+        if self.frame_gate: logger.info(f"Adaptive capture: {self.frame_gate.summary()}")
+        logger.info(f"Capture stats: {self.telemetry.summary()}")
+
+        with self.main_lock, self.aux_lock:
+            self.manifest.mark_stopped()
+
+            # Маркируем инпуты как finished и закрываем Main / Aux Writer
+            if self.main_writer:
+                self.finish_segment(
+                    self.main_writer, self.main_inputs(), "main", self.main_clock.index,
+                    self.main_clock.elapsed() if self.main_clock.started else 0.0, self.main_session_started
+                )
+            if self.aux_writer:
+                self.finish_segment(
+                    self.aux_writer, [self.mic_input], "mic", self.aux_clock.index,
+                    self.aux_clock.elapsed() if self.aux_clock.started else 0.0, self.aux_session_started
+                )
+
+    # --- Телеметрия ---
+
+    @objc.python_method
+    def stats(self):
+        """Снимок счетчиков захвата по потокам (video, sys_audio, mic), см. steno.capture.CaptureTelemetry."""
+        snapshot = self.telemetry.snapshot()
+        if self.frame_gate is not None:
+            snapshot["adaptive"] = self.frame_gate.stats()
+        return snapshot
 
     # --- Delegates ---
+    # Колбэки только считают и кладут сэмпл в очередь своего потока
 
     @objc.typedSelector(STREAM_SIGNATURE)
     def stream_didOutputSampleBuffer_ofType_(self, stream, sampleBuffer, outputType):
         if not self.is_recording: return
-        
+
+        started = time.perf_counter()
+        stats = self.telemetry["video" if outputType == 0 else "sys_audio"]
         with objc.autorelease_pool():
-            if not CoreMedia.CMSampleBufferDataIsReady(sampleBuffer): return
-            
-            pts = CoreMedia.CMSampleBufferGetPresentationTimeStamp(sampleBuffer)
-
-            # --- VIDEO HANDLER (Main Writer) ---
-            if outputType == 0: 
-                # Логика старта Главной сессии (строго по Видео)
-                if not self.main_session_started:
-                    self.main_writer.startSessionAtSourceTime_(pts)
-                    self.main_session_started = True
-                    logger.info(f"Main Session started (Video PTS): {pts.value}")
-
-                if self.video_input.isReadyForMoreMediaData():
-                    pixel_buffer = CoreMedia.CMSampleBufferGetImageBuffer(sampleBuffer)
-                    if pixel_buffer:
-                        self.video_adaptor.appendPixelBuffer_withPresentationTime_(pixel_buffer, pts)
-
-            # --- SYSTEM AUDIO HANDLER (Main Writer) ---
-            elif outputType == 1:
-                # Системный звук пишем в Main Writer, поэтому ждем, пока видео стартанет сессию
-                if not self.main_session_started: return
-                
-                if self.sys_input.isReadyForMoreMediaData():
-                    self.sys_input.appendSampleBuffer_(sampleBuffer)
-
-    # --- MICROPHONE HANDLER (Aux Writer) ---
+            try:
+                if not CoreMedia.CMSampleBufferDataIsReady(sampleBuffer): return
+
+                pts = CoreMedia.CMSampleBufferGetPresentationTimeStamp(sampleBuffer)
+                seconds = CoreMedia.CMTimeGetSeconds(pts)
+
+                # --- VIDEO ---
+                if outputType == 0:
+                    stats.on_sample(seconds)
+                    changed = True
+                    if self.frame_gate is not None:
+                        status, dirty = frame_info(sampleBuffer)
+                        # Idle/Blank — SCK сообщает, что нового изображения нет. На статичном
+                        # экране других кадров не будет: для гейта это неизмененный кадр,
+                        # а keepalive повторяет последнее полное изображение (write_video)
+                        idle = status != SCK.SCFrameStatusComplete
+                        changed = not idle and (
+                            dirty is None or dirty_fraction(dirty, self.width, self.height) >= MIN_DIRTY_FRACTION
+                        )
+                        if not self.frame_gate.offer(seconds, changed):
+                            stats.dropped_adaptive += 1
+                            return
+                        if idle:
+                            sampleBuffer = None
+                    # Кадры с изменением экрана — ключевые для политики drop_non_key
+                    self.video_ring.put((sampleBuffer, pts, seconds), key=changed)
+
+                # --- SYSTEM AUDIO ---
+                elif outputType == 1:
+                    stats.on_sample(seconds, CoreMedia.CMTimeGetSeconds(CoreMedia.CMSampleBufferGetDuration(sampleBuffer)))
+                    self.sys_ring.put((sampleBuffer, pts, seconds))
+            finally:
+                stats.on_handled(time.perf_counter() - started)
+                self.telemetry.maybe_log(started)
+
+    # --- MICROPHONE ---
     def captureOutput_didOutputSampleBuffer_fromConnection_(self, output, sampleBuffer, connection):
         if not self.is_recording: return
-        
+
+        started = time.perf_counter()
+        stats = self.telemetry["mic"]
         with objc.autorelease_pool():
-            if not CoreMedia.CMSampleBufferDataIsReady(sampleBuffer): return
-            
+            try:
+                if not CoreMedia.CMSampleBufferDataIsReady(sampleBuffer): return
+
+                pts = CoreMedia.CMSampleBufferGetPresentationTimeStamp(sampleBuffer)
+                seconds = CoreMedia.CMTimeGetSeconds(pts)
+                stats.on_sample(seconds, CoreMedia.CMTimeGetSeconds(CoreMedia.CMSampleBufferGetDuration(sampleBuffer)))
+                self.mic_ring.put((sampleBuffer, pts, seconds))
+            finally:
+                stats.on_handled(time.perf_counter() - started)
+                self.telemetry.maybe_log(started)
+
+    # --- Потоки писателей ---
+
+    @objc.python_method
+    def wait_until_ready(self, get_input):
+        """Ждет готовности инпута (back-pressure кодера) не дольше READY_TIMEOUT."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not get_input().isReadyForMoreMediaData():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(READY_POLL)
+        return True
+
+    @objc.python_method
+    def write_video(self, item):
+        """VIDEO HANDLER (Main Writer)"""
+        sampleBuffer, pts, seconds = item
+        stats = self.telemetry["video"]
+        if sampleBuffer is None:
+            # Keepalive на статичном экране: повтор последнего изображения с новым PTS
+            # (двигает и ротацию кусков — main_clock идет только по видео)
+            pixel_buffer = self.last_pixel_buffer
+            if pixel_buffer is None:
+                stats.dropped_adaptive += 1
+                return
+        else:
+            pixel_buffer = CoreMedia.CMSampleBufferGetImageBuffer(sampleBuffer)
+            if pixel_buffer:
+                self.last_pixel_buffer = pixel_buffer
+
+        with self.main_lock:
+            # Логика старта Главной сессии (строго по Видео)
+            if not self.main_session_started:
+                self.main_writer.startSessionAtSourceTime_(pts)
+                self.main_session_started = True
+                self.main_clock.start(seconds)
+                if self.mixer: self.mixer.start(seconds)
+                logger.info(f"Main Session started (Video PTS): {pts.value}")
+            elif self.main_clock.tick(seconds):
+                # Новый кусок начинается с этого кадра (у нового писателя он ключевой)
+                self.rotate_main(pts, seconds)
+
+        if not pixel_buffer:
+            return
+        # Инпуты видео меняет только этот поток (ротация), ждать можно без блокировки
+        if self.wait_until_ready(lambda: self.video_input):
+            self.video_adaptor.appendPixelBuffer_withPresentationTime_(pixel_buffer, pts)
+            stats.appended += 1
+        else:
+            stats.dropped_not_ready += 1
+
+    @objc.python_method
+    def write_main_audio(self, sampleBuffer, stats, get_input):
+        """Звук в Main Writer: ждем, пока видео стартанет сессию."""
+        if not self.main_session_started:
+            stats.dropped_no_session += 1
+            return
+        if not self.wait_until_ready(get_input):
+            stats.dropped_not_ready += 1
+            return
+        with self.main_lock:
+            # Инпут мог смениться ротацией, пока ждали
+            inp = get_input()
+            if inp.isReadyForMoreMediaData():
+                inp.appendSampleBuffer_(sampleBuffer)
+                stats.appended += 1
+            else:
+                stats.dropped_not_ready += 1
+
+    @objc.python_method
+    def mix_sample(self, source, sampleBuffer, seconds):
+        """Копия звука в речевую дорожку (режим speech_mixdown)."""
+        if self.mixer is None:
+            return
+        try:
+            pcm = sample_pcm(sampleBuffer)
+            if pcm:
+                self.mixer.add(source, seconds, pcm[0], pcm[1])
+        except Exception as e:
+            logger.warning(f"Speech mixdown stopped: {e}")
+            self.mixer = None
+
+    @objc.python_method
+    def write_sys_audio(self, item):
+        """SYSTEM AUDIO HANDLER (Main Writer)"""
+        sampleBuffer, pts, seconds = item
+        self.mix_sample("sys", sampleBuffer, seconds)
+        self.write_main_audio(sampleBuffer, self.telemetry["sys_audio"], lambda: self.sys_input)
+
+    @objc.python_method
+    def write_mic(self, item):
+        """MICROPHONE HANDLER (Aux Writer)"""
+        sampleBuffer, pts, seconds = item
+        stats = self.telemetry["mic"]
+        self.mix_sample("mic", sampleBuffer, seconds)
+        if self.dual_track:
+            # Часы микрофона (AVCapture) и SCK — host time, одна шкала с видео
+            self.write_main_audio(sampleBuffer, stats, lambda: self.mic_input)
+            return
+        with self.aux_lock:
             # Логика старта Aux сессии (независимо от видео)
             if not self.aux_session_started:
-                pts = CoreMedia.CMSampleBufferGetPresentationTimeStamp(sampleBuffer)
                 self.aux_writer.startSessionAtSourceTime_(pts)
                 self.aux_session_started = True
+                self.aux_clock.start(seconds)
                 logger.info(f"Aux Audio Session started (Mic PTS): {pts.value}")
-            
-            if self.mic_input.isReadyForMoreMediaData():
-                self.mic_input.appendSampleBuffer_(sampleBuffer)
\ No newline at end of file
+            elif self.aux_clock.tick(seconds):
+                self.rotate_aux(pts, seconds)
+
+        if self.wait_until_ready(lambda: self.mic_input):
+            self.mic_input.appendSampleBuffer_(sampleBuffer)
+            stats.appended += 1
+        else:
+            stats.dropped_not_ready += 1
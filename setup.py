@@ -17,6 +17,7 @@ DATA_FILES = [
         'assets/icon_error.png',
         'assets/app_icon.icns.icns'
     ]),
+    ('bin', ['bin/ffmpeg']),
 ]
 
 OPTIONS = {
@@ -31,7 +32,7 @@ OPTIONS = {
         'NSMicrophoneUsageDescription': "Приложение записывает звук микрофона во время встреч.",
         'NSScreenCaptureUsageDescription': "Приложение записывает экран для сохранения видео встреч.",
     },
-    'packages': ['rumps', 'certifi', 'objc', 'AVFoundation', 'Quartz', 'ApplicationServices', 'AppKit', 'Foundation'],
+    'packages': ['steno', 'rumps', 'certifi', 'objc', 'AVFoundation', 'Quartz', 'ApplicationServices', 'AppKit', 'Foundation'],
     'includes': ['google.genai'],
     'iconfile': 'assets/app_icon.icns.icns',
 }
@@ -0,0 +1,7 @@
+"""
+Steno core: конфиг, разбор дат, ИИ-пайплайн, очередь задач и индекс файлов.
+
+Пакет не зависит от rumps/PyObjC и импортируется на любой платформе;
+тяжелые SDK (google.genai) подгружаются лениво, в момент использования.
+Интерфейс строки меню macOS — тонкая оболочка в app.py.
+"""
@@ -0,0 +1,6 @@
+# steno/__main__.py
+import sys
+
+from steno.cli import main
+
+sys.exit(main())
@@ -0,0 +1,393 @@
+# steno/api.py
+"""
+Общий клиент Gemini API для всех задач обработки.
+
+Раньше каждая задача создавала свой genai.Client: соединения не
+переиспользовались, а несколько задач разом упирались в лимиты
+провайдера (429) и падали. Теперь:
+
+- на каждую пару (api_key, base_url) — один долгоживущий клиент
+  (get_client), его пул соединений общий для всех задач;
+- все запросы идут через async API SDK (client.aio) в одном фоновом
+  цикле asyncio: загрузка статусов файлов, опрос и генерация разных задач
+  выполняются одновременно, не занимая по потоку на запрос;
+- перед запросом — ведро токенов ключа (RateLimiter): запросы в минуту
+  (rate_limit_rpm) и токены в минуту (rate_limit_tpm, по оценке до
+  запроса и фактическому расходу после);
+- 429 и 5xx повторяются с экспоненциальной задержкой; 429 придерживает
+  все запросы ключа на время, указанное сервером (RetryInfo);
+- загрузка файлов идет своим HTTP (steno/uploader.py, чанки с докачкой),
+  но через те же лимиты ключа (client.uploads).
+
+Код пайплайна синхронный (задачи очереди — потоки), поэтому клиент
+сохраняет интерфейс genai.Client: client.files.get/delete,
+client.models.generate_content/generate_content_stream — вызовы
+выполняются в общем цикле, поток задачи ждет результат.
+
+Для проверки без сети см. steno/fakeapi.py (локальная заглушка API).
+"""
+import re
+import time
+import queue
+import random
+import asyncio
+import threading
+import logging
+
+from steno.media import estimate_media_tokens, AUDIO_TOKENS_PER_SECOND
+
+logger = logging.getLogger("Steno")
+
+DEFAULT_RPM = 60
+DEFAULT_TPM = 1000000
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+CHARS_PER_TOKEN = 4
+
+_STREAM_END = object()
+
+
+class TokenBucket:
+    """
+    Ведро на per_minute единиц: пополняется равномерно, емкость — минутный
+    запас. take может увести уровень в минус (фактический расход оказался
+    больше оценки) — следующие запросы подождут дольше.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def delay_for(self, amount):
+        """Через сколько секунд в ведре будет amount (не больше емкости)."""
+        self._refill()
+        missing = min(amount, self.per_minute) - self.level
+        return max(0.0, missing * 60.0 / self.per_minute)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Лимиты одного ключа: запросы и токены в минуту (0 — без ограничения).
+    Используется только из цикла ApiLoop, поэтому без блокировок.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.requests = None
+        self.tokens = None
+        self.paused_until = 0.0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm, tpm):
+        if (self.requests.per_minute if self.requests else 0) != rpm:
+            self.requests = TokenBucket(rpm) if rpm else None
+        if (self.tokens.per_minute if self.tokens else 0) != tpm:
+            self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens=0):
+        """Ждет места под запрос с оценкой tokens. Возвращает время ожидания (сек)."""
+        started = time.monotonic()
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if self.requests:
+                delay = max(delay, self.requests.delay_for(1))
+            if self.tokens and tokens:
+                delay = max(delay, self.tokens.delay_for(tokens))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+        return time.monotonic() - started
+
+    async def wait_paused(self):
+        """Ждет конца паузы после 429, ведра не трогает. Возвращает время ожидания (сек)."""
+        started = time.monotonic()
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return time.monotonic() - started
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated, actual):
+        """Поправка ведра токенов на фактический расход после ответа."""
+        if self.tokens and actual:
+            self.tokens.take(actual - estimated)
+
+    def pause(self, seconds):
+        """Сервер ответил 429: все запросы ключа ждут seconds."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ApiLoop:
+    """Фоновый поток с циклом asyncio, общий для всех клиентов."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="steno-api", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Выполняет корутину в цикле и ждет результат в вызывающем потоке."""
+        return self.submit(coro).result()
+
+
+def is_retryable(error):
+    """429 и 5xx, обрывы и таймауты сети имеет смысл повторить, ошибки запроса — нет."""
+    from steno.streaming import _is_retryable
+    return _is_retryable(error)
+
+
+def retry_delay(error, attempt):
+    """Задержка перед повтором: из RetryInfo ответа 429, иначе экспонента с разбросом."""
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for item in (details.get("error") or {}).get("details") or []:
+            match = re.fullmatch(r"([\d.]+)s", str(item.get("retryDelay", "")))
+            if match:
+                return min(RETRY_MAX_DELAY, float(match.group(1)))
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _file_duration(remote_file):
+    metadata = getattr(remote_file, "video_metadata", None)
+    duration = getattr(metadata, "video_duration", None)
+    if duration is None:
+        return None
+    try:
+        return float(str(duration).rstrip("s"))
+    except ValueError:
+        return None
+
+
+def estimate_request_tokens(contents):
+    """
+    Грубая оценка входных токенов запроса для ведра TPM: текст — по длине,
+    файлы — по длительности, если API ее сообщил. Расхождение с фактом
+    учитывается после ответа (RateLimiter.settle).
+    """
+    total = 0
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            total += len(item) // CHARS_PER_TOKEN
+            continue
+        for part in getattr(item, "parts", None) or []:
+            total += len(getattr(part, "text", None) or "") // CHARS_PER_TOKEN
+        duration = _file_duration(item)
+        if duration is not None:
+            video = str(getattr(item, "mime_type", "")).startswith("video/")
+            total += estimate_media_tokens(duration, video_tracks=int(video), audio_tracks=1)
+        elif getattr(item, "uri", None):
+            # Длительность неизвестна: минута речи как нижняя оценка
+            total += 60 * AUDIO_TOKENS_PER_SECOND
+    return total
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return (getattr(usage, "total_token_count", None) or 0) if usage else 0
+
+
+class ApiClient:
+    """
+    Долгоживущий клиент одной пары (api_key, base_url). Async-методы
+    (get_file, delete_file, generate, stream) выполняются в цикле ApiLoop;
+    files и models — синхронная обертка с интерфейсом genai.Client.
+    """
+
+    def __init__(self, api_key, base_url, limiter, loop):
+        from google import genai
+
+        client_kwargs = {"api_key": api_key}
+        if base_url:
+            client_kwargs["http_options"] = {"baseUrl": base_url}
+        self.genai = genai.Client(**client_kwargs)
+        self.base_url = base_url
+        self.limiter = limiter
+        self.loop = loop
+        self.files = _Files(self)
+        self.models = _Models(self)
+        self.uploads = _Uploads(self)
+        self.stats = {"requests": 0, "retries": 0, "throttled_seconds": 0.0}
+
+    async def call(self, fn, tokens=0, what="request"):
+        """fn() -> корутина запроса. Лимиты ключа, повторы на 429/5xx."""
+        attempt = 0
+        while True:
+            self.stats["throttled_seconds"] += await self.limiter.acquire(tokens)
+            self.stats["requests"] += 1
+            try:
+                return await fn()
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                if getattr(e, "code", None) == 429:
+                    self.limiter.pause(delay)
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"API {what} failed ({e}), retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def get_file(self, name):
+        return await self.call(lambda: self.genai.aio.files.get(name=name), what=f"files.get {name}")
+
+    async def delete_file(self, name):
+        return await self.call(lambda: self.genai.aio.files.delete(name=name), what=f"files.delete {name}")
+
+    async def generate(self, model, contents, config=None):
+        estimate = estimate_request_tokens(contents)
+        response = await self.call(
+            lambda: self.genai.aio.models.generate_content(model=model, contents=contents, config=config),
+            tokens=estimate, what=f"generate_content {model}"
+        )
+        self.limiter.settle(estimate, _usage_tokens(response))
+        return response
+
+    async def stream(self, model, contents, config, on_chunk):
+        """
+        Потоковая генерация: куски ответа передаются в on_chunk по мере прихода.
+        Повторяется только открытие потока (до первого куска) — обрыв посреди
+        ответа продолжает generate_streaming (steno/streaming.py).
+        """
+        estimate = estimate_request_tokens(contents)
+
+        async def open_stream():
+            iterator = await self.genai.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+            # Запрос уходит на первом шаге итерации — его ошибки тоже повторяем
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = None
+            return iterator, first
+
+        iterator, chunk = await self.call(open_stream, tokens=estimate, what=f"generate_content_stream {model}")
+        usage = 0
+        while chunk is not None:
+            usage = _usage_tokens(chunk) or usage
+            on_chunk(chunk)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                chunk = None
+        self.limiter.settle(estimate, usage)
+
+    def run(self, coro):
+        return self.loop.run(coro)
+
+
+class _Files:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, name):
+        return self._client.run(self._client.get_file(name))
+
+    def delete(self, name):
+        return self._client.run(self._client.delete_file(name))
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        return self._client.run(self._client.generate(model, contents, config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        """Синхронный итератор кусков: цикл кладет их в очередь, поток задачи забирает."""
+        chunks = queue.Queue()
+
+        async def pump():
+            try:
+                await self._client.stream(model, contents, config, chunks.put)
+                chunks.put(_STREAM_END)
+            except BaseException as e:
+                chunks.put(e)
+                raise
+
+        future = self._client.loop.submit(pump())
+        try:
+            while True:
+                item = chunks.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Потребитель бросил итерацию (ошибка записи, отмена) — поток закрываем
+            future.cancel()
+
+
+class _Uploads:
+    """
+    Лимиты ключа для ResumableUploader (limiter=client.uploads). Новая сессия
+    загрузки — один запрос из ведра RPM, как files.upload в SDK. Чанки и сверка
+    смещения ждут только паузы после 429: иначе ведро съедали бы мегабайтные
+    чанки длинной записи, а генерация стояла бы за ними.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def acquire(self, new_session=False):
+        """Из потока загрузки, перед каждым HTTP-запросом."""
+        client = self._client
+
+        async def wait():
+            if new_session:
+                client.stats["throttled_seconds"] += await client.limiter.acquire()
+                client.stats["requests"] += 1
+            else:
+                client.stats["throttled_seconds"] += await client.limiter.wait_paused()
+
+        client.run(wait())
+
+    def pause(self, seconds):
+        """Загрузка получила 429: придерживаем все запросы ключа."""
+        self._client.loop.loop.call_soon_threadsafe(self._client.limiter.pause, seconds)
+
+
+_pool_lock = threading.Lock()
+_loop = None
+_clients = {}
+_limiters = {}
+
+
+def get_client(api_key, base_url="", rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+    """Общий клиент для (api_key, base_url); лимиты — на ключ, обновляются из аргументов."""
+    global _loop
+    with _pool_lock:
+        if _loop is None:
+            _loop = ApiLoop()
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            limiter = _limiters[api_key] = RateLimiter(rpm, tpm)
+        else:
+            _loop.loop.call_soon_threadsafe(limiter.configure, rpm, tpm)
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = _clients[(api_key, base_url)] = ApiClient(api_key, base_url, limiter, _loop)
+        return client
+
+
+def client_stats():
+    """Счетчики клиентов пула: запросы, повторы, ожидание лимитов (для логов и бенчмарка)."""
+    with _pool_lock:
+        return {f"{base_url or 'default'}": dict(client.stats) for (_, base_url), client in _clients.items()}
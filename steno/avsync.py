@@ -0,0 +1,188 @@
+# steno/avsync.py
+"""
+Проверка синхронности дорожек записи.
+
+    python -m steno ~/Movies/ScreenRecordings/Meet_x.mp4 --check-sync
+
+A/V — разница первых меток времени видео и системного звука в контейнере.
+Микрофон/система — сдвиг по содержимому: системный звук из динамиков
+попадает в микрофон, огибающие громкости двух дорожек сравниваются
+взаимной корреляцией в начале и в конце записи (разница — дрейф часов).
+В наушниках звук в микрофон не попадает — тогда сдвиг не измерить.
+"""
+import re
+import math
+import logging
+from array import array
+
+from steno.media import MediaError, _run_ffmpeg, probe_media
+
+logger = logging.getLogger("Steno")
+
+# Подписи дорожек в одном файле (recorder.py, режим dual_track)
+TRACK_TITLES = {"video": "Screen", "sys_audio": "System Audio", "mic": "Microphone"}
+
+# Огибающая: звук 8 кГц, громкость по окнам 10 мс
+ENVELOPE_RATE = 8000
+ENVELOPE_STEP = 80
+MEASURE_SECONDS = 60
+MAX_LAG_SECONDS = 1.0
+# Ниже — совпадения нет (наушники, тишина), сдвиг не считаем
+MIN_CORRELATION = 0.3
+
+
+def list_streams(path):
+    """Потоки файла по выводу `ffmpeg -i`: [{"index", "type", "title"}]."""
+    result = _run_ffmpeg(["-i", path])
+    streams = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"\s*Stream #0:(\d+)\S*: (Video|Audio):", line)
+        if match:
+            streams.append({"index": int(match.group(1)), "type": match.group(2).lower(), "title": ""})
+            continue
+        # title важнее handler_name (его AVFoundation ставит всем дорожкам одинаковым)
+        match = re.match(r"\s*(title|handler_name)\s*: (.+)", line)
+        if match and streams and (match.group(1) == "title" or not streams[-1]["title"]):
+            streams[-1]["title"] = match.group(2).strip()
+    return streams
+
+
+def stream_starts(path):
+    """Первая метка времени (сек) каждого потока, без декодирования (framecrc по -c copy)."""
+    result = _run_ffmpeg(["-i", path, "-map", "0", "-c", "copy", "-t", "2", "-f", "framecrc", "-"])
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+    time_bases = {}
+    starts = {}
+    for line in result.stdout.splitlines():
+        match = re.match(r"#tb (\d+): (\d+)/(\d+)", line)
+        if match:
+            time_bases[int(match.group(1))] = int(match.group(2)) / int(match.group(3))
+            continue
+        if line.startswith("#"):
+            continue
+        fields = [f.strip() for f in line.split(",")]
+        if len(fields) < 3:
+            continue
+        index = int(fields[0])
+        if index not in starts and index in time_bases:
+            starts[index] = int(fields[2]) * time_bases[index]
+    return starts
+
+
+def audio_envelope(path, audio_index, start, seconds):
+    """Громкость дорожки 0:a:audio_index по окнам ENVELOPE_STEP сэмплов."""
+    result = _run_ffmpeg([
+        "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", path,
+        "-map", f"0:a:{audio_index}", "-ac", "1", "-ar", str(ENVELOPE_RATE), "-f", "s16le", "-",
+    ], text=False)
+    if result.returncode != 0:
+        raise MediaError(f"ffmpeg failed on audio stream {audio_index} of {path}")
+    samples = array("h")
+    samples.frombytes(result.stdout[:len(result.stdout) // 2 * 2])
+    envelope = []
+    for i in range(0, len(samples) - ENVELOPE_STEP + 1, ENVELOPE_STEP):
+        chunk = samples[i:i + ENVELOPE_STEP]
+        envelope.append(math.sqrt(sum(x * x for x in chunk) / ENVELOPE_STEP))
+    return envelope
+
+
+def best_lag(reference, other, max_lag):
+    """
+    Сдвиг other относительно reference (в окнах огибающей) с максимальной
+    нормированной корреляцией. Положительный — other запаздывает.
+    Возвращает (сдвиг, корреляция).
+    """
+    n = min(len(reference), len(other))
+    if n <= 2 * max_lag:
+        return 0, 0.0
+    ref_mean = sum(reference[:n]) / n
+    oth_mean = sum(other[:n]) / n
+    ref = [x - ref_mean for x in reference[:n]]
+    oth = [x - oth_mean for x in other[:n]]
+    best = (0, 0.0)
+    for lag in range(-max_lag, max_lag + 1):
+        a = ref[max(0, -lag):n - max(0, lag)]
+        b = oth[max(0, lag):n - max(0, -lag)]
+        norm = math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
+        if not norm:
+            continue
+        score = sum(x * y for x, y in zip(a, b)) / norm
+        if score > best[1]:
+            best = (lag, score)
+    return best
+
+
+def _find_audio(streams, title, fallback):
+    audio = [s for s in streams if s["type"] == "audio"]
+    for position, stream in enumerate(audio):
+        if stream["title"] == title:
+            return position
+    return fallback if fallback < len(audio) else None
+
+
+def measure_sync(path, mic_path=None, seconds=MEASURE_SECONDS):
+    """
+    Сдвиги дорожек записи. mic_path — отдельный файл микрофона (старый режим
+    записи), иначе микрофон ищется второй дорожкой того же файла.
+    Возвращает словарь: av_offset (начало звука минус начало видео, сек),
+    mic_offset_start / mic_offset_end (запаздывание микрофона, сек, None —
+    не измерить), drift (изменение сдвига за запись), correlation.
+    """
+    streams = list_streams(path)
+    starts = stream_starts(path)
+    video = next((s for s in streams if s["type"] == "video"), None)
+    sys_position = _find_audio(streams, TRACK_TITLES["sys_audio"], 0)
+    audio = [s for s in streams if s["type"] == "audio"]
+
+    report = {"av_offset": None, "mic_offset_start": None, "mic_offset_end": None, "drift": None, "correlation": None}
+    if video is not None and sys_position is not None:
+        sys_stream = audio[sys_position]
+        if video["index"] in starts and sys_stream["index"] in starts:
+            report["av_offset"] = starts[sys_stream["index"]] - starts[video["index"]]
+
+    if mic_path:
+        mic_source, mic_position = mic_path, 0
+    else:
+        mic_source, mic_position = path, _find_audio(streams, TRACK_TITLES["mic"], 1)
+    if sys_position is None or mic_position is None:
+        return report
+
+    duration = probe_media(path)["duration"]
+    seconds = min(seconds, duration)
+    max_lag = int(MAX_LAG_SECONDS * ENVELOPE_RATE / ENVELOPE_STEP)
+    step = ENVELOPE_STEP / ENVELOPE_RATE
+    windows = {"mic_offset_start": 0.0}
+    if duration > 2 * seconds:
+        windows["mic_offset_end"] = duration - seconds
+    scores = []
+    for key, start in windows.items():
+        lag, score = best_lag(
+            audio_envelope(path, sys_position, start, seconds),
+            audio_envelope(mic_source, mic_position, start, seconds),
+            max_lag
+        )
+        scores.append(score)
+        if score >= MIN_CORRELATION:
+            report[key] = lag * step
+    report["correlation"] = min(scores)
+    if report["mic_offset_start"] is not None and report["mic_offset_end"] is not None:
+        report["drift"] = report["mic_offset_end"] - report["mic_offset_start"]
+    return report
+
+
+def format_sync_report(path, report):
+    def ms(value):
+        return "n/a" if value is None else f"{value * 1000:+.0f} ms"
+
+    lines = [
+        path,
+        f"  A/V offset (system audio vs video): {ms(report['av_offset'])}",
+        f"  Mic vs system audio at start:       {ms(report['mic_offset_start'])}",
+        f"  Mic vs system audio at end:         {ms(report['mic_offset_end'])}",
+        f"  Mic drift over recording:           {ms(report['drift'])}",
+    ]
+    if report["correlation"] is not None and report["correlation"] < MIN_CORRELATION:
+        lines.append("  (system audio is not audible in the mic track — headphones? mic offset not measurable)")
+    return "\n".join(lines)
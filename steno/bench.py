@@ -0,0 +1,390 @@
+# steno/bench.py
+"""
+Бенчмарки без сети и квоты: API — локальная заглушка (steno/fakeapi.py).
+
+    python -m steno.bench upload-wait --files 4   # от начала загрузки до готового ответа
+    python -m steno.bench live --minutes 10 30 60  # от Stop до протокола: live против обычной обработки
+    python -m steno.bench capture --seconds 30     # размер файла и цена кодирования по пресетам видео
+    python -m steno.bench index --files 10000      # меню Recent: индекс папки против listdir + getmtime
+
+Служебные файлы (журналы, кэш, индексы в ~/.recorder_app_*) бенчмарки
+пишут во временный HOME — настоящие не трогаются.
+"""
+import os
+import sys
+import time
+import tempfile
+import resource
+import argparse
+import logging
+
+from steno.fakeapi import serve
+
+logger = logging.getLogger("Steno")
+
+LEGACY_POLL_INTERVAL = 3.0
+
+
+def _make_files(directory, sizes_mb):
+    paths = []
+    for i, size_mb in enumerate(sizes_mb):
+        path = os.path.join(directory, f"bench_{i}.m4a")
+        with open(path, "wb") as f:
+            f.write(os.urandom(int(size_mb * 1e6)))
+        paths.append(path)
+    return paths
+
+
+# --- Ожидание обработки файлов (user-002) ---
+
+def wait_sequential(client, names):
+    """Прежнее ожидание: файлы по очереди, files.get раз в 3 секунды."""
+    ready = []
+    for name in names:
+        remote_file = client.files.get(name=name)
+        while remote_file.state.name == "PROCESSING":
+            time.sleep(LEGACY_POLL_INTERVAL)
+            remote_file = client.files.get(name=name)
+        ready.append(remote_file)
+    return ready
+
+
+def bench_upload_wait(files, size_mb, processing_seconds, processing_per_mb, rounds):
+    """
+    Время от начала загрузки до ответа модели: загрузка (ResumableUploader),
+    ожидание ACTIVE и генерация. Сравнивается прежний последовательный опрос
+    с wait_for_files_active; у файлов разный размер — и разное время обработки.
+    """
+    from steno.api import get_client
+    from steno.uploader import ResumableUploader, UploadJournal, wait_for_files_active
+
+    sizes = [size_mb * (i + 1) for i in range(files)]
+    print(
+        f"{files} files ({', '.join(f'{s:.0f} MB' for s in sizes)}), processing "
+        f"{processing_seconds}s + {processing_per_mb}s/MB, {rounds} rounds"
+    )
+    with tempfile.TemporaryDirectory(prefix="steno_bench_") as tmp:
+        paths = _make_files(tmp, sizes)
+        for label, wait in (("sequential 3s polling", wait_sequential), ("concurrent backoff", wait_for_files_active)):
+            totals, waits, polls = [], [], []
+            for _ in range(rounds):
+                server, base_url, state = serve(
+                    processing_seconds=processing_seconds, processing_per_mb=processing_per_mb, latency=0.05
+                )
+                client = get_client("fake", base_url, rpm=0, tpm=0)
+                uploader = ResumableUploader("fake", base_url=base_url, journal=UploadJournal(os.path.join(tmp, "journal.json")))
+                started = time.monotonic()
+                remote_files, _ = uploader.upload_all(paths)
+                uploaded = time.monotonic()
+                requests_before = state.counters["requests"]
+                ready = wait(client, [f["name"] for f in remote_files])
+                waited = time.monotonic()
+                polls.append(state.counters["requests"] - requests_before)
+                client.models.generate_content(model="fake-model", contents=ready + ["Протокол"])
+                totals.append(time.monotonic() - started)
+                waits.append(waited - uploaded)
+                server.shutdown()
+                server.server_close()
+            print(
+                f"{label:<22} upload->response {sum(totals) / rounds:.2f}s "
+                f"(waiting {sum(waits) / rounds:.2f}s, {sum(polls) / rounds:.0f} status requests)"
+            )
+
+
+# --- От Stop до протокола (user-012) ---
+
+def _simulate_recording(live, directory, segments, segment_mb, segment_seconds, interval):
+    """Рекордер: каждые interval секунд закрывает кусок и отдает его сессии. Возвращает склеенную запись."""
+    paths = []
+    for index in range(segments):
+        time.sleep(interval)
+        path = os.path.join(directory, f"main_{index:04d}.mp4")
+        with open(path, "wb") as f:
+            f.write(os.urandom(int(segment_mb * 1e6)))
+        paths.append(path)
+        if live is not None:
+            live.on_segment({
+                "track": "main", "index": index, "path": path,
+                "start": index * segment_seconds, "duration": float(segment_seconds),
+            })
+    video_path = os.path.join(directory, "Meet_bench.mp4")
+    with open(video_path, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                out.write(f.read())
+    return video_path
+
+
+def bench_live(minutes_list, segment_mb, interval, upload_bandwidth, processing_per_mb, latency):
+    """
+    Время от Stop до готового протокола для встреч разной длины: LiveSession
+    (куски загружены во время записи) против обработки записи после Stop.
+    Режим video — без ffmpeg, куски уходят как есть; куски по segment_minutes
+    из DEFAULT_CONFIG, запись ускорена: кусок закрывается раз в interval секунд.
+    """
+    from steno.config import DEFAULT_CONFIG
+    from steno.live import LiveSession
+    from steno.pipeline import process_video_with_ai
+
+    segment_seconds = int(DEFAULT_CONFIG["segment_minutes"]) * 60
+    print(
+        f"Segments of {segment_mb} MB per {segment_seconds // 60} min, upload {upload_bandwidth} MB/s, "
+        f"processing 1s + {processing_per_mb}s/MB, {latency}s generation"
+    )
+    for minutes in minutes_list:
+        segments = max(1, minutes * 60 // segment_seconds)
+        server, base_url, _ = serve(
+            processing_seconds=1.0, processing_per_mb=processing_per_mb, latency=latency,
+            upload_bandwidth=upload_bandwidth
+        )
+        config = dict(
+            DEFAULT_CONFIG, api_key="fake", base_url=base_url, processing_mode="video",
+            dual_track=True, map_reduce=False, trim_silence=False, rate_limit_rpm=0, rate_limit_tpm=0
+        )
+        with tempfile.TemporaryDirectory(prefix="steno_bench_") as tmp:
+            live = LiveSession(os.path.join(tmp, "Meet_bench.mp4"), config)
+            video_path = _simulate_recording(live, tmp, segments, segment_mb, segment_seconds, interval)
+            stopped = time.monotonic()
+            live.recording_stopped()
+            live.finish()
+            live_seconds = time.monotonic() - stopped
+
+            stopped = time.monotonic()
+            process_video_with_ai(video_path, config)
+            batch_seconds = time.monotonic() - stopped
+        server.shutdown()
+        server.server_close()
+        print(
+            f"{minutes:>4} min ({segments:>2} segments, {segments * segment_mb:.0f} MB): "
+            f"Stop->protocol live {live_seconds:.1f}s, after Stop {batch_seconds:.1f}s"
+        )
+
+
+# --- Пресеты видео (user-015) ---
+
+# На macOS — те же аппаратные кодеры, что у AVAssetWriter, иначе программные
+HARDWARE_ENCODERS = {"h264": "h264_videotoolbox", "hevc": "hevc_videotoolbox"}
+SOFTWARE_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+
+
+def encoder_args(preset, codec):
+    """
+    Настройки пресета в аргументы ffmpeg — как recorder.video_settings_for
+    для AVAssetWriter: кодек, GOP, без B-кадров, quality или битрейт.
+    Возвращает (имя кодера, аргументы).
+    """
+    from steno.vad import has_encoder
+
+    fps = int(preset.get("fps", 10))
+    keyframe_interval = float(preset.get("keyframe_interval", 5))
+    if preset.get("screen_content"):
+        keyframe_interval = max(keyframe_interval, 10.0)
+    hardware = has_encoder(HARDWARE_ENCODERS[codec])
+    encoder = HARDWARE_ENCODERS[codec] if hardware else SOFTWARE_ENCODERS[codec]
+    args = [
+        "-c:v", encoder, "-profile:v", "main", "-pix_fmt", "yuv420p",
+        "-g", str(max(1, round(keyframe_interval * fps))), "-bf", "0",
+    ]
+    if preset.get("quality") is not None:
+        if hardware:
+            args += ["-q:v", str(round(float(preset["quality"]) * 100))]
+        else:
+            # Шкала AVVideoQualityKey 0..1 на CRF программных кодеров — приблизительно
+            args += ["-crf", str(round(40 - float(preset["quality"]) * 22))]
+    else:
+        args += ["-b:v", str(int(preset.get("bitrate", 3000000)))]
+    if not hardware:
+        args += ["-preset", "veryfast"] + (["-x265-params", "log-level=error"] if codec == "hevc" else [])
+    return encoder, args
+
+
+def _screen_source(preset, seconds):
+    """Синтетический экран: статичный «слайд», раз в 10 с новый, и движущийся курсор."""
+    size = f"{preset['width']}x{preset['height']}"
+    fps = preset["fps"]
+    return [
+        "-f", "lavfi", "-i", f"smptehdbars=s={size}:r={fps}:d={seconds}",
+        "-f", "lavfi", "-i", f"color=c=white:s=32x32:r={fps}:d={seconds}",
+        "-filter_complex", "[0]hue=H=floor(t/10)*PI/3[bg];[bg][1]overlay=x='mod(t*300,W-w)':y='(H-h)/2+100*sin(t)'",
+    ]
+
+
+def bench_capture(seconds, codecs, presets, input_path=None):
+    """
+    Размер записи и цена кодирования (процессорное время ffmpeg) для каждого
+    пресета VIDEO_QUALITY_PRESETS и кодека. Источник — синтетический экран
+    или своя запись (input_path), приведенная к размеру и частоте пресета.
+    """
+    from steno.config import VIDEO_QUALITY_PRESETS
+    from steno.media import MediaError, _run_ffmpeg
+
+    print(f"{seconds}s of {'synthetic screen' if input_path is None else os.path.basename(input_path)} per preset")
+    print(f"{'preset':<12} {'codec':<5} {'encoder':<18} {'MB/hour':>8} {'CPU s/min':>10} {'speed':>7}")
+    with tempfile.TemporaryDirectory(prefix="steno_bench_") as tmp:
+        for name in presets or VIDEO_QUALITY_PRESETS:
+            preset = VIDEO_QUALITY_PRESETS[name]
+            for codec in codecs or [preset.get("codec", "h264")]:
+                encoder, args = encoder_args(preset, codec)
+                if input_path is None:
+                    source = _screen_source(preset, seconds)
+                else:
+                    source = [
+                        "-i", input_path, "-t", str(seconds), "-an",
+                        "-vf", f"scale={preset['width']}:{preset['height']},fps={preset['fps']}",
+                    ]
+                out_path = os.path.join(tmp, f"{name}_{codec}.mp4".replace(" ", "_"))
+                before = resource.getrusage(resource.RUSAGE_CHILDREN)
+                started = time.monotonic()
+                try:
+                    result = _run_ffmpeg(["-y"] + source + args + [out_path])
+                except MediaError as e:
+                    print(f"ffmpeg is required: {e}")
+                    return
+                wall = time.monotonic() - started
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                if result.returncode != 0 or not os.path.exists(out_path):
+                    print(f"{name:<12} {codec:<5} {encoder:<18} failed: {result.stderr.strip().splitlines()[-1:]}")
+                    continue
+                cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+                size = os.path.getsize(out_path)
+                print(
+                    f"{name:<12} {codec:<5} {encoder:<18} {size / 1e6 * 3600 / seconds:>8.0f} "
+                    f"{cpu * 60 / seconds:>10.1f} {seconds / max(wall, 1e-6):>6.1f}x"
+                )
+
+
+def _timed(fn, rounds):
+    """Лучшее время fn() из rounds запусков, мс."""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_index(files, rounds):
+    """
+    Время построения меню Recent Recordings/Protocols для папки с files записями:
+    разовый просмотр (listdir + getmtime на каждый файл, как до индекса) против
+    RecordingsIndex — холодное построение, загрузка с диска, refresh без изменений
+    и после одной новой записи.
+    """
+    from steno.index import RecordingsIndex, RECORDING, PROTOCOL, recent_recordings, recent_protocols
+
+    with tempfile.TemporaryDirectory(prefix="steno_bench_") as tmp:
+        save_dir = os.path.join(tmp, "recordings")
+        os.makedirs(save_dir)
+        base = time.time() - files * 60
+        for i in range(files):
+            # Записи с протоколом и микрофоном, как в живой папке
+            for name in (f"Meet_{i:06d}.mp4", f"Meet_{i:06d}_mic.m4a", f"Meet_{i:06d}_protocol.txt"):
+                path = os.path.join(save_dir, name)
+                open(path, "wb").close()
+                os.utime(path, (base + i * 60, base + i * 60))
+        settled = iter(range(time.time_ns() - 60 * 10**9, 0, -1))
+
+        def settle():
+            # Папка «давно не менялась» (свежему mtime каталога индекс не верит, см.
+            # RACY_WINDOW_NS), но каждое изменение сдвигает ее mtime
+            stamp = next(settled)
+            os.utime(save_dir, ns=(stamp, stamp))
+
+        settle()
+        index_path = os.path.join(tmp, "index.json")
+        print(f"{files} recordings ({len(os.listdir(save_dir))} files), best of {rounds}, ms")
+
+        legacy = _timed(lambda: (recent_recordings(save_dir), recent_protocols(save_dir)), rounds)
+        print(f"  listdir + getmtime per menu build       {legacy:>9.1f}")
+
+        def cold():
+            index = RecordingsIndex(save_dir, path=None)
+            index.refresh()
+            return index
+        print(f"  index: cold build (scan + stat)         {_timed(cold, rounds):>9.1f}")
+
+        index = cold()
+        index.path = index_path
+        print(f"  index: save to disk                     {_timed(index.save, rounds):>9.1f}")
+
+        def load():
+            loaded = RecordingsIndex(save_dir, path=index_path)
+            loaded.refresh()
+            loaded.recent(RECORDING)
+        print(f"  index: load from disk + refresh         {_timed(load, rounds):>9.1f}")
+
+        index.refresh()
+        print(f"  index: refresh, nothing changed         {_timed(index.refresh, rounds):>9.3f}")
+
+        def recent():
+            index._recent = {}
+            index.recent(RECORDING)
+            index.recent(PROTOCOL)
+        print(f"  index: rebuild both Recent menus        {_timed(recent, rounds):>9.1f}")
+
+        counter = iter(range(files, files + rounds))
+
+        def one_new():
+            path = os.path.join(save_dir, f"Meet_{next(counter):06d}.mp4")
+            open(path, "wb").close()
+            settle()
+            index.refresh()
+            index.recent(RECORDING)
+        print(f"  index: refresh after one new recording  {_timed(one_new, rounds):>9.1f}")
+
+
+def _isolate_home():
+    home = tempfile.mkdtemp(prefix="steno_bench_home_")
+    os.environ["HOME"] = home
+    return home
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Steno benchmarks against the local fake API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upload_wait = commands.add_parser("upload-wait", help="upload, wait for ACTIVE and generate")
+    upload_wait.add_argument("--files", type=int, default=4)
+    upload_wait.add_argument("--size-mb", type=float, default=2.0, help="size of the first file, the next ones grow by this much")
+    upload_wait.add_argument("--processing-seconds", type=float, default=1.0)
+    upload_wait.add_argument("--processing-per-mb", type=float, default=0.5)
+    upload_wait.add_argument("--rounds", type=int, default=3)
+
+    live = commands.add_parser("live", help="Stop-to-protocol latency, live session against processing after Stop")
+    live.add_argument("--minutes", type=int, nargs="+", default=[10, 30, 60], help="meeting lengths")
+    live.add_argument("--segment-mb", type=float, default=2.0)
+    live.add_argument("--interval", type=float, default=4.0, help="real seconds between closed segments (uploads must keep up)")
+    live.add_argument("--upload-bandwidth", type=float, default=4.0, help="MB/s")
+    live.add_argument("--processing-per-mb", type=float, default=0.2)
+    live.add_argument("--latency", type=float, default=1.0, help="seconds per generation request")
+
+    capture = commands.add_parser("capture", help="file size and encoding cost of the video presets (needs ffmpeg)")
+    capture.add_argument("--seconds", type=int, default=30)
+    capture.add_argument("--codecs", nargs="+", choices=["h264", "hevc"], default=["h264", "hevc"],
+                         help="codecs to compare (default: both)")
+    capture.add_argument("--presets", nargs="+", help="preset names (default: all)")
+    capture.add_argument("--input", help="a recording to re-encode instead of the synthetic screen")
+
+    index = commands.add_parser("index", help="Recent menus: recordings index against listdir + getmtime")
+    index.add_argument("--files", type=int, default=10000, help="recordings in the folder")
+    index.add_argument("--rounds", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    # Модули steno читают пути ~/.recorder_app_* при импорте — HOME подменяется до них
+    _isolate_home()
+
+    if args.command == "upload-wait":
+        bench_upload_wait(args.files, args.size_mb, args.processing_seconds, args.processing_per_mb, args.rounds)
+    elif args.command == "live":
+        bench_live(args.minutes, args.segment_mb, args.interval, args.upload_bandwidth, args.processing_per_mb, args.latency)
+    elif args.command == "capture":
+        bench_capture(args.seconds, args.codecs, args.presets, args.input)
+    elif args.command == "index":
+        bench_index(args.files, args.rounds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
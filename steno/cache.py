@@ -0,0 +1,238 @@
+# steno/cache.py
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("Steno")
+
+CACHE_DIR = os.path.expanduser("~/.recorder_app_cache")
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+# Files API хранит загруженные файлы 48 часов. Если срок не пришел в ответе,
+# считаем от момента загрузки с запасом.
+REMOTE_FILE_TTL = 47 * 3600
+REMOTE_FILE_MARGIN = 3600
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def file_digest(path):
+    """SHA-256 содержимого файла (hex)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_json(path):
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except: pass
+    return {}
+
+
+def _save_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+_locks_guard = threading.Lock()
+_file_locks = {}
+
+
+def _file_lock(path):
+    """
+    Один замок на файл индекса для всех экземпляров: у каждой задачи очереди
+    свои DigestMemo/ResultCache/RemoteFileCache. Под замком индекс
+    перечитывается с диска и дополняется — записи соседних задач не теряются.
+    """
+    path = os.path.abspath(path)
+    with _locks_guard:
+        return _file_locks.setdefault(path, threading.Lock())
+
+
+class DigestMemo:
+    """
+    SHA-256 содержимого файлов с запоминанием по (путь, размер, mtime),
+    чтобы не перечитывать многогигабайтные записи при каждом запуске.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "digests.json")
+        self._lock = _file_lock(self.path)
+        self._memo = _load_json(self.path)
+
+    def digest(self, path):
+        st = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+        with self._lock:
+            if memo_key in self._memo:
+                return self._memo[memo_key]
+
+        digest = file_digest(path)
+
+        with self._lock:
+            self._memo = _load_json(self.path)
+            # Старые записи того же пути больше не нужны
+            prefix = os.path.abspath(path) + "|"
+            for stale in [k for k in self._memo if k.startswith(prefix)]:
+                del self._memo[stale]
+            self._memo[memo_key] = digest
+            _save_json(self.path, self._memo)
+        return digest
+
+
+def result_key(media_digests, model_name, system_prompt, meeting_date, mode="", options=None):
+    """
+    Ключ результата: какая запись + какой моделью + с каким промптом.
+    options — настройки подготовки, влияющие на отправленное (обрезка тишины).
+    """
+    payload = json.dumps({
+        "media": list(media_digests),
+        "model": model_name,
+        "prompt": system_prompt,
+        "date": meeting_date,
+        "mode": mode,
+        "options": options,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш готовых протоколов, адресуемый по содержимому (см. result_key).
+    Размер ограничен max_bytes, при переполнении вытесняются давно
+    не использованные записи (LRU).
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.dir = os.path.join(cache_dir, "protocols")
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, "protocols.json")
+        self.max_bytes = max_bytes
+        self._lock = _file_lock(self.index_path)
+        self._index = _load_json(self.index_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.dir, key + ".txt")
+
+    def get(self, key):
+        with self._lock:
+            self._index = _load_json(self.index_path)
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            try:
+                with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                del self._index[key]
+                _save_json(self.index_path, self._index)
+                return None
+            entry["last_used"] = time.time()
+            _save_json(self.index_path, self._index)
+            return text
+
+    def put(self, key, text):
+        data = text.encode("utf-8")
+        with self._lock:
+            self._index = _load_json(self.index_path)
+            with open(self._entry_path(key), "wb") as f:
+                f.write(data)
+            now = time.time()
+            self._index[key] = {"size": len(data), "created": now, "last_used": now}
+            self._evict()
+            _save_json(self.index_path, self._index)
+
+    def _evict(self):
+        # Протоколы без записи в индексе (потерянные прежними версиями) не учитывались в лимите
+        for name in os.listdir(self.dir):
+            if name.endswith(".txt") and name[:-4] not in self._index:
+                try:
+                    os.remove(os.path.join(self.dir, name))
+                except OSError:
+                    pass
+        total = sum(e["size"] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)["size"]
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+            logger.info(f"Result cache: evicted {key[:12]}")
+
+
+def _parse_expiration(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        # 2025-01-01T12:00:00.123456789Z — отбрасываем наносекунды
+        value = str(value).replace("Z", "+00:00")
+        if "." in value:
+            head, tail = value.split(".", 1)
+            frac, _, tz = tail.partition("+")
+            value = f"{head}.{frac[:6]}" + (f"+{tz}" if tz else "")
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class RemoteFileCache:
+    """
+    Уже загруженные в Files API файлы: digest содержимого -> имя файла на
+    сервере. Позволяет при смене модели или промпта не загружать медиа
+    повторно, пока файл не истек. Ключ учитывает API-ключ и base_url —
+    файлы видны только в своем проекте.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "remote_files.json")
+        self._lock = _file_lock(self.path)
+        self._entries = _load_json(self.path)
+
+    @staticmethod
+    def _key(account, digest):
+        return hashlib.sha256(account.encode("utf-8")).hexdigest()[:16] + ":" + digest
+
+    def get(self, account, digest):
+        with self._lock:
+            self._entries = _load_json(self.path)
+            entry = self._entries.get(self._key(account, digest))
+            if entry and entry["expires"] - REMOTE_FILE_MARGIN > time.time():
+                return entry["name"]
+            return None
+
+    def put(self, account, digest, name, expiration=None):
+        expires = _parse_expiration(expiration) or time.time() + REMOTE_FILE_TTL
+        with self._lock:
+            now = time.time()
+            self._entries = {k: e for k, e in _load_json(self.path).items() if e["expires"] > now}
+            self._entries[self._key(account, digest)] = {"name": name, "expires": expires}
+            _save_json(self.path, self._entries)
+
+    def forget(self, account, digest):
+        with self._lock:
+            self._entries = _load_json(self.path)
+            if self._entries.pop(self._key(account, digest), None) is not None:
+                _save_json(self.path, self._entries)
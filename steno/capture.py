@@ -0,0 +1,611 @@
+# steno/capture.py
+"""
+Логика захвата экрана, не зависящая от macOS (используется в recorder.py).
+"""
+import logging
+import threading
+from array import array
+from collections import deque
+
+logger = logging.getLogger("Steno")
+
+# Изменения меньше этой доли кадра (часы в строке меню, мигающий курсор)
+# не считаются новым кадром
+MIN_DIRTY_FRACTION = 0.002
+# Даже на статичном экране кадр пишется не реже, чем раз в столько секунд
+KEEPALIVE_SECONDS = 5.0
+# Сколько держится повышенная частота после последнего движения
+BOOST_HOLD_SECONDS = 1.0
+BOOST_MAX_FPS = 30
+
+
+def boost_fps_for(fps):
+    """Частота при движении на экране: втрое выше пресета, но не выше BOOST_MAX_FPS (и не ниже пресета)."""
+    return max(fps, min(BOOST_MAX_FPS, fps * 3))
+
+
+def dirty_fraction(rects, width, height):
+    """Доля кадра, покрытая измененными областями [(x, y, w, h)] (пересечения не вычитаются)."""
+    if width <= 0 or height <= 0:
+        return 1.0
+    area = sum(max(0.0, w) * max(0.0, h) for _, _, w, h in rects)
+    return min(1.0, area / float(width * height))
+
+
+class AdaptiveFrameGate:
+    """
+    Какие кадры видео писать. ScreenCaptureKit отдает кадры с частотой до
+    boost_fps; гейт пропускает:
+      * неизмененные кадры — только раз в keepalive секунд;
+      * измененные — не чаще fps, а пока на экране движение (изменения
+        идут подряд) — не чаще boost_fps в течение boost_hold секунд.
+    Выходной файл получается с переменной частотой кадров: писатель
+    получает только пропущенные кадры со своими PTS.
+    """
+
+    def __init__(self, fps, boost_fps=None, keepalive=KEEPALIVE_SECONDS, boost_hold=BOOST_HOLD_SECONDS):
+        self.fps = fps
+        self.boost_fps = boost_fps or boost_fps_for(fps)
+        self.keepalive = keepalive
+        self.boost_hold = boost_hold
+        self.last_kept = None
+        self.last_changed = None
+        self.motion_until = None
+
+        self.delivered = 0
+        self.kept = 0
+        self.dropped_static = 0
+        self.dropped_rate = 0
+        self.boosted = 0
+
+    def offer(self, pts, changed=True):
+        """pts — секунды. True — кадр писать."""
+        self.delivered += 1
+        if self.last_kept is None:
+            return self._keep(pts, changed)
+
+        gap = pts - self.last_kept
+        if not changed:
+            if gap >= self.keepalive:
+                return self._keep(pts, changed)
+            self.dropped_static += 1
+            return False
+
+        # Два изменения подряд быстрее базовой частоты — на экране движение
+        if self.last_changed is not None and pts - self.last_changed < 2.0 / self.fps:
+            self.motion_until = pts + self.boost_hold
+        self.last_changed = pts
+
+        boosted = self.motion_until is not None and pts <= self.motion_until
+        interval = 1.0 / (self.boost_fps if boosted else self.fps)
+        # Небольшой допуск: PTS приходят с дрожанием
+        if gap < interval * 0.9:
+            self.dropped_rate += 1
+            return False
+        if boosted and gap < 0.9 / self.fps:
+            self.boosted += 1
+        return self._keep(pts, changed)
+
+    def _keep(self, pts, changed):
+        self.kept += 1
+        self.last_kept = pts
+        if changed and self.last_changed is None:
+            self.last_changed = pts
+        return True
+
+    def stats(self):
+        return {
+            "delivered": self.delivered,
+            "kept": self.kept,
+            "dropped_static": self.dropped_static,
+            "dropped_rate": self.dropped_rate,
+            "boosted": self.boosted,
+        }
+
+    def summary(self):
+        share = self.kept / self.delivered if self.delivered else 0.0
+        return (
+            f"video frames: delivered {self.delivered}, kept {self.kept} ({share:.0%}), "
+            f"dropped static {self.dropped_static}, dropped over rate {self.dropped_rate}, "
+            f"kept at boosted rate {self.boosted}"
+        )
+
+
+# --- Телеметрия захвата ---
+# Время обработки колбэка — гистограмма по степеням двойки в микросекундах
+# (корзина i: [2^(i-1), 2^i) мкс). Обновление — пара целочисленных операций,
+# поэтому телеметрию можно не выключать.
+HISTOGRAM_BUCKETS = 24
+TELEMETRY_LOG_INTERVAL = 30.0
+
+
+class StreamStats:
+    """
+    Счетчики одного потока (видео, системный звук, микрофон). Обновляются из
+    одной очереди захвата, читаются из любого потока (значения могут
+    отставать на один кадр).
+    """
+
+    def __init__(self, name, expected_interval=None):
+        self.name = name
+        self.expected_interval = expected_interval
+        self.delivered = 0
+        self.appended = 0
+        self.dropped_not_ready = 0
+        self.dropped_no_session = 0
+        self.dropped_adaptive = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.last_pts = None
+        self.max_gap = 0.0
+        self.gaps = 0
+        # SampleRing между колбэком и писателем (если есть)
+        self.queue = None
+
+    def on_sample(self, pts, duration=None):
+        """
+        Новый сэмпл с PTS в секундах: счетчик и разрыв относительно предыдущего.
+        duration — длительность сэмпла (у звука буферы разной длины), иначе
+        ожидаемый интервал потока.
+        """
+        self.delivered += 1
+        if self.last_pts is not None:
+            gap = pts - self.last_pts
+            if gap > self.max_gap:
+                self.max_gap = gap
+            # Разрыв — пропуск больше двух ожидаемых интервалов
+            expected = duration or self.expected_interval
+            if expected and gap > 2 * expected:
+                self.gaps += 1
+        self.last_pts = pts
+
+    def on_handled(self, seconds):
+        micros = int(seconds * 1e6)
+        self.histogram[min(micros.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q, в секундах."""
+        total = sum(self.histogram)
+        if not total:
+            return 0.0
+        threshold = q * total
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= threshold:
+                return (1 << i) / 1e6
+        return (1 << (HISTOGRAM_BUCKETS - 1)) / 1e6
+
+    def snapshot(self):
+        return {
+            "delivered": self.delivered,
+            "appended": self.appended,
+            "dropped_not_ready": self.dropped_not_ready,
+            "dropped_no_session": self.dropped_no_session,
+            "dropped_adaptive": self.dropped_adaptive,
+            "handling_p50_ms": self.percentile(0.5) * 1000,
+            "handling_p99_ms": self.percentile(0.99) * 1000,
+            "max_pts_gap_ms": self.max_gap * 1000,
+            "pts_gaps": self.gaps,
+            "histogram_us": list(self.histogram),
+            "queue": self.queue.stats() if self.queue is not None else None,
+        }
+
+    def summary(self):
+        return (
+            f"{self.name}: delivered {self.delivered}, appended {self.appended}, "
+            f"not ready {self.dropped_not_ready}, no session {self.dropped_no_session}"
+            + (f", adaptive {self.dropped_adaptive}" if self.dropped_adaptive else "")
+            + f", handling p50 {self.percentile(0.5) * 1000:.2f}ms p99 {self.percentile(0.99) * 1000:.2f}ms"
+            + f", max gap {self.max_gap * 1000:.0f}ms ({self.gaps} gaps)"
+            + (
+                f", queue max {self.queue.max_depth}/{self.queue.capacity}, overflow {self.queue.dropped}"
+                if self.queue is not None else ""
+            )
+        )
+
+
+class CaptureTelemetry:
+    """
+    Телеметрия всех потоков рекордера. snapshot() — для API и отладки,
+    maybe_log() вызывается из колбэков и пишет строку в лог не чаще раза
+    в interval секунд.
+    """
+
+    def __init__(self, fps, interval=TELEMETRY_LOG_INTERVAL, log=None):
+        self.streams = {
+            "video": StreamStats("video", 1.0 / fps),
+            "sys_audio": StreamStats("sys_audio"),
+            "mic": StreamStats("mic"),
+        }
+        self.interval = interval
+        self.log = log or logger
+        self._last_log = None
+
+    def __getitem__(self, name):
+        return self.streams[name]
+
+    def snapshot(self):
+        return {name: stats.snapshot() for name, stats in self.streams.items()}
+
+    def summary(self):
+        return " | ".join(stats.summary() for stats in self.streams.values())
+
+    def maybe_log(self, now):
+        if self._last_log is None:
+            self._last_log = now
+        elif now - self._last_log >= self.interval:
+            self._last_log = now
+            self.log.info(f"Capture stats: {self.summary()}")
+
+
+# --- Буфер между колбэками захвата и писателями ---
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DROP_NON_KEY = "drop_non_key"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DROP_NON_KEY)
+
+
+class SampleRing:
+    """
+    Ограниченная очередь от колбэка захвата (производитель) к потоку
+    писателя (потребитель). put() не ждет потребителя: при переполнении
+    сэмпл сбрасывается по политике overflow:
+      * drop_oldest — выбрасывается самый старый (минимальная задержка);
+      * drop_newest — выбрасывается новый;
+      * drop_non_key — выбрасывается самый старый сэмпл без флага key
+        (для видео key — кадр с изменением экрана), ключевые сохраняются.
+    Замок держится только на время операции с deque, колбэк не блокируется.
+    """
+
+    def __init__(self, capacity, overflow=DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.capacity = max(1, int(capacity))
+        self.overflow = overflow
+        self.closed = False
+        self._items = deque()
+        self._cond = threading.Condition()
+
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, key=False):
+        """False — сэмпл не принят (очередь закрыта или сброшен сам новый сэмпл)."""
+        with self._cond:
+            if self.closed:
+                return False
+            self.put_count += 1
+            if len(self._items) >= self.capacity and not self._evict(key):
+                self.dropped += 1
+                return False
+            self._items.append((item, key))
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._cond.notify()
+        return True
+
+    def _evict(self, incoming_key):
+        """Освобождает место под новый сэмпл. False — сбросить надо новый."""
+        if self.overflow == DROP_NEWEST:
+            return False
+        if self.overflow == DROP_NON_KEY:
+            for i, (_, key) in enumerate(self._items):
+                if not key:
+                    del self._items[i]
+                    self.dropped += 1
+                    return True
+            # Очередь из одних ключевых: новый обычный сэмпл не нужен,
+            # новый ключевой важнее самого старого
+            if not incoming_key:
+                return False
+        self._items.popleft()
+        self.dropped += 1
+        return True
+
+    def get(self, timeout=None):
+        """Следующий сэмпл; None — очередь закрыта и пуста (или истек timeout)."""
+        with self._cond:
+            while not self._items:
+                if self.closed:
+                    return None
+                if not self._cond.wait(timeout) and timeout is not None:
+                    return None
+            self.get_count += 1
+            return self._items.popleft()[0]
+
+    def close(self):
+        """Новые сэмплы не принимаются; потребитель дочитает оставшиеся и получит None."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "policy": self.overflow,
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "put": self.put_count,
+            "got": self.get_count,
+            "dropped": self.dropped,
+        }
+
+
+class SampleWorker:
+    """
+    Поток писателя: забирает сэмплы из SampleRing и передает в handler(item).
+    wrap — контекст на каждый сэмпл (в рекордере — autorelease pool).
+    """
+
+    def __init__(self, name, ring, handler, wrap=None):
+        self.ring = ring
+        self.handler = handler
+        self.wrap = wrap
+        self.thread = threading.Thread(target=self._run, name=f"steno-{name}-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            item = self.ring.get()
+            if item is None:
+                return
+            try:
+                if self.wrap is not None:
+                    with self.wrap():
+                        self.handler(item)
+                else:
+                    self.handler(item)
+            except Exception:
+                logger.exception(f"{self.thread.name}: sample handling failed")
+
+    def stop(self, timeout=2.0):
+        """Закрывает очередь и ждет, пока поток допишет оставшиеся сэмплы."""
+        self.ring.close()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+
+# --- Что захватывать: дисплей, приложение или набор окон ---
+# Окна и дисплеи описываются обычными словарями (рекордер строит их из
+# SCShareableContent): {"id", "frame": (x, y, w, h)} для дисплея,
+# {"id", "bundle_id", "app_name", "title", "frame", "display_id"} для окна.
+CAPTURE_DISPLAY = "display"
+CAPTURE_APP = "app"
+CAPTURE_WINDOWS = "windows"
+# Меньшие окна (значки в строке меню, всплывашки) не захватываем
+MIN_WINDOW_SIZE = 120
+
+
+def fit_output_size(source_width, source_height, max_width, max_height):
+    """
+    Размер кадра с пропорциями источника. Бюджет — площадь пресета
+    (max_width * max_height), источник меньше бюджета не растягивается.
+    Стороны четные (требование кодеров).
+    """
+    if source_width <= 0 or source_height <= 0:
+        return max_width, max_height
+    budget = float(max_width * max_height)
+    scale = min(1.0, (budget / (source_width * source_height)) ** 0.5)
+    width = max(2, int(source_width * scale) // 2 * 2)
+    height = max(2, int(source_height * scale) // 2 * 2)
+    return width, height
+
+
+def union_rect(rects):
+    """Охватывающий прямоугольник (x, y, w, h)."""
+    left = min(x for x, _, _, _ in rects)
+    top = min(y for _, y, _, _ in rects)
+    right = max(x + w for x, _, w, _ in rects)
+    bottom = max(y + h for _, y, _, h in rects)
+    return left, top, right - left, bottom - top
+
+
+def _overlap(a, b):
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    return max(0, width) * max(0, height)
+
+
+def match_windows(windows, apps=(), title=None):
+    """
+    Окна цели: приложения из apps (bundle id или имя, без учета регистра)
+    и/или заголовок, содержащий title. Мелкие окна отбрасываются.
+    """
+    apps = {a.lower() for a in apps}
+    title = title.lower() if title else None
+    matched = []
+    for window in windows:
+        _, _, w, h = window["frame"]
+        if w < MIN_WINDOW_SIZE or h < MIN_WINDOW_SIZE:
+            continue
+        if apps and (window.get("bundle_id") or "").lower() not in apps and (window.get("app_name") or "").lower() not in apps:
+            continue
+        if title and title not in (window.get("title") or "").lower():
+            continue
+        matched.append(window)
+    return matched
+
+
+def order_displays(displays, main_id=None):
+    """Главный дисплей первым, остальные слева направо — так нумеруются "Display 2", "Display 3"."""
+    return sorted(displays, key=lambda d: (d["id"] != main_id, d["frame"][0], d["frame"][1]))
+
+
+def pick_display(displays, target, main_id=None, windows=()):
+    """
+    Дисплей цели: по display_id, по номеру display_index (см. order_displays),
+    а для окон — тот, на котором большая часть их площади.
+    """
+    ordered = order_displays(displays, main_id)
+    if not ordered:
+        return None
+    if target.get("display_id") is not None:
+        for display in ordered:
+            if display["id"] == target["display_id"]:
+                return display
+    if windows:
+        return max(ordered, key=lambda d: sum(_overlap(d["frame"], w["frame"]) for w in windows))
+    index = int(target.get("display_index", 0))
+    return ordered[index] if 0 <= index < len(ordered) else ordered[0]
+
+
+def plan_capture(target, displays, windows, main_id=None):
+    """
+    Что и с какой областью захватывать. target — словарь из конфига
+    ("kind": display | app | windows, "display_index"/"display_id",
+    "apps", "title"). Возвращает словарь:
+      kind — фактический вид захвата (если окна не нашлись — display),
+      display, windows — выбранные дисплей и окна,
+      source_rect — область в точках относительно дисплея (None — весь дисплей).
+    Одно окно захватывается само по себе, независимо от дисплея.
+    """
+    kind = target.get("kind", CAPTURE_DISPLAY)
+    selected = []
+    if kind in (CAPTURE_APP, CAPTURE_WINDOWS):
+        selected = match_windows(windows, target.get("apps", ()), target.get("title"))
+        if not selected:
+            logger.warning(f"No windows match capture target {target}, capturing the display")
+            kind = CAPTURE_DISPLAY
+
+    display = pick_display(displays, target, main_id, selected)
+    if kind == CAPTURE_DISPLAY or display is None:
+        return {"kind": CAPTURE_DISPLAY, "display": display, "windows": [], "source_rect": None}
+
+    # Окна только на выбранном дисплее; область — их охватывающий прямоугольник
+    on_display = [w for w in selected if _overlap(display["frame"], w["frame"])] or selected[:1]
+    if kind == CAPTURE_WINDOWS and len(on_display) == 1:
+        return {"kind": CAPTURE_WINDOWS, "display": display, "windows": on_display, "source_rect": None}
+
+    dx, dy, dw, dh = display["frame"]
+    x, y, w, h = union_rect([w["frame"] for w in on_display])
+    left, top = max(x, dx), max(y, dy)
+    right, bottom = min(x + w, dx + dw), min(y + h, dy + dh)
+    source_rect = (left - dx, top - dy, right - left, bottom - top)
+    return {"kind": kind, "display": display, "windows": on_display, "source_rect": source_rect}
+
+
+# --- Сведение системного звука и микрофона в одну речевую дорожку ---
+MIX_SAMPLE_RATE = 16000
+# Источник, отставший больше чем на столько, не задерживает сведение (считается тишиной)
+MIX_MAX_LAG = 0.5
+
+
+def pcm_to_mono(data, channels, bits, is_float, interleaved=True):
+    """Сырые PCM-байты (float32, int16 или int32) -> моно float -1..1."""
+    if is_float:
+        typecode, scale = "f", 1.0
+    elif bits == 16:
+        typecode, scale = "h", 1.0 / 32768
+    else:
+        typecode, scale = "i", 1.0 / 2147483648
+    samples = array(typecode)
+    samples.frombytes(data[:len(data) // samples.itemsize * samples.itemsize])
+    frames = len(samples) // max(1, channels)
+    if channels <= 1:
+        return [x * scale for x in samples]
+    if interleaved:
+        planes = [samples[c::channels] for c in range(channels)]
+    else:
+        planes = [samples[c * frames:(c + 1) * frames] for c in range(channels)]
+    scale /= channels
+    return [sum(frame) * scale for frame in zip(*planes)]
+
+
+def resample(samples, source_rate, target_rate=MIX_SAMPLE_RATE):
+    """Понижение частоты усреднением окна (для речи достаточно, без внешних библиотек)."""
+    if source_rate == target_rate or not samples:
+        return list(samples)
+    if source_rate % target_rate == 0:
+        # Целое отношение (48 кГц -> 16 кГц): среднее соседних сэмплов срезами
+        factor = source_rate // target_rate
+        count = len(samples) // factor
+        return [sum(w) / factor for w in zip(*(samples[k:count * factor:factor] for k in range(factor)))]
+    step = source_rate / float(target_rate)
+    count = int(len(samples) / step)
+    out = []
+    for i in range(count):
+        lo = int(i * step)
+        hi = max(lo + 1, int((i + 1) * step))
+        window = samples[lo:hi]
+        out.append(sum(window) / len(window))
+    return out
+
+
+class SpeechMixer:
+    """
+    Сведение нескольких источников (по умолчанию sys и mic) в моно
+    MIX_SAMPLE_RATE в реальном времени. Буферы раскладываются по PTS, так что
+    разные часы и пропуски не копят сдвиг. Готовые куски (int16 PCM, байты)
+    отдаются в on_block, как только все источники их покрыли, — или через
+    MIX_MAX_LAG, если какой-то источник молчит (нет микрофона, пауза SCK).
+    Потокобезопасен: add вызывают потоки писателей разных дорожек.
+    """
+
+    def __init__(self, on_block, sources=("sys", "mic"), rate=MIX_SAMPLE_RATE, max_lag=MIX_MAX_LAG):
+        self.on_block = on_block
+        self.rate = rate
+        self.max_lag = int(max_lag * rate)
+        self.origin = None
+        self.flushed = 0
+        self.samples_out = 0
+        self._buffers = {name: array("f") for name in sources}
+        self._lock = threading.Lock()
+
+    def start(self, pts):
+        """Начало дорожки (секунды PTS) — обычно первый кадр видео; звук до него отбрасывается."""
+        with self._lock:
+            if self.origin is None:
+                self.origin = pts
+
+    def add(self, source, pts, samples, source_rate):
+        """samples — моно float -1..1 (см. pcm_to_mono) с частотой source_rate, pts — секунды."""
+        if self.origin is None:
+            return
+        chunk = array("f", resample(samples, source_rate, self.rate))
+        with self._lock:
+            position = int(round((pts - self.origin) * self.rate))
+            if position < self.flushed:
+                # Опоздавший буфер: начало уже сведено без него
+                chunk = chunk[self.flushed - position:]
+                position = self.flushed
+            data = self._buffers[source]
+            offset = position - self.flushed
+            if offset > len(data):
+                data.extend(array("f", bytes(4 * (offset - len(data)))))
+            data[offset:offset + len(chunk)] = chunk
+            self._flush(final=False)
+
+    def close(self):
+        """Сводит все, что осталось в буферах."""
+        with self._lock:
+            self._flush(final=True)
+
+    def _flush(self, final):
+        lengths = [len(data) for data in self._buffers.values()]
+        longest = max(lengths)
+        ready = longest if final else max(min(lengths), longest - self.max_lag)
+        if ready <= 0:
+            return
+        parts = []
+        for data in self._buffers.values():
+            part = data[:ready]
+            if len(part) < ready:
+                part.extend(array("f", bytes(4 * (ready - len(part)))))
+            parts.append(part)
+            del data[:ready]
+        mixed = [sum(frame) for frame in zip(*parts)]
+        self.flushed += ready
+        self.samples_out += ready
+        pcm = array("h", (int(32767 * (1.0 if x > 1.0 else -1.0 if x < -1.0 else x)) for x in mixed))
+        self.on_block(pcm.tobytes())
+
+    def seconds(self):
+        return self.samples_out / float(self.rate)
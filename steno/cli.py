@@ -0,0 +1,194 @@
+# steno/cli.py
+"""
+Пакетная обработка записей без GUI (работает и на Linux).
+
+    python -m steno ~/Movies/ScreenRecordings --jobs 4
+    python -m steno "/archive/2024/Meet_*.mp4" --mode video --model gemini-3-pro-preview
+    python -m steno ~/Movies/ScreenRecordings --recover   # сначала склеить оборванные записи
+    python -m steno ~/Movies/ScreenRecordings/Meet_x.mp4 --check-sync   # сдвиги дорожек, без обработки
+    python -m steno ~/Movies/ScreenRecordings --search "бюджет"   # поиск по протоколам
+    python -m steno ~/Movies/ScreenRecordings --estimate   # токены и стоимость до обработки
+    python -m steno ~/Movies/ScreenRecordings --report     # расход за последние 30 дней
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import logging
+
+from steno.config import ConfigManager, AI_MODELS, PROCESSING_MODES
+from steno.pipeline import process_video_with_ai
+from steno.jobs import JobQueue, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from steno.media import MediaError, probe_media
+from steno.segments import find_unfinished, recover_recording
+from steno.avsync import measure_sync, format_sync_report
+from steno.search import ProtocolSearch, format_item, DECISION, ACTION
+from steno.ledger import estimate_table, format_estimate, report as usage_report
+
+logger = logging.getLogger("Steno")
+
+
+def collect_recordings(target):
+    """Каталог (все .mp4 в нем) или glob-шаблон."""
+    target = os.path.expanduser(target)
+    if os.path.isdir(target):
+        paths = [os.path.join(target, f) for f in os.listdir(target) if f.lower().endswith(".mp4")]
+    else:
+        paths = [p for p in glob.glob(target) if p.lower().endswith(".mp4")]
+    return sorted(paths)
+
+
+def has_protocol(video_path):
+    return os.path.exists(os.path.splitext(video_path)[0] + "_protocol.txt")
+
+
+def media_duration(video_path):
+    try:
+        return probe_media(video_path)["duration"]
+    except MediaError:
+        return 0.0
+
+
+def check_sync(recordings):
+    failed = 0
+    for path in recordings:
+        mic_path = os.path.splitext(path)[0] + "_mic.m4a"
+        try:
+            report = measure_sync(path, mic_path if os.path.exists(mic_path) else None)
+            print(format_sync_report(path, report))
+        except MediaError as e:
+            failed += 1
+            print(f"FAILED  {path}: {e}")
+    return 1 if failed else 0
+
+
+def search_protocols(target, query, items=None, limit=20):
+    """Дозаполняет индекс протоколами папки target и печатает найденное."""
+    target = os.path.expanduser(target)
+    search = ProtocolSearch()
+    try:
+        search.backfill(target if os.path.isdir(target) else os.path.dirname(target))
+        started = time.perf_counter()
+        if items:
+            results = search.items(query, kind=None if items == "all" else items, limit=limit)
+            lines = [f"{r['date'] or '-':<12} {r['kind']:<8} {format_item(r)}  [{os.path.basename(r['path'])}]" for r in results]
+        else:
+            results = search.search(query, limit=limit)
+            lines = [f"{r['date'] or '-':<12} {r['title'] or r['name']}\n    {r['path']}\n    {r['snippet']}" for r in results]
+        elapsed = time.perf_counter() - started
+    finally:
+        search.close()
+    print("\n".join(lines) if lines else "Nothing found")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+    return 0 if results else 1
+
+
+def estimate_recordings(recordings, config):
+    """Оценка токенов и стоимости каждой записи во всех режимах и на всех моделях."""
+    if not recordings:
+        print("No recordings found")
+        return 1
+    for path in recordings:
+        duration = media_duration(path)
+        if not duration:
+            print(f"FAILED  {path}: cannot read duration")
+            continue
+        print(os.path.basename(path))
+        print(format_estimate(duration, estimate_table(duration, config), config))
+        print()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Steno: batch AI protocols for recorded meetings")
+    parser.add_argument("target", help="directory with recordings or a glob pattern")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="recordings processed at the same time (default: 2)")
+    parser.add_argument("--force", action="store_true", help="process recordings that already have a _protocol.txt")
+    parser.add_argument("--mode", choices=list(PROCESSING_MODES), help="processing mode (default: from config)")
+    parser.add_argument("--model", help=f"model name (default: from config; known: {', '.join(AI_MODELS)})")
+    parser.add_argument("--api-key", help="API key (default: $GEMINI_API_KEY or config)")
+    parser.add_argument("--base-url", help="API base URL (default: from config)")
+    parser.add_argument("--recover", action="store_true", help="first stitch recordings interrupted by a crash (*.segments directories)")
+    parser.add_argument("--check-sync", action="store_true", help="only measure A/V and mic/system audio offsets of the recordings")
+    parser.add_argument("--search", metavar="QUERY", help="only search the protocols in the target directory")
+    parser.add_argument("--items", choices=[DECISION, ACTION, "all"], help="with --search: list matching decisions / action items")
+    parser.add_argument("--estimate", action="store_true", help="only estimate tokens and cost of the recordings for every mode and model")
+    parser.add_argument("--report", type=int, nargs="?", const=30, metavar="DAYS", help="only print token usage and cost for the last DAYS days (default: 30)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
+    if args.check_sync:
+        return check_sync(collect_recordings(args.target))
+    if args.search is not None:
+        return search_protocols(args.target, args.search, args.items)
+
+    # Переопределения из командной строки в файл конфига не сохраняются
+    config = ConfigManager.load()
+    config["api_key"] = args.api_key or os.environ.get("GEMINI_API_KEY") or config.get("api_key")
+    if args.mode:
+        config["processing_mode"] = args.mode
+    if args.model:
+        config["model_name"] = args.model
+    if args.base_url is not None:
+        config["base_url"] = args.base_url
+    if args.report is not None:
+        print(usage_report(days=args.report, config=config))
+        return 0
+    if args.estimate:
+        return estimate_recordings(collect_recordings(args.target), config)
+    if not config["api_key"]:
+        parser.error("no API key: pass --api-key, set GEMINI_API_KEY or configure the app")
+
+    if args.recover:
+        target_dir = os.path.expanduser(args.target)
+        for segments_dir in find_unfinished(target_dir if os.path.isdir(target_dir) else os.path.dirname(target_dir)):
+            results = recover_recording(segments_dir)
+            print(f"Recovered {segments_dir}: {', '.join(results.values()) or 'nothing usable'}")
+
+    recordings = collect_recordings(args.target)
+    pending = recordings if args.force else [p for p in recordings if not has_protocol(p)]
+    skipped = len(recordings) - len(pending)
+    print(f"Found {len(recordings)} recordings, {skipped} already have a protocol, {len(pending)} to process")
+    if not pending:
+        return 0
+
+    started = time.monotonic()
+    queue = JobQueue(
+        lambda job: process_video_with_ai(job.video_path, config, job),
+        max_concurrent=args.jobs,
+        path=None
+    )
+    for path in pending:
+        queue.submit(path)
+    try:
+        queue.wait_idle()
+    except KeyboardInterrupt:
+        print("Interrupted, cancelling running jobs...")
+        for job in queue.active():
+            queue.cancel(job.id)
+        queue.wait_idle()
+    elapsed = time.monotonic() - started
+
+    jobs = queue.jobs()
+    done = [job for job in jobs if job.state == JOB_DONE]
+    failed = [job for job in jobs if job.state == JOB_FAILED]
+    cancelled = [job for job in jobs if job.state == JOB_CANCELLED]
+    media_seconds = sum(media_duration(job.video_path) for job in done)
+    input_bytes = sum(os.path.getsize(job.video_path) for job in done)
+
+    print()
+    for job in failed:
+        print(f"FAILED  {job.name}: {job.error}")
+    print(f"Done: {len(done)}, failed: {len(failed)}, cancelled: {len(cancelled)}, skipped: {skipped}")
+    print(
+        f"Wall time {elapsed:.1f}s, {len(done) / max(elapsed, 1e-6) * 3600:.1f} recordings/h, "
+        f"{media_seconds / 3600:.2f} h of media ({media_seconds / max(elapsed, 1e-6):.1f}x real time), "
+        f"{input_bytes / 1e6 / max(elapsed, 1e-6):.2f} MB/s of recordings"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# steno/config.py
+import os
+import json
+import threading
+
+# --- Константы и Настройки ---
+CONFIG_FILE = os.path.expanduser("~/.recorder_app_config.json")
+
+AI_MODELS = [
+    "gemini-3-pro-preview",
+    "gemini-3-flash-preview",
+    "gemini-flash-lite-latest"
+]
+
+DEFAULT_CONFIG = {
+    "api_key": "",
+    "base_url": "https://gemini-warmup.galaypro.ru",
+    "video_device_idx": "0",
+    "video_device_name": "Main Screen",
+    "model_name": "gemini-3-flash-preview",
+    "prompt": "Ты — ИИ-ассистент для составления протоколов встреч. Твоя задача — проанализировать предоставленный медиафайл и вернуть ТОЛЬКО протокол в формате Markdown (оптимизированный для Confluence), строго без вступительных слов, приветствий и пояснений самой нейросети.\n\nИспользуй следующий шаблон:\n# Протокол встречи: [Сформулируй тему]\n**Дата:** [Дата из запроса]\n**Участники:** [Список имен или ролей]\n\n## 1. Саммари (Summary)\n[Краткое, структурированное содержание обсуждения без воды]\n\n## 2. Принятые решения\n* [Список конкретных решений]\n\n## 3. План действий (Action Items)\nОформи строго как таблицу:\n| Задача | Ответственный | Срок |\n| :--- | :--- | :--- |\n| [Описание задачи] | [Имя] | [Дедлайн или -] |",
+    "save_dir": os.path.expanduser("~/Movies/ScreenRecordings"),
+    "video_quality": "Medium",
+    # Кодек поверх пресета: "" — как в пресете, "h264" или "hevc"
+    "video_codec": "",
+    # Статичные кадры не пишутся, при движении частота кадров временно растет
+    "adaptive_capture": True,
+    # Что записывать: название из CAPTURE_TARGETS или свой словарь
+    # ({"kind": "windows", "apps": [...], "title": "..."}, см. steno.capture.plan_capture)
+    "capture_target": "Main Display",
+    # Один файл на встречу: системный звук и микрофон — отдельные дорожки MP4
+    # на общей шкале времени (вместо отдельного _mic.m4a), одна загрузка
+    "dual_track": False,
+    # Профили кодирования звука (AUDIO_PROFILES) для системного звука и микрофона.
+    # Системный звук по умолчанию прежний (в записи бывают музыка и видео), микрофон — речевой
+    "sys_audio_profile": "Music",
+    "mic_audio_profile": "Speech Low",
+    # Сводить системный звук и микрофон в речевую дорожку (_speech.m4a) прямо во время записи
+    "speech_mixdown": False,
+    # Как часто писать в лог счетчики захвата (кадры, сбросы, задержки), сек
+    "telemetry_interval": 30,
+    "processing_mode": "audio",
+    "cache_max_mb": 50,
+    # Оставлять загруженные записи в Files API (до истечения, ~47 ч), чтобы повторная
+    # обработка не загружала их заново. По умолчанию удаляются сразу после обработки
+    "reuse_uploads": False,
+    "max_parallel_jobs": 2,
+    "streaming": True,
+    # Лимиты ключа API на все задачи сразу (0 — без ограничения); 429/5xx повторяются
+    "rate_limit_rpm": 60,
+    "rate_limit_tpm": 1000000,
+    # Запись кусками: при падении теряется не больше одного куска
+    "segment_minutes": 5,
+    # Загружать куски во время записи и генерировать протокол сразу после Stop
+    "live_processing": True,
+    # Длинные встречи: конспект по окнам быстрой моделью, затем сведение
+    "map_reduce": True,
+    "map_reduce_window_minutes": 20,
+    "map_reduce_concurrency": 4,
+    "map_model": "gemini-flash-lite-latest",
+    # Вырезать паузы длиннее trim_min_silence_seconds перед загрузкой (нужен NumPy)
+    "trim_silence": True,
+    "trim_min_silence_seconds": 10,
+    "used_tokens": 0,
+    "last_request_tokens": 0
+}
+
+# codec: "h264" или "hevc"; keyframe_interval — макс. интервал ключевых кадров, сек;
+# quality (0..1) — постоянное качество вместо средней скорости bitrate;
+# screen_content — настройки под экран: длинный GOP, статичные кадры почти бесплатны
+VIDEO_QUALITY_PRESETS = {
+    "Low": {"width": 960, "height": 540, "fps": 5, "bitrate": 1000000, "codec": "h264", "keyframe_interval": 5},
+    "Medium": {"width": 1280, "height": 720, "fps": 10, "bitrate": 3000000, "codec": "h264", "keyframe_interval": 5},
+    "High": {"width": 1920, "height": 1080, "fps": 30, "bitrate": 8000000, "codec": "h264", "keyframe_interval": 5},
+    "Ultra": {"width": 2560, "height": 1440, "fps": 60, "bitrate": 25000000, "codec": "h264", "keyframe_interval": 5},
+    "Screen HEVC": {
+        "width": 1920, "height": 1080, "fps": 10, "bitrate": 2000000, "codec": "hevc",
+        "keyframe_interval": 10, "quality": 0.5, "screen_content": True
+    },
+}
+
+VIDEO_CODECS = {
+    "": "Preset Default",
+    "h264": "H.264",
+    "hevc": "HEVC (H.265)",
+}
+
+# Кодирование звуковых дорожек записи (AAC). Music — прежние 44.1 кГц стерео 128 кбит/с;
+# для речи хватает моно: Speech — в 4 раза меньше, Speech Low — в 5 с лишним
+AUDIO_PROFILES = {
+    "Music": {"sample_rate": 44100, "channels": 2, "bitrate": 128000},
+    "Speech": {"sample_rate": 24000, "channels": 1, "bitrate": 32000},
+    "Speech Low": {"sample_rate": 16000, "channels": 1, "bitrate": 24000},
+}
+
+# Приложения видеовстреч (bundle id) для захвата только их окон
+MEETING_APPS = [
+    "us.zoom.xos",
+    "com.microsoft.teams2",
+    "com.microsoft.teams",
+    "com.cisco.webexmeetingsapp",
+    "com.apple.FaceTime",
+    "com.tinyspeck.slackmacgap",
+]
+
+# Цели захвата: дисплеи нумеруются с главного, затем слева направо.
+# Окно или приложение пишется в размере источника — меньше пикселей, чем весь экран
+CAPTURE_TARGETS = {
+    "Main Display": {"kind": "display", "display_index": 0},
+    "Display 2": {"kind": "display", "display_index": 1},
+    "Display 3": {"kind": "display", "display_index": 2},
+    "Meeting App": {"kind": "app", "apps": MEETING_APPS},
+    "Meeting Window": {"kind": "windows", "apps": MEETING_APPS},
+    "Google Meet Tab": {"kind": "windows", "title": "Meet - "},
+}
+
+# Цены Gemini API, $ за 1M токенов (платный уровень, запросы до 200K токенов):
+# input — текст/изображения/видео, audio — звук, cached — кэшированный вход,
+# output — ответ вместе с "размышлениями". Для оценки стоимости, не для биллинга;
+# переопределяются ключом "model_prices" в конфиге.
+MODEL_PRICES = {
+    "gemini-3-pro-preview": {"input": 2.00, "audio": 2.00, "cached": 0.20, "output": 12.00},
+    "gemini-3-flash-preview": {"input": 0.50, "audio": 1.00, "cached": 0.05, "output": 3.00},
+    "gemini-flash-lite-latest": {"input": 0.10, "audio": 0.30, "cached": 0.01, "output": 0.40},
+}
+
+# Что отправляем в модель: только речь (по умолчанию), речь + слайды или полное видео
+PROCESSING_MODES = {
+    "audio": "Audio only",
+    "slides": "Audio + Slides",
+    "video": "Full video"
+}
+
+class ConfigManager:
+    @staticmethod
+    def load():
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, "r") as f:
+                    return {**DEFAULT_CONFIG, **json.load(f)}
+            except: pass
+        return DEFAULT_CONFIG.copy()
+
+    # Конфиг сохраняют и UI, и параллельные задачи обработки
+    lock = threading.RLock()
+
+    @staticmethod
+    def save(config):
+        with ConfigManager.lock:
+            with open(CONFIG_FILE, "w") as f:
+                json.dump(config, f, indent=4)
+
+    @staticmethod
+    def add_token_usage(config, total_tokens):
+        """
+        Учет токенов: счетчик в файле увеличивается атомарно относительно
+        других задач, переданный config получает новые значения.
+        """
+        with ConfigManager.lock:
+            stored = ConfigManager.load()
+            stored["used_tokens"] = stored.get("used_tokens", 0) + total_tokens
+            stored["last_request_tokens"] = total_tokens
+            ConfigManager.save(stored)
+        config["used_tokens"] = stored["used_tokens"]
+        config["last_request_tokens"] = total_tokens
@@ -0,0 +1,36 @@
+# steno/dates.py
+import os
+import re
+from datetime import datetime
+
+def get_meeting_date(filename):
+    """
+    Алгоритм получения даты встречи:
+    1. Из названия файла (Meet_YYYY-MM-DD_HH-MM-SS.mp4)
+    2. Дата изменения файла
+    3. Дата создания файла
+    4. Текущая дата
+    """
+    # 1. Попытка распарсить из имени файла
+    # Ожидаемый формат от рекордера: Meet_DD.MM.YYYY_HH:MM:SS.mp4
+    basename = os.path.basename(filename)
+    match = re.search(r"Meet_(\d{2}\.\d{2}\.\d{4})_", basename)
+    if match:
+        return match.group(1)
+    
+    # 2. Дата изменения
+    try:
+        mtime = os.path.getmtime(filename)
+        return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d")
+    except:
+        pass
+
+    # 3. Дата создания
+    try:
+        ctime = os.path.getctime(filename)
+        return datetime.fromtimestamp(ctime).strftime("%Y-%m-%d")
+    except:
+        pass
+
+    # 4. Текущая дата
+    return datetime.now().strftime("%Y-%m-%d")
@@ -0,0 +1,314 @@
+# steno/fakeapi.py
+"""
+Локальная заглушка Gemini API для проверки и бенчмарков без сети и квоты.
+
+    python -m steno.fakeapi --port 8765 --rpm 30 --fail-rate 0.05
+    # в ~/.recorder_app_config.json: "base_url": "http://127.0.0.1:8765"
+
+    python -m steno.fakeapi --bench 40        # общий клиент против клиента на задачу
+
+Поддерживает то, чем пользуется Steno: resumable-загрузку Files API
+(steno/uploader.py), files.get (файл в PROCESSING заданное время, затем
+ACTIVE), files.delete, generateContent и streamGenerateContent (SSE).
+Ответы — фиксированный протокол с usageMetadata. Свой лимит запросов в
+минуту (--rpm) отвечает 429 с RetryInfo, --fail-rate — доля случайных 503.
+В лимит входят генерация, files.get и начало сессии загрузки (чанки — нет).
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import logging
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("Steno")
+
+FAKE_PROTOCOL = (
+    "# Протокол встречи: Проверка заглушки\n**Дата:** 01.01.2025\n**Участники:** Тест\n\n"
+    "## 1. Саммари (Summary)\nОтвет локальной заглушки API.\n\n"
+    "## 2. Принятые решения\n* Решение заглушки\n\n"
+    "## 3. План действий (Action Items)\n| Задача | Ответственный | Срок |\n| :--- | :--- | :--- |\n"
+    "| Проверить клиент | Тест | - |\n"
+)
+
+
+class FakeState:
+    """Состояние заглушки: файлы, сессии загрузки, окно запросов для лимита."""
+
+    def __init__(self, rpm=0, fail_rate=0.0, latency=0.2, processing_seconds=1.0, chunk_delay=0.02, processing_per_mb=0.0,
+                 upload_bandwidth=0.0):
+        self.rpm = rpm
+        self.fail_rate = fail_rate
+        self.latency = latency
+        # Файл в PROCESSING: processing_seconds плюс processing_per_mb на мегабайт
+        self.processing_seconds = processing_seconds
+        self.processing_per_mb = processing_per_mb
+        # Скорость приема загрузок, МБ/с (0 — без ограничения)
+        self.upload_bandwidth = upload_bandwidth
+        self.chunk_delay = chunk_delay
+        self.lock = threading.Lock()
+        self.files = {}
+        self.uploads = {}
+        self.recent = deque()
+        self.counters = {"requests": 0, "throttled": 0, "failed": 0}
+
+    def admit(self):
+        """None — запрос принят, иначе (код, тело ошибки)."""
+        with self.lock:
+            self.counters["requests"] += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if self.rpm and len(self.recent) >= self.rpm:
+                self.counters["throttled"] += 1
+                retry = max(1, int(60 - (now - self.recent[0])) + 1)
+                return 429, _error(429, "RESOURCE_EXHAUSTED", "Quota exceeded (fake)", retry)
+            self.recent.append(now)
+            if self.fail_rate and random.random() < self.fail_rate:
+                self.counters["failed"] += 1
+                return 503, _error(503, "UNAVAILABLE", "The model is overloaded (fake)")
+        return None
+
+
+def _error(code, status, message, retry_seconds=None):
+    error = {"code": code, "message": message, "status": status}
+    if retry_seconds is not None:
+        error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_seconds}s"}]
+    return {"error": error}
+
+
+def _usage(prompt_tokens, text):
+    output = len(text) // 4
+    return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output, "totalTokenCount": prompt_tokens + output}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, fmt, *args):
+        logger.debug("fakeapi: " + fmt % args)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, code, payload=None, headers=None):
+        body = json.dumps(payload if payload is not None else {}).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _file(self, file_id):
+        entry = self.state.files.get(file_id)
+        if entry is None:
+            return None
+        processing = self.state.processing_seconds + int(entry["file"]["sizeBytes"]) / 1e6 * self.state.processing_per_mb
+        ready = time.monotonic() - entry["created"] >= processing
+        return dict(entry["file"], state="ACTIVE" if ready else "PROCESSING")
+
+    # --- Files API ---
+
+    def do_POST(self):
+        body = self._body()
+        path = self.path.split("?", 1)[0]
+        if path == "/upload/v1beta/files":
+            return self._upload_start(body)
+        match = re.fullmatch(r"/upload/session/(\w+)", path)
+        if match:
+            return self._upload_chunk(match.group(1), body)
+        match = re.fullmatch(r"/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)", path)
+        if match:
+            rejected = self.state.admit()
+            if rejected:
+                return self._send(*rejected)
+            request = json.loads(body or b"{}")
+            prompt_tokens = len(json.dumps(request)) // 4
+            time.sleep(self.state.latency)
+            if match.group(2) == "generateContent":
+                return self._send(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": FAKE_PROTOCOL}]}, "finishReason": "STOP"}],
+                    "usageMetadata": _usage(prompt_tokens, FAKE_PROTOCOL),
+                    "modelVersion": match.group(1),
+                })
+            return self._stream(prompt_tokens)
+        self._send(404, _error(404, "NOT_FOUND", f"Unknown path {path}"))
+
+    def _upload_start(self, body):
+        rejected = self.state.admit()
+        if rejected:
+            return self._send(*rejected)
+        upload_id = uuid.uuid4().hex
+        meta = json.loads(body or b"{}").get("file", {})
+        with self.state.lock:
+            self.state.uploads[upload_id] = {
+                "received": 0,
+                "size": int(self.headers.get("X-Goog-Upload-Header-Content-Length") or 0),
+                "mime_type": self.headers.get("X-Goog-Upload-Header-Content-Type", "application/octet-stream"),
+                "display_name": meta.get("display_name", upload_id),
+            }
+        host = self.headers.get("Host", "127.0.0.1")
+        self._send(200, {}, {"X-Goog-Upload-URL": f"http://{host}/upload/session/{upload_id}", "X-Goog-Upload-Status": "active"})
+
+    def _upload_chunk(self, upload_id, body):
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if self.state.upload_bandwidth and body:
+            time.sleep(len(body) / 1e6 / self.state.upload_bandwidth)
+        with self.state.lock:
+            upload = self.state.uploads.get(upload_id)
+            if upload is None:
+                return self._send(404, _error(404, "NOT_FOUND", "Upload session not found"))
+            if command == "query":
+                final = upload.get("file")
+                if final:
+                    return self._send(200, {"file": final}, {"X-Goog-Upload-Status": "final"})
+                return self._send(200, {}, {"X-Goog-Upload-Status": "active", "X-Goog-Upload-Size-Received": str(upload["received"])})
+            offset = int(self.headers.get("X-Goog-Upload-Offset") or 0)
+            if offset != upload["received"]:
+                return self._send(400, _error(400, "INVALID_ARGUMENT", "Offset mismatch"))
+            upload["received"] += len(body)
+            if "finalize" not in command:
+                return self._send(200, {}, {"X-Goog-Upload-Status": "active"})
+            file_id = uuid.uuid4().hex[:12]
+            remote = {
+                "name": f"files/{file_id}", "displayName": upload["display_name"], "mimeType": upload["mime_type"],
+                "sizeBytes": str(upload["received"]), "uri": f"http://fake/v1beta/files/{file_id}",
+                "expirationTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 47 * 3600)),
+            }
+            self.state.files[file_id] = {"file": remote, "created": time.monotonic()}
+            upload["file"] = dict(remote, state="PROCESSING")
+        self._send(200, {"file": upload["file"]}, {"X-Goog-Upload-Status": "final"})
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1beta/files/(\w+)", self.path.split("?", 1)[0])
+        if not match:
+            return self._send(404, _error(404, "NOT_FOUND", "Unknown path"))
+        rejected = self.state.admit()
+        if rejected:
+            return self._send(*rejected)
+        remote = self._file(match.group(1))
+        if remote is None:
+            return self._send(404, _error(404, "NOT_FOUND", "File not found"))
+        self._send(200, remote)
+
+    def do_DELETE(self):
+        match = re.fullmatch(r"/v1beta/files/(\w+)", self.path.split("?", 1)[0])
+        with self.state.lock:
+            removed = match and self.state.files.pop(match.group(1), None)
+        if not removed:
+            return self._send(404, _error(404, "NOT_FOUND", "File not found"))
+        self._send(200, {})
+
+    # --- Генерация ---
+
+    def _stream(self, prompt_tokens):
+        """SSE по строке протокола на событие, usageMetadata — в последнем."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        lines = FAKE_PROTOCOL.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": line}]}}]}
+            if i == len(lines) - 1:
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = _usage(prompt_tokens, FAKE_PROTOCOL)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.state.chunk_delay)
+        self.close_connection = True
+
+
+def serve(port=0, **options):
+    """Запускает заглушку в фоновом потоке. Возвращает (сервер, base_url, состояние)."""
+    state = FakeState(**options)
+    handler = type("BoundFakeHandler", (FakeHandler,), {"state": state})
+    # Очередь подключений по умолчанию (5) мала для десятков одновременных задач
+    server_class = type("FakeServer", (ThreadingHTTPServer,), {"request_queue_size": 128})
+    server = server_class(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+def bench(count, rpm, fail_rate, latency):
+    """
+    count параллельных генераций (как задачи очереди — по потоку на задачу):
+    общий клиент с лимитером и повторами против нового genai.Client на задачу.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from google import genai
+    from steno.api import get_client, client_stats
+
+    def run(label, make):
+        server, base_url, state = serve(rpm=rpm, fail_rate=fail_rate, latency=latency)
+        failures = []
+
+        def one(i):
+            try:
+                # Ссылка на клиент нужна: genai.Client, собранный сборщиком мусора, закрывает соединение
+                client = make(base_url)
+                client.models.generate_content(model="fake-model", contents=[f"Встреча {i}"])
+            except Exception as e:
+                failures.append(e)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            list(pool.map(one, range(count)))
+        elapsed = time.monotonic() - started
+        server.shutdown()
+        print(
+            f"{label:<22} {count - len(failures)}/{count} ok in {elapsed:.2f}s, "
+            f"server saw {state.counters['requests']} requests "
+            f"({state.counters['throttled']} throttled, {state.counters['failed']} failed)"
+        )
+
+    print(f"{count} concurrent generations, server limit {rpm or 'none'} rpm, {fail_rate:.0%} random 503, {latency}s latency")
+    run("client per job", lambda base_url: genai.Client(api_key="fake", http_options={"baseUrl": base_url}))
+    run("shared pooled client", lambda base_url: get_client("fake", base_url, rpm=rpm, tpm=0))
+    for name, stats in client_stats().items():
+        print(f"  {name}: {stats['requests']} requests, {stats['retries']} retries, {stats['throttled_seconds']:.1f}s waiting for the limiter")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake Gemini API for Steno")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429 (default: unlimited)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per generation request")
+    parser.add_argument("--processing-seconds", type=float, default=1.0, help="uploaded files stay PROCESSING this long")
+    parser.add_argument("--bench", type=int, metavar="N", help="run N concurrent generations against a private server and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    # Каждый запрос SDK и httpx пишут в лог — в выводе бенчмарка это шум
+    for name in ("httpx", "google_genai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    if args.bench:
+        bench(args.bench, args.rpm, args.fail_rate, args.latency)
+        return 0
+
+    server, base_url, _ = serve(
+        args.port, rpm=args.rpm, fail_rate=args.fail_rate, latency=args.latency,
+        processing_seconds=args.processing_seconds
+    )
+    print(f"Fake Gemini API on {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+# steno/index.py
+"""
+Индекс папки записей для меню Recent Recordings / Recent Protocols.
+
+Меню открывается часто, а в папке тысячи файлов: полный listdir со stat
+каждого файла на главном потоке заметно тормозит. RecordingsIndex хранит
+список файлов (размер, mtime, длительность, есть ли протокол) в
+~/.recorder_app_index.json и пересканирует папку, только когда изменился
+mtime самого каталога (его меняет любое создание, удаление или
+переименование файла — в том числе атомарная запись протокола и склейка
+записи). В остальных случаях refresh — это один stat. При пересканировании
+stat делается только для новых и перезаписанных файлов (сменился inode);
+правка файла на месте без смены inode индексом не замечается.
+"""
+import os
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger("Steno")
+
+INDEX_FILE = os.path.expanduser("~/.recorder_app_index.json")
+INDEX_VERSION = 1
+# Сохранение на диск откладывается и идет в фоне: JSON на тысячи файлов
+# кодируется десятки миллисекунд, главному потоку ждать незачем
+SAVE_DELAY = 2.0
+# Насколько свежий mtime каталога считаем ненадежным (см. refresh)
+RACY_WINDOW_NS = 2_000_000_000
+
+RECORDING = "recording"
+PROTOCOL = "protocol"
+PROTOCOL_SUFFIX = "_protocol.txt"
+
+
+def classify(name):
+    """Тип файла папки записей: запись (.mp4), протокол или None (микрофон, временные, скрытые)."""
+    if name.startswith(".") or ".tmp" in name:
+        return None
+    if name.endswith(PROTOCOL_SUFFIX):
+        return PROTOCOL
+    if name.lower().endswith(".mp4"):
+        return RECORDING
+    return None
+
+
+def protocol_name(recording_name):
+    return os.path.splitext(recording_name)[0] + PROTOCOL_SUFFIX
+
+
+class RecordingsIndex:
+    """
+    Инкрементальный индекс записей и протоколов одной папки.
+
+    refresh() возвращает изменения с прошлого вызова: (добавленные,
+    удаленные, измененные) имена. recent(kind, limit) — последние файлы по
+    mtime, список пересчитывается только при изменениях.
+
+    Методы можно звать из разных потоков (меню — с главного, восстановление
+    и длительности — из фоновых): refresh держит замок на все сканирование,
+    наружу отдаются только копии записей.
+    """
+
+    def __init__(self, save_dir, path=INDEX_FILE):
+        self.save_dir = save_dir
+        self.path = path
+        self.files = {}
+        self.dir_mtime = None
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._save_timer = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Recordings index unreadable, rebuilding: {e}")
+            return
+        if data.get("version") != INDEX_VERSION or data.get("save_dir") != self.save_dir:
+            return
+        self.files = data.get("files", {})
+        self.dir_mtime = data.get("dir_mtime")
+
+    def _schedule_save(self):
+        """Вызывается под self._lock."""
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(SAVE_DELAY, self.save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._save_timer = None
+            data = {
+                "version": INDEX_VERSION, "save_dir": self.save_dir,
+                "dir_mtime": self.dir_mtime, "files": {name: dict(info) for name, info in self.files.items()},
+            }
+        tmp_path = self.path + ".tmp"
+        try:
+            # json.dumps целиком (C-кодировщик) в разы быстрее потокового json.dump на тысячах записей
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Cannot save recordings index: {e}")
+
+    def refresh(self, force=False):
+        """Сверяет индекс с папкой. Возвращает (added, removed, changed) — множества имен."""
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.save_dir).st_mtime_ns
+            except OSError:
+                # Папки нет (удалили, отключили диск) — индекс пуст
+                removed = set(self.files)
+                self.files = {}
+                self.dir_mtime = None
+                self._recent = {}
+                return set(), removed, set()
+            if not force and dir_mtime == self.dir_mtime:
+                return set(), set(), set()
+
+            added, changed, seen = set(), set(), set()
+            with os.scandir(self.save_dir) as entries:
+                for entry in entries:
+                    kind = classify(entry.name)
+                    if kind is None:
+                        continue
+                    seen.add(entry.name)
+                    old = self.files.get(entry.name)
+                    # inode приходит из scandir бесплатно; атомарная перезапись (os.replace)
+                    # меняет его, так что stat нужен только новым и перезаписанным файлам
+                    if old is not None and old.get("inode") == entry.inode():
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        seen.discard(entry.name)
+                        continue
+                    if old is not None and old["mtime"] == st.st_mtime and old["size"] == st.st_size:
+                        old["inode"] = entry.inode()
+                        continue
+                    self.files[entry.name] = {
+                        "kind": kind,
+                        "inode": entry.inode(),
+                        "size": st.st_size,
+                        "mtime": st.st_mtime,
+                        # Длительность пересчитываем, только если файл изменился
+                        "duration": old.get("duration") if old and old["size"] == st.st_size else None,
+                    }
+                    (changed if old is not None else added).add(entry.name)
+            removed = set(self.files) - seen
+            for name in removed:
+                del self.files[name]
+
+            # mtime каталога грубое (тик ядра, 1-2 с на HFS+/FAT): изменения в ту же
+            # единицу времени после скана его не сдвинут. Свежему mtime не верим —
+            # следующий refresh просканирует папку еще раз
+            self.dir_mtime = dir_mtime if time.time_ns() - dir_mtime > RACY_WINDOW_NS else None
+            if added or removed or changed:
+                self._recent = {}
+                self._schedule_save()
+            return added, removed, changed
+
+    def recent(self, kind, limit=10):
+        """Последние файлы вида kind по mtime (новые первыми)."""
+        with self._lock:
+            key = (kind, limit)
+            if key not in self._recent:
+                names = [name for name, info in self.files.items() if info["kind"] == kind]
+                names.sort(key=lambda name: self.files[name]["mtime"], reverse=True)
+                self._recent[key] = names[:limit]
+            return list(self._recent[key])
+
+    def info(self, name):
+        """Запись индекса с признаком has_protocol (для записей)."""
+        with self._lock:
+            entry = self.files.get(name)
+            if entry is None:
+                return None
+            entry = dict(entry)
+            if entry["kind"] == RECORDING:
+                entry["has_protocol"] = protocol_name(name) in self.files
+            return entry
+
+    def fill_durations(self, limit=None):
+        """Длительность записей без нее (ffmpeg, медленно — вызывать в фоне). Возвращает число обновленных."""
+        from steno.media import MediaError, probe_media
+
+        with self._lock:
+            pending = [n for n, i in self.files.items() if i["kind"] == RECORDING and i.get("duration") is None]
+            pending.sort(key=lambda n: self.files[n]["mtime"], reverse=True)
+        updated = 0
+        for name in pending[:limit]:
+            try:
+                duration = probe_media(os.path.join(self.save_dir, name))["duration"]
+            except MediaError:
+                continue
+            with self._lock:
+                if name in self.files:
+                    self.files[name]["duration"] = duration
+                    updated += 1
+        if updated:
+            with self._lock:
+                self._schedule_save()
+        return updated
+
+
+def _list_recent(save_dir, predicate, limit):
+    if not os.path.exists(save_dir):
+        return []
+    files = [f for f in os.listdir(save_dir) if predicate(f)]
+    files.sort(key=lambda x: os.path.getmtime(os.path.join(save_dir, x)), reverse=True)
+    return files[:limit]
+
+
+def recent_recordings(save_dir, limit=10):
+    """
+    Последние записи (только .mp4 — основные файлы).
+    .m4a (микрофон) скрыты, они подтянутся автоматически при обработке.
+    Разовый просмотр папки; меню приложения работает через RecordingsIndex.
+    """
+    return _list_recent(save_dir, lambda f: classify(f) == RECORDING, limit)
+
+
+def recent_protocols(save_dir, limit=10):
+    return _list_recent(save_dir, lambda f: classify(f) == PROTOCOL, limit)
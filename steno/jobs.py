@@ -0,0 +1,276 @@
+# steno/jobs.py
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger("Steno")
+
+JOBS_FILE = os.path.expanduser("~/.recorder_app_jobs.json")
+MAX_FINISHED_JOBS = 20
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """Одна задача ИИ-обработки записи: состояние, этап и прогресс."""
+
+    def __init__(self, video_path, job_id=None, state=JOB_QUEUED, stage="", progress=0.0,
+                 error=None, result=None, created=None, finished=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.video_path = video_path
+        self.state = state
+        self.stage = stage
+        self.progress = progress
+        self.error = error
+        self.result = result
+        self.created = created or time.time()
+        self.finished = finished
+        self.cancel_event = threading.Event()
+        self._listener = None
+
+    @property
+    def name(self):
+        return os.path.basename(self.video_path)
+
+    def report(self, stage, progress=None):
+        """Вызывается пайплайном на каждом этапе. Заодно точка отмены."""
+        self.check_cancelled()
+        self.stage = stage
+        if progress is not None:
+            self.progress = progress
+        logger.info(f"[job {self.id}] {stage}" + (f" ({progress:.0%})" if progress is not None else ""))
+        if self._listener:
+            self._listener(self)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "video_path": self.video_path,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "error": self.error,
+            "result": self.result,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["video_path"], job_id=data.get("id"), state=data.get("state", JOB_QUEUED),
+            stage=data.get("stage", ""), progress=data.get("progress", 0.0), error=data.get("error"),
+            result=data.get("result"), created=data.get("created"), finished=data.get("finished"),
+        )
+
+
+class JobQueue:
+    """
+    Очередь ИИ-задач с ограничением числа одновременно выполняемых.
+
+    worker(job) выполняет задачу в отдельном потоке и возвращает результат
+    (путь к протоколу); прогресс и отмена — через job.report()/check_cancelled().
+    on_change(job) вызывается из рабочих потоков при любом изменении задачи.
+    Очередь сохраняется на диск: после перезапуска незавершенные задачи
+    (в том числе прерванные на середине) выполняются заново.
+    """
+
+    def __init__(self, worker, max_concurrent=2, path=JOBS_FILE, on_change=None):
+        self.worker = worker
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.path = path
+        self.on_change = on_change
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        self._jobs = []
+        self._load()
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Cannot load job queue: {e}")
+            return
+        for item in data:
+            job = Job.from_dict(item)
+            if job.state == JOB_RUNNING:
+                job.state = JOB_QUEUED
+                job.stage = "Прервано, повтор"
+                job.progress = 0.0
+            job._listener = self._notify
+            self._jobs.append(job)
+
+    def _save(self):
+        """
+        Снимок очереди на диск. Зовут и рабочие потоки, и главный: запись и
+        os.replace — под замком, во временный файл с уникальным именем.
+        Ошибка записи только логируется — на исход задачи она не влияет.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            data = [job.to_dict() for job in self._jobs]
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.path) or ".", prefix=os.path.basename(self.path) + ".", suffix=".tmp"
+                )
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Cannot save job queue: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _notify(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception as e:
+                logger.warning(f"Job listener failed: {e}")
+
+    # --- API ---
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def active(self):
+        with self._lock:
+            return [job for job in self._jobs if job.state in ACTIVE_STATES]
+
+    def running(self):
+        with self._lock:
+            return [job for job in self._jobs if job.state == JOB_RUNNING]
+
+    def get(self, job_id):
+        with self._lock:
+            for job in self._jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def submit(self, video_path):
+        """Ставит запись в очередь. Повторная постановка активной записи не дублирует задачу."""
+        with self._lock:
+            for job in self._jobs:
+                if job.video_path == video_path and job.state in ACTIVE_STATES:
+                    return job
+            job = Job(video_path)
+            job._listener = self._notify
+            self._jobs.append(job)
+        logger.info(f"Job {job.id} queued: {job.name}")
+        self._save()
+        self._notify(job)
+        self._schedule()
+        return job
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if not job or job.state not in ACTIVE_STATES:
+                return False
+            job.cancel_event.set()
+            if job.state == JOB_QUEUED:
+                self._finish(job, JOB_CANCELLED)
+                return True
+        # Выполняемая задача остановится на ближайшей точке отмены
+        logger.info(f"Cancellation requested for job {job.id}")
+        return True
+
+    def clear_finished(self):
+        with self._lock:
+            self._jobs = [job for job in self._jobs if job.state in ACTIVE_STATES]
+        self._save()
+
+    def set_max_concurrent(self, value):
+        self.max_concurrent = max(1, int(value))
+        self._schedule()
+
+    def start(self):
+        """Запускает задачи, оставшиеся в очереди с прошлого запуска."""
+        self._schedule()
+
+    def wait_idle(self, timeout=None):
+        """Блокирует, пока в очереди есть незавершенные задачи. True — очередь пуста."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.active(), timeout)
+
+    # --- Scheduling ---
+
+    def _schedule(self):
+        with self._lock:
+            slots = self.max_concurrent - len(self.running())
+            queued = [job for job in self._jobs if job.state == JOB_QUEUED]
+            to_start = queued[:max(0, slots)]
+            for job in to_start:
+                job.state = JOB_RUNNING
+                job.stage = "Запуск"
+                job.progress = 0.0
+        for job in to_start:
+            self._notify(job)
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        if to_start:
+            self._save()
+
+    def _run(self, job):
+        # Исход задачи — только по worker: сбой учета (_finish) не делает готовую задачу упавшей
+        state, result, error = JOB_DONE, None, None
+        try:
+            result = self.worker(job)
+        except JobCancelled:
+            state = JOB_CANCELLED
+        except Exception as e:
+            if job.cancel_event.is_set():
+                state = JOB_CANCELLED
+            else:
+                logger.exception(f"Job {job.id} failed")
+                state, error = JOB_FAILED, str(e)
+        try:
+            self._finish(job, state, result=result, error=error)
+        except Exception:
+            logger.exception(f"Job {job.id}: cannot record state {state}")
+        finally:
+            self._schedule()
+
+    def _finish(self, job, state, result=None, error=None):
+        with self._lock:
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            if state == JOB_DONE:
+                job.progress = 1.0
+            job.stage = {JOB_DONE: "Готово", JOB_FAILED: "Ошибка", JOB_CANCELLED: "Отменено"}[state]
+            # Историю завершенных держим короткой
+            finished = [j for j in self._jobs if j.state not in ACTIVE_STATES]
+            for old in finished[:-MAX_FINISHED_JOBS]:
+                self._jobs.remove(old)
+            self._idle.notify_all()
+        logger.info(f"Job {job.id} {state}: {job.name}" + (f" ({error})" if error else ""))
+        self._save()
+        self._notify(job)
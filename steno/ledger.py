@@ -0,0 +1,390 @@
+# steno/ledger.py
+"""
+Учет токенов и стоимости по встречам.
+
+Каждая обработка записи (обычная, live, из командной строки) добавляет
+строку в ~/.recorder_app_ledger.jsonl: модель, режим, длительность медиа,
+загруженные байты, токены входа / ответа / кэша (по данным usage_metadata
+каждого запроса), время этапов и оценку стоимости по MODEL_PRICES.
+
+До загрузки стоимость оценивается по длительности записи и режиму
+(estimate_job / estimate_table): видно, во что обойдется встреча в каждом
+режиме и на каждой модели, и можно заранее выбрать подешевле.
+
+    python -m steno ~/Movies/ScreenRecordings --report
+    python -m steno ~/Movies/ScreenRecordings/Meet_x.mp4 --estimate
+"""
+import os
+import json
+import math
+import time
+import threading
+import logging
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from steno.config import AI_MODELS, MODEL_PRICES, PROCESSING_MODES
+from steno.media import estimate_media_tokens, IMAGE_TOKENS_PER_SLIDE
+
+logger = logging.getLogger("Steno")
+
+LEDGER_FILE = os.path.expanduser("~/.recorder_app_ledger.jsonl")
+
+# Оценка до загрузки: протокол и конспект окна в токенах ответа,
+# слайдов в минуту в режиме slides, символов на токен в промптах
+OUTPUT_TOKENS_ESTIMATE = 2500
+MAP_OUTPUT_TOKENS_ESTIMATE = 1500
+SLIDES_PER_MINUTE = 0.5
+CHARS_PER_TOKEN = 4
+
+# Период итога стоимости в меню (Ledger.recent_cost)
+RECENT_COST_DAYS = 30
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+def prices_for(model, config=None):
+    prices = dict(MODEL_PRICES)
+    prices.update((config or {}).get("model_prices") or {})
+    return prices.get(model)
+
+
+def token_cost(model, prompt=0, output=0, cached=0, audio=0, config=None):
+    """Стоимость в $ (None — цен модели нет). audio и cached — части prompt."""
+    price = prices_for(model, config)
+    if price is None:
+        return None
+    text = max(0, prompt - cached - audio)
+    return (
+        text * price["input"] + audio * price.get("audio", price["input"])
+        + cached * price.get("cached", price["input"]) + output * price["output"]
+    ) / 1e6
+
+
+def _count(usage, field):
+    return getattr(usage, field, None) or 0
+
+
+def _audio_tokens(usage):
+    """Токены звука из разбивки входа по модальностям (если API ее прислал)."""
+    total = 0
+    for detail in getattr(usage, "prompt_tokens_details", None) or []:
+        modality = getattr(detail, "modality", None)
+        if (getattr(modality, "name", None) or str(modality or "")).upper().endswith("AUDIO"):
+            total += _count(detail, "token_count")
+    return total
+
+
+class LedgerEntry:
+    """
+    Учет одной обработки. add_usage/add_upload/stage вызываются из потоков
+    задачи (в том числе параллельных окон), finish пишет строку в журнал.
+    """
+
+    def __init__(self, video_path, config, job_id=None, live=False):
+        self.config = config
+        self.started = time.monotonic()
+        self.data = {
+            "id": job_id,
+            "video": os.path.basename(video_path),
+            "started": time.time(),
+            "mode": config.get("processing_mode", "audio"),
+            "live": live,
+            "duration": None,
+            "estimate": None,
+            "cached_result": False,
+            "files_uploaded": 0,
+            "files_reused": 0,
+            "bytes_uploaded": 0,
+            "requests": 0,
+            "prompt_tokens": 0,
+            "audio_tokens": 0,
+            "cached_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+            "models": {},
+            "stages": {},
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Время этапа (сек); повторные и параллельные вызовы складываются."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                stages = self.data["stages"]
+                stages[name] = round(stages.get(name, 0.0) + time.monotonic() - started, 2)
+
+    def set(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+
+    def add_upload(self, sent_bytes, uploaded, reused=0):
+        with self._lock:
+            self.data["bytes_uploaded"] += sent_bytes
+            self.data["files_uploaded"] += uploaded
+            self.data["files_reused"] += reused
+
+    def add_usage(self, model, usage):
+        """usage — usage_metadata ответа (или последнего куска потока)."""
+        counts = {
+            "requests": 1,
+            "prompt_tokens": _count(usage, "prompt_token_count"),
+            "audio_tokens": _audio_tokens(usage),
+            "cached_tokens": _count(usage, "cached_content_token_count"),
+            # "Размышления" оплачиваются как ответ
+            "output_tokens": _count(usage, "candidates_token_count") + _count(usage, "thoughts_token_count"),
+            "total_tokens": _count(usage, "total_token_count"),
+        }
+        with self._lock:
+            per_model = self.data["models"].setdefault(model, dict.fromkeys(counts, 0))
+            for key, value in counts.items():
+                self.data[key] += value
+                per_model[key] += value
+
+    @property
+    def total_tokens(self):
+        return self.data["total_tokens"]
+
+    def cost(self):
+        """Стоимость по моделям, None — для какой-то модели нет цен."""
+        total = 0.0
+        for model, counts in self.data["models"].items():
+            cost = token_cost(
+                model, counts["prompt_tokens"], counts["output_tokens"],
+                counts["cached_tokens"], counts["audio_tokens"], self.config
+            )
+            if cost is None:
+                return None
+            total += cost
+        return total
+
+    def finish(self, status=STATUS_DONE, ledger=None):
+        with self._lock:
+            self.data["status"] = status
+            self.data["seconds"] = round(time.monotonic() - self.started, 2)
+        cost = self.cost()
+        self.set(cost=round(cost, 6) if cost is not None else None)
+        (ledger or Ledger()).append(self.data)
+        logger.info(
+            f"Ledger: {self.data['video']} {status}, {self.data['total_tokens']} tokens "
+            f"(in {self.data['prompt_tokens']}, cached {self.data['cached_tokens']}, out {self.data['output_tokens']})"
+            + (f", ~${cost:.4f}" if cost is not None else "")
+            + f", stages {self.data['stages']}"
+        )
+        return self.data
+
+
+def timed(entry, name):
+    """entry.stage(name) или пустой контекст, если учета нет (entry None)."""
+    return entry.stage(name) if entry is not None else nullcontext()
+
+
+class Ledger:
+    """Журнал обработок: JSON Lines, строка на задачу, только дописывается."""
+
+    _lock = threading.Lock()
+    # Путь -> {"offset": прочитано байт, "costs": [(started, cost)]} — итог за
+    # RECENT_COST_DAYS без перечитывания журнала (экземпляры Ledger создаются на месте)
+    _recent = {}
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with Ledger._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    start = f.tell()
+                    f.write(line + "\n")
+                    end = f.tell()
+            except OSError as e:
+                logger.warning(f"Cannot write token ledger: {e}")
+                return
+            # Итог уже прочитан до этой строки — дополняем его; иначе (журнал дописал
+            # другой процесс) строку подхватит recent_cost
+            state = Ledger._recent.get(self.path)
+            if state is not None and state["offset"] == start:
+                state["offset"] = end
+                state["costs"].append((record.get("started", 0), record.get("cost") or 0.0))
+
+    def recent_cost(self, now=None):
+        """
+        Стоимость обработок за последние RECENT_COST_DAYS дней. Журнал
+        читается целиком один раз, дальше — только дописанные строки.
+        """
+        now = time.time() if now is None else now
+        with Ledger._lock:
+            state = Ledger._recent.setdefault(self.path, {"offset": 0, "costs": []})
+            self._read_new(state)
+            since = now - RECENT_COST_DAYS * 86400
+            state["costs"] = [(started, cost) for started, cost in state["costs"] if started >= since]
+            return sum(cost for _, cost in state["costs"])
+
+    def _read_new(self, state):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size < state["offset"]:
+            # Журнал удален или обрезан — читаем заново
+            state["offset"], state["costs"] = 0, []
+        if size == state["offset"]:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(state["offset"])
+            data = f.read()
+        # Недописанная последняя строка — в следующий раз
+        data = data[:data.rfind(b"\n") + 1]
+        state["offset"] += len(data)
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            state["costs"].append((record.get("started", 0), record.get("cost") or 0.0))
+
+    def entries(self, since=None):
+        """Записи журнала (с момента since, unix-время), старые первыми."""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or record.get("started", 0) >= since:
+                    records.append(record)
+        return records
+
+
+# --- Оценка до загрузки ---
+
+def media_tokens(duration, mode, audio_tracks=1):
+    """Входные токены медиа в режиме mode (audio — речевая дорожка, slides — плюс слайды, video — все дорожки)."""
+    if mode == "video":
+        return estimate_media_tokens(duration, video_tracks=1, audio_tracks=audio_tracks)
+    tokens = estimate_media_tokens(duration, audio_tracks=1)
+    if mode == "slides":
+        tokens += int(duration / 60 * SLIDES_PER_MINUTE) * IMAGE_TOKENS_PER_SLIDE
+    return tokens
+
+
+def estimate_job(duration, mode, model, config, audio_tracks=1):
+    """
+    Оценка одной обработки: {"model", "mode", "input_tokens", "output_tokens",
+    "audio_tokens", "cost", "map_reduce"}. Длинные встречи считаются как
+    map-reduce: медиа — модели map_model, конспекты — основной модели.
+    """
+    prompt = len(config.get("prompt") or "") // CHARS_PER_TOKEN
+    media = media_tokens(duration, mode, audio_tracks)
+    audio = media if mode == "audio" else estimate_media_tokens(duration, audio_tracks=1 if mode == "slides" else audio_tracks)
+    window = int(config.get("map_reduce_window_minutes", 20)) * 60
+    map_reduce = bool(config.get("map_reduce", True)) and duration > window * 1.5
+
+    if not map_reduce:
+        cost = token_cost(model, prompt + media, OUTPUT_TOKENS_ESTIMATE, audio=audio, config=config)
+        return {
+            "model": model, "mode": mode, "input_tokens": prompt + media, "audio_tokens": audio,
+            "output_tokens": OUTPUT_TOKENS_ESTIMATE, "cost": cost, "map_reduce": False,
+        }
+
+    windows = math.ceil(duration / window)
+    map_model = config.get("map_model") or model
+    map_input = media + windows * 200
+    map_output = windows * MAP_OUTPUT_TOKENS_ESTIMATE
+    reduce_input = prompt + map_output
+    map_cost = token_cost(map_model, map_input, map_output, audio=audio, config=config)
+    reduce_cost = token_cost(model, reduce_input, OUTPUT_TOKENS_ESTIMATE, config=config)
+    return {
+        "model": model, "mode": mode, "input_tokens": map_input + reduce_input, "audio_tokens": audio,
+        "output_tokens": map_output + OUTPUT_TOKENS_ESTIMATE,
+        "cost": None if map_cost is None or reduce_cost is None else map_cost + reduce_cost,
+        "map_reduce": True,
+    }
+
+
+def estimate_table(duration, config, audio_tracks=1):
+    """Оценки для всех режимов и моделей, дешевые первыми."""
+    rows = [
+        estimate_job(duration, mode, model, config, audio_tracks)
+        for mode in PROCESSING_MODES for model in AI_MODELS
+    ]
+    return sorted(rows, key=lambda r: (r["cost"] is None, r["cost"] or 0))
+
+
+def format_estimate(duration, rows, config=None):
+    current = (config.get("processing_mode"), config.get("model_name")) if config else None
+    lines = [f"Estimate for {duration / 60:.0f} min of media:"]
+    for r in rows:
+        cost = f"${r['cost']:.3f}" if r["cost"] is not None else "n/a"
+        mark = "*" if (r["mode"], r["model"]) == current else " "
+        lines.append(
+            f" {mark} {PROCESSING_MODES[r['mode']]:<15} {r['model']:<26} "
+            f"~{r['input_tokens'] / 1000:.0f}K in / ~{r['output_tokens'] / 1000:.1f}K out  {cost}"
+            + ("  (map-reduce)" if r["map_reduce"] else "")
+        )
+    return "\n".join(lines)
+
+
+# --- Отчет ---
+
+def summarize(records, config=None):
+    """Итоги по записям журнала: всего и по моделям."""
+    summary = {"jobs": 0, "failed": 0, "cached": 0, "media_seconds": 0.0, "bytes_uploaded": 0,
+               "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+               "cost": 0.0, "models": {}}
+    for r in records:
+        summary["jobs"] += 1
+        summary["failed"] += r.get("status") != STATUS_DONE
+        summary["cached"] += bool(r.get("cached_result"))
+        summary["media_seconds"] += r.get("duration") or 0.0
+        summary["cost"] += r.get("cost") or 0.0
+        for key in ("bytes_uploaded", "prompt_tokens", "cached_tokens", "output_tokens", "total_tokens"):
+            summary[key] += r.get(key, 0)
+        for model, counts in (r.get("models") or {}).items():
+            per_model = summary["models"].setdefault(model, {"requests": 0, "total_tokens": 0, "cost": 0.0})
+            per_model["requests"] += counts.get("requests", 0)
+            per_model["total_tokens"] += counts.get("total_tokens", 0)
+            per_model["cost"] += token_cost(
+                model, counts.get("prompt_tokens", 0), counts.get("output_tokens", 0),
+                counts.get("cached_tokens", 0), counts.get("audio_tokens", 0), config
+            ) or 0.0
+    return summary
+
+
+def format_report(records, days=30, last=10, config=None):
+    s = summarize(records, config)
+    hours = s["media_seconds"] / 3600
+    lines = [
+        f"Last {days} days: {s['jobs']} jobs ({s['failed']} failed, {s['cached']} from cache), "
+        f"{hours:.1f} h of media, {s['bytes_uploaded'] / 1e6:.0f} MB uploaded",
+        f"Tokens: {s['total_tokens']:,} (in {s['prompt_tokens']:,}, cached {s['cached_tokens']:,}, "
+        f"out {s['output_tokens']:,})",
+        f"Cost: ~${s['cost']:.2f}" + (f" (~${s['cost'] / hours:.2f} per hour of meetings)" if hours else ""),
+    ]
+    for model, m in sorted(s["models"].items(), key=lambda item: -item[1]["cost"]):
+        lines.append(f"  {model}: {m['requests']} requests, {m['total_tokens']:,} tokens, ~${m['cost']:.2f}")
+    if records:
+        lines.append("")
+        lines.append("Recent jobs:")
+    for r in records[-last:][::-1]:
+        cost = f"~${r['cost']:.3f}" if r.get("cost") is not None else "n/a"
+        stages = ", ".join(f"{name} {seconds:.0f}s" for name, seconds in (r.get("stages") or {}).items())
+        lines.append(
+            f"  {datetime.fromtimestamp(r.get('started', 0)).strftime('%d.%m %H:%M')} {r.get('video')} "
+            f"[{r.get('status')}] {r.get('total_tokens', 0):,} tokens {cost}" + (f" — {stages}" if stages else "")
+        )
+    return "\n".join(lines)
+
+
+def report(days=30, path=LEDGER_FILE, last=10, config=None):
+    return format_report(Ledger(path).entries(since=time.time() - days * 86400), days=days, last=last, config=config)
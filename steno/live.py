@@ -0,0 +1,294 @@
+# steno/live.py
+"""
+Обработка во время записи.
+
+Рекордер отдает готовые куски (steno.segments, хук on_segment), а
+LiveSession в фоне готовит их под режим обработки (речевая дорожка,
+слайды) и загружает в Files API, пока встреча еще идет. У длинных встреч
+законченные окна (map_reduce_window_minutes) конспектируются тут же.
+После Stop остается догрузить последний кусок и запустить генерацию
+(или свести конспекты окон) — время от Stop до протокола не зависит от
+длины встречи.
+"""
+import os
+import time
+import shutil
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from steno.config import ConfigManager, PROCESSING_MODES
+from steno.dates import get_meeting_date
+from steno.media import MediaError, extract_speech_audio, extract_slides
+from steno.pipeline import (
+    make_client, build_slide_parts, user_prompt, report_progress, run_generation,
+    summarise_window, reduce_notes, delete_remote_files, upload_and_wait
+)
+from steno.cache import file_digest
+from steno.streaming import ProtocolWriter
+from steno.search import index_protocol
+from steno.ledger import LedgerEntry, STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED
+from steno.jobs import JobCancelled
+
+logger = logging.getLogger("Steno")
+
+LIVE_DIR_SUFFIX = ".live"
+# Сколько ждать закрытия последних кусков после Stop
+STOP_TIMEOUT = 10 * 60
+
+
+def live_dir_for(video_path):
+    """Скрытый рабочий каталог рядом с записью: .Meet_x.live/"""
+    base = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(os.path.dirname(video_path), "." + base + LIVE_DIR_SUFFIX)
+
+
+def cleanup_stale(save_dir):
+    """Рабочие каталоги сессий, оборванных падением приложения."""
+    if not os.path.isdir(save_dir):
+        return
+    for name in os.listdir(save_dir):
+        if name.startswith(".") and name.endswith(LIVE_DIR_SUFFIX):
+            shutil.rmtree(os.path.join(save_dir, name), ignore_errors=True)
+
+
+class LiveSession:
+    """
+    Загрузка кусков записи по мере их готовности и генерация протокола по Stop.
+
+    on_segment — хук для SegmentManifest (вызывается из потоков AVFoundation),
+    recording_stopped — после склейки кусков, finish — в задаче очереди.
+    Куски обрабатываются строго по порядку одним фоновым потоком.
+    """
+
+    def __init__(self, video_path, config):
+        self.video_path = video_path
+        self.config = config
+        self.mode = config.get("processing_mode", "audio")
+        self.window_seconds = int(config.get("map_reduce_window_minutes", 20)) * 60
+        # Микрофон — дорожка основного файла, отдельных кусков _mic не будет
+        self.dual_track = bool(config.get("dual_track", False))
+        self.work_dir = live_dir_for(video_path)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        self.error = None
+        self.tokens = 0
+        # Учет токенов сессии: загрузки кусков во время записи и генерация после Stop
+        self.ledger = LedgerEntry(video_path, config, live=True)
+        self.parts = {}
+        self.notes = {}
+        self.stopped = threading.Event()
+        # Прерывает загрузку кусков: отмена задачи или закрытие сессии
+        self.cancel_event = threading.Event()
+
+        self._lock = threading.Lock()
+        self._main = {}
+        self._mic = {}
+        self._scheduled = set()
+        self._client = None
+        self._base_url = ""
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._mapper = ThreadPoolExecutor(max_workers=max(1, int(config.get("map_reduce_concurrency", 4))))
+
+    # --- Куски от рекордера ---
+
+    def on_segment(self, entry):
+        # Каталог кусков удаляется после склейки — держим жесткую ссылку у себя
+        path = os.path.join(self.work_dir, os.path.basename(entry["path"]))
+        try:
+            os.link(entry["path"], path)
+        except OSError:
+            shutil.copy2(entry["path"], path)
+        entry = dict(entry, path=path)
+
+        with self._lock:
+            (self._main if entry["track"] == "main" else self._mic)[entry["index"]] = entry
+            ready = self._take_ready(final=False)
+        for index in ready:
+            self._worker.submit(self._process, index)
+
+    def recording_stopped(self, results=None):
+        self.stopped.set()
+
+    def _take_ready(self, final):
+        """
+        Куски, которые можно обрабатывать: есть и видео, и микрофон с тем же
+        номером (в режиме dual_track — сразу). Если микрофон не пришел, а
+        следующий кусок видео уже есть — дорожки микрофона нет, обрабатываем
+        видео одно.
+        """
+        ready = []
+        for index in sorted(self._main):
+            if index in self._scheduled:
+                continue
+            if final or self.dual_track or index in self._mic or index + 1 in self._main:
+                self._scheduled.add(index)
+                ready.append(index)
+        return ready
+
+    def _process(self, index):
+        if self.error is not None:
+            return
+        try:
+            main = self._main[index]
+            mic = self._mic.get(index)
+            start = main["start"]
+            end = start + (main["duration"] or 0.0)
+            paths, slides = self._prepare(index, main, mic)
+            files = self._upload(paths)
+            with self._lock:
+                self.parts[index] = {"start": start, "end": end, "files": files, "slides": slides}
+            logger.info(f"Live: segment {index} uploaded ({len(files)} file(s), {end / 60:.1f} min recorded)")
+            self._schedule_maps(final=False)
+        except Exception as e:
+            logger.exception(f"Live: segment {index} failed")
+            self.error = e
+
+    def _prepare(self, index, main, mic):
+        """Как pipeline.prepare_media, но для одного куска; таймкоды слайдов — от начала записи."""
+        raw_paths = [main["path"]] + ([mic["path"]] if mic else [])
+        if self.mode not in ("audio", "slides"):
+            return raw_paths, []
+        try:
+            speech_path = extract_speech_audio(
+                main["path"], mic["path"] if mic else None,
+                out_path=os.path.join(self.work_dir, f"speech_{index:04d}.m4a")
+            )
+            slides = []
+            if self.mode == "slides":
+                slides_dir = os.path.join(self.work_dir, f"slides_{index:04d}")
+                slides = [(p, t + main["start"]) for p, t in extract_slides(main["path"], out_dir=slides_dir)]
+        except MediaError as e:
+            logger.warning(f"{PROCESSING_MODES[self.mode]} mode unavailable for segment {index} ({e}), uploading it as is")
+            return raw_paths, []
+        return [speech_path], slides
+
+    def _upload(self, paths):
+        if self._client is None:
+            self._client, self._base_url = make_client(self.config)
+        # Как в обычной обработке: кэш загруженных файлов, учет, отмена
+        with self.ledger.stage("upload"):
+            return upload_and_wait(
+                self._client, self._base_url, paths, [file_digest(p) for p in paths], self.config,
+                entry=self.ledger, cancel_event=self.cancel_event
+            )
+
+    # --- Окна длинных встреч ---
+
+    def _long_meeting(self):
+        if not self.config.get("map_reduce", True) or not self.parts:
+            return False
+        return max(p["end"] for p in self.parts.values()) > self.window_seconds * 1.5
+
+    def _schedule_maps(self, final):
+        """
+        Как только запись длиннее полутора окон, каждое законченное окно
+        конспектируется в фоне. Последнее окно — только после Stop (final).
+        """
+        with self._lock:
+            if not self._long_meeting():
+                return
+            groups = {}
+            for index in sorted(self.parts):
+                groups.setdefault(int(self.parts[index]["start"] // self.window_seconds), []).append(self.parts[index])
+            last = max(groups)
+            for window, parts in groups.items():
+                if window in self.notes or (window == last and not final):
+                    continue
+                self.notes[window] = self._mapper.submit(self._summarise, window, parts)
+
+    def _summarise(self, window, parts):
+        files = [f for p in parts for f in p["files"]]
+        slides = [s for p in parts for s in p["slides"]]
+        start, end = parts[0]["start"], parts[-1]["end"]
+        with self.ledger.stage("map"):
+            note, tokens = summarise_window(self._client, files, slides, window, start, end, self.config, self.ledger)
+        with self._lock:
+            self.tokens += tokens
+        logger.info(f"Live: window {window + 1} summarised")
+        return start, end, note
+
+    # --- После Stop ---
+
+    def finish(self, job=None, timeout=STOP_TIMEOUT):
+        """Догружает последние куски и генерирует протокол. Возвращает путь к нему."""
+        status = STATUS_FAILED
+        try:
+            report_progress(job, "Завершение записи", 0.05)
+            give_up_at = time.monotonic() + timeout
+            while not self.stopped.wait(0.5):
+                if job is not None:
+                    job.check_cancelled()
+                if time.monotonic() > give_up_at:
+                    raise TimeoutError("Recording did not finish in time")
+
+            with self._lock:
+                ready = self._take_ready(final=True)
+            for index in ready:
+                self._worker.submit(self._process, index)
+            report_progress(job, "Загрузка последнего куска", 0.2)
+            # Поток кусков один: пустая задача выполнится после всех загрузок
+            uploaded = self._worker.submit(lambda: None)
+            while not uploaded.done():
+                if job is not None and job.cancel_event.is_set():
+                    self.cancel_event.set()
+                    job.check_cancelled()
+                time.sleep(0.2)
+            if self.error is not None:
+                raise self.error
+            if not self.parts:
+                raise Exception("Нет загруженных кусков записи")
+
+            self.ledger.set(duration=round(max(p["end"] for p in self.parts.values()), 1))
+            txt_path = os.path.splitext(self.video_path)[0] + "_protocol.txt"
+            meeting_date = get_meeting_date(self.video_path)
+            writer = ProtocolWriter(txt_path)
+            try:
+                if self._long_meeting():
+                    self._schedule_maps(final=True)
+                    report_progress(job, f"Конспект окон ({len(self.notes)})", 0.4)
+                    windows = [self.notes[w].result() for w in sorted(self.notes)]
+                    with self.ledger.stage("reduce"):
+                        protocol_text, tokens = reduce_notes(
+                            self._client, windows, [note for _, _, note in windows], meeting_date,
+                            self.config, writer, job, progress_range=(0.6, 0.95), entry=self.ledger
+                        )
+                else:
+                    report_progress(job, "Генерация протокола", 0.6)
+                    parts = [self.parts[i] for i in sorted(self.parts)]
+                    files = [f for p in parts for f in p["files"]]
+                    slides = [s for p in parts for s in p["slides"]]
+                    contents = files + build_slide_parts(slides) + [
+                        user_prompt(meeting_date, bool(slides), in_parts=len(parts) > 1)
+                    ]
+                    with self.ledger.stage("generate"):
+                        protocol_text, usage = run_generation(
+                            self._client, contents, self.config, writer, job, entry=self.ledger
+                        )
+                    tokens = (usage.total_token_count or 0) if usage else 0
+            except Exception:
+                writer.abort()
+                raise
+
+            if self.tokens + tokens:
+                ConfigManager.add_token_usage(self.config, self.tokens + tokens)
+            index_protocol(txt_path)
+            logger.info(f"Live: protocol saved to {txt_path} ({len(protocol_text)} chars)")
+            status = STATUS_DONE
+            return txt_path
+        except JobCancelled:
+            status = STATUS_CANCELLED
+            raise
+        finally:
+            self.ledger.finish(status)
+            self.close()
+
+    def close(self):
+        """Останавливает фоновые потоки и убирает рабочий каталог."""
+        self.stopped.set()
+        self.cancel_event.set()
+        self._worker.shutdown(wait=False)
+        self._mapper.shutdown(wait=False)
+        if self._client is not None and not self.config.get("reuse_uploads", False):
+            delete_remote_files(self._client, [f for p in self.parts.values() for f in p["files"]])
+        shutil.rmtree(self.work_dir, ignore_errors=True)
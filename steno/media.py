@@ -0,0 +1,330 @@
+# steno/media.py
+import os
+import re
+import json
+import shutil
+import subprocess
+import logging
+
+logger = logging.getLogger("Steno")
+
+# Внутри .app py2app выставляет RESOURCEPATH (Contents/Resources),
+# при запуске из исходников bin/ лежит в корне репозитория.
+RESOURCE_DIR = os.environ.get("RESOURCEPATH") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_FFMPEG = os.path.join(RESOURCE_DIR, "bin", "ffmpeg")
+
+# Сколько токенов Gemini считает за секунду медиа (по документации API):
+# кадр видео семплируется с частотой 1 fps, звук — 32 токена/сек.
+VIDEO_TOKENS_PER_SECOND = 258
+AUDIO_TOKENS_PER_SECOND = 32
+
+# Картинка ~1024x576 режется моделью на 2 тайла по 258 токенов
+IMAGE_TOKENS_PER_SLIDE = 516
+
+# Речевой профиль: моно, 16 кГц, AAC 32 кбит/с
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_BITRATE = "32k"
+
+# Поиск слайдов: кадр раз в SLIDE_SAMPLE_INTERVAL сек, разностный хеш
+# (dHash) по сетке SLIDE_HASH_SIZE x SLIDE_HASH_SIZE. Новый слайд — если
+# отличается от предыдущего сохраненного больше чем на SLIDE_THRESHOLD бит.
+SLIDE_SAMPLE_INTERVAL = 1.0
+SLIDE_HASH_SIZE = 16
+SLIDE_THRESHOLD = 20
+SLIDE_MAX_COUNT = 150
+SLIDE_MAX_WIDTH = 1024
+SLIDE_JPEG_QUALITY = 6  # шкала ffmpeg -q:v, 2 (лучше) .. 31 (хуже)
+
+
+class MediaError(Exception):
+    pass
+
+
+def find_ffmpeg():
+    """ffmpeg из bin/ рядом с приложением, иначе из PATH."""
+    if os.path.isfile(BUNDLED_FFMPEG) and os.access(BUNDLED_FFMPEG, os.X_OK):
+        return BUNDLED_FFMPEG
+    return shutil.which("ffmpeg")
+
+
+def _run_ffmpeg(args, text=True):
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise MediaError("ffmpeg not found")
+    result = subprocess.run([ffmpeg, "-hide_banner", "-nostdin"] + args, capture_output=True, text=text)
+    return result
+
+
+def probe_media(path):
+    """
+    Длительность и состав потоков файла.
+    ffprobe не поставляется с приложением, поэтому разбираем вывод `ffmpeg -i`.
+    """
+    result = _run_ffmpeg(["-i", path])
+    info = {"duration": 0.0, "has_video": False, "has_audio": False, "audio_streams": 0}
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match:
+        h, m, s = match.groups()
+        info["duration"] = int(h) * 3600 + int(m) * 60 + float(s)
+    info["has_video"] = bool(re.search(r"Stream #\S+.*: Video:", result.stderr))
+    # Запись в одном файле (dual_track) несет две звуковые дорожки: система и микрофон
+    info["audio_streams"] = len(re.findall(r"Stream #\S+.*: Audio:", result.stderr))
+    info["has_audio"] = info["audio_streams"] > 0
+    return info
+
+
+def estimate_media_tokens(duration, video_tracks=0, audio_tracks=0):
+    """Оценка входных токенов за медиа заданной длительности."""
+    per_second = video_tracks * VIDEO_TOKENS_PER_SECOND + audio_tracks * AUDIO_TOKENS_PER_SECOND
+    return int(duration * per_second)
+
+
+def extract_speech_audio(video_path, mic_path=None, out_path=None):
+    """
+    Вынимает звук из основного файла, сводит его с дорожкой микрофона и
+    кодирует в компактный речевой формат (моно, 16 кГц, AAC).
+
+    Результат кладется рядом с записью (<имя>_speech.m4a) и переиспользуется,
+    если он новее исходников.
+    """
+    base_name = os.path.splitext(video_path)[0]
+    out_path = out_path or base_name + "_speech.m4a"
+    sources = [p for p in (video_path, mic_path) if p and os.path.exists(p)]
+
+    if os.path.exists(out_path) and all(os.path.getmtime(out_path) >= os.path.getmtime(p) for p in sources):
+        logger.info(f"Reusing speech audio: {out_path}")
+        return out_path
+
+    inputs = [(p, probe_media(p)["audio_streams"]) for p in sources]
+    inputs = [(p, n) for p, n in inputs if n]
+    if not inputs:
+        raise MediaError("No audio streams to extract")
+
+    args = []
+    for p, _ in inputs:
+        args += ["-i", p]
+    # Все звуковые дорожки всех файлов (у dual_track-записи их две в одном файле)
+    streams = [f"[{i}:a:{j}]" for i, (_, n) in enumerate(inputs) for j in range(n)]
+    if len(streams) > 1:
+        # normalize=0 — не приглушаем каждый источник вдвое, речь и так тихая
+        args += ["-filter_complex", f"{''.join(streams)}amix=inputs={len(streams)}:duration=longest:normalize=0[a]", "-map", "[a]"]
+    else:
+        args += ["-map", "0:a:0"]
+    args += [
+        "-vn", "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE),
+        "-c:a", "aac", "-b:a", SPEECH_BITRATE,
+        "-map_metadata", "-1", "-fflags", "+bitexact",
+        "-y", out_path + ".tmp.m4a",
+    ]
+
+    logger.info(f"Extracting speech audio from {len(inputs)} source(s) -> {out_path}")
+    result = _run_ffmpeg(args)
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+    os.replace(out_path + ".tmp.m4a", out_path)
+    return out_path
+
+
+class SpeechEncoder:
+    """
+    Кодирует речевую дорожку на лету: моно int16 PCM (байты) идет в stdin
+    ffmpeg, на выходе — AAC в речевом профиле. Файл появляется под итоговым
+    именем только после close().
+    """
+
+    def __init__(self, out_path, sample_rate=SPEECH_SAMPLE_RATE, bitrate=SPEECH_BITRATE):
+        ffmpeg = find_ffmpeg()
+        if not ffmpeg:
+            raise MediaError("ffmpeg not found")
+        self.out_path = out_path
+        self.tmp_path = out_path + ".tmp.m4a"
+        self.bytes_in = 0
+        self.process = subprocess.Popen(
+            [ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error",
+             "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "aac", "-b:a", bitrate, "-y", self.tmp_path],
+            stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def write(self, pcm):
+        try:
+            self.process.stdin.write(pcm)
+            self.bytes_in += len(pcm)
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def close(self):
+        """Дожидается ffmpeg. Возвращает путь к файлу или None, если кодирование не удалось."""
+        # communicate закрывает stdin — ffmpeg дописывает файл и выходит
+        _, stderr = self.process.communicate()
+        if self.process.returncode != 0 or not os.path.exists(self.tmp_path):
+            logger.error(f"Speech encoder failed: {stderr.decode(errors='replace').strip()[-200:]}")
+            return None
+        os.replace(self.tmp_path, self.out_path)
+        return self.out_path
+
+
+def _dhash(pixels, size):
+    """Разностный хеш кадра (size+1) x size в оттенках серого."""
+    bits = 0
+    row_len = size + 1
+    for y in range(size):
+        row = pixels[y * row_len:(y + 1) * row_len]
+        for x in range(size):
+            bits = (bits << 1) | (row[x] < row[x + 1])
+    return bits
+
+
+def detect_slide_changes(video_path, interval=SLIDE_SAMPLE_INTERVAL,
+                         hash_size=SLIDE_HASH_SIZE, threshold=SLIDE_THRESHOLD):
+    """
+    Декодирует видео в крошечные серые кадры и возвращает номера кадров
+    (в потоке с шагом interval сек), на которых сменилось изображение.
+    """
+    result = _run_ffmpeg([
+        "-hwaccel", "auto", "-i", video_path,
+        "-an", "-vf", f"fps=1/{interval},scale={hash_size + 1}:{hash_size}:flags=area,format=gray",
+        "-f", "rawvideo", "-",
+    ], text=False)
+    if result.returncode != 0:
+        tail = result.stderr.decode("utf-8", "replace").strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+    return distinct_frames(result.stdout, hash_size, threshold)
+
+
+def distinct_frames(data, hash_size=SLIDE_HASH_SIZE, threshold=SLIDE_THRESHOLD):
+    """
+    Номера кадров (серые (hash_size+1) x hash_size байт подряд в data),
+    отличающихся от предыдущего сохраненного больше чем на threshold бит dHash.
+    """
+    frame_bytes = (hash_size + 1) * hash_size
+    changes = []
+    last_hash = None
+    for n in range(len(data) // frame_bytes):
+        frame_hash = _dhash(data[n * frame_bytes:(n + 1) * frame_bytes], hash_size)
+        if last_hash is None or bin(frame_hash ^ last_hash).count("1") > threshold:
+            changes.append(n)
+            last_hash = frame_hash
+    return changes
+
+
+def extract_slides(video_path, out_dir=None, interval=SLIDE_SAMPLE_INTERVAL, max_count=SLIDE_MAX_COUNT):
+    """
+    Сохраняет различающиеся кадры записи (слайды) как небольшие JPEG.
+    Возвращает список (путь, секунда от начала записи).
+
+    Результат лежит в <имя>_slides/ вместе с slides.json и переиспользуется,
+    пока запись не изменилась.
+    """
+    out_dir = out_dir or os.path.splitext(video_path)[0] + "_slides"
+    manifest_path = os.path.join(out_dir, "slides.json")
+    if os.path.exists(manifest_path) and os.path.getmtime(manifest_path) >= os.path.getmtime(video_path):
+        try:
+            with open(manifest_path, "r") as f:
+                slides = json.load(f)
+            if all(os.path.exists(os.path.join(out_dir, name)) for name, _ in slides):
+                logger.info(f"Reusing {len(slides)} slides from {out_dir}")
+                return [(os.path.join(out_dir, name), seconds) for name, seconds in slides]
+        except: pass
+
+    frames = detect_slide_changes(video_path, interval=interval)
+    if len(frames) > max_count:
+        # Слишком много смен кадра (видео, а не слайды) — прореживаем равномерно
+        step = len(frames) / max_count
+        frames = [frames[int(i * step)] for i in range(max_count)]
+    if not frames:
+        return []
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    # Один проход декодера: select оставляет только нужные кадры
+    select = "+".join(f"eq(n\\,{n})" for n in frames)
+    result = _run_ffmpeg([
+        "-hwaccel", "auto", "-i", video_path, "-an",
+        "-vf", f"fps=1/{interval},select='{select}',scale='min({SLIDE_MAX_WIDTH},iw)':-2",
+        "-fps_mode", "vfr", "-q:v", str(SLIDE_JPEG_QUALITY),
+        os.path.join(out_dir, "slide_%04d.jpg"),
+    ])
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+
+    slides = []
+    for i, n in enumerate(frames):
+        name = f"slide_{i + 1:04d}.jpg"
+        if os.path.exists(os.path.join(out_dir, name)):
+            slides.append((name, n * interval))
+    with open(manifest_path, "w") as f:
+        json.dump(slides, f, indent=4)
+
+    logger.info(f"Extracted {len(slides)} slides from {os.path.basename(video_path)}")
+    return [(os.path.join(out_dir, name), seconds) for name, seconds in slides]
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def split_media(path, window_seconds, out_dir):
+    """
+    Режет файл на окна по window_seconds без перекодирования (-c copy).
+    Возвращает [(путь, начало окна в секундах)]. У видео разрез приходится
+    на ближайший ключевой кадр, поэтому границы окон приблизительные.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    pattern = os.path.join(out_dir, f"{stem}_w%03d{ext}")
+    result = _run_ffmpeg([
+        "-i", path, "-map", "0", "-c", "copy",
+        "-f", "segment", "-segment_time", str(window_seconds), "-reset_timestamps", "1",
+        "-y", pattern,
+    ])
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+
+    segments = []
+    index = 0
+    while os.path.exists(pattern % index):
+        segments.append((pattern % index, index * window_seconds))
+        index += 1
+    return segments
+
+
+def remux_media(path, out_path):
+    """
+    Перепаковка без перекодирования. Чинит фрагментированный MP4, оборванный
+    на середине записи: все целые фрагменты попадают в нормальный файл.
+    """
+    result = _run_ffmpeg(["-i", path, "-map", "0", "-c", "copy", "-y", out_path])
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+    return out_path
+
+
+def concat_media(paths, out_path):
+    """Склейка однотипных кусков (concat demuxer, без перекодирования)."""
+    list_path = out_path + ".concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in paths:
+            escaped = os.path.abspath(p).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    tmp_path = out_path + ".tmp" + os.path.splitext(out_path)[1]
+    try:
+        result = _run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-map", "0", "-c", "copy", "-movflags", "+faststart", "-y", tmp_path,
+        ])
+        if result.returncode != 0:
+            tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+            raise MediaError(f"ffmpeg failed: {tail[0]}")
+        os.replace(tmp_path, out_path)
+    finally:
+        for p in (list_path, tmp_path):
+            if os.path.exists(p):
+                os.remove(p)
+    return out_path
@@ -0,0 +1,533 @@
+# steno/pipeline.py
+import os
+import time
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# google.genai импортируется лениво (в функциях, которые обращаются к API):
+# SDK тяжелый, а подготовка медиа и кэш в нем не нуждаются.
+from steno.config import ConfigManager, PROCESSING_MODES
+from steno.dates import get_meeting_date
+from steno.streaming import ProtocolWriter, generate_streaming, write_atomic
+from steno.uploader import ResumableUploader, wait_for_files_active
+from steno.vad import trim_silence, trim_settings, TIMEMAP_SUFFIX
+from steno.search import index_protocol
+from steno.api import get_client, DEFAULT_RPM, DEFAULT_TPM
+from steno.ledger import LedgerEntry, estimate_job, timed, STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED
+from steno.jobs import JobCancelled
+from steno.cache import DigestMemo, ResultCache, RemoteFileCache, result_key, file_digest
+from steno.media import (
+    MediaError, extract_speech_audio, extract_slides, probe_media,
+    estimate_media_tokens, format_timestamp, split_media, IMAGE_TOKENS_PER_SLIDE
+)
+
+logger = logging.getLogger("Steno")
+
+def has_mic_track(video_path):
+    """Запись в режиме dual_track: микрофон — вторая звуковая дорожка основного файла."""
+    try:
+        return probe_media(video_path)["audio_streams"] > 1
+    except MediaError:
+        return False
+
+
+def source_paths(video_path):
+    """Исходные файлы записи: основное видео и, если есть, дорожка микрофона (имя_файла_mic.m4a)."""
+    mic_audio_path = os.path.splitext(video_path)[0] + "_mic.m4a"
+    return [video_path] + ([mic_audio_path] if os.path.exists(mic_audio_path) else [])
+
+
+def upload_digests(paths, config, memo=None):
+    """
+    Digest файлов для RemoteFileCache — нужен только при reuse_uploads.
+    memo (DigestMemo) — для постоянных файлов; временные (обрезка, окна)
+    хэшируются напрямую: их пути не повторяются, запоминать их незачем.
+    """
+    if not config.get("reuse_uploads", False):
+        return [None] * len(paths)
+    return [memo.digest(p) if memo is not None else file_digest(p) for p in paths]
+
+
+def source_result_key(video_path, config, meeting_date, memo):
+    """
+    Ключ кэша результатов от исходных файлов записи и настроек подготовки:
+    проверяется до prepare_media и trim_silence, попадание не перекодирует запись.
+    """
+    return result_key(
+        [memo.digest(p) for p in source_paths(video_path)],
+        config.get("model_name"), config.get("prompt"), meeting_date,
+        config.get("processing_mode", "audio"), options={"trim": trim_settings(config)}
+    )
+
+
+def prepare_media(video_path, config):
+    """
+    Готовит медиа для отправки в модель. Возвращает (файлы для загрузки, слайды, режим).
+    Режим "video": основное видео + дорожка микрофона (_mic.m4a), как есть.
+    Режим "audio": звук обоих файлов сводится локально в одну речевую дорожку,
+    видео не загружается.
+    Режим "slides": как "audio", плюс уникальные кадры экрана (слайды) с таймкодами.
+    Если подготовить медиа не удалось — откатываемся на видео, режим тогда "video".
+    """
+    # Основное видео + микрофон (M4A)
+    # Файл микрофона должен лежать рядом с именем: имя_файла_mic.m4a
+    mic_audio_path = os.path.splitext(video_path)[0] + "_mic.m4a"
+    original_paths = source_paths(video_path)
+    if len(original_paths) > 1:
+        logger.info(f"Found microphone audio track: {mic_audio_path}")
+    elif has_mic_track(video_path):
+        logger.info("Microphone is a track of the main file (dual-track recording)")
+    else:
+        logger.warning("Microphone audio file not found, processing video only.")
+
+    mode = config.get("processing_mode", "audio")
+    if mode not in ("audio", "slides"):
+        return original_paths, [], "video"
+
+    try:
+        speech_path = extract_speech_audio(video_path, mic_audio_path if len(original_paths) > 1 else None)
+        slides = extract_slides(video_path) if mode == "slides" else []
+    except MediaError as e:
+        logger.warning(f"{PROCESSING_MODES[mode]} mode unavailable ({e}), uploading full video")
+        return original_paths, [], "video"
+
+    # Отчет об экономии относительно загрузки видео
+    original_bytes = sum(os.path.getsize(p) for p in original_paths)
+    sent_bytes = os.path.getsize(speech_path) + sum(os.path.getsize(p) for p, _ in slides)
+    duration = probe_media(speech_path)["duration"]
+    tokens_video = estimate_media_tokens(duration, video_tracks=1, audio_tracks=len(original_paths))
+    tokens_sent = estimate_media_tokens(duration, audio_tracks=1) + len(slides) * IMAGE_TOKENS_PER_SLIDE
+    logger.info(
+        f"{PROCESSING_MODES[mode]} mode: sending {sent_bytes / 1e6:.1f} MB instead of {original_bytes / 1e6:.1f} MB"
+        + (f" ({len(slides)} slides)" if slides else "")
+        + f", ~{tokens_sent} input tokens instead of ~{tokens_video} (saved ~{tokens_video - tokens_sent})"
+    )
+    return [speech_path], slides, mode
+
+def build_slide_parts(slides):
+    """Слайды уходят прямо в запрос (inline), каждый с подписью-таймкодом."""
+    from google.genai import types
+
+    parts = []
+    for i, (path, seconds) in enumerate(slides, 1):
+        with open(path, "rb") as f:
+            data = f.read()
+        parts.append(f"Слайд {i}, время записи {format_timestamp(seconds)}:")
+        parts.append(types.Part.from_bytes(data=data, mime_type="image/jpeg"))
+    return parts
+
+def user_prompt(meeting_date, with_slides=False, in_parts=False):
+    """User Prompt с датой встречи. in_parts — запись приложена последовательными кусками."""
+    if with_slides:
+        text = (
+            "Составь протокол по прикрепленной аудиозаписи встречи. "
+            "Также приложены ключевые кадры экрана (слайды) с таймкодами — используй их содержимое."
+        )
+    else:
+        text = "Составь протокол по прикрепленному файлу."
+    if in_parts:
+        text += " Запись приложена последовательными частями по порядку — это одна встреча."
+    return f"{text}\n\nДата встречи: {meeting_date}"
+
+def report_progress(job, stage, progress=None):
+    """Этап обработки: в задачу очереди (с точкой отмены) или просто в лог."""
+    if job is not None:
+        job.report(stage, progress)
+    else:
+        logger.info(stage)
+
+def make_client(config):
+    """Общий клиент для ключа и base_url из конфига (соединения и лимиты — на все задачи), см. steno/api.py."""
+    base_url = config.get("base_url", "").strip()
+    if base_url and not base_url.startswith(("http://", "https://")):
+        base_url = "https://" + base_url
+
+    client = get_client(
+        config.get("api_key"), base_url,
+        rpm=int(config.get("rate_limit_rpm", DEFAULT_RPM)),
+        tpm=int(config.get("rate_limit_tpm", DEFAULT_TPM))
+    )
+    return client, base_url
+
+def upload_and_wait(client, base_url, paths, digests, config, job=None, entry=None, cancel_event=None):
+    """
+    Загружает файлы и ждет их обработки. Возвращает объекты File по порядку.
+    Уже загруженные файлы (по digest содержимого) берутся из RemoteFileCache,
+    пока не истекли, — смена модели или промпта не требует повторной загрузки.
+    cancel_event прерывает загрузку и ожидание (по умолчанию — отмена job).
+    Загрузка идет мимо SDK, но под лимитами ключа client (client.uploads).
+    """
+    api_key = config.get("api_key")
+
+    # Уже загруженные файлы
+    account = f"{api_key}|{base_url}"
+    reuse_uploads = config.get("reuse_uploads", False)
+    remote_cache = RemoteFileCache()
+    remote_names = [None] * len(paths)
+    if reuse_uploads:
+        for i, digest in enumerate(digests):
+            name = remote_cache.get(account, digest)
+            if not name:
+                continue
+            try:
+                client.files.get(name=name)
+                remote_names[i] = name
+                logger.info(f"Reusing uploaded file {name} for {os.path.basename(paths[i])}")
+            except Exception:
+                remote_cache.forget(account, digest)
+
+    # Загрузка недостающих файлов (параллельно, чанками, с докачкой после сбоя)
+    missing = [i for i, name in enumerate(remote_names) if name is None]
+    if cancel_event is None and job is not None:
+        cancel_event = job.cancel_event
+    if missing:
+        try:
+            uploader = ResumableUploader(
+                api_key, base_url=base_url or None, cancel_event=cancel_event, limiter=client.uploads
+            )
+            remote_files, upload_stats = uploader.upload_all([paths[i] for i in missing])
+        except Exception as upload_err:
+            logger.exception("File upload failed")
+            raise Exception(f"Ошибка загрузки: {upload_err}")
+        for i, remote_file in zip(missing, remote_files):
+            remote_names[i] = remote_file["name"]
+            if reuse_uploads:
+                remote_cache.put(account, digests[i], remote_file["name"], remote_file.get("expirationTime"))
+        if entry is not None:
+            entry.add_upload(upload_stats["sent"], len(missing), reused=len(paths) - len(missing))
+    elif entry is not None:
+        entry.add_upload(0, 0, reused=len(paths))
+
+    # Ожидание процессинга ВСЕХ файлов (одновременно, с backoff)
+    return wait_for_files_active(client, remote_names, cancel_event=cancel_event)
+
+def delete_remote_files(client, remote_files):
+    for uf in remote_files:
+        try:
+            client.files.delete(name=uf.name)
+            logger.info(f"Remote file deleted: {uf.name}")
+        except Exception as delete_err:
+            logger.warning(f"Could not delete remote file: {delete_err}")
+
+def run_generation(client, contents, config, writer, job=None, model=None, progress_range=(0.6, 0.95), entry=None):
+    """
+    Генерация протокола в writer: потоковая (config "streaming") или одним
+    ответом. Возвращает (текст, usage_metadata).
+    """
+    from google.genai import types
+
+    model = model or config.get("model_name")
+    low, high = progress_range
+    gen_config = types.GenerateContentConfig(
+        http_options={"timeout": 600000},
+        system_instruction=config.get("prompt")
+    )
+
+    def on_progress(chars):
+        # Длина протокола заранее неизвестна — прогресс асимптотически к верхней границе
+        report_progress(job, f"Генерация протокола ({chars} симв.)", low + (high - low) * chars / (chars + 3000))
+
+    if config.get("streaming", True):
+        protocol_text, usage, _ = generate_streaming(client, model, contents, gen_config, writer, on_progress=on_progress)
+    else:
+        started = time.monotonic()
+        response = client.models.generate_content(model=model, contents=contents, config=gen_config)
+        writer.finish(response.text)
+        logger.info(f"Generation finished in {time.monotonic() - started:.1f}s")
+        protocol_text, usage = response.text, response.usage_metadata
+    if entry is not None and usage:
+        entry.add_usage(model, usage)
+    return protocol_text, usage
+
+def generate_protocol(files_to_upload_paths, upload_digests, slides, meeting_date, config, txt_path, job=None, entry=None):
+    """
+    Загрузка медиа, ожидание обработки и генерация протокола в txt_path.
+    Возвращает (текст протокола, израсходованные токены).
+    В потоковом режиме (config "streaming") протокол пишется в
+    _protocol.partial.txt по мере генерации и по готовности переименовывается
+    в txt_path; при неустранимом обрыве частичный текст остается в
+    _protocol.partial.txt.
+    Длинные записи (дольше полутора окон map_reduce_window_minutes)
+    обрабатываются по окнам, см. generate_map_reduce.
+    """
+    client, base_url = make_client(config)
+    writer = ProtocolWriter(txt_path)
+
+    window_seconds = int(config.get("map_reduce_window_minutes", 20)) * 60
+    duration = 0.0
+    if config.get("map_reduce", True):
+        try:
+            duration = probe_media(files_to_upload_paths[0])["duration"]
+        except MediaError:
+            pass
+
+    ready_files = []
+    try:
+        if duration > window_seconds * 1.5:
+            return generate_map_reduce(
+                client, base_url, files_to_upload_paths, slides, duration, meeting_date, config, writer, job, entry
+            )
+
+        report_progress(job, f"Загрузка файлов ({len(files_to_upload_paths)})", 0.2)
+        with timed(entry, "upload"):
+            ready_files = upload_and_wait(client, base_url, files_to_upload_paths, upload_digests, config, job, entry)
+
+        # Генерация контента
+        report_progress(job, "Генерация протокола", 0.6)
+        logger.info(f"Generating protocol with model: {config.get('model_name')}")
+
+        # Собираем контент: [File1, File2, ..., Слайды..., UserPrompt]
+        contents = ready_files + build_slide_parts(slides) + [user_prompt(meeting_date, bool(slides))]
+
+        with timed(entry, "generate"):
+            protocol_text, usage = run_generation(client, contents, config, writer, job, entry=entry)
+        return protocol_text, (usage.total_token_count or 0) if usage else 0
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        # Удаление файлов из облака (если не переиспользуем их до истечения срока)
+        if not config.get("reuse_uploads", False):
+            delete_remote_files(client, ready_files)
+
+# --- Длинные встречи: map-reduce по временным окнам ---
+MAP_SYSTEM_PROMPT = (
+    "Ты — ИИ-ассистент, который конспектирует фрагмент длинной встречи. "
+    "Верни только подробные заметки в Markdown, без вступлений."
+)
+MAP_USER_PROMPT = (
+    "Это фрагмент {index} записи встречи (время записи {start}–{end}).\n"
+    "Составь подробные заметки по фрагменту: участники, обсуждавшиеся темы и аргументы, "
+    "принятые решения, задачи (что, кто, срок). Указывай время записи для ключевых моментов. "
+    "Не додумывай то, чего нет во фрагменте."
+)
+REDUCE_USER_PROMPT = (
+    "Выше — заметки по последовательным фрагментам одной встречи. "
+    "Составь по ним единый протокол всей встречи строго по шаблону из инструкции: "
+    "объедини повторы, сохрани все решения и задачи.\n\nДата встречи: {meeting_date}"
+)
+
+def split_into_windows(paths, window_seconds, duration, out_dir):
+    """
+    Режет каждый файл на окна одинаковой длины.
+    Возвращает [(начало, конец, [куски файлов этого окна])].
+    """
+    per_file = [split_media(p, window_seconds, out_dir) for p in paths]
+    count = max(len(segments) for segments in per_file)
+    windows = []
+    for i in range(count):
+        start = i * window_seconds
+        end = min(duration, start + window_seconds)
+        window_paths = [segments[i][0] for segments in per_file if i < len(segments)]
+        windows.append((start, end, window_paths))
+    return windows
+
+def window_slides(slides, windows, index):
+    """
+    Слайды окна index: [начало, конец). Последнему окну — и все после его
+    конца (длительность из ffprobe бывает чуть меньше времени последнего кадра).
+    """
+    start, end = windows[index][:2]
+    last = index == len(windows) - 1
+    return [(p, t) for p, t in slides if start <= t and (t < end or last)]
+
+def summarise_window(client, files, slides, index, start, end, config, entry=None):
+    """
+    Map-шаг: конспект одного окна (загруженные файлы + слайды окна) быстрой
+    моделью map_model. Возвращает (заметки, израсходованные токены).
+    """
+    from google.genai import types
+
+    map_config = types.GenerateContentConfig(
+        http_options={"timeout": 600000},
+        system_instruction=MAP_SYSTEM_PROMPT
+    )
+    prompt = MAP_USER_PROMPT.format(index=index + 1, start=format_timestamp(start), end=format_timestamp(end))
+    model = config.get("map_model") or config.get("model_name")
+    response = client.models.generate_content(
+        model=model,
+        contents=list(files) + build_slide_parts(slides) + [prompt],
+        config=map_config
+    )
+    usage = response.usage_metadata
+    if entry is not None and usage:
+        entry.add_usage(model, usage)
+    return response.text or "", (usage.total_token_count or 0) if usage else 0
+
+def reduce_notes(client, windows, notes, meeting_date, config, writer, job=None, progress_range=(0.7, 0.95), entry=None):
+    """
+    Reduce-шаг: заметки окон (windows — [(начало, конец, ...)]) сводятся
+    основной моделью в протокол. Возвращает (текст протокола, токены).
+    """
+    report_progress(job, "Сведение протокола", progress_range[0])
+    joined = "\n\n".join(
+        f"### Фрагмент {i + 1} ({format_timestamp(window[0])}–{format_timestamp(window[1])})\n\n{note.strip()}"
+        for i, (window, note) in enumerate(zip(windows, notes))
+    )
+    contents = [joined, REDUCE_USER_PROMPT.format(meeting_date=meeting_date)]
+    protocol_text, usage = run_generation(client, contents, config, writer, job, progress_range=progress_range, entry=entry)
+    return protocol_text, (usage.total_token_count or 0) if usage else 0
+
+def generate_map_reduce(client, base_url, paths, slides, duration, meeting_date, config, writer, job=None, entry=None):
+    """
+    Map: окна записи параллельно (не больше map_reduce_concurrency одновременно)
+    загружаются и конспектируются быстрой моделью (map_model).
+    Reduce: заметки всех окон сводятся основной моделью в протокол по шаблону
+    из системного промпта. Время обработки определяется длиной одного окна,
+    а не всей встречи. Возвращает (текст протокола, израсходованные токены).
+    """
+    window_seconds = int(config.get("map_reduce_window_minutes", 20)) * 60
+    concurrency = max(1, int(config.get("map_reduce_concurrency", 4)))
+    reuse_uploads = config.get("reuse_uploads", False)
+
+    with tempfile.TemporaryDirectory(prefix="steno_windows_") as tmp_dir:
+        report_progress(job, "Разбиение записи на окна", 0.15)
+        windows = split_into_windows(paths, window_seconds, duration, tmp_dir)
+        total = len(windows)
+        logger.info(
+            f"Map-reduce: {total} windows of {window_seconds // 60} min, {concurrency} at a time, "
+            f"map model {config.get('map_model') or config.get('model_name')}"
+        )
+
+        lock = threading.Lock()
+        progress = {"done": 0, "tokens": 0}
+
+        def summarise(index):
+            start, end, window_paths = windows[index]
+            if job is not None:
+                job.check_cancelled()
+            with timed(entry, "upload"):
+                files = upload_and_wait(client, base_url, window_paths, upload_digests(window_paths, config), config, job, entry)
+            try:
+                with timed(entry, "map"):
+                    note, tokens = summarise_window(
+                        client, files, window_slides(slides, windows, index), index, start, end, config, entry
+                    )
+            finally:
+                if not reuse_uploads:
+                    delete_remote_files(client, files)
+            with lock:
+                progress["done"] += 1
+                progress["tokens"] += tokens
+                done = progress["done"]
+            report_progress(job, f"Конспект окон {done}/{total}", 0.2 + 0.5 * done / total)
+            return note
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, total)) as pool:
+            notes = list(pool.map(summarise, range(total)))
+
+    with timed(entry, "reduce"):
+        protocol_text, tokens = reduce_notes(client, windows, notes, meeting_date, config, writer, job, entry=entry)
+    return protocol_text, progress["tokens"] + tokens
+
+# --- Воркер ИИ (ОБНОВЛЕННЫЙ ПОД ДВА ФАЙЛА) ---
+def process_video_with_ai(video_path, config, job=None):
+    """
+    Полный цикл обработки одной записи. Возвращает путь к протоколу.
+    Ошибки пробрасываются вызывающему (очереди задач), UI здесь не трогаем.
+    """
+    logger.info(f"Starting AI processing logic for: {video_path}")
+
+    if not config.get("api_key"):
+        raise Exception("Нет API ключа")
+
+    # Учет токенов и времени этапов (steno/ledger.py)
+    entry = LedgerEntry(video_path, config, job_id=job.id if job is not None else None)
+    try:
+        txt_path = _process_video(video_path, config, job, entry)
+    except JobCancelled:
+        entry.finish(STATUS_CANCELLED)
+        raise
+    except Exception:
+        entry.finish(STATUS_FAILED)
+        raise
+    entry.finish(STATUS_DONE)
+    return txt_path
+
+
+def _process_video(video_path, config, job, entry):
+    base_name = os.path.splitext(video_path)[0]
+    txt_path = base_name + "_protocol.txt"
+    # Дата встречи для User Prompt
+    meeting_date = get_meeting_date(video_path)
+
+    # 1. Кэш результатов: та же запись + настройки + модель + промпт + дата -> готовый протокол.
+    # Проверяется до подготовки и обрезки — попадание не перекодирует запись
+    report_progress(job, "Проверка кэша", 0.05)
+    digests = DigestMemo()
+    cache_key = source_result_key(video_path, config, meeting_date, digests)
+    result_cache = ResultCache(max_bytes=int(config.get("cache_max_mb", 50)) * 1024 * 1024)
+    protocol_text = result_cache.get(cache_key)
+    if protocol_text is not None:
+        logger.info(f"Result cache hit ({cache_key[:12]}), skipping preparation, upload and generation")
+        entry.set(cached_result=True)
+        return save_protocol(txt_path, protocol_text, job)
+
+    # 2. Определяем файлы для загрузки
+    report_progress(job, "Подготовка медиа", 0.08)
+    with entry.stage("prepare"):
+        files_to_upload_paths, slides, mode = prepare_media(video_path, config)
+
+    with tempfile.TemporaryDirectory(prefix="steno_trim_") as trim_dir:
+        # Длинные паузы вырезаются; таймкоды протокола переводятся обратно во время записи
+        time_map = None
+        if config.get("trim_silence", True):
+            report_progress(job, "Поиск тишины", 0.1)
+            with entry.stage("trim"):
+                files_to_upload_paths, time_map = trim_silence(files_to_upload_paths, trim_dir, config)
+        if time_map is not None:
+            slides = [(p, time_map.to_trimmed(t)) for p, t in slides]
+        preflight_estimate(files_to_upload_paths, mode, time_map, config, entry)
+
+        # 3. Загрузка и генерация
+        protocol_text, total_tokens = generate_protocol(
+            files_to_upload_paths,
+            upload_digests(files_to_upload_paths, config, memo=digests if time_map is None else None),
+            slides, meeting_date, config, txt_path, job, entry
+        )
+
+    # --- Token Usage Tracking ---
+    if total_tokens:
+        ConfigManager.add_token_usage(config, total_tokens)
+    # ----------------------------
+
+    # Соответствие времени — рядом с протоколом; от прошлой обработки с обрезкой не остается
+    timemap_path = base_name + TIMEMAP_SUFFIX
+    if time_map is not None:
+        protocol_text = time_map.rewrite_timestamps(protocol_text)
+        time_map.save(timemap_path)
+    elif os.path.exists(timemap_path):
+        os.remove(timemap_path)
+    result_cache.put(cache_key, protocol_text)
+    return save_protocol(txt_path, protocol_text, job)
+
+
+def preflight_estimate(paths, mode, time_map, config, entry):
+    """
+    Оценка токенов и стоимости до загрузки — в лог и в учет задачи.
+    mode — режим из prepare_media: подготовка могла откатиться на видео,
+    а после trim_silence paths — уже временные файлы без пауз.
+    """
+    try:
+        duration = time_map.trimmed_duration if time_map is not None else probe_media(paths[0])["duration"]
+    except MediaError:
+        return
+    estimate = estimate_job(duration, mode, config.get("model_name"), config, audio_tracks=len(paths))
+    entry.set(duration=round(duration, 1), mode=mode, estimate=estimate)
+    logger.info(
+        f"Pre-flight estimate: ~{estimate['input_tokens']} input / ~{estimate['output_tokens']} output tokens"
+        + (f", ~${estimate['cost']:.3f}" if estimate["cost"] is not None else "")
+        + (" (map-reduce)" if estimate["map_reduce"] else "")
+    )
+
+
+def save_protocol(txt_path, protocol_text, job=None):
+    """Протокол — в файл рядом с записью и в поисковый индекс."""
+    report_progress(job, "Сохранение протокола", 0.95)
+    write_atomic(txt_path, protocol_text)
+    index_protocol(txt_path)
+
+    logger.info(f"Protocol saved to: {txt_path}")
+    return txt_path
@@ -0,0 +1,428 @@
+# steno/search.py
+"""
+Полнотекстовый поиск по протоколам.
+
+    python -m steno ~/Movies/ScreenRecordings --search "бюджет на рекламу"
+    python -m steno ~/Movies/ScreenRecordings --search "Иван" --items action
+
+Протоколы индексируются в SQLite (~/.recorder_app_search.db, FTS5):
+текст целиком и отдельными строками — решения (раздел «Принятые решения»)
+и задачи из таблицы «План действий» (задача, ответственный, срок).
+Пайплайн добавляет протокол в индекс сразу после записи, backfill
+догоняет папку (старые протоколы, правки руками, удаления) — перечитываются
+только файлы с изменившимися размером или mtime.
+
+Без FTS5 в сборке SQLite поиск работает через LIKE — медленнее, но работает.
+"""
+import os
+import re
+import sqlite3
+import threading
+import logging
+
+from steno.index import classify, PROTOCOL, PROTOCOL_SUFFIX
+
+logger = logging.getLogger("Steno")
+
+SEARCH_DB = os.path.expanduser("~/.recorder_app_search.db")
+SCHEMA_VERSION = 1
+
+DECISION = "decision"
+ACTION = "action"
+
+# Заголовки разделов протокола (шаблон промпта в steno/config.py) и колонки таблицы задач
+DECISION_HEADINGS = ("решени", "decision")
+ACTION_HEADINGS = ("действ", "action", "задач")
+ACTION_COLUMNS = {
+    "task": ("задач", "task", "action", "что"),
+    "owner": ("ответствен", "owner", "responsible", "исполнит", "assignee", "кто"),
+    "due": ("срок", "due", "deadline", "дедлайн", "когда"),
+}
+
+SNIPPET_TOKENS = 12
+
+
+# --- Разбор протокола ---
+
+def _split_row(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _is_separator(cells):
+    return all(re.fullmatch(r":?-{2,}:?", cell.replace(" ", "")) for cell in cells if cell)
+
+
+def _clean(text):
+    """Markdown-разметка внутри ячейки/пункта не нужна ни в поиске, ни в выдаче."""
+    text = re.sub(r"\*\*|__|`", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _column_roles(header):
+    roles = {}
+    for i, cell in enumerate(header):
+        name = cell.lower()
+        for role, keys in ACTION_COLUMNS.items():
+            if role not in roles and any(key in name for key in keys):
+                roles[role] = i
+                break
+    # Таблица без узнаваемых заголовков: задача, ответственный, срок по порядку
+    for position, role in enumerate(("task", "owner", "due")):
+        if role not in roles and position < len(header) and position not in roles.values():
+            roles[role] = position
+    return roles
+
+
+def _table_row(result, section, header, cells):
+    cells = [_clean(cell) for cell in cells]
+    if section == DECISION:
+        if cells and cells[0]:
+            result["decisions"].append(cells[0])
+        return
+    roles = _column_roles(header)
+    row = {role: cells[i] if i < len(cells) else "" for role, i in roles.items()}
+    if row.get("task"):
+        result["actions"].append({
+            "task": row["task"],
+            "owner": "" if row.get("owner") == "-" else row.get("owner", ""),
+            "due": "" if row.get("due") == "-" else row.get("due", ""),
+        })
+
+
+def _looks_like_header(cells):
+    keys = [key for keys in ACTION_COLUMNS.values() for key in keys] + list(DECISION_HEADINGS)
+    return any(key in cell.lower() for cell in cells for key in keys)
+
+
+def parse_protocol(text):
+    """
+    Структура протокола: title, date, participants, decisions (строки)
+    и actions ({"task", "owner", "due"}). Разделы ищутся по заголовкам ##,
+    решения — пункты списка или строки таблицы, задачи — строки таблицы.
+    Первая строка таблицы — заголовок, только если за ней идет разделитель |---|.
+    """
+    result = {"title": "", "date": "", "participants": "", "decisions": [], "actions": []}
+    section = None
+    header = None
+    # Первая строка таблицы, пока не ясно, заголовок ли она
+    pending = None
+
+    def flush():
+        # Таблица из одной строки без разделителя — данные, если это не заголовок
+        if pending is not None and not _looks_like_header(pending):
+            _table_row(result, section, [""] * len(pending), pending)
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if pending is not None and not stripped.startswith("|"):
+            flush()
+            pending = None
+        heading = re.match(r"(#{1,6})\s+(.*)", stripped)
+        if heading:
+            title = _clean(heading.group(2))
+            if len(heading.group(1)) == 1 and not result["title"]:
+                # "# Протокол встречи: Тема" -> "Тема"
+                result["title"] = title.split(":", 1)[1].strip() if ":" in title else title
+            lower = title.lower()
+            if any(key in lower for key in DECISION_HEADINGS):
+                section = DECISION
+            elif any(key in lower for key in ACTION_HEADINGS):
+                section = ACTION
+            else:
+                section = None
+            header = None
+            continue
+
+        field = re.match(r"\*\*(.+?):?\*\*:?\s*(.*)", stripped)
+        if field and section is None:
+            name = field.group(1).lower()
+            if name.startswith(("дата", "date")) and not result["date"]:
+                result["date"] = _clean(field.group(2))
+            elif name.startswith(("участник", "participant")) and not result["participants"]:
+                result["participants"] = _clean(field.group(2))
+            continue
+
+        if section is None or not stripped:
+            continue
+        if stripped.startswith("|"):
+            cells = _split_row(stripped)
+            if _is_separator(cells):
+                if pending is not None:
+                    header, pending = pending, None
+                continue
+            if header is None and pending is None:
+                pending = cells
+                continue
+            if pending is not None:
+                # Разделителя нет — таблица без заголовка: колонки по порядку, первая строка — тоже данные
+                header = [""] * len(pending)
+                _table_row(result, section, header, pending)
+                pending = None
+            _table_row(result, section, header, cells)
+            continue
+        header = None
+        bullet = re.match(r"(?:[*\-+]|\d+[.)])\s+(.*)", stripped)
+        if bullet and section == DECISION:
+            item = _clean(bullet.group(1))
+            if item:
+                result["decisions"].append(item)
+    flush()
+    return result
+
+
+def fts_query(text):
+    """Запрос пользователя -> запрос FTS5: все слова, каждое как префикс (падежи, окончания)."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# --- Индекс ---
+
+class ProtocolSearch:
+    """
+    Индекс протоколов в SQLite. Один объект можно использовать из разных
+    потоков (запросы сериализуются); разные процессы работают с базой через
+    блокировки SQLite.
+    """
+
+    def __init__(self, path=SEARCH_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # lower() в SQLite складывает только ASCII — для запасного LIKE по-русски нужен свой
+        self.db.create_function("py_lower", 1, lambda value: value.lower() if value else value, deterministic=True)
+        self.has_fts = self._has_fts5()
+        self._create()
+
+    def _has_fts5(self):
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)")
+            self.db.execute("DROP TABLE temp.fts5_probe")
+            return True
+        except sqlite3.OperationalError:
+            logger.info("SQLite has no FTS5, protocol search falls back to LIKE")
+            return False
+
+    def _create(self):
+        with self._lock, self.db:
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, SCHEMA_VERSION):
+                # Индекс — производные данные: при смене схемы строится заново
+                for table in ("protocols", "items", "protocols_fts", "items_fts"):
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS protocols ("
+                "id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, name TEXT, title TEXT, "
+                "meeting_date TEXT, participants TEXT, body TEXT, size INTEGER, mtime REAL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "id INTEGER PRIMARY KEY, protocol_id INTEGER NOT NULL, kind TEXT NOT NULL, "
+                "position INTEGER, text TEXT, owner TEXT, due TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS items_protocol ON items(protocol_id)")
+            if self.has_fts:
+                # unicode61 складывает регистр кириллицы, remove_diacritics — ё/е и латиницу с акцентами
+                tokenizer = "tokenize='unicode61 remove_diacritics 2'"
+                self.db.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS protocols_fts USING fts5("
+                    f"title, participants, body, content='protocols', content_rowid='id', {tokenizer})"
+                )
+                self.db.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+                    f"text, owner, content='items', content_rowid='id', {tokenizer})"
+                )
+            self.db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    # --- Запись ---
+
+    def _delete(self, protocol_id):
+        """Под self._lock, внутри транзакции."""
+        if self.has_fts:
+            # Внешний контент: из FTS удаляем, передавая старые значения колонок
+            self.db.execute(
+                "INSERT INTO items_fts(items_fts, rowid, text, owner) "
+                "SELECT 'delete', id, text, owner FROM items WHERE protocol_id=?", (protocol_id,)
+            )
+            self.db.execute(
+                "INSERT INTO protocols_fts(protocols_fts, rowid, title, participants, body) "
+                "SELECT 'delete', id, title, participants, body FROM protocols WHERE id=?", (protocol_id,)
+            )
+        self.db.execute("DELETE FROM items WHERE protocol_id=?", (protocol_id,))
+        self.db.execute("DELETE FROM protocols WHERE id=?", (protocol_id,))
+
+    def index_file(self, path, force=False):
+        """Индексирует протокол, если он новый или изменился. Возвращает True, если перечитан."""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+            with self._lock:
+                row = self.db.execute("SELECT id, size, mtime FROM protocols WHERE path=?", (path,)).fetchone()
+            if not force and row is not None and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+                return False
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError as e:
+            logger.warning(f"Cannot index protocol {path}: {e}")
+            return False
+
+        parsed = parse_protocol(text)
+        with self._lock, self.db:
+            old = self.db.execute("SELECT id FROM protocols WHERE path=?", (path,)).fetchone()
+            if old is not None:
+                self._delete(old["id"])
+            cursor = self.db.execute(
+                "INSERT INTO protocols(path, name, title, meeting_date, participants, body, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, os.path.basename(path), parsed["title"], parsed["date"], parsed["participants"],
+                 text, st.st_size, st.st_mtime)
+            )
+            protocol_id = cursor.lastrowid
+            rows = [(protocol_id, DECISION, i, text_, "", "") for i, text_ in enumerate(parsed["decisions"])]
+            rows += [(protocol_id, ACTION, i, a["task"], a["owner"], a["due"]) for i, a in enumerate(parsed["actions"])]
+            self.db.executemany(
+                "INSERT INTO items(protocol_id, kind, position, text, owner, due) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            if self.has_fts:
+                self.db.execute(
+                    "INSERT INTO protocols_fts(rowid, title, participants, body) "
+                    "SELECT id, title, participants, body FROM protocols WHERE id=?", (protocol_id,)
+                )
+                self.db.execute(
+                    "INSERT INTO items_fts(rowid, text, owner) "
+                    "SELECT id, text, owner FROM items WHERE protocol_id=?", (protocol_id,)
+                )
+        return True
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._lock, self.db:
+            row = self.db.execute("SELECT id FROM protocols WHERE path=?", (path,)).fetchone()
+            if row is not None:
+                self._delete(row["id"])
+
+    def backfill(self, folder):
+        """Сверяет индекс с папкой. Возвращает (перечитано, удалено из индекса)."""
+        folder = os.path.abspath(folder)
+        present = set()
+        indexed = 0
+        if os.path.isdir(folder):
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if classify(entry.name) != PROTOCOL:
+                        continue
+                    present.add(entry.path)
+                    if self.index_file(entry.path):
+                        indexed += 1
+        with self._lock:
+            known = [row["path"] for row in self.db.execute(
+                "SELECT path FROM protocols WHERE path LIKE ? ESCAPE '\\'",
+                (folder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%",)
+            )]
+        # Только файлы прямо в папке: вложенные каталоги индексируются своим backfill
+        stale = [p for p in known if os.path.dirname(p) == folder and p not in present]
+        for path in stale:
+            self.remove(path)
+        if indexed or stale:
+            logger.info(f"Protocol search index: {indexed} indexed, {len(stale)} removed ({folder})")
+        return indexed, len(stale)
+
+    # --- Запросы ---
+
+    def search(self, query, limit=20):
+        """
+        Протоколы по запросу, лучшие первыми:
+        [{"path", "name", "title", "date", "snippet"}].
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            if self.has_fts:
+                rows = self.db.execute(
+                    "SELECT p.path, p.name, p.title, p.meeting_date, "
+                    f"snippet(protocols_fts, 2, '[', ']', '…', {SNIPPET_TOKENS}) AS snippet "
+                    "FROM protocols_fts JOIN protocols p ON p.id = protocols_fts.rowid "
+                    "WHERE protocols_fts MATCH ? "
+                    # Совпадение в теме весит больше, чем в тексте
+                    "ORDER BY bm25(protocols_fts, 10.0, 5.0, 1.0) LIMIT ?",
+                    (match, limit)
+                ).fetchall()
+            else:
+                rows = self._like(
+                    "SELECT path, name, title, meeting_date, substr(body, 1, 120) AS snippet FROM protocols",
+                    ("title", "participants", "body"), query, "ORDER BY mtime DESC", limit
+                )
+        return [
+            {"path": r["path"], "name": r["name"], "title": r["title"], "date": r["meeting_date"],
+             "snippet": re.sub(r"\s+", " ", r["snippet"] or "").strip()}
+            for r in rows
+        ]
+
+    def items(self, query="", kind=None, limit=50):
+        """
+        Решения и задачи по запросу (текст или ответственный), новые протоколы первыми:
+        [{"kind", "text", "owner", "due", "path", "title", "date"}].
+        """
+        params = []
+        where = []
+        if kind:
+            where.append("i.kind = ?")
+            params.append(kind)
+        select = (
+            "SELECT i.kind, i.text, i.owner, i.due, p.path, p.title, p.meeting_date "
+            "FROM items i JOIN protocols p ON p.id = i.protocol_id"
+        )
+        with self._lock:
+            match = fts_query(query)
+            if match and self.has_fts:
+                where.append("i.id IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)")
+                params.append(match)
+            elif match:
+                words = re.findall(r"\w+", query.lower())
+                where += ["(py_lower(i.text) LIKE ? OR py_lower(i.owner) LIKE ?)"] * len(words)
+                for word in words:
+                    params += [f"%{word}%", f"%{word}%"]
+            sql = select + (" WHERE " + " AND ".join(where) if where else "")
+            rows = self.db.execute(sql + " ORDER BY p.mtime DESC, i.kind, i.position LIMIT ?", params + [limit]).fetchall()
+        return [
+            {"kind": r["kind"], "text": r["text"], "owner": r["owner"], "due": r["due"],
+             "path": r["path"], "title": r["title"], "date": r["meeting_date"]}
+            for r in rows
+        ]
+
+    def _like(self, select, columns, query, order, limit):
+        """Запасной поиск без FTS5 (под self._lock): каждое слово — в любой из колонок."""
+        words = re.findall(r"\w+", query.lower())
+        clause = " OR ".join(f"py_lower({c}) LIKE ?" for c in columns)
+        params = [f"%{word}%" for word in words for _ in columns]
+        sql = f"{select} WHERE " + " AND ".join(f"({clause})" for _ in words) + f" {order} LIMIT ?"
+        return self.db.execute(sql, params + [limit]).fetchall()
+
+
+def index_protocol(path, db_path=SEARCH_DB):
+    """Добавляет один протокол в индекс (после записи пайплайном); сбой индекса не роняет обработку."""
+    if not path.endswith(PROTOCOL_SUFFIX):
+        return
+    try:
+        search = ProtocolSearch(db_path)
+        try:
+            search.index_file(path, force=True)
+        finally:
+            search.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Protocol search index update failed: {e}")
+
+
+def format_item(item):
+    """Строка решения/задачи для вывода в консоль и меню."""
+    if item["kind"] == ACTION:
+        extra = ", ".join(x for x in (item["owner"], item["due"]) if x)
+        return f"{item['text']}" + (f" ({extra})" if extra else "")
+    return item["text"]
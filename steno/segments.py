@@ -0,0 +1,292 @@
+# steno/segments.py
+"""
+Запись кусками (сегментами).
+
+Рекордер каждые segment_seconds закрывает текущие файлы и открывает новые,
+поэтому при падении, отключении питания или kill теряется не вся встреча,
+а максимум последний незакрытый кусок (да и тот обычно чинится: писатели
+пишут фрагментированный MP4). Куски лежат в каталоге <запись>.segments/
+рядом с итоговым файлом, их список — в manifest.json там же.
+
+После остановки куски склеиваются (без перекодирования) в обычные
+Meet_....mp4 и Meet_..._mic.m4a, каталог удаляется. Если склейки не было
+(приложение упало), recover_recording делает то же самое для того, что
+успело записаться.
+
+Модуль не зависит от macOS: состояние — обычный JSON, время — секунды PTS.
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import logging
+
+from steno.media import MediaError, concat_media, probe_media, remux_media
+
+logger = logging.getLogger("Steno")
+
+SEGMENT_SECONDS = 300
+SEGMENTS_SUFFIX = ".segments"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+SEGMENT_RECORDING = "recording"
+SEGMENT_COMPLETE = "complete"
+SEGMENT_FAILED = "failed"
+
+
+def segments_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + SEGMENTS_SUFFIX
+
+
+class SegmentClock:
+    """
+    Когда резать дорожку на следующий кусок. Время — PTS в секундах,
+    граница — первый кадр, пришедший не раньше segment_seconds от начала куска.
+    """
+
+    def __init__(self, segment_seconds=SEGMENT_SECONDS):
+        self.segment_seconds = segment_seconds
+        self.index = 0
+        self.origin = None
+        self.segment_start = None
+        self.last_pts = None
+
+    @property
+    def started(self):
+        return self.segment_start is not None
+
+    def start(self, pts):
+        self.origin = pts
+        self.segment_start = pts
+        self.last_pts = pts
+
+    def tick(self, pts):
+        """Запоминает PTS кадра. True — этот кадр уже должен идти в новый кусок."""
+        if self.segment_start is None:
+            self.start(pts)
+            return False
+        self.last_pts = max(self.last_pts, pts)
+        return self.segment_seconds > 0 and pts - self.segment_start >= self.segment_seconds
+
+    def rotate(self, pts):
+        """Закрывает текущий кусок на pts. Возвращает (индекс, длительность) закрытого."""
+        closed = (self.index, pts - self.segment_start)
+        self.index += 1
+        self.segment_start = pts
+        return closed
+
+    def elapsed(self):
+        """Длительность текущего куска по последнему кадру."""
+        return self.last_pts - self.segment_start
+
+
+class SegmentManifest:
+    """
+    Список кусков записи. Сохраняется атомарно после каждого изменения,
+    поэтому после падения на диске всегда согласованное состояние.
+
+    outputs — итоговые файлы по дорожкам, например
+    {"main": ".../Meet_x.mp4", "mic": ".../Meet_x_mic.m4a"}.
+    on_segment(entry) вызывается, когда кусок закрыт и готов к обработке.
+    """
+
+    def __init__(self, directory, outputs=None, segment_seconds=SEGMENT_SECONDS, on_segment=None):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.on_segment = on_segment
+        self._lock = threading.Lock()
+        self.data = {
+            "version": MANIFEST_VERSION,
+            "created": time.time(),
+            "segment_seconds": segment_seconds,
+            "outputs": dict(outputs or {}),
+            "stopped": False,
+            "stitched": False,
+            "segments": [],
+        }
+
+    @classmethod
+    def create(cls, outputs, segment_seconds=SEGMENT_SECONDS, on_segment=None):
+        """Новый манифест в каталоге кусков рядом с основным файлом (outputs["main"])."""
+        directory = segments_dir_for(outputs["main"])
+        if os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        manifest = cls(directory, outputs, segment_seconds, on_segment)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        """Принимает путь к manifest.json или к каталогу кусков."""
+        if os.path.isdir(path):
+            path = os.path.join(path, MANIFEST_NAME)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        manifest = cls(os.path.dirname(path))
+        manifest.data = data
+        return manifest
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def outputs(self):
+        return self.data["outputs"]
+
+    @property
+    def stopped(self):
+        return self.data["stopped"]
+
+    def segment_path(self, track, index, ext):
+        return os.path.join(self.directory, f"{track}_{index:04d}{ext}")
+
+    def _find(self, track, index):
+        for entry in self.data["segments"]:
+            if entry["track"] == track and entry["index"] == index:
+                return entry
+        return None
+
+    def open_segment(self, track, index, path, start=0.0):
+        with self._lock:
+            self.data["segments"].append({
+                "track": track,
+                "index": index,
+                "file": os.path.basename(path),
+                "start": round(start, 3),
+                "duration": None,
+                "status": SEGMENT_RECORDING,
+            })
+            self.save()
+
+    def close_segment(self, track, index, duration, ok=True):
+        with self._lock:
+            entry = self._find(track, index)
+            if entry is None:
+                return None
+            entry["duration"] = round(max(duration, 0.0), 3)
+            entry["status"] = SEGMENT_COMPLETE if ok else SEGMENT_FAILED
+            self.save()
+            entry = dict(entry, path=os.path.join(self.directory, entry["file"]))
+        if ok and self.on_segment:
+            try:
+                self.on_segment(entry)
+            except Exception:
+                logger.exception("Segment listener failed")
+        return entry
+
+    def mark_stopped(self):
+        with self._lock:
+            self.data["stopped"] = True
+            self.save()
+
+    def mark_stitched(self):
+        with self._lock:
+            self.data["stitched"] = True
+            self.save()
+
+    def segments(self, track=None, status=None):
+        """Куски по порядку, с абсолютными путями в поле path."""
+        with self._lock:
+            entries = [
+                dict(e, path=os.path.join(self.directory, e["file"]))
+                for e in self.data["segments"]
+                if (track is None or e["track"] == track) and (status is None or e["status"] == status)
+            ]
+        return sorted(entries, key=lambda e: (e["track"], e["index"]))
+
+    def all_closed(self):
+        with self._lock:
+            return all(e["status"] != SEGMENT_RECORDING for e in self.data["segments"])
+
+    def is_finished(self):
+        """Остановлена и все писатели закрыты — можно склеивать."""
+        return self.stopped and self.all_closed()
+
+
+def _usable(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    try:
+        return probe_media(path)["duration"] > 0
+    except MediaError:
+        return False
+
+
+def stitch_segments(manifest, keep_segments=False, repair=False):
+    """
+    Склеивает куски каждой дорожки в итоговый файл из manifest.outputs.
+    repair=True — еще и чинит незакрытые куски (после падения) перепаковкой.
+    Возвращает {дорожка: путь} для дорожек, которые удалось собрать.
+    """
+    results = {}
+    failed = False
+    for track, out_path in manifest.outputs.items():
+        parts = []
+        for entry in manifest.segments(track):
+            path = entry["path"]
+            if entry["status"] != SEGMENT_COMPLETE:
+                if not repair:
+                    continue
+                repaired = os.path.splitext(path)[0] + "_repaired" + os.path.splitext(path)[1]
+                try:
+                    path = remux_media(path, repaired)
+                    logger.info(f"Repaired unfinished segment {entry['file']}")
+                except MediaError as e:
+                    logger.warning(f"Segment {entry['file']} is not recoverable: {e}")
+                    continue
+            if _usable(path):
+                parts.append(path)
+            else:
+                logger.warning(f"Skipping empty or unreadable segment {entry['file']}")
+
+        if not parts:
+            logger.warning(f"No usable segments for track {track}")
+            continue
+        try:
+            if len(parts) == 1:
+                shutil.copyfile(parts[0], out_path + ".tmp")
+                os.replace(out_path + ".tmp", out_path)
+            else:
+                concat_media(parts, out_path)
+            results[track] = out_path
+            logger.info(f"Stitched {len(parts)} segment(s) of {track} -> {out_path}")
+        except (MediaError, OSError) as e:
+            failed = True
+            logger.error(f"Stitching {track} failed: {e}")
+
+    if results and not failed:
+        manifest.mark_stitched()
+        if not keep_segments:
+            shutil.rmtree(manifest.directory, ignore_errors=True)
+    return results
+
+
+def find_unfinished(save_dir):
+    """Каталоги кусков, которые так и не склеились (запись оборвалась)."""
+    if not os.path.isdir(save_dir):
+        return []
+    found = []
+    for name in sorted(os.listdir(save_dir)):
+        path = os.path.join(save_dir, name)
+        if name.endswith(SEGMENTS_SUFFIX) and os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            found.append(path)
+    return found
+
+
+def recover_recording(path, keep_segments=False):
+    """
+    Восстановление после падения: чинит и склеивает все, что успело
+    записаться. path — каталог кусков или его manifest.json.
+    Возвращает {дорожка: путь}.
+    """
+    manifest = SegmentManifest.load(path)
+    if manifest.data.get("stitched"):
+        return {track: p for track, p in manifest.outputs.items() if os.path.exists(p)}
+    logger.info(f"Recovering recording from {manifest.directory}")
+    return stitch_segments(manifest, keep_segments=keep_segments, repair=True)
@@ -0,0 +1,155 @@
+# steno/streaming.py
+import os
+import time
+import logging
+
+logger = logging.getLogger("Steno")
+
+# Как часто переписывать протокол на диске во время генерации
+WRITE_INTERVAL = 0.5
+# Сколько раз пытаемся продолжить генерацию после обрыва соединения
+MAX_CONTINUATIONS = 2
+
+CONTINUE_PROMPT = (
+    "Генерация протокола оборвалась. Продолжи ответ ровно с того места, где он "
+    "закончился, без повторения уже написанного текста и без пояснений."
+)
+PARTIAL_NOTE = "\n\n_(Протокол не завершен: генерация прервалась.)_\n"
+
+
+def write_atomic(path, text):
+    """Пишет во временный файл рядом и подменяет целевой — читатель не увидит полфайла."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def partial_path_for(path):
+    """Meet_x_protocol.txt -> Meet_x_protocol.partial.txt"""
+    return path[:-len(".txt")] + ".partial.txt"
+
+
+class ProtocolWriter:
+    """
+    Протокол на диске по мере генерации. Пока генерация идет, текст
+    атомарно переписывается в _protocol.partial.txt (не чаще раза в interval
+    секунд), готовый протокол подменяет _protocol.txt одним переименованием.
+    Обрыв или падение процесса не оставляют недописанный текст под
+    итоговым именем — запись не считается обработанной.
+    """
+
+    def __init__(self, path, interval=WRITE_INTERVAL):
+        self.path = path
+        self.partial_path = partial_path_for(path)
+        self.interval = interval
+        self.text = ""
+        self._written = 0
+        self._last_write = 0.0
+
+    def append(self, chunk):
+        self.text += chunk
+        if time.monotonic() - self._last_write >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._written == len(self.text) and self._last_write:
+            return
+        write_atomic(self.partial_path, self.text)
+        self._written = len(self.text)
+        self._last_write = time.monotonic()
+
+    def finish(self, text=None):
+        if text is not None:
+            self.text = text
+        write_atomic(self.path, self.text)
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+        return self.path
+
+    def abort(self):
+        """
+        Генерация не удалась: частичный результат остается в
+        _protocol.partial.txt (с пометкой), _protocol.txt не тронут.
+        Возвращает путь к частичному протоколу или None.
+        """
+        if not self.text.strip():
+            if os.path.exists(self.partial_path):
+                os.remove(self.partial_path)
+            return None
+        write_atomic(self.partial_path, self.text + PARTIAL_NOTE)
+        logger.warning(f"Partial protocol ({len(self.text)} chars) saved to {self.partial_path}")
+        return self.partial_path
+
+
+def generate_streaming(client, model, contents, gen_config, writer, on_progress=None,
+                       max_continuations=MAX_CONTINUATIONS):
+    """
+    Потоковая генерация с записью кусков в writer по мере поступления.
+
+    При обрыве после частичного ответа запрос повторяется с уже полученным
+    текстом в роли ответа модели и просьбой продолжить (до max_continuations
+    раз). Возвращает (текст, usage_metadata, статистика с TTFT и временем).
+    """
+    from google.genai import types
+
+    started = time.monotonic()
+    first_token_at = None
+    usage = None
+    attempt = 0
+    request_contents = list(contents)
+
+    while True:
+        try:
+            for chunk in client.models.generate_content_stream(model=model, contents=request_contents, config=gen_config):
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                text = chunk.text or ""
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    logger.info(f"First token after {first_token_at - started:.1f}s")
+                writer.append(text)
+                if on_progress:
+                    on_progress(len(writer.text))
+            break
+        except Exception as e:
+            if not writer.text or attempt >= max_continuations or not _is_retryable(e):
+                raise
+            attempt += 1
+            logger.warning(f"Stream interrupted after {len(writer.text)} chars ({e}), continuing (attempt {attempt})")
+            writer.flush()
+            request_contents = list(contents) + [
+                types.Content(role="model", parts=[types.Part(text=writer.text)]),
+                CONTINUE_PROMPT,
+            ]
+
+    writer.finish()
+    total = time.monotonic() - started
+    stats = {
+        "ttft": (first_token_at - started) if first_token_at else None,
+        "seconds": total,
+        "chars": len(writer.text),
+        "continuations": attempt,
+    }
+    logger.info(
+        f"Generation finished: {stats['chars']} chars in {total:.1f}s"
+        + (f", time to first token {stats['ttft']:.1f}s" if stats["ttft"] is not None else "")
+        + (f", {attempt} continuation(s)" if attempt else "")
+    )
+    return writer.text, usage, stats
+
+
+def _is_retryable(error):
+    """Обрывы сети и 5xx/429 имеет смысл продолжать, ошибки запроса — нет."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (ConnectionError, TimeoutError))
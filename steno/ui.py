@@ -0,0 +1,249 @@
+# steno/ui.py
+"""
+Состояние приложения в строке меню как машина событий.
+
+Колбэки рекордера (старт захвата, склейка кусков после stop) и очереди
+задач приходят из чужих потоков. Они не трогают меню сами, а отправляют
+событие (post) в цикл главного потока; машина меняет состояние и
+перерисовывает только то, что изменилось (иконку, заголовок кнопки,
+очередь, списки файлов). Ни sleep, ни опроса по таймеру.
+
+Модуль не зависит от rumps и PyObjC: цикл событий и отрисовка передаются
+снаружи. В приложении цикл — главный поток AppKit, без GUI — ManualLoop.
+"""
+import heapq
+import itertools
+import threading
+import logging
+from collections import deque
+
+from steno.jobs import JOB_DONE, JOB_FAILED, JOB_CANCELLED
+
+logger = logging.getLogger("Steno")
+
+# Состояния записи
+STATE_IDLE = "idle"
+STATE_STARTING = "starting"
+STATE_RECORDING = "recording"
+
+# Иконки (см. app.py set_state_icon)
+ICON_IDLE = "idle"
+ICON_RECORDING = "recording"
+ICON_PROCESSING = "processing"
+ICON_ERROR = "error"
+
+# События
+EV_START_REQUESTED = "start_requested"
+EV_STARTED = "started"
+EV_START_FAILED = "start_failed"
+EV_STOP_REQUESTED = "stop_requested"
+EV_SAVED = "saved"
+EV_JOB_CHANGED = "job_changed"
+EV_FILES_CHANGED = "files_changed"
+EV_RECOVERED = "recovered"
+EV_ALERT = "alert"
+
+# Мигание иконкой при ошибке обработки: столько переключений с таким шагом
+FLASH_TOGGLES = 12
+FLASH_INTERVAL = 0.5
+
+# Заголовки кнопки записи (по ним же rumps ищет пункт меню)
+TITLE_START = "Start Recording"
+TITLE_STOP = "Stop"
+
+
+class ManualLoop:
+    """
+    Цикл событий без GUI: call_soon/call_later копятся, выполняет их
+    run_pending, время двигает advance. Для запуска UIStateMachine
+    в тестах и скриптах; потокобезопасен, как и цикл главного потока.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._queue = deque()
+        self._timers = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def call_soon(self, fn, *args):
+        with self._lock:
+            self._queue.append((fn, args))
+
+    def call_later(self, delay, fn, *args):
+        with self._lock:
+            heapq.heappush(self._timers, (self.now + delay, next(self._order), fn, args))
+
+    def run_pending(self):
+        """Выполняет все накопленные вызовы (и те, что они добавят). Возвращает их число."""
+        count = 0
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return count
+                fn, args = self._queue.popleft()
+            fn(*args)
+            count += 1
+
+    def advance(self, seconds):
+        """Сдвигает время, по порядку срабатывают наступившие таймеры."""
+        target = self.now + seconds
+        self.run_pending()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > target:
+                    break
+                when, _, fn, args = heapq.heappop(self._timers)
+                self.now = when
+            fn(*args)
+            self.run_pending()
+        self.now = target
+
+
+class UIStateMachine:
+    """
+    Машина состояний меню. view — объект отрисовки с методами:
+      show_icon(icon), set_record_title(title), refresh_queue(), refresh_files(),
+      update_tokens(), notify(title, subtitle, message), alert(title, message).
+    Все методы view вызываются только из цикла loop (главного потока).
+    """
+
+    def __init__(self, loop, view):
+        self.loop = loop
+        self.view = view
+        self.state = STATE_IDLE
+        self.saving = 0
+        self.active_jobs = 0
+        self.flash_left = 0
+        self.icon = None
+        self.title = None
+        self._queue_dirty = False
+
+    @property
+    def recording(self):
+        return self.state in (STATE_STARTING, STATE_RECORDING)
+
+    # --- Вход событий ---
+
+    def post(self, event, **data):
+        """Из любого потока: событие обработается в цикле главного потока."""
+        self.loop.call_soon(self._dispatch, event, data)
+
+    def send(self, event, **data):
+        """Из главного потока (колбэки меню): обработать сразу, до следующего клика."""
+        self._dispatch(event, data)
+
+    def _dispatch(self, event, data):
+        handler = getattr(self, "on_" + event, None)
+        if handler is None:
+            logger.warning(f"UI: unknown event {event}")
+            return
+        handler(**data)
+        self.render()
+
+    # --- Переходы ---
+
+    def on_start_requested(self):
+        if self.state == STATE_IDLE:
+            self.state = STATE_STARTING
+
+    def on_started(self):
+        if self.state == STATE_STARTING:
+            self.state = STATE_RECORDING
+
+    def on_start_failed(self, error=""):
+        if not self.recording:
+            return
+        self.state = STATE_IDLE
+        self.view.alert(
+            "Recording Error",
+            f"Не удалось начать запись: {error}\n\nПроверьте права доступа в "
+            "System Settings -> Privacy & Security -> Screen Recording."
+        )
+
+    def on_stop_requested(self, pending=True):
+        """pending — рекордер дописывает файлы и пришлет saved."""
+        if not self.recording:
+            return
+        # Кнопка сразу снова "Start Recording", файлы дописываются в фоне
+        self.state = STATE_IDLE
+        if pending:
+            self.saving += 1
+
+    def on_saved(self, name="", ok=True):
+        self.saving = max(0, self.saving - 1)
+        if ok:
+            self.view.notify("Готово", "Файлы сохранены", name)
+        else:
+            self.view.notify("Ошибка записи", "Не удалось сохранить запись", name)
+        self.view.refresh_files()
+
+    def on_job_changed(self, state=None, name="", result=None, error=None, active=None):
+        if active is not None:
+            self.active_jobs = active
+        if state == JOB_DONE:
+            self.view.notify("Готово!", "Протокол сохранен", f"Файл: {result or name}")
+            self.view.update_tokens()
+            self.view.refresh_files()
+        elif state == JOB_FAILED:
+            self.view.notify("AI Ошибка", "Сбой обработки", (error or "")[:50])
+            self.flash()
+        elif state == JOB_CANCELLED:
+            self.view.notify("AI Обработка", "Отменено", name)
+        # Прогресс задач приходит часто — очередь перестраиваем раз на пачку событий
+        if not self._queue_dirty:
+            self._queue_dirty = True
+            self.loop.call_soon(self._refresh_queue)
+
+    def on_files_changed(self):
+        self.view.refresh_files()
+
+    def on_recovered(self, name=""):
+        """Запись, оборванная падением, склеена из кусков при запуске."""
+        self.view.notify("Запись восстановлена", "Запись была прервана", name)
+        self.view.refresh_files()
+
+    def on_alert(self, title="", message=""):
+        """Результат фоновой работы, начатой из меню (например, оценка стоимости)."""
+        self.view.alert(title, message)
+
+    # --- Отрисовка ---
+
+    def _refresh_queue(self):
+        self._queue_dirty = False
+        self.view.refresh_queue()
+
+    def flash(self):
+        """Мигание иконкой ошибки (таймерами цикла); повторная ошибка продлевает мигание."""
+        running = self.flash_left > 0
+        self.flash_left = FLASH_TOGGLES
+        if not running:
+            self.loop.call_later(FLASH_INTERVAL, self._flash_tick)
+        self.render()
+
+    def _flash_tick(self):
+        self.flash_left -= 1
+        if self.flash_left > 0:
+            self.loop.call_later(FLASH_INTERVAL, self._flash_tick)
+        self.render()
+
+    def current_icon(self):
+        if self.recording:
+            return ICON_RECORDING
+        # Четные шаги мигания — иконка ошибки, нечетные — обычная
+        if self.flash_left and self.flash_left % 2 == 0:
+            return ICON_ERROR
+        if self.saving or self.active_jobs:
+            return ICON_PROCESSING
+        return ICON_IDLE
+
+    def render(self):
+        """Передает во view только изменившееся."""
+        icon = self.current_icon()
+        if icon != self.icon:
+            self.icon = icon
+            self.view.show_icon(icon)
+        title = TITLE_STOP if self.recording else TITLE_START
+        if title != self.title:
+            self.title = title
+            self.view.set_record_title(title)
@@ -0,0 +1,372 @@
+# steno/uploader.py
+import os
+import re
+import json
+import time
+import random
+import threading
+import logging
+import mimetypes
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("Steno")
+
+DEFAULT_API_BASE = "https://generativelanguage.googleapis.com"
+UPLOAD_JOURNAL_FILE = os.path.expanduser("~/.recorder_app_uploads.json")
+
+# Размер чанка обязан быть кратен 256 КБ (требование resumable-протокола),
+# последний чанк может быть любого размера.
+CHUNK_GRANULARITY = 256 * 1024
+CHUNK_SIZE = 32 * CHUNK_GRANULARITY  # 8 МБ
+MAX_CHUNK_RETRIES = 5
+REQUEST_TIMEOUT = 120
+# Пауза ключа после 429 без RetryInfo в ответе
+THROTTLE_DELAY = 10.0
+
+# Ожидание обработки файлов на стороне Google
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 15.0
+PROCESSING_DEADLINE = 30 * 60
+
+MIME_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4a": "audio/mp4",
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+def _retry_info(error):
+    """Задержка из RetryInfo тела ответа 429 (секунды) или None."""
+    try:
+        details = (json.loads(error.read() or b"{}").get("error") or {}).get("details") or []
+    except (ValueError, OSError, AttributeError):
+        return None
+    for item in details:
+        match = re.fullmatch(r"([\d.]+)s", str(item.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _retry_delay(retries):
+    return min(30.0, 2 ** retries) * (0.5 + random.random() / 2)
+
+
+class UploadJournal:
+    """
+    Локальный журнал незавершенных загрузок.
+    Ключ — путь + размер + mtime файла, значение — upload URL сессии и
+    подтвержденное сервером смещение. После сбоя загрузка продолжается
+    с последнего записанного чанка, а не с нуля.
+    """
+
+    def __init__(self, path=UPLOAD_JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    return json.load(f)
+            except: pass
+        return {}
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key_for(path):
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def update(self, key, **fields):
+        with self._lock:
+            self._entries.setdefault(key, {}).update(fields)
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+
+class ResumableUploader:
+    """
+    Загрузка файлов в Files API по resumable-протоколу.
+
+    Файлы грузятся параллельно (по потоку на файл), каждый файл режется на
+    чанки. Чанки одного файла уходят строго по порядку — протокол принимает
+    данные только с текущего смещения, — поэтому параллелизм достигается
+    между файлами. После каждого чанка смещение пишется в журнал.
+
+    base_url можно направить на локальную заглушку Files API.
+    cancel_event (threading.Event) прерывает загрузку между чанками,
+    журнал при этом сохраняется — загрузку можно будет продолжить.
+    limiter — лимиты ключа общего клиента (ApiClient.uploads, steno/api.py):
+    acquire(new_session) перед каждым запросом, pause(seconds) после 429.
+    """
+
+    def __init__(self, api_key, base_url=None, chunk_size=CHUNK_SIZE,
+                 journal=None, max_workers=4, timeout=REQUEST_TIMEOUT, cancel_event=None, limiter=None):
+        if chunk_size % CHUNK_GRANULARITY:
+            raise ValueError(f"chunk_size must be a multiple of {CHUNK_GRANULARITY}")
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_API_BASE).rstrip("/")
+        self.chunk_size = chunk_size
+        self.journal = journal if journal is not None else UploadJournal()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.limiter = limiter
+
+    # --- HTTP ---
+
+    def _request(self, url, headers, data=None, new_session=False):
+        if self.limiter is not None:
+            self.limiter.acquire(new_session)
+        all_headers = {"x-goog-api-key": self.api_key}
+        all_headers.update(headers)
+        req = urllib.request.Request(url, data=data if data is not None else b"", headers=all_headers, method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+                return resp.status, {k.lower(): v for k, v in resp.headers.items()}, body
+        except urllib.error.HTTPError as e:
+            if e.code == 429 and self.limiter is not None:
+                self.limiter.pause(_retry_info(e) or THROTTLE_DELAY)
+            raise
+
+    def _start_session(self, path, size):
+        mime_type = MIME_TYPES.get(os.path.splitext(path)[1].lower()) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        body = json.dumps({"file": {"display_name": os.path.basename(path)}}).encode("utf-8")
+        retries = 0
+        while True:
+            try:
+                _, headers, _ = self._request(
+                    f"{self.base_url}/upload/v1beta/files",
+                    {
+                        "Content-Type": "application/json",
+                        "X-Goog-Upload-Protocol": "resumable",
+                        "X-Goog-Upload-Command": "start",
+                        "X-Goog-Upload-Header-Content-Length": str(size),
+                        "X-Goog-Upload-Header-Content-Type": mime_type,
+                    },
+                    body,
+                    new_session=True,
+                )
+                break
+            except (urllib.error.URLError, OSError) as e:
+                # Сессия считается запросом ключа: 429 и 5xx повторяем, как и чанки
+                status = getattr(e, "code", None)
+                if status is not None and status < 500 and status != 429:
+                    raise
+                retries += 1
+                if retries > MAX_CHUNK_RETRIES:
+                    raise
+                delay = _retry_delay(retries)
+                logger.warning(f"Upload session for {os.path.basename(path)} failed ({e}), retry {retries} in {delay:.1f}s")
+                time.sleep(delay)
+        upload_url = headers.get("x-goog-upload-url")
+        if not upload_url:
+            raise UploadError("Server did not return an upload URL")
+        return upload_url
+
+    def _query_offset(self, upload_url):
+        """Сколько байт сервер уже принял. None — сессия больше не существует."""
+        try:
+            _, headers, body = self._request(upload_url, {"X-Goog-Upload-Command": "query"})
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 410):
+                return None, None
+            raise
+        if headers.get("x-goog-upload-status") == "final":
+            return -1, json.loads(body or b"{}").get("file")
+        return int(headers.get("x-goog-upload-size-received", 0)), None
+
+    # --- Upload ---
+
+    def upload(self, path):
+        """Загружает один файл. Возвращает (file dict из ответа API, статистика)."""
+        size = os.path.getsize(path)
+        key = self.journal.key_for(path)
+        entry = self.journal.get(key)
+
+        upload_url = None
+        offset = 0
+        if entry and entry.get("upload_url"):
+            try:
+                offset, remote_file = self._query_offset(entry["upload_url"])
+            except (urllib.error.URLError, OSError) as e:
+                logger.warning(f"Cannot query upload session, starting over: {e}")
+                offset, remote_file = None, None
+            if offset == -1 and remote_file:
+                # Файл уже был загружен целиком до сбоя — осталось только получить ответ
+                self.journal.remove(key)
+                return remote_file, {"path": path, "bytes": size, "sent": 0, "resumed_from": size, "seconds": 0.0}
+            if offset is not None:
+                upload_url = entry["upload_url"]
+                logger.info(f"Resuming upload of {os.path.basename(path)} from {offset}/{size} bytes")
+
+        if upload_url is None:
+            upload_url = self._start_session(path, size)
+            offset = 0
+            self.journal.update(key, upload_url=upload_url, offset=0, started=time.time())
+
+        resumed_from = offset
+        started = time.monotonic()
+        remote_file = None
+        retries = 0
+
+        with open(path, "rb") as f:
+            while remote_file is None:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise UploadError(f"Upload of {os.path.basename(path)} cancelled")
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                is_last = offset + len(chunk) >= size
+                command = "upload, finalize" if is_last else "upload"
+                try:
+                    _, headers, body = self._request(
+                        upload_url,
+                        {
+                            "Content-Length": str(len(chunk)),
+                            "X-Goog-Upload-Offset": str(offset),
+                            "X-Goog-Upload-Command": command,
+                        },
+                        chunk,
+                    )
+                except (urllib.error.URLError, OSError) as e:
+                    status = getattr(e, "code", None)
+                    if status is not None and status < 500 and status != 429:
+                        raise UploadError(f"Upload of {os.path.basename(path)} rejected: HTTP {status}")
+                    retries += 1
+                    if retries > MAX_CHUNK_RETRIES:
+                        raise UploadError(f"Upload of {os.path.basename(path)} failed after {MAX_CHUNK_RETRIES} retries: {e}")
+                    delay = _retry_delay(retries)
+                    logger.warning(f"Chunk at {offset} failed ({e}), retry {retries} in {delay:.1f}s")
+                    time.sleep(delay)
+                    # Сервер мог принять часть данных — сверяемся с ним
+                    try:
+                        server_offset, final_file = self._query_offset(upload_url)
+                    except (urllib.error.URLError, OSError):
+                        continue
+                    if server_offset is None:
+                        self.journal.remove(key)
+                        raise UploadError(f"Upload session for {os.path.basename(path)} expired")
+                    if server_offset == -1:
+                        remote_file = final_file
+                    else:
+                        offset = server_offset
+                    continue
+
+                retries = 0
+                if is_last:
+                    remote_file = json.loads(body or b"{}").get("file")
+                    if not remote_file:
+                        raise UploadError(f"Server returned no file for {os.path.basename(path)}")
+                else:
+                    offset += len(chunk)
+                    self.journal.update(key, offset=offset)
+
+        self.journal.remove(key)
+        seconds = time.monotonic() - started
+        sent = size - resumed_from
+        logger.info(
+            f"Uploaded {os.path.basename(path)}: {sent / 1e6:.1f} MB in {seconds:.1f}s "
+            f"({sent / 1e6 / max(seconds, 1e-6):.2f} MB/s)"
+            + (f", resumed from {resumed_from} bytes" if resumed_from else "")
+        )
+        return remote_file, {"path": path, "bytes": size, "sent": sent, "resumed_from": resumed_from, "seconds": seconds}
+
+    def upload_all(self, paths):
+        """
+        Загружает все файлы одновременно.
+        Возвращает (список file dict в порядке paths, сводная статистика).
+        """
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(paths)))) as pool:
+            results = list(pool.map(self.upload, paths))
+
+        seconds = time.monotonic() - started
+        sent = sum(stats["sent"] for _, stats in results)
+        summary = {
+            "files": [stats for _, stats in results],
+            "bytes": sum(stats["bytes"] for _, stats in results),
+            "sent": sent,
+            "seconds": seconds,
+            "throughput_mbps": sent / 1e6 / max(seconds, 1e-6),
+        }
+        logger.info(f"Upload finished: {len(paths)} files, {sent / 1e6:.1f} MB in {seconds:.1f}s ({summary['throughput_mbps']:.2f} MB/s)")
+        return [remote_file for remote_file, _ in results], summary
+
+
+def _state_name(remote_file):
+    state = getattr(remote_file, "state", None)
+    return getattr(state, "name", None) or str(state or "")
+
+
+def wait_for_files_active(client, names, deadline=PROCESSING_DEADLINE,
+                          initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY, cancel_event=None):
+    """
+    Ждет, пока все загруженные файлы перейдут в ACTIVE.
+
+    Файлы опрашиваются одновременно, у каждого свой интервал: экспоненциальный
+    рост от initial_delay до max_delay со случайным разбросом (jitter), чтобы
+    запросы не шли равномерным потоком. Возврат — как только активны все файлы.
+    Возвращает объекты File в порядке names.
+    cancel_event (threading.Event) прерывает ожидание.
+    """
+    started = time.monotonic()
+    give_up_at = started + deadline
+    ready = {}
+    delays = {name: initial_delay for name in names}
+    next_poll = {name: started for name in names}
+    polls = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+        while len(ready) < len(names):
+            if cancel_event is not None and cancel_event.is_set():
+                raise UploadError("Waiting for file processing cancelled")
+            now = time.monotonic()
+            due = [name for name in names if name not in ready and next_poll[name] <= now]
+            if not due:
+                wake_at = min(next_poll[name] for name in names if name not in ready)
+                if wake_at > give_up_at:
+                    raise TimeoutError(f"Files were not processed within {deadline:.0f}s")
+                if cancel_event is not None:
+                    cancel_event.wait(max(0.0, wake_at - now))
+                else:
+                    time.sleep(max(0.0, wake_at - now))
+                continue
+
+            polls += len(due)
+            for name, remote_file in zip(due, pool.map(lambda n: client.files.get(name=n), due)):
+                state = _state_name(remote_file)
+                if state == "ACTIVE":
+                    ready[name] = remote_file
+                    logger.info(f"File ready: {name} ({time.monotonic() - started:.1f}s)")
+                elif state == "FAILED":
+                    logger.error(f"Google failed to process file {name}")
+                    raise UploadError(f"Google не смог обработать файл {getattr(remote_file, 'display_name', name)}")
+                else:
+                    delay = delays[name]
+                    next_poll[name] = time.monotonic() + delay * (0.5 + random.random() / 2)
+                    delays[name] = min(max_delay, delay * 2)
+
+    logger.info(f"All {len(names)} files active in {time.monotonic() - started:.1f}s ({polls} status requests)")
+    return [ready[name] for name in names]
@@ -0,0 +1,288 @@
+# steno/vad.py
+"""
+Вырезание длинной тишины перед загрузкой.
+
+Ожидание участников, перерывы, молчание в начале и конце — это минуты
+медиа, за которые платим токенами. Перед загрузкой звук всех дорожек
+(запись, микрофон) сводится и размечается простым детектором речи по
+энергии кадров (NumPy, час звука — секунды). Паузы длиннее
+trim_min_silence_seconds вырезаются из всех загружаемых файлов одинаково,
+а TimeMap переводит время обрезанной записи обратно во время оригинала:
+таймкоды в протоколе совпадают с исходной записью.
+
+NumPy — необязательная зависимость: без него обрезка просто пропускается.
+"""
+import os
+import re
+import json
+import logging
+
+from steno.media import (
+    MediaError, _run_ffmpeg, probe_media, format_timestamp, SPEECH_SAMPLE_RATE, SPEECH_BITRATE
+)
+
+logger = logging.getLogger("Steno")
+
+VAD_SAMPLE_RATE = 8000
+VAD_FRAME_SECONDS = 0.03
+# Блок разбора: память не растет с длиной записи
+VAD_BLOCK_SECONDS = 60
+# Речь — кадры громче шумового пола (10-й перцентиль) на VAD_MARGIN_DB,
+# но не тише VAD_MIN_DB (относительно полной шкалы)
+VAD_MARGIN_DB = 12.0
+VAD_MIN_DB = -55.0
+# Вокруг речи оставляем запас, чтобы не резать начало и конец фраз
+SPEECH_PAD_SECONDS = 1.0
+MIN_SILENCE_SECONDS = 10.0
+# Меньше этой доли вырезать не стоит перекодирования
+MIN_TRIM_FRACTION = 0.05
+
+TIMEMAP_SUFFIX = "_timemap.json"
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+class TimeMap:
+    """
+    Соответствие времени обрезанной записи и оригинала.
+    spans — оставленные отрезки оригинала [(начало, конец)] по порядку.
+    """
+
+    def __init__(self, spans, duration):
+        self.spans = [(float(a), float(b)) for a, b in spans]
+        self.duration = float(duration)
+        self.offsets = []
+        position = 0.0
+        for a, b in self.spans:
+            self.offsets.append(position)
+            position += b - a
+        self.trimmed_duration = position
+
+    @property
+    def removed(self):
+        return self.duration - self.trimmed_duration
+
+    def to_original(self, t):
+        for (a, b), offset in zip(self.spans, self.offsets):
+            if t < offset + (b - a):
+                return a + max(0.0, t - offset)
+        if not self.spans:
+            return t
+        return self.spans[-1][1] + (t - self.trimmed_duration)
+
+    def to_trimmed(self, t):
+        """Время оригинала -> время обрезанной записи (из вырезанной паузы — ее место склейки)."""
+        for (a, b), offset in zip(self.spans, self.offsets):
+            if t < a:
+                return offset
+            if t < b:
+                return offset + (t - a)
+        return self.trimmed_duration
+
+    def rewrite_timestamps(self, text):
+        """
+        Таймкоды ЧЧ:ММ:СС и [ММ:СС] в тексте протокола -> время оригинала.
+        Время суток вида 15:00 (сроки задач) не трогаем.
+        """
+        def full(match):
+            h, m, s = (int(g) for g in match.groups())
+            return format_timestamp(self.to_original(h * 3600 + m * 60 + s))
+
+        def short(match):
+            m, s = (int(g) for g in match.groups())
+            return "[" + format_timestamp(self.to_original(m * 60 + s)) + "]"
+
+        text = re.sub(r"(?<![\d:])(\d{1,2}):(\d{2}):(\d{2})(?![\d:])", full, text)
+        return re.sub(r"\[(\d{1,3}):(\d{2})\]", short, text)
+
+    def to_dict(self):
+        return {"duration": self.duration, "spans": self.spans}
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["spans"], data["duration"])
+
+
+def trim_settings(config):
+    """Все, от чего зависит результат trim_silence (для ключа кэша результатов); None — обрезка выключена."""
+    if not config.get("trim_silence", True):
+        return None
+    return {
+        "min_silence": float(config.get("trim_min_silence_seconds", MIN_SILENCE_SECONDS)),
+        "frame": VAD_FRAME_SECONDS,
+        "margin_db": VAD_MARGIN_DB,
+        "min_db": VAD_MIN_DB,
+        "pad": SPEECH_PAD_SECONDS,
+        "min_fraction": MIN_TRIM_FRACTION,
+    }
+
+
+def decode_audio(paths, rate=VAD_SAMPLE_RATE):
+    """Все звуковые дорожки файлов, сведенные в моно int16 с частотой rate (байты)."""
+    inputs = [(p, probe_media(p)["audio_streams"]) for p in paths]
+    inputs = [(p, n) for p, n in inputs if n]
+    if not inputs:
+        raise MediaError("No audio streams to analyse")
+    args = []
+    for p, _ in inputs:
+        args += ["-i", p]
+    streams = [f"[{i}:a:{j}]" for i, (_, n) in enumerate(inputs) for j in range(n)]
+    if len(streams) > 1:
+        args += ["-filter_complex", f"{''.join(streams)}amix=inputs={len(streams)}:duration=longest:normalize=0[a]", "-map", "[a]"]
+    else:
+        args += ["-map", "0:a:0"]
+    args += ["-vn", "-ac", "1", "-ar", str(rate), "-f", "s16le", "pipe:1"]
+    result = _run_ffmpeg(args, text=False)
+    if result.returncode != 0:
+        raise MediaError("ffmpeg failed to decode audio for VAD")
+    return result.stdout
+
+
+def frame_energy_db(pcm, rate=VAD_SAMPLE_RATE, np=None):
+    """Энергия кадров VAD_FRAME_SECONDS в дБ относительно полной шкалы."""
+    np = np or _numpy()
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype=np.int16)
+    frame = int(rate * VAD_FRAME_SECONDS)
+    frames_per_block = int(VAD_BLOCK_SECONDS / VAD_FRAME_SECONDS)
+    count = len(samples) // frame
+    energy = np.empty(count, dtype=np.float32)
+    for start in range(0, count, frames_per_block):
+        stop = min(count, start + frames_per_block)
+        block = samples[start * frame:stop * frame].reshape(stop - start, frame).astype(np.float32) / 32768.0
+        energy[start:stop] = np.mean(block * block, axis=1)
+    return 10.0 * np.log10(energy + 1e-10)
+
+
+def speech_spans(energy_db, min_silence=MIN_SILENCE_SECONDS, pad=SPEECH_PAD_SECONDS, np=None):
+    """
+    Отрезки, которые оставляем: речь с запасом pad, паузы короче min_silence
+    не режутся. Возвращает [(начало, конец)] в секундах.
+    """
+    np = np or _numpy()
+    if len(energy_db) == 0:
+        return []
+    threshold = max(float(np.percentile(energy_db, 10)) + VAD_MARGIN_DB, VAD_MIN_DB)
+    active = energy_db > threshold
+
+    # Расширяем речь на pad в обе стороны, затем заполняем паузы короче min_silence
+    pad_frames = int(pad / VAD_FRAME_SECONDS)
+    if pad_frames:
+        active = np.convolve(active.astype(np.int32), np.ones(2 * pad_frames + 1, dtype=np.int32), "same") > 0
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return []
+
+    gap_frames = min_silence / VAD_FRAME_SECONDS
+    spans = [[int(starts[0]), int(ends[0])]]
+    for a, b in zip(starts[1:], ends[1:]):
+        if a - spans[-1][1] < gap_frames:
+            spans[-1][1] = int(b)
+        else:
+            spans.append([int(a), int(b)])
+    return [(a * VAD_FRAME_SECONDS, b * VAD_FRAME_SECONDS) for a, b in spans]
+
+
+_ENCODERS = {}
+
+
+def has_encoder(name):
+    if name not in _ENCODERS:
+        try:
+            _ENCODERS[name] = name in _run_ffmpeg(["-encoders"]).stdout
+        except MediaError:
+            _ENCODERS[name] = False
+    return _ENCODERS[name]
+
+
+def trim_media(path, spans, out_path):
+    """
+    Оставляет в файле только spans (trim/atrim + concat, с перекодированием).
+    Звук — речевой профиль, видео — H.264 (нужен libx264 в ffmpeg).
+    """
+    info = probe_media(path)
+    audio_count = info["audio_streams"]
+    graph = []
+    labels = ""
+    for k, (a, b) in enumerate(spans):
+        if info["has_video"]:
+            graph.append(f"[0:v:0]trim=start={a:.3f}:end={b:.3f},setpts=PTS-STARTPTS[v{k}]")
+            labels += f"[v{k}]"
+        for j in range(audio_count):
+            graph.append(f"[0:a:{j}]atrim=start={a:.3f}:end={b:.3f},asetpts=PTS-STARTPTS[a{k}_{j}]")
+            labels += f"[a{k}_{j}]"
+    outputs = ("[v]" if info["has_video"] else "") + "".join(f"[a{j}]" for j in range(audio_count))
+    graph.append(f"{labels}concat=n={len(spans)}:v={int(info['has_video'])}:a={audio_count}{outputs}")
+
+    args = ["-i", path, "-filter_complex", ";".join(graph)]
+    if info["has_video"]:
+        args += ["-map", "[v]", "-c:v", "libx264", "-preset", "veryfast", "-crf", "30", "-pix_fmt", "yuv420p"]
+    for j in range(audio_count):
+        args += ["-map", f"[a{j}]"]
+    args += [
+        "-c:a", "aac", "-b:a", SPEECH_BITRATE, "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE),
+        "-map_metadata", "-1", "-fflags", "+bitexact", "-y", out_path,
+    ]
+    result = _run_ffmpeg(args)
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise MediaError(f"ffmpeg failed: {tail[0]}")
+    return out_path
+
+
+def trim_silence(paths, out_dir, config):
+    """
+    Вырезает длинные паузы из всех файлов paths (одинаково).
+    Возвращает (пути для загрузки, TimeMap или None — резать нечего или нельзя).
+    """
+    np = _numpy()
+    if np is None:
+        logger.info("NumPy is not installed, silence trimming skipped")
+        return paths, None
+
+    try:
+        duration = probe_media(paths[0])["duration"]
+        if any(probe_media(p)["has_video"] for p in paths) and not has_encoder("libx264"):
+            logger.info("ffmpeg has no libx264, silence trimming of video skipped")
+            return paths, None
+        energy = frame_energy_db(decode_audio(paths), np=np)
+    except MediaError as e:
+        logger.warning(f"Silence analysis failed ({e}), uploading untrimmed media")
+        return paths, None
+
+    min_silence = float(config.get("trim_min_silence_seconds", MIN_SILENCE_SECONDS))
+    spans = speech_spans(energy, min_silence=min_silence, np=np)
+    if spans:
+        spans[-1] = (spans[-1][0], min(spans[-1][1], duration))
+    time_map = TimeMap(spans, duration)
+    if not spans or time_map.removed < duration * MIN_TRIM_FRACTION:
+        logger.info(f"Silence trimming: nothing worth cutting ({time_map.removed:.0f}s of {duration:.0f}s)")
+        return paths, None
+
+    trimmed = []
+    try:
+        for p in paths:
+            stem, ext = os.path.splitext(os.path.basename(p))
+            trimmed.append(trim_media(p, spans, os.path.join(out_dir, f"{stem}_trimmed{ext}")))
+    except MediaError as e:
+        logger.warning(f"Silence trimming failed ({e}), uploading untrimmed media")
+        return paths, None
+
+    logger.info(
+        f"Silence trimming: removed {time_map.removed / 60:.1f} min of {duration / 60:.1f} min "
+        f"({len(spans)} speech spans)"
+    )
+    return trimmed, time_map
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Журналы, кэш и индексы (~/.recorder_app_*) — во временном HOME, до импорта модулей steno
+os.environ["HOME"] = tempfile.mkdtemp(prefix="steno_test_home_")
+
+from steno.fakeapi import serve  # noqa: E402
+
+
+@pytest.fixture
+def fake_api():
+    """Локальная заглушка Gemini API: (base_url, состояние)."""
+    server, base_url, state = serve(processing_seconds=0.2, latency=0.01, chunk_delay=0.0)
+    yield base_url, state
+    server.shutdown()
+    server.server_close()
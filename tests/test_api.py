@@ -0,0 +1,116 @@
+import os
+import time
+import uuid
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from steno import uploader as uploader_module
+from steno.api import get_client
+from steno.fakeapi import serve
+from steno.uploader import ResumableUploader, UploadJournal, CHUNK_GRANULARITY
+
+
+@pytest.fixture
+def limited_api():
+    """Заглушка со своим лимитом 20 запросов в минуту."""
+    server, base_url, state = serve(rpm=20, processing_seconds=0.0, latency=0.01, chunk_delay=0.0)
+    yield base_url, state
+    server.shutdown()
+    server.server_close()
+
+
+def make_files(tmp_path, count, size=CHUNK_GRANULARITY * 2 + 100):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"part{i}.m4a"
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+
+def test_uploads_and_generation_share_key_limits(tmp_path, limited_api):
+    """Сессии загрузки расходуют то же ведро ключа, что и генерация: сервер не отвечает 429."""
+    base_url, state = limited_api
+    # Свой ключ на тест: лимиты общего клиента живут на ключ
+    client = get_client(f"key-{uuid.uuid4().hex}", base_url, rpm=20, tpm=0)
+    uploader = ResumableUploader(
+        "key", base_url=base_url, chunk_size=CHUNK_GRANULARITY,
+        journal=UploadJournal(str(tmp_path / "journal.json")), limiter=client.uploads
+    )
+    paths = make_files(tmp_path, 12)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        generations = [pool.submit(client.models.generate_content, model="fake-model", contents="Протокол") for _ in range(8)]
+        remote_files, summary = uploader.upload_all(paths)
+        responses = [f.result() for f in generations]
+
+    assert len(remote_files) == 12 and summary["sent"] == summary["bytes"]
+    assert all(r.text for r in responses)
+    assert state.counters["throttled"] == 0
+    # 12 сессий + 8 генераций; чанки ведро не расходуют
+    assert client.stats["requests"] == 20
+    assert state.counters["requests"] == 20
+
+    # Ведро пусто: следующая сессия ждет пополнения, а не получает 429
+    started = time.monotonic()
+    client.uploads.acquire(new_session=True)
+    assert time.monotonic() - started > 1.5
+    assert state.counters["throttled"] == 0
+
+
+def test_upload_waits_for_key_pause(tmp_path, fake_api):
+    base_url, state = fake_api
+    client = get_client(f"key-{uuid.uuid4().hex}", base_url, rpm=0, tpm=0)
+    uploader = ResumableUploader(
+        "key", base_url=base_url, chunk_size=CHUNK_GRANULARITY,
+        journal=UploadJournal(str(tmp_path / "journal.json")), limiter=client.uploads
+    )
+    path = make_files(tmp_path, 1)[0]
+
+    # Другая задача ключа получила 429 — загрузка тоже ждет
+    client.uploads.pause(0.5)
+    started = time.monotonic()
+    uploader.upload(path)
+    assert time.monotonic() - started >= 0.4
+    assert client.stats["throttled_seconds"] >= 0.4
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.sessions = 0
+        self.requests = 0
+        self.pauses = []
+
+    def acquire(self, new_session=False):
+        self.requests += 1
+        self.sessions += int(new_session)
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+def test_session_429_pauses_key(tmp_path, monkeypatch):
+    server, base_url, state = serve(rpm=1, processing_seconds=0.0, latency=0.01, chunk_delay=0.0)
+    monkeypatch.setattr(uploader_module, "_retry_delay", lambda retries: 0.01)
+    try:
+        limiter = RecordingLimiter()
+        uploader = ResumableUploader(
+            "key", base_url=base_url, chunk_size=CHUNK_GRANULARITY,
+            journal=UploadJournal(str(tmp_path / "journal.json")), limiter=limiter
+        )
+        first, second = make_files(tmp_path, 2)
+        uploader.upload(first)
+        assert limiter.sessions == 1 and limiter.requests == 4  # сессия и три чанка
+        assert limiter.pauses == []
+
+        # Лимит сервера исчерпан: сессия повторяется, каждый 429 ставит ключ на паузу по RetryInfo
+        with pytest.raises(urllib.error.HTTPError):
+            uploader.upload(second)
+        assert limiter.sessions == 1 + 1 + uploader_module.MAX_CHUNK_RETRIES
+        assert len(limiter.pauses) == 1 + uploader_module.MAX_CHUNK_RETRIES
+        assert all(50 <= p <= 61 for p in limiter.pauses)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,60 @@
+import os
+import math
+import struct
+
+import pytest
+
+from steno.config import AUDIO_PROFILES
+from steno.media import SpeechEncoder, MediaError, _run_ffmpeg, find_ffmpeg, probe_media
+
+SECONDS = 60
+
+pytestmark = pytest.mark.skipif(find_ffmpeg() is None, reason="ffmpeg not found")
+
+
+def encode(profile, out_path):
+    """AAC с настройками профиля — как audio_settings_for в рекордере (частота, каналы, битрейт)."""
+    result = _run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", f"anoisesrc=d={SECONDS}:c=pink:a=0.2,lowpass=f=4000",
+        "-ar", str(profile["sample_rate"]), "-ac", str(profile["channels"]),
+        "-c:a", "aac", "-b:a", str(profile["bitrate"]), out_path,
+    ])
+    if result.returncode != 0:
+        raise MediaError(result.stderr[-300:])
+    return os.path.getsize(out_path)
+
+
+@pytest.fixture(scope="module")
+def sizes(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("profiles")
+    return {
+        name: encode(profile, str(directory / f"{name.replace(' ', '_')}.m4a"))
+        for name, profile in AUDIO_PROFILES.items()
+    }
+
+
+@pytest.mark.parametrize("name", list(AUDIO_PROFILES))
+def test_size_follows_profile_bitrate(sizes, name):
+    expected = AUDIO_PROFILES[name]["bitrate"] / 8 * SECONDS
+    assert 0.75 * expected < sizes[name] < 1.25 * expected
+
+
+def test_speech_profiles_shrink_audio(sizes):
+    # Обещанное в AUDIO_PROFILES: Speech — в 4 раза меньше Music, Speech Low — в 5 с лишним
+    assert sizes["Music"] / sizes["Speech"] > 3.5
+    assert sizes["Music"] / sizes["Speech Low"] > 4.5
+
+
+def test_live_speech_mixdown_size(tmp_path, sizes):
+    out_path = str(tmp_path / "Meet_x_speech.m4a")
+    encoder = SpeechEncoder(out_path)
+    rate = 16000
+    for second in range(SECONDS):
+        samples = [int(8000 * math.sin(2 * math.pi * (220 + second) * i / rate) * (0.5 + 0.5 * math.sin(i / 900)))
+                   for i in range(rate)]
+        encoder.write(struct.pack(f"<{rate}h", *samples))
+    assert encoder.close() == out_path
+
+    assert abs(probe_media(out_path)["duration"] - SECONDS) < 1
+    # Речевая дорожка обеих сторон меньше одной дорожки Music в разы
+    assert os.path.getsize(out_path) * 3.5 < sizes["Music"]
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import itertools
+import threading
+
+from steno import cache
+from steno.cache import DigestMemo, ResultCache, RemoteFileCache, result_key, file_digest, REMOTE_FILE_MARGIN
+
+
+def test_result_cache_hit(tmp_path):
+    key = result_key(["a" * 64], "gemini-3-pro-preview", "prompt", "2025-01-01", "audio")
+    assert key != result_key(["a" * 64], "gemini-3-flash-preview", "prompt", "2025-01-01", "audio")
+    ResultCache(str(tmp_path)).put(key, "# Протокол")
+
+    # Другая задача (свой экземпляр) видит результат
+    other = ResultCache(str(tmp_path))
+    assert other.get(key) == "# Протокол"
+    assert other.get("missing") is None
+
+    # Файл протокола пропал — запись убирается из индекса
+    os.remove(os.path.join(str(tmp_path), "protocols", key + ".txt"))
+    assert other.get(key) is None
+    assert key not in ResultCache(str(tmp_path))._index
+
+
+def test_result_cache_lru_by_size(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache.time, "time", lambda: float(next(clock)))
+    results = ResultCache(str(tmp_path), max_bytes=250)
+    for key in ("a", "b"):
+        results.put(key, "x" * 100)
+    # a использовали недавно — вытесняется b
+    assert results.get("a")
+    results.put("c", "x" * 100)
+    assert sorted(results._index) == ["a", "c"]
+    assert sorted(os.listdir(results.dir)) == ["a.txt", "c.txt"]
+    # Запись больше лимита вытесняет все остальное
+    results.put("d", "x" * 240)
+    assert sorted(results._index) == ["d"]
+
+
+def test_result_cache_concurrent_jobs_keep_size_limit(tmp_path):
+    """Каждая задача со своим экземпляром: ни записи, ни лимит не теряются."""
+    errors = []
+
+    def job(i):
+        try:
+            ResultCache(str(tmp_path), max_bytes=1000).put(f"key{i:02d}", "x" * 100)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+    with open(os.path.join(str(tmp_path), "protocols.json")) as f:
+        index = json.load(f)
+    files = os.listdir(os.path.join(str(tmp_path), "protocols"))
+    assert len(index) == 10
+    assert sorted(files) == sorted(f"{key}.txt" for key in index)
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")] == []
+
+
+def test_digest_memo_shared_between_jobs(tmp_path):
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"part{i}.m4a"
+        path.write_bytes(os.urandom(1000))
+        paths.append(str(path))
+    cache_dir = str(tmp_path / "cache")
+    threads = [threading.Thread(target=DigestMemo(cache_dir).digest, args=(p,)) for p in paths]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    memo = DigestMemo(cache_dir)
+    assert len(memo._memo) == len(paths)
+    assert memo.digest(paths[0]) == file_digest(paths[0])
+    # Файл изменился — старая запись пути заменяется
+    with open(paths[0], "ab") as f:
+        f.write(b"more")
+    os.utime(paths[0], ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    assert memo.digest(paths[0]) == file_digest(paths[0])
+    assert sum(1 for key in DigestMemo(cache_dir)._memo if key.startswith(os.path.abspath(paths[0]) + "|")) == 1
+
+
+def test_remote_file_expiry(tmp_path):
+    remote = RemoteFileCache(str(tmp_path))
+    now = time.time()
+    remote.put("key|", "d1", "files/fresh", time.strftime("%Y-%m-%dT%H:%M:%S.123456789Z", time.gmtime(now + 2 * 3600)))
+    # Истекает раньше запаса — уже непригоден
+    remote.put("key|", "d2", "files/soon", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + REMOTE_FILE_MARGIN / 2)))
+    # Срок не пришел — считаем от загрузки
+    remote.put("key|", "d3", "files/default")
+
+    other = RemoteFileCache(str(tmp_path))
+    assert other.get("key|", "d1") == "files/fresh"
+    assert other.get("key|", "d2") is None
+    assert other.get("key|", "d3") == "files/default"
+    # Файлы видны только в своем аккаунте
+    assert other.get("other|", "d1") is None
+
+    other.forget("key|", "d1")
+    assert remote.get("key|", "d1") is None
+
+
+def test_remote_file_expired_entries_dropped(tmp_path):
+    remote = RemoteFileCache(str(tmp_path))
+    remote.put("key|", "old", "files/old", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 60)))
+    remote.put("key|", "new", "files/new")
+    with open(os.path.join(str(tmp_path), "remote_files.json")) as f:
+        names = [entry["name"] for entry in json.load(f).values()]
+    assert names == ["files/new"]
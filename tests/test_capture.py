@@ -0,0 +1,265 @@
+import time
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from steno.capture import (
+    SampleRing, SampleWorker, DROP_OLDEST, DROP_NEWEST, DROP_NON_KEY, OVERFLOW_POLICIES,
+    AdaptiveFrameGate, CaptureTelemetry, StreamStats, boost_fps_for, dirty_fraction,
+)
+
+
+def run_pipeline(ring, producers, per_producer, key_every=0, handler_delay=0.0, burst=0):
+    """
+    producers потоков кладут (номер потока, номер сэмпла) без пауз (или пачками
+    по burst с паузой 1 мс), писатель медленнее их. Возвращает обработанные
+    сэмплы по порядку и число отказов put().
+    """
+    handled = []
+
+    def handle(item):
+        handled.append(item)
+        if handler_delay:
+            time.sleep(handler_delay)
+
+    worker = SampleWorker("test", ring, handle).start()
+    rejected = [0] * producers
+    start = threading.Barrier(producers)
+
+    def produce(p):
+        start.wait()
+        for i in range(per_producer):
+            key = bool(key_every) and i % key_every == 0
+            if not ring.put((p, i), key=key):
+                rejected[p] += 1
+            if burst and i % burst == burst - 1:
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=produce, args=(p,)) for p in range(producers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    worker.stop(timeout=30)
+    assert not worker.thread.is_alive()
+    return handled, sum(rejected)
+
+
+@pytest.mark.parametrize("policy", OVERFLOW_POLICIES)
+def test_drop_accounting_under_load(policy):
+    producers, per_producer = 4, 20_000
+    ring = SampleRing(64, overflow=policy)
+
+    handled, rejected = run_pipeline(ring, producers, per_producer, key_every=50, handler_delay=0.00002)
+    stats = ring.stats()
+
+    total = producers * per_producer
+    assert stats["put"] == total
+    # Каждый сэмпл либо записан, либо учтен как сброшенный — ничего не теряется молча
+    assert stats["got"] == len(handled)
+    assert len(handled) + stats["dropped"] == total
+    assert stats["dropped"] > 0
+    assert stats["max_depth"] <= ring.capacity
+    assert stats["depth"] == 0
+    # Отказ put() — только когда сброшен сам новый сэмпл
+    if policy == DROP_OLDEST:
+        assert rejected == 0
+    else:
+        assert rejected <= stats["dropped"]
+    # Порядок сэмплов каждого источника сохраняется
+    for p in range(producers):
+        sequence = [i for q, i in handled if q == p]
+        assert sequence == sorted(sequence)
+    assert len(set(handled)) == len(handled)
+
+
+def test_drop_oldest_keeps_latest():
+    ring = SampleRing(8, overflow=DROP_OLDEST)
+    for i in range(100):
+        ring.put(i)
+    ring.close()
+    assert [ring.get() for _ in range(8)] == list(range(92, 100))
+    assert ring.get() is None
+    assert ring.dropped == 92
+
+
+def test_drop_newest_keeps_earliest():
+    ring = SampleRing(8, overflow=DROP_NEWEST)
+    accepted = [ring.put(i) for i in range(100)]
+    assert accepted == [True] * 8 + [False] * 92
+    ring.close()
+    assert [ring.get() for _ in range(9)] == list(range(8)) + [None]
+
+
+def test_drop_non_key_keeps_key_samples_under_load():
+    # Писатель не успевает за всеми кадрами, но успевает за ключевыми
+    ring = SampleRing(16, overflow=DROP_NON_KEY)
+    handled, _ = run_pipeline(ring, producers=2, per_producer=10_000, key_every=25, handler_delay=0.0001, burst=25)
+    keys = {(p, i) for p in range(2) for i in range(0, 10_000, 25)}
+    assert ring.dropped > 0
+    assert keys <= set(handled)
+
+
+def test_drop_non_key_when_full_of_keys():
+    ring = SampleRing(2, overflow=DROP_NON_KEY)
+    ring.put("k1", key=True)
+    ring.put("k2", key=True)
+    assert ring.put("frame") is False
+    assert ring.put("k3", key=True) is True
+    ring.close()
+    assert [ring.get(), ring.get(), ring.get()] == ["k2", "k3", None]
+    assert ring.dropped == 2
+
+
+def test_put_after_close_is_rejected_and_not_counted():
+    ring = SampleRing(4)
+    ring.put(1)
+    ring.close()
+    assert ring.put(2) is False
+    assert ring.stats()["put"] == 1
+    assert ring.get() == 1 and ring.get() is None
+
+
+def test_get_timeout():
+    ring = SampleRing(4)
+    started = time.monotonic()
+    assert ring.get(timeout=0.05) is None
+    assert time.monotonic() - started >= 0.05
+
+
+def test_worker_survives_handler_errors_and_wraps_each_sample():
+    wrapped = []
+
+    @contextmanager
+    def wrap():
+        wrapped.append(True)
+        yield
+
+    handled = []
+
+    def handle(item):
+        if item % 2:
+            raise RuntimeError("append failed")
+        handled.append(item)
+
+    ring = SampleRing(100)
+    worker = SampleWorker("test", ring, handle, wrap=wrap).start()
+    for i in range(10):
+        ring.put(i)
+    worker.stop()
+    assert handled == [0, 2, 4, 6, 8]
+    assert len(wrapped) == 10
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SampleRing(4, overflow="drop_everything")
+
+
+def offer_frames(gate, start, stop, rate, changed):
+    """Кадры с частотой rate на [start, stop): PTS пропущенных гейтом."""
+    kept = []
+    for i in range(int(round((stop - start) * rate))):
+        pts = start + i / rate
+        if gate.offer(pts, changed):
+            kept.append(round(pts, 3))
+    return kept
+
+
+def test_frame_gate_keepalive_on_static_screen():
+    # Статичный экран (и Idle-кадры SCK) — кадр раз в keepalive секунд
+    gate = AdaptiveFrameGate(10, keepalive=5.0)
+    assert offer_frames(gate, 0, 21, 30, changed=False) == [0, 5, 10, 15, 20]
+    assert gate.dropped_static == gate.delivered - 5
+    # Изменение после паузы пропускается сразу, отсчет keepalive — от него
+    assert gate.offer(21.5, changed=True)
+    assert offer_frames(gate, 21.6, 30, 30, changed=False) == [26.5]
+
+
+def test_frame_gate_boost_and_hold():
+    gate = AdaptiveFrameGate(10, boost_hold=1.0)
+    assert gate.boost_fps == 30
+    # Движение: SCK отдает 60 кадров/с, пишется не чаще boost_fps
+    kept = offer_frames(gate, 0, 2, 60, changed=True)
+    assert 58 <= len(kept) <= 61
+    assert gate.dropped_rate == 120 - len(kept)
+    assert gate.boosted > 0
+    # Движение кончилось: в течение boost_hold редкие изменения еще на повышенной частоте
+    last = kept[-1]
+    assert gate.offer(last + 0.05, changed=True)
+    # После boost_hold — снова не чаще fps
+    assert gate.offer(last + 1.5, changed=True)
+    assert not gate.offer(last + 1.55, changed=False)
+    assert gate.offer(last + 1.75, changed=True)
+    stats = gate.stats()
+    assert stats["delivered"] == stats["kept"] + stats["dropped_static"] + stats["dropped_rate"]
+
+
+def test_frame_gate_rate_limit_without_boost():
+    # Пресет уже на максимуме — повышать некуда
+    assert boost_fps_for(30) == 30 and boost_fps_for(60) == 60 and boost_fps_for(5) == 15
+    gate = AdaptiveFrameGate(30)
+    kept = offer_frames(gate, 0, 1, 120, changed=True)
+    assert 29 <= len(kept) <= 31
+    assert gate.boosted == 0
+
+
+def test_dirty_fraction():
+    assert dirty_fraction([], 100, 100) == 0.0
+    assert dirty_fraction([(0, 0, 10, 10), (50, 50, 10, 20)], 100, 100) == pytest.approx(0.03)
+    assert dirty_fraction([(0, 0, 200, 200)], 100, 100) == 1.0
+    assert dirty_fraction([(0, 0, 1, 1)], 0, 0) == 1.0
+
+
+def test_stream_stats_gaps_and_histogram():
+    stats = StreamStats("video", expected_interval=0.1)
+    for pts in (0.0, 0.1, 0.2, 0.5, 0.6):
+        stats.on_sample(pts)
+    assert stats.delivered == 5
+    assert stats.gaps == 1 and stats.max_gap == pytest.approx(0.3)
+    # Звук: ожидаемый интервал — длительность буфера
+    audio = StreamStats("mic")
+    audio.on_sample(0.0, 0.02)
+    audio.on_sample(0.03, 0.02)
+    audio.on_sample(0.2, 0.02)
+    assert audio.gaps == 1
+
+    for _ in range(98):
+        stats.on_handled(0.000050)
+    stats.on_handled(0.002)
+    stats.on_handled(0.002)
+    # Корзины — степени двойки в микросекундах: 50 мкс -> [32, 64), 2 мс -> [1024, 2048)
+    assert stats.percentile(0.5) == pytest.approx(64e-6)
+    assert stats.percentile(0.99) == pytest.approx(2048e-6)
+    assert StreamStats("empty").percentile(0.5) == 0.0
+
+
+def test_capture_telemetry_snapshot_and_log_interval():
+    class Log:
+        def __init__(self):
+            self.lines = []
+
+        def info(self, line):
+            self.lines.append(line)
+
+    log = Log()
+    telemetry = CaptureTelemetry(10, interval=30.0, log=log)
+    assert telemetry["video"].expected_interval == pytest.approx(0.1)
+    telemetry["video"].on_sample(0.0)
+    telemetry["video"].dropped_adaptive += 3
+    ring = SampleRing(4)
+    telemetry["mic"].queue = ring
+    ring.put(1)
+
+    snapshot = telemetry.snapshot()
+    assert set(snapshot) == {"video", "sys_audio", "mic"}
+    assert snapshot["video"]["delivered"] == 1 and snapshot["video"]["dropped_adaptive"] == 3
+    assert snapshot["mic"]["queue"]["put"] == 1 and snapshot["sys_audio"]["queue"] is None
+    assert "adaptive 3" in telemetry.summary()
+
+    # Первый вызов только запоминает время, дальше — не чаще interval
+    for now in (100.0, 110.0, 129.9, 130.0, 140.0, 160.0):
+        telemetry.maybe_log(now)
+    assert len(log.lines) == 2
+    assert log.lines[0].startswith("Capture stats: video: delivered 1")
@@ -0,0 +1,38 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+# Ядро грузится без PyObjC, rumps и SDK; тяжелое — лениво, при первом запросе
+CORE_MODULES = ["steno.config", "steno.pipeline", "steno.cli", "steno.live", "steno.jobs", "steno.index", "steno.search"]
+HEAVY_MODULES = ["google.genai", "httpx", "numpy", "rumps", "objc", "AppKit", "Foundation", "recorder"]
+# Бюджет на холодный импорт модуля (-X importtime, накопленное время), мс
+IMPORT_BUDGET_MS = 300
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+
+
+def _cumulative_ms(stderr, module):
+    """Накопленное время импорта module из вывода -X importtime."""
+    for line in stderr.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    raise AssertionError(f"{module} not in -X importtime output")
+
+
+@pytest.mark.parametrize("module", CORE_MODULES)
+def test_core_does_not_import_heavy_modules(module):
+    result = _run(f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    assert result.stdout.strip() == ""
+
+
+@pytest.mark.parametrize("module", ["steno.pipeline", "steno.cli"])
+def test_import_time_budget(module):
+    # Лучшее из трех запусков: первый может упираться в холодный кэш диска
+    best = min(_cumulative_ms(_run(f"import {module}").stderr, module) for _ in range(3))
+    assert best < IMPORT_BUDGET_MS, f"import {module} took {best:.0f} ms"
@@ -0,0 +1,131 @@
+import os
+import threading
+
+from steno.index import RecordingsIndex, RECORDING, PROTOCOL
+
+
+def touch(directory, name, mtime=None, data=b"x"):
+    # Как в приложении: готовый файл появляется в папке целиком (os.replace)
+    path = os.path.join(directory, name)
+    tmp = os.path.join(directory, "." + name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, path)
+    return path
+
+
+def test_incremental_refresh(tmp_path):
+    save_dir = str(tmp_path / "rec")
+    os.makedirs(save_dir)
+    touch(save_dir, "Meet_1.mp4", mtime=1000)
+    touch(save_dir, "Meet_1_mic.m4a", mtime=1000)
+    touch(save_dir, "Meet_2.mp4", mtime=2000)
+    touch(save_dir, ".Meet_3.live", mtime=3000)
+    index = RecordingsIndex(save_dir, path=None)
+
+    assert index.refresh() == ({"Meet_1.mp4", "Meet_2.mp4"}, set(), set())
+    assert index.recent(RECORDING) == ["Meet_2.mp4", "Meet_1.mp4"]
+    # Папка не менялась — изменений нет
+    assert index.refresh() == (set(), set(), set())
+
+    touch(save_dir, "Meet_1_protocol.txt", mtime=4000)
+    os.remove(os.path.join(save_dir, "Meet_2.mp4"))
+    assert index.refresh() == ({"Meet_1_protocol.txt"}, {"Meet_2.mp4"}, set())
+    assert index.recent(PROTOCOL) == ["Meet_1_protocol.txt"]
+    assert index.info("Meet_1.mp4")["has_protocol"]
+
+    # Атомарная перезапись протокола (новый inode) — измененный файл
+    touch(save_dir, "Meet_1_protocol.txt", data=b"new protocol")
+    assert index.refresh() == (set(), set(), {"Meet_1_protocol.txt"})
+
+
+def test_fresh_dir_mtime_is_not_trusted(tmp_path):
+    """Изменение в тот же тик mtime каталога, что и прошлый скан, не теряется."""
+    save_dir = str(tmp_path / "rec")
+    os.makedirs(save_dir)
+    touch(save_dir, "Meet_1.mp4")
+    index = RecordingsIndex(save_dir, path=None)
+    tick = os.stat(save_dir).st_mtime_ns
+    assert index.refresh()[0] == {"Meet_1.mp4"}
+    assert index.dir_mtime is None
+
+    # Грубые часы ФС: новый файл, а mtime каталога прежний
+    touch(save_dir, "Meet_2.mp4")
+    os.utime(save_dir, ns=(tick, tick))
+    assert index.refresh()[0] == {"Meet_2.mp4"}
+
+    # Давно измененной папке верим — скан пропускается
+    old = tick - 60 * 10**9
+    os.utime(save_dir, ns=(old, old))
+    index.refresh()
+    assert index.dir_mtime == old
+    touch(save_dir, "Meet_3.mp4")
+    os.utime(save_dir, ns=(old, old))
+    assert index.refresh() == (set(), set(), set())
+    assert index.refresh(force=True)[0] == {"Meet_3.mp4"}
+
+
+def test_index_persists(tmp_path):
+    save_dir = str(tmp_path / "rec")
+    os.makedirs(save_dir)
+    touch(save_dir, "Meet_1.mp4")
+    path = str(tmp_path / "index.json")
+    index = RecordingsIndex(save_dir, path=path)
+    index.refresh()
+    index.save()
+
+    reloaded = RecordingsIndex(save_dir, path=path)
+    assert reloaded.refresh() == (set(), set(), set())
+    assert reloaded.recent(RECORDING) == ["Meet_1.mp4"]
+    # Индекс другой папки не подхватывается
+    assert RecordingsIndex(str(tmp_path), path=path).files == {}
+
+
+def test_concurrent_refresh_and_fill_durations(tmp_path, monkeypatch):
+    """Меню (главный поток) и фоновые потоки обновляют индекс одновременно, пока папка меняется."""
+    from steno import media
+
+    save_dir = str(tmp_path / "rec")
+    os.makedirs(save_dir)
+    for i in range(200):
+        touch(save_dir, f"Meet_{i:04d}.mp4", mtime=1000 + i)
+    monkeypatch.setattr(media, "probe_media", lambda path: {"duration": 60.0})
+    index = RecordingsIndex(save_dir, path=str(tmp_path / "index.json"))
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        for i in range(200, 400):
+            touch(save_dir, f"Meet_{i:04d}.mp4", mtime=1000 + i)
+            touch(save_dir, f"Meet_{i - 200:04d}_protocol.txt", mtime=1000 + i)
+            if i % 3 == 0:
+                os.remove(os.path.join(save_dir, f"Meet_{i - 150:04d}.mp4"))
+        stop.set()
+
+    def reader(fn):
+        try:
+            while not stop.is_set():
+                fn()
+            fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=writer),
+        threading.Thread(target=reader, args=(index.refresh,)),
+        threading.Thread(target=reader, args=(lambda: (index.refresh(), index.recent(RECORDING), index.recent(PROTOCOL)),)),
+        threading.Thread(target=reader, args=(lambda: index.fill_durations(limit=20),)),
+        threading.Thread(target=reader, args=(index.save,)),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    assert errors == []
+
+    index.refresh()
+    expected = {n for n in os.listdir(save_dir)}
+    assert set(index.files) == expected
+    assert index.recent(RECORDING, 1) == ["Meet_0399.mp4"]
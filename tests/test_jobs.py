@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+
+from steno.jobs import (
+    Job, JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, MAX_FINISHED_JOBS,
+)
+
+
+def test_concurrent_completion(tmp_path):
+    """Рабочие потоки сохраняют очередь одновременно: ни одна готовая задача не становится упавшей."""
+    path = str(tmp_path / "jobs.json")
+    for _ in range(10):
+        changes = []
+        queue = JobQueue(lambda job: "ok", max_concurrent=8, path=path, on_change=changes.append)
+        queue.clear_finished()
+        jobs = [queue.submit(f"/rec/Meet_{i}.mp4") for i in range(MAX_FINISHED_JOBS)]
+        assert queue.wait_idle(timeout=10)
+        assert [job.state for job in jobs] == [JOB_DONE] * len(jobs)
+        assert all(job.result == "ok" and job.error is None for job in jobs)
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert {item["state"] for item in saved} == {JOB_DONE}
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_save_error_keeps_job_done(tmp_path):
+    queue = JobQueue(lambda job: "ok", path=str(tmp_path / "missing" / "jobs.json"))
+    job = queue.submit("/rec/Meet_1.mp4")
+    assert queue.wait_idle(timeout=5)
+    assert job.state == JOB_DONE and job.result == "ok"
+
+
+def test_worker_error_fails_job(tmp_path):
+    def worker(job):
+        raise RuntimeError("quota")
+
+    queue = JobQueue(worker, path=str(tmp_path / "jobs.json"))
+    job = queue.submit("/rec/Meet_1.mp4")
+    assert queue.wait_idle(timeout=5)
+    assert (job.state, job.error) == (JOB_FAILED, "quota")
+
+
+def test_cancel_queued_and_running(tmp_path):
+    started = threading.Event()
+    ran = []
+
+    def worker(job):
+        ran.append(job.video_path)
+        started.set()
+        while True:
+            job.report("Генерация")
+            job.cancel_event.wait(0.01)
+
+    queue = JobQueue(worker, max_concurrent=1, path=str(tmp_path / "jobs.json"))
+    running = queue.submit("/rec/Meet_1.mp4")
+    queued = queue.submit("/rec/Meet_2.mp4")
+    assert started.wait(5)
+    assert (running.state, queued.state) == (JOB_RUNNING, JOB_QUEUED)
+    # Повторная постановка активной записи не дублирует задачу
+    assert queue.submit("/rec/Meet_2.mp4") is queued
+
+    assert queue.cancel(queued.id)
+    assert queued.state == JOB_CANCELLED
+    assert queue.cancel(running.id)
+    assert queue.wait_idle(timeout=5)
+    assert running.state == JOB_CANCELLED
+    assert ran == ["/rec/Meet_1.mp4"]
+    assert not queue.cancel(running.id)
+
+
+def test_running_jobs_requeued_after_restart(tmp_path):
+    path = str(tmp_path / "jobs.json")
+    interrupted = Job("/rec/Meet_1.mp4", state=JOB_RUNNING, stage="Загрузка", progress=0.4)
+    done = Job("/rec/Meet_0.mp4", state=JOB_DONE, result="/rec/Meet_0_protocol.txt")
+    with open(path, "w") as f:
+        json.dump([done.to_dict(), interrupted.to_dict()], f)
+
+    ran = []
+    queue = JobQueue(lambda job: ran.append(job.id) or "ok", path=path)
+    restored = queue.get(interrupted.id)
+    assert (restored.state, restored.stage, restored.progress) == (JOB_QUEUED, "Прервано, повтор", 0.0)
+    assert queue.get(done.id).state == JOB_DONE
+
+    queue.start()
+    assert queue.wait_idle(timeout=5)
+    assert ran == [interrupted.id]
+    assert restored.state == JOB_DONE
@@ -0,0 +1,131 @@
+import json
+import time
+
+import pytest
+
+from steno.config import AI_MODELS, PROCESSING_MODES
+from steno.ledger import (
+    Ledger, LedgerEntry, summarize, format_report, estimate_job, estimate_table, format_estimate,
+    token_cost, STATUS_DONE, STATUS_FAILED, RECENT_COST_DAYS,
+)
+
+PRO, FLASH = "gemini-3-pro-preview", "gemini-3-flash-preview"
+
+
+class Usage:
+    def __init__(self, prompt, output, cached=0, total=None):
+        self.prompt_token_count = prompt
+        self.candidates_token_count = output
+        self.cached_content_token_count = cached
+        self.thoughts_token_count = 0
+        self.total_token_count = total or prompt + output
+
+
+def record(video, model, prompt, output, status=STATUS_DONE, started=None, **fields):
+    entry = LedgerEntry(f"/rec/{video}", {"processing_mode": "audio"})
+    entry.add_usage(model, Usage(prompt, output))
+    entry.data.update(status=status, started=started or time.time(), cost=entry.cost(), **fields)
+    return entry.data
+
+
+def test_token_cost():
+    # 1M входа pro: $2, 1M ответа: $12; кэш — по своей цене
+    assert token_cost(PRO, 1_000_000, 1_000_000) == pytest.approx(14.0)
+    assert token_cost(PRO, 1_000_000, cached=1_000_000) == pytest.approx(0.2)
+    assert token_cost(FLASH, 1_000_000, audio=1_000_000) == pytest.approx(1.0)
+    assert token_cost("unknown-model", 1000) is None
+    assert token_cost("unknown-model", 1_000_000, config={"model_prices": {"unknown-model": {"input": 1, "output": 1}}}) == 1.0
+
+
+def test_summarize():
+    records = [
+        record("Meet_1.mp4", PRO, 1_000_000, 10_000, duration=3600, bytes_uploaded=5_000_000),
+        record("Meet_2.mp4", FLASH, 2_000_000, 20_000, status=STATUS_FAILED, duration=1800),
+        record("Meet_3.mp4", PRO, 0, 0, cached_result=True),
+    ]
+    s = summarize(records)
+    assert (s["jobs"], s["failed"], s["cached"]) == (3, 1, 1)
+    assert s["media_seconds"] == 5400 and s["bytes_uploaded"] == 5_000_000
+    assert s["prompt_tokens"] == 3_000_000 and s["output_tokens"] == 30_000
+    assert s["cost"] == pytest.approx(2.12 + 1.06)
+    assert s["models"][PRO] == {"requests": 2, "total_tokens": 1_010_000, "cost": pytest.approx(2.12)}
+    assert s["models"][FLASH]["cost"] == pytest.approx(1.06)
+    assert summarize([])["jobs"] == 0
+
+
+def test_format_report():
+    started = time.mktime((2025, 3, 14, 10, 30, 0, 0, 0, -1))
+    records = [
+        record("Meet_1.mp4", PRO, 1_000_000, 10_000, duration=3600, started=started, stages={"upload": 12.4}),
+        record("Meet_2.mp4", FLASH, 2_000_000, 20_000, duration=3600, started=started + 60),
+    ]
+    lines = format_report(records, days=7, last=1).splitlines()
+    assert lines[0] == "Last 7 days: 2 jobs (0 failed, 0 from cache), 2.0 h of media, 0 MB uploaded"
+    assert lines[1] == "Tokens: 3,030,000 (in 3,000,000, cached 0, out 30,000)"
+    assert lines[2] == "Cost: ~$3.18 (~$1.59 per hour of meetings)"
+    # Модели — дорогие первыми; из последних задач — только last, новые первыми
+    assert lines[3].startswith(f"  {PRO}: 1 requests") and lines[4].startswith(f"  {FLASH}:")
+    assert lines[-1] == "  14.03 10:31 Meet_2.mp4 [done] 2,020,000 tokens ~$1.060"
+    assert "Meet_1.mp4" not in "\n".join(lines)
+    assert format_report([]).splitlines()[2] == "Cost: ~$0.00"
+
+
+def test_estimate_table():
+    config = {"prompt": "x" * 4000, "map_reduce": True, "map_reduce_window_minutes": 20}
+    rows = estimate_table(600, config)
+    assert len(rows) == len(PROCESSING_MODES) * len(AI_MODELS)
+    assert {(r["mode"], r["model"]) for r in rows} == {(m, a) for m in PROCESSING_MODES for a in AI_MODELS}
+    costs = [r["cost"] for r in rows]
+    assert costs == sorted(costs)
+    by_key = {(r["mode"], r["model"]): r for r in rows}
+    # Видео дороже только звука, pro дороже flash
+    assert by_key[("video", PRO)]["input_tokens"] > by_key[("slides", PRO)]["input_tokens"] > by_key[("audio", PRO)]["input_tokens"]
+    assert by_key[("audio", PRO)]["cost"] > by_key[("audio", FLASH)]["cost"]
+    assert not any(r["map_reduce"] for r in rows)
+
+    # Длинная встреча — map-reduce; конспекты окон считаются моделью map_model
+    long_config = dict(config, map_model=FLASH)
+    long = estimate_job(3 * 3600, "audio", PRO, long_config)
+    assert long["map_reduce"]
+    assert long["cost"] < estimate_job(3 * 3600, "audio", PRO, dict(config, map_reduce=False))["cost"]
+
+    text = format_estimate(600, rows, {"processing_mode": "audio", "model_name": FLASH})
+    assert text.splitlines()[0] == "Estimate for 10 min of media:"
+    assert sum(line.startswith(" *") for line in text.splitlines()) == 1
+
+
+def test_recent_cost_running_total(tmp_path):
+    path = str(tmp_path / "ledger.jsonl")
+    ledger = Ledger(path)
+    now = time.time()
+    ledger.append(record("old.mp4", PRO, 1_000_000, 0, started=now - (RECENT_COST_DAYS + 1) * 86400))
+    ledger.append(record("Meet_1.mp4", PRO, 1_000_000, 0, started=now - 86400))
+    assert ledger.recent_cost() == pytest.approx(2.0)
+
+    # Дописано через этот процесс — итог обновлен без чтения журнала
+    Ledger(path).append(record("Meet_2.mp4", FLASH, 1_000_000, 0))
+    assert Ledger._recent[path]["offset"] == len(open(path, "rb").read())
+    assert Ledger(path).recent_cost() == pytest.approx(2.5)
+
+    # Дописал другой процесс (в том числе недописанная строка) — подхватываются только целые строки
+    line = json.dumps(record("Meet_3.mp4", FLASH, 2_000_000, 0))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n" + line[:10])
+    assert ledger.recent_cost() == pytest.approx(3.5)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[10:] + "\n")
+    assert ledger.recent_cost() == pytest.approx(4.5)
+
+    # Окно сдвигается со временем
+    assert ledger.recent_cost(now=now + (RECENT_COST_DAYS - 0.5) * 86400) == pytest.approx(2.5)
+    assert [r["video"] for r in ledger.entries()] == ["old.mp4", "Meet_1.mp4", "Meet_2.mp4", "Meet_3.mp4", "Meet_3.mp4"]
+
+
+def test_recent_cost_missing_or_truncated(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    ledger = Ledger(str(path))
+    assert ledger.recent_cost() == 0.0
+    ledger.append(record("Meet_1.mp4", PRO, 1_000_000, 0))
+    assert ledger.recent_cost() == pytest.approx(2.0)
+    path.write_text("")
+    assert ledger.recent_cost() == 0.0
@@ -0,0 +1,69 @@
+import os
+import time
+import threading
+
+import pytest
+
+from steno.config import DEFAULT_CONFIG
+from steno.fakeapi import serve
+from steno.jobs import Job, JobCancelled
+from steno.live import LiveSession
+
+
+def make_config(base_url):
+    # Режим video: куски уходят как есть, без ffmpeg
+    return dict(
+        DEFAULT_CONFIG, api_key="fake", base_url=base_url, processing_mode="video",
+        dual_track=True, map_reduce=False, rate_limit_rpm=0, rate_limit_tpm=0
+    )
+
+
+def add_segment(live, tmp_path, index, size, segment_seconds=300):
+    path = tmp_path / f"main_{index:04d}.mp4"
+    path.write_bytes(os.urandom(size))
+    live.on_segment({
+        "track": "main", "index": index, "path": str(path),
+        "start": index * segment_seconds, "duration": float(segment_seconds),
+    })
+
+
+def test_protocol_right_after_stop(tmp_path, fake_api):
+    base_url, state = fake_api
+    video_path = str(tmp_path / "Meet_x.mp4")
+    live = LiveSession(video_path, make_config(base_url))
+    for index in range(3):
+        add_segment(live, tmp_path, index, 100_000)
+    live.recording_stopped()
+
+    txt_path = live.finish(Job(video_path))
+
+    assert txt_path == str(tmp_path / "Meet_x_protocol.txt")
+    assert os.path.exists(txt_path)
+    assert len(live.parts) == 3
+    assert not os.path.isdir(live.work_dir)
+    # reuse_uploads выключен: загруженные куски удалены
+    assert state.files == {}
+
+
+def test_cancel_interrupts_segment_upload(tmp_path):
+    # 3 чанка по 8 МБ, каждый ~1 с
+    server, base_url, state = serve(processing_seconds=0.2, latency=0.01, upload_bandwidth=8.0)
+    try:
+        video_path = str(tmp_path / "Meet_x.mp4")
+        live = LiveSession(video_path, make_config(base_url))
+        job = Job(video_path)
+        add_segment(live, tmp_path, 0, 24_000_000)
+        live.recording_stopped()
+        threading.Timer(0.3, job.cancel_event.set).start()
+
+        started = time.monotonic()
+        with pytest.raises(JobCancelled):
+            live.finish(job)
+        assert time.monotonic() - started < 2.0
+        assert live.cancel_event.is_set()
+        # Сессия загрузки оборвана до конца файла
+        time.sleep(1.2)
+        assert all(u["received"] < 24_000_000 for u in state.uploads.values())
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from steno import pipeline
+from steno.config import DEFAULT_CONFIG
+from steno.media import split_media, probe_media, find_ffmpeg, _run_ffmpeg
+
+
+def fake_split(durations):
+    """split_media без ffmpeg: файл -> куски по window_seconds, длительность файла из durations."""
+    def split_media(path, window_seconds, out_dir):
+        count = -(-int(durations[path]) // window_seconds)
+        return [(f"{path}.w{i}", i * window_seconds) for i in range(count)]
+    return split_media
+
+
+def test_windows_cover_recording_without_gaps(monkeypatch):
+    # Микрофон включили позже — его дорожка короче
+    monkeypatch.setattr(pipeline, "split_media", fake_split({"main.m4a": 3000, "mic.m4a": 1300}))
+    windows = pipeline.split_into_windows(["main.m4a", "mic.m4a"], 1200, 3000, "/tmp")
+    assert [(start, end) for start, end, _ in windows] == [(0, 1200), (1200, 2400), (2400, 3000)]
+    # Окна стык в стык: конец одного — начало следующего, последнее — до конца записи
+    for (_, end, _), (start, _, _) in zip(windows, windows[1:]):
+        assert end == start
+    assert [paths for _, _, paths in windows] == [
+        ["main.m4a.w0", "mic.m4a.w0"], ["main.m4a.w1", "mic.m4a.w1"], ["main.m4a.w2"],
+    ]
+
+
+def test_window_slides_boundaries():
+    windows = [(0, 600, []), (600, 1200, []), (1200, 1500, [])]
+    slides = [("a.jpg", 0.0), ("b.jpg", 599.0), ("c.jpg", 600.0), ("d.jpg", 1499.0), ("e.jpg", 1500.5)]
+    assigned = [pipeline.window_slides(slides, windows, i) for i in range(len(windows))]
+    # Слайд на границе — в следующем окне; после конца записи — в последнем
+    assert [[name for name, _ in window] for window in assigned] == [["a.jpg", "b.jpg"], ["c.jpg"], ["d.jpg", "e.jpg"]]
+    # Каждый слайд ровно в одном окне
+    assert sorted(s for window in assigned for s in window) == sorted(slides)
+
+
+def test_map_reduce_windows_in_parallel(monkeypatch):
+    monkeypatch.setattr(pipeline, "split_media", fake_split({"speech.m4a": 5 * 600}))
+    lock = threading.Lock()
+    state = {"running": 0, "max_running": 0}
+    summarised = []
+    reduced = {}
+
+    def upload_and_wait(client, base_url, paths, digests, config, job=None, entry=None):
+        return list(paths)
+
+    def summarise_window(client, files, slides, index, start, end, config, entry=None):
+        with lock:
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        threading.Event().wait(0.02)
+        with lock:
+            state["running"] -= 1
+            summarised.append((index, start, end, files, slides))
+        return f"Заметки {index + 1}", 100
+
+    def run_generation(client, contents, config, writer, job=None, progress_range=None, entry=None):
+        reduced["contents"] = contents
+        return "Протокол", None
+
+    monkeypatch.setattr(pipeline, "upload_and_wait", upload_and_wait)
+    monkeypatch.setattr(pipeline, "summarise_window", summarise_window)
+    monkeypatch.setattr(pipeline, "run_generation", run_generation)
+    monkeypatch.setattr(pipeline, "delete_remote_files", lambda client, files: None)
+
+    config = dict(DEFAULT_CONFIG, map_reduce_window_minutes=10, map_reduce_concurrency=2)
+    slides = [("s1.jpg", 30.0), ("s2.jpg", 1250.0)]
+    text, tokens = pipeline.generate_map_reduce(
+        None, "", ["speech.m4a"], slides, 3000, "2025-03-14", config, writer=None
+    )
+    assert (text, tokens) == ("Протокол", 500)
+    assert state["max_running"] == 2
+    assert sorted((index, start, end, files) for index, start, end, files, _ in summarised) == [
+        (i, i * 600, (i + 1) * 600, [f"speech.m4a.w{i}"]) for i in range(5)
+    ]
+    assert {index: slides for index, _, _, _, slides in summarised if slides} == {0: [("s1.jpg", 30.0)], 2: [("s2.jpg", 1250.0)]}
+    # Заметки сводятся по порядку окон, с их границами
+    joined = reduced["contents"][0]
+    assert joined.index("Фрагмент 1 (00:00:00–00:10:00)") < joined.index("Фрагмент 5 (00:40:00–00:50:00)")
+    assert [line for line in joined.splitlines() if line.startswith("Заметки")] == [f"Заметки {i}" for i in range(1, 6)]
+
+
+@pytest.mark.skipif(find_ffmpeg() is None, reason="ffmpeg not found")
+def test_split_media_windows_add_up(tmp_path):
+    path = str(tmp_path / "speech.m4a")
+    result = _run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", "sine=frequency=440:duration=25", "-c:a", "aac", "-b:a", "32k", path,
+    ])
+    assert result.returncode == 0
+    segments = split_media(path, 10, str(tmp_path))
+    assert [start for _, start in segments] == [0, 10, 20]
+    durations = [probe_media(p)["duration"] for p, _ in segments]
+    # Окна не перекрываются и не теряют звук: в сумме — вся запись
+    assert durations[0] == pytest.approx(10, abs=0.1) and durations[1] == pytest.approx(10, abs=0.1)
+    assert sum(durations) == pytest.approx(probe_media(path)["duration"], abs=0.1)
@@ -0,0 +1,116 @@
+from steno import pipeline
+from steno.config import DEFAULT_CONFIG
+from steno.media import MediaError
+
+
+class FakeEntry:
+    def __init__(self):
+        self.fields = {}
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class FakeTimeMap:
+    trimmed_duration = 600.0
+
+
+def test_prepare_media_reports_video_fallback(tmp_path, monkeypatch):
+    video = tmp_path / "Meet_1.mp4"
+    video.write_bytes(b"video")
+    mic = tmp_path / "Meet_1_mic.m4a"
+    mic.write_bytes(b"mic")
+
+    def no_ffmpeg(*args, **kwargs):
+        raise MediaError("ffmpeg not found")
+
+    monkeypatch.setattr(pipeline, "extract_speech_audio", no_ffmpeg)
+    paths, slides, mode = pipeline.prepare_media(str(video), dict(DEFAULT_CONFIG, processing_mode="slides"))
+    assert (paths, slides, mode) == ([str(video), str(mic)], [], "video")
+
+    paths, slides, mode = pipeline.prepare_media(str(video), dict(DEFAULT_CONFIG, processing_mode="video"))
+    assert mode == "video" and len(paths) == 2
+
+
+def test_preflight_estimate_uses_prepared_mode(tmp_path):
+    # После trim_silence пути — временные файлы, исходного видео среди них нет
+    trimmed = [str(tmp_path / "trimmed_0.mp4"), str(tmp_path / "trimmed_1.m4a")]
+    config = dict(DEFAULT_CONFIG, processing_mode="audio")
+
+    video_entry = FakeEntry()
+    pipeline.preflight_estimate(trimmed, "video", FakeTimeMap(), config, video_entry)
+    audio_entry = FakeEntry()
+    pipeline.preflight_estimate(trimmed[:1], "audio", FakeTimeMap(), config, audio_entry)
+
+    assert video_entry.fields["mode"] == "video"
+    assert audio_entry.fields["mode"] == "audio"
+    assert video_entry.fields["duration"] == 600.0
+    assert video_entry.fields["estimate"]["input_tokens"] > audio_entry.fields["estimate"]["input_tokens"]
+
+
+def run_pipeline(monkeypatch, video, config, trim=None):
+    """process_video_with_ai без сети и ffmpeg: подготовка, обрезка и генерация подменены."""
+    calls = {"prepare": 0, "trim": 0, "generate": 0}
+
+    def prepare_media(video_path, config):
+        calls["prepare"] += 1
+        return [video_path], [], "video"
+
+    def trim_silence(paths, out_dir, config):
+        calls["trim"] += 1
+        return paths, trim
+
+    def generate_protocol(paths, digests, slides, meeting_date, config, txt_path, job=None, entry=None):
+        calls["generate"] += 1
+        return "00:00:05 Открытие", 0
+
+    monkeypatch.setattr(pipeline, "prepare_media", prepare_media)
+    monkeypatch.setattr(pipeline, "trim_silence", trim_silence)
+    monkeypatch.setattr(pipeline, "generate_protocol", generate_protocol)
+    monkeypatch.setattr(pipeline, "preflight_estimate", lambda *args: None)
+    txt_path = pipeline.process_video_with_ai(str(video), config)
+    with open(txt_path, encoding="utf-8") as f:
+        return f.read(), calls
+
+
+def test_cache_hit_skips_preparation(tmp_path, monkeypatch):
+    from steno.vad import TimeMap
+
+    video = tmp_path / "Meet_2025-01-01_10-00.mp4"
+    video.write_bytes(b"video")
+    (tmp_path / "Meet_2025-01-01_10-00_mic.m4a").write_bytes(b"mic")
+    config = dict(DEFAULT_CONFIG, api_key="fake", model_name="model-a")
+    time_map = TimeMap([(10, 20)], 100)
+
+    text, calls = run_pipeline(monkeypatch, video, config, trim=time_map)
+    assert text == "00:00:15 Открытие"
+    assert calls == {"prepare": 1, "trim": 1, "generate": 1}
+
+    # Повтор: готовый протокол без подготовки и перекодирования
+    text, calls = run_pipeline(monkeypatch, video, config, trim=time_map)
+    assert text == "00:00:15 Открытие"
+    assert calls == {"prepare": 0, "trim": 0, "generate": 0}
+
+    # Другие настройки обрезки, модель или новый микрофон — другой ключ
+    for changed in (dict(config, trim_min_silence_seconds=30), dict(config, trim_silence=False), dict(config, model_name="model-b")):
+        _, calls = run_pipeline(monkeypatch, video, changed, trim=time_map)
+        assert calls["generate"] == 1
+    (tmp_path / "Meet_2025-01-01_10-00_mic.m4a").write_bytes(b"new mic")
+    _, calls = run_pipeline(monkeypatch, video, config, trim=time_map)
+    assert calls["generate"] == 1
+
+
+def test_stale_timemap_removed(tmp_path, monkeypatch):
+    from steno.vad import TimeMap, TIMEMAP_SUFFIX
+
+    video = tmp_path / "Meet_1.mp4"
+    video.write_bytes(b"video")
+    timemap_path = tmp_path / ("Meet_1" + TIMEMAP_SUFFIX)
+    config = dict(DEFAULT_CONFIG, api_key="fake", model_name="model-a")
+
+    run_pipeline(monkeypatch, video, config, trim=TimeMap([(10, 20)], 100))
+    assert timemap_path.exists()
+    # Повторная обработка, в которой резать нечего: старое соответствие не остается рядом с протоколом
+    text, _ = run_pipeline(monkeypatch, video, dict(config, model_name="model-b"), trim=None)
+    assert text == "00:00:05 Открытие"
+    assert not timemap_path.exists()
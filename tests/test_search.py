@@ -0,0 +1,194 @@
+import os
+
+import pytest
+
+from steno.search import ProtocolSearch, parse_protocol, fts_query, format_item, DECISION, ACTION
+
+PROTOCOL = """# Протокол встречи: Бюджет на рекламу
+
+**Дата:** 14.03.2025
+**Участники:** Иван Петров, Мария Соколова
+
+## Обсуждение
+- Разобрали расходы прошлого квартала
+
+## Принятые решения
+1. Увеличить **бюджет** на рекламу в соцсетях
+2. Отказаться от баннеров
+* Перенести запуск на апрель
+
+## План действий
+| Задача | Ответственный | Срок |
+|---|---|---|
+| Подготовить медиаплан | Иван Петров | 21.03 |
+| Согласовать договор | - | - |
+| Обновить `лендинг` | Мария Соколова |
+"""
+
+
+def test_parse_protocol_decisions_and_actions():
+    parsed = parse_protocol(PROTOCOL)
+    assert parsed["title"] == "Бюджет на рекламу"
+    assert parsed["date"] == "14.03.2025"
+    assert parsed["participants"] == "Иван Петров, Мария Соколова"
+    # Пункты из раздела «Обсуждение» решениями не считаются
+    assert parsed["decisions"] == [
+        "Увеличить бюджет на рекламу в соцсетях", "Отказаться от баннеров", "Перенести запуск на апрель",
+    ]
+    assert parsed["actions"] == [
+        {"task": "Подготовить медиаплан", "owner": "Иван Петров", "due": "21.03"},
+        # "-" — ответственного и срока нет
+        {"task": "Согласовать договор", "owner": "", "due": ""},
+        # Короткая строка таблицы
+        {"task": "Обновить лендинг", "owner": "Мария Соколова", "due": ""},
+    ]
+
+
+def test_parse_protocol_tables_without_known_headers():
+    text = """# Встреча
+
+## Decisions
+| Решение | Комментарий |
+|:--|--:|
+| Выпустить версию 2.0 | после тестов |
+
+## Action items
+| # | Кто | Когда | Что |
+|---|---|---|---|
+| 1 | Анна | пятница | Написать релиз-ноты |
+
+## Задачи
+| Починить сборку | Олег | завтра |
+| Обновить документацию | Анна | - |
+"""
+    parsed = parse_protocol(text)
+    assert parsed["title"] == "Встреча"
+    assert parsed["decisions"] == ["Выпустить версию 2.0"]
+    # Колонки узнаются по заголовкам в любом порядке
+    assert parsed["actions"][0] == {"task": "Написать релиз-ноты", "owner": "Анна", "due": "пятница"}
+    # Таблица без заголовка (нет разделителя): все строки — задача, ответственный, срок по порядку
+    assert parsed["actions"][1:] == [
+        {"task": "Починить сборку", "owner": "Олег", "due": "завтра"},
+        {"task": "Обновить документацию", "owner": "Анна", "due": ""},
+    ]
+
+
+def test_parse_protocol_single_row_tables():
+    text = """## Решения
+| Оставить тариф |
+
+## План действий
+| Задача | Ответственный | Срок |
+"""
+    parsed = parse_protocol(text)
+    assert parsed["decisions"] == ["Оставить тариф"]
+    # Один заголовок без строк — задач нет
+    assert parsed["actions"] == []
+
+
+def test_fts_query():
+    assert fts_query("Бюджет на РЕКЛАМУ!") == '"бюджет"* "на"* "рекламу"*'
+    assert fts_query("  ,; ") == ""
+
+
+def write(path, text, mtime=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+@pytest.fixture
+def search(tmp_path):
+    search = ProtocolSearch(str(tmp_path / "search.db"))
+    yield search
+    search.close()
+
+
+def test_incremental_reindex(tmp_path, search, monkeypatch):
+    folder = tmp_path / "rec"
+    folder.mkdir()
+    path = write(folder / "Meet_1_protocol.txt", PROTOCOL, mtime=1_700_000_000)
+    write(folder / "Meet_1.mp4", "not a protocol")
+    assert search.backfill(str(folder)) == (1, 0)
+    assert search.backfill(str(folder)) == (0, 0)
+
+    reads = []
+    real_open = open
+
+    def counting_open(file, *args, **kwargs):
+        if str(file).endswith("_protocol.txt"):
+            reads.append(file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", counting_open)
+    # Тот же размер, другой mtime — перечитывается
+    edited = PROTOCOL.replace("апрель", "август")
+    write(folder / "Meet_1_protocol.txt", edited, mtime=1_700_000_100)
+    assert search.backfill(str(folder)) == (1, 0)
+    assert search.search("апрель") == []
+    # Тот же mtime, другой размер — перечитывается
+    write(folder / "Meet_1_protocol.txt", edited + "\nДополнение", mtime=1_700_000_100)
+    assert search.backfill(str(folder)) == (1, 0)
+    assert search.backfill(str(folder)) == (0, 0)
+    assert len(reads) == 2
+    monkeypatch.undo()
+
+    assert [r["name"] for r in search.search("август дополнение")] == ["Meet_1_protocol.txt"]
+    # Старые строки решений и задач заменены, а не добавлены
+    assert len(search.items(kind=DECISION)) == 3
+    assert len(search.items(kind=ACTION)) == 3
+    assert search.index_file(path, force=True)
+
+
+def test_backfill_removes_deleted_files(tmp_path, search):
+    folder = tmp_path / "rec"
+    nested = folder / "archive"
+    nested.mkdir(parents=True)
+    first = write(folder / "Meet_1_protocol.txt", PROTOCOL)
+    write(folder / "Meet_2_protocol.txt", PROTOCOL.replace("рекламу", "найм"))
+    write(nested / "Meet_0_protocol.txt", PROTOCOL)
+    assert search.backfill(str(nested)) == (1, 0)
+    assert search.backfill(str(folder)) == (2, 0)
+
+    os.remove(first)
+    assert search.backfill(str(folder)) == (0, 1)
+    # Протокол вложенной папки — не удаленный файл этой
+    names = sorted(r["name"] for r in search.search("протокол встречи"))
+    assert names == ["Meet_0_protocol.txt", "Meet_2_protocol.txt"]
+    assert {item["path"] for item in search.items()} == {str(folder / "Meet_2_protocol.txt"), str(nested / "Meet_0_protocol.txt")}
+
+
+def test_cyrillic_prefix_search(tmp_path, search):
+    write(tmp_path / "Meet_1_protocol.txt", PROTOCOL)
+    search.backfill(str(tmp_path))
+    # Другие падежи и регистр: «бюджета» не найдет «бюджет», но префикс «бюдж» — найдет
+    for query in ("бюдж", "БЮДЖЕТ", "реклам", "Соколов"):
+        assert [r["title"] for r in search.search(query)] == ["Бюджет на рекламу"], query
+    assert search.search("бюджет найм") == []
+    assert "[" in search.search("баннер")[0]["snippet"]
+
+    actions = search.items("иван", kind=ACTION)
+    assert [format_item(a) for a in actions] == ["Подготовить медиаплан (Иван Петров, 21.03)"]
+    assert [a["text"] for a in search.items("договор")] == ["Согласовать договор"]
+    assert [a["text"] for a in search.items("баннер", kind=DECISION)] == ["Отказаться от баннеров"]
+
+
+def test_like_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(ProtocolSearch, "_has_fts5", lambda self: False)
+    search = ProtocolSearch(str(tmp_path / "search.db"))
+    try:
+        assert not search.has_fts
+        write(tmp_path / "Meet_1_protocol.txt", PROTOCOL, mtime=1_700_000_000)
+        write(tmp_path / "Meet_2_protocol.txt", PROTOCOL.replace("рекламу", "найм"), mtime=1_700_000_100)
+        assert search.backfill(str(tmp_path)) == (2, 0)
+        # Регистр кириллицы складывается py_lower; новые протоколы первыми
+        assert [r["name"] for r in search.search("БЮДЖЕТ")] == ["Meet_2_protocol.txt", "Meet_1_protocol.txt"]
+        assert [r["name"] for r in search.search("бюджет рекламу")] == ["Meet_1_protocol.txt"]
+        assert search.search("") == []
+        actions = search.items("СОКОЛОВА", kind=ACTION)
+        assert [a["text"] for a in actions] == ["Обновить лендинг"] * 2
+        assert search.items("медиаплан иван", kind=ACTION)[0]["due"] == "21.03"
+        assert search.items("медиаплан иван", kind=DECISION) == []
+    finally:
+        search.close()
@@ -0,0 +1,167 @@
+import os
+
+import pytest
+
+from steno import segments
+from steno.media import MediaError
+from steno.segments import (
+    SegmentClock, SegmentManifest, stitch_segments, recover_recording, find_unfinished,
+    SEGMENT_COMPLETE, SEGMENT_FAILED, SEGMENT_RECORDING,
+)
+
+
+# --- SegmentClock ---
+
+def test_clock_rotates_on_first_frame_past_boundary():
+    clock = SegmentClock(segment_seconds=10)
+    assert not clock.started
+    assert clock.tick(100.0) is False
+    assert clock.started and clock.origin == 100.0
+
+    assert [clock.tick(pts) for pts in (101.0, 105.0, 109.96)] == [False, False, False]
+    # Кадры могут приходить не по порядку — last_pts не откатывается
+    clock.tick(108.0)
+    assert clock.elapsed() == pytest.approx(9.96)
+
+    assert clock.tick(110.04) is True
+    assert clock.rotate(110.04) == (0, pytest.approx(10.04))
+    assert clock.index == 1 and clock.segment_start == 110.04
+    assert clock.tick(115.0) is False
+    assert clock.tick(120.1) is True
+    assert clock.rotate(120.1) == (1, pytest.approx(10.06))
+
+
+def test_clock_without_rotation():
+    clock = SegmentClock(segment_seconds=0)
+    clock.tick(0.0)
+    assert clock.tick(10_000.0) is False
+    assert clock.elapsed() == 10_000.0
+
+
+# --- Манифест ---
+
+def make_manifest(tmp_path, on_segment=None):
+    outputs = {"main": str(tmp_path / "Meet_x.mp4"), "mic": str(tmp_path / "Meet_x_mic.m4a")}
+    return SegmentManifest.create(outputs, segment_seconds=10, on_segment=on_segment)
+
+
+def write_segment(manifest, track, index, data, start=0.0, duration=10.0, status=SEGMENT_COMPLETE):
+    ext = ".mp4" if track == "main" else ".m4a"
+    path = manifest.segment_path(track, index, ext)
+    with open(path, "wb") as f:
+        f.write(data)
+    manifest.open_segment(track, index, path, start=start)
+    if status != SEGMENT_RECORDING:
+        manifest.close_segment(track, index, duration, ok=status == SEGMENT_COMPLETE)
+    return path
+
+
+def test_manifest_survives_reload(tmp_path):
+    closed = []
+    manifest = make_manifest(tmp_path, on_segment=closed.append)
+    write_segment(manifest, "main", 0, b"a", start=0.0)
+    write_segment(manifest, "mic", 0, b"b", start=0.0, status=SEGMENT_FAILED)
+    write_segment(manifest, "main", 1, b"c", start=10.0, status=SEGMENT_RECORDING)
+
+    # Слушатель получает только успешно закрытые куски, с абсолютным путем
+    assert [(e["track"], e["index"]) for e in closed] == [("main", 0)]
+    assert closed[0]["path"] == manifest.segment_path("main", 0, ".mp4")
+    assert not manifest.all_closed()
+
+    # Как после падения: новый процесс читает manifest.json с диска
+    reloaded = SegmentManifest.load(manifest.directory)
+    assert reloaded.outputs == manifest.outputs
+    assert [(e["track"], e["index"], e["status"]) for e in reloaded.segments()] == [
+        ("main", 0, SEGMENT_COMPLETE), ("main", 1, SEGMENT_RECORDING), ("mic", 0, SEGMENT_FAILED),
+    ]
+    assert reloaded.segments("main", SEGMENT_COMPLETE)[0]["duration"] == 10.0
+    assert not reloaded.is_finished()
+    assert find_unfinished(str(tmp_path)) == [manifest.directory]
+
+    reloaded.close_segment("main", 1, 4.5)
+    reloaded.mark_stopped()
+    assert SegmentManifest.load(os.path.join(manifest.directory, "manifest.json")).is_finished()
+
+
+# --- Склейка и восстановление (ffmpeg заменен на операции с байтами) ---
+
+@pytest.fixture
+def fake_media(monkeypatch):
+    def probe_media(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data.startswith(b"broken"):
+            raise MediaError("moov atom not found")
+        return {"duration": float(len(data))}
+
+    def remux_media(src, dst):
+        with open(src, "rb") as f:
+            data = f.read()
+        if data.startswith(b"garbage"):
+            raise MediaError("invalid data")
+        with open(dst, "wb") as f:
+            f.write(data.replace(b"broken", b"fixed:"))
+        return dst
+
+    def concat_media(parts, out_path):
+        with open(out_path, "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    out.write(f.read())
+        return out_path
+
+    monkeypatch.setattr(segments, "probe_media", probe_media)
+    monkeypatch.setattr(segments, "remux_media", remux_media)
+    monkeypatch.setattr(segments, "concat_media", concat_media)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_stitch_skips_unclosed_segments_without_repair(tmp_path, fake_media):
+    manifest = make_manifest(tmp_path)
+    write_segment(manifest, "main", 0, b"[0]")
+    write_segment(manifest, "main", 1, b"[1]", status=SEGMENT_RECORDING)
+    write_segment(manifest, "main", 2, b"[2]")
+
+    results = stitch_segments(manifest)
+
+    assert results == {"main": manifest.outputs["main"]}
+    assert read(results["main"]) == b"[0][2]"
+    assert not os.path.isdir(manifest.directory)
+
+
+def test_recover_repairs_and_skips_failed_segments(tmp_path, fake_media):
+    manifest = make_manifest(tmp_path)
+    write_segment(manifest, "main", 0, b"[0]")
+    # Писатель не успел закрыть файл, но перепаковка его чинит
+    write_segment(manifest, "main", 1, b"broken[1]", status=SEGMENT_FAILED)
+    # Кусок не читается даже после перепаковки
+    write_segment(manifest, "main", 2, b"garbage", status=SEGMENT_FAILED)
+    write_segment(manifest, "main", 3, b"", status=SEGMENT_COMPLETE)
+    write_segment(manifest, "main", 4, b"broken[4]", status=SEGMENT_RECORDING)
+    write_segment(manifest, "mic", 0, b"garbage", status=SEGMENT_RECORDING)
+    # Приложение упало: ни остановки, ни склейки
+
+    results = recover_recording(manifest.directory, keep_segments=True)
+
+    assert results == {"main": manifest.outputs["main"]}
+    assert read(results["main"]) == b"[0]fixed:[1]fixed:[4]"
+    assert not os.path.exists(manifest.outputs["mic"])
+    assert SegmentManifest.load(manifest.directory).data["stitched"]
+    # Повторный запуск ничего не склеивает заново
+    assert recover_recording(manifest.directory) == {"main": manifest.outputs["main"]}
+
+
+def test_single_segment_is_copied(tmp_path, fake_media):
+    manifest = make_manifest(tmp_path)
+    write_segment(manifest, "main", 0, b"only")
+    write_segment(manifest, "mic", 0, b"mic")
+    manifest.mark_stopped()
+
+    results = stitch_segments(manifest)
+
+    assert read(results["main"]) == b"only"
+    assert read(results["mic"]) == b"mic"
@@ -0,0 +1,114 @@
+import os
+import random
+
+import pytest
+
+from steno import media
+from steno.media import (
+    distinct_frames, extract_slides, find_ffmpeg, _run_ffmpeg, _dhash, SLIDE_HASH_SIZE, SLIDE_THRESHOLD,
+)
+
+SIZE = SLIDE_HASH_SIZE
+WIDTH = SIZE + 1
+
+
+def slide(seed):
+    """Серый кадр (SIZE+1) x SIZE: соседние пиксели строки различаются не меньше чем на 12."""
+    rng = random.Random(seed)
+    return [value for _ in range(SIZE) for value in rng.sample(range(10, 250, 12), WIDTH)]
+
+
+def noisy(pixels, seed, amount=3):
+    """Шум сжатия: яркость каждого пикселя чуть плавает."""
+    rng = random.Random(seed)
+    return [p + rng.randint(-amount, amount) for p in pixels]
+
+
+def brighter(pixels, delta):
+    return [min(255, p + delta) for p in pixels]
+
+
+def with_cursor(pixels):
+    """Курсор или мигающая каретка — один квадратик 2x2."""
+    pixels = list(pixels)
+    for y in (5, 6):
+        for x in (7, 8):
+            pixels[y * WIDTH + x] = 255
+    return pixels
+
+
+def frames(*images):
+    return bytes(max(0, min(255, p)) for image in images for p in image)
+
+
+def bits(a, b):
+    return bin(_dhash(bytes(a), SIZE) ^ _dhash(bytes(b), SIZE)).count("1")
+
+
+def test_dhash_ignores_noise_and_brightness():
+    a, b = slide(1), slide(2)
+    assert bits(a, noisy(a, 7)) == 0
+    # dHash сравнивает соседние пиксели — общий сдвиг яркости его не меняет
+    assert bits(a, brighter(a, 15)) == 0
+    # Квадратик 2x2 меняет не больше трех сравнений в каждой из двух строк
+    assert bits(a, with_cursor(a)) <= 6 < SLIDE_THRESHOLD
+    # Другой слайд — около половины из SIZE*SIZE бит
+    assert bits(a, b) > SIZE * SIZE // 4
+
+
+def test_duplicate_slides_suppressed():
+    a, b = slide(1), slide(2)
+    data = frames(
+        a, noisy(a, 1), brighter(a, 15), with_cursor(a),   # 0-3: один слайд
+        b, noisy(b, 2), b,                                 # 4-6: следующий
+        a,                                                 # 7: вернулись к первому
+    )
+    assert distinct_frames(data) == [0, 4, 7]
+    # Порог выше любого различия — только первый кадр; нулевой — каждый измененный
+    assert distinct_frames(data, threshold=SIZE * SIZE) == [0]
+    assert distinct_frames(data, threshold=0) == [0, 3, 4, 7]
+    # Хвост неполного кадра не считается
+    assert distinct_frames(data + b"\0" * 10) == [0, 4, 7]
+    assert distinct_frames(b"") == []
+
+
+def test_gradual_change_compared_with_last_kept():
+    # Медленная анимация: каждый кадр чуть отличается от предыдущего, но
+    # сравнение идет с последним сохраненным — накопленное изменение дает новый слайд
+    a, b = slide(1), slide(2)
+    steps = []
+    for k in range(SIZE + 1):
+        rows = b[:k * WIDTH] + a[k * WIDTH:]
+        steps.append(rows)
+    kept = distinct_frames(frames(*steps))
+    assert kept[0] == 0 and len(kept) >= 2
+    assert all(later - earlier > 1 for earlier, later in zip(kept, kept[1:]))
+
+
+@pytest.mark.skipif(find_ffmpeg() is None, reason="ffmpeg not found")
+def test_extract_slides_from_video(tmp_path, monkeypatch):
+    video = str(tmp_path / "Meet_1.mp4")
+    # Три статичных "слайда" по 3 секунды: полосы, цветные столбцы, снова полосы
+    result = _run_ffmpeg([
+        "-y", "-f", "lavfi", "-i", "smptebars=s=320x240:d=3:r=5",
+        "-f", "lavfi", "-i", "rgbtestsrc=s=320x240:d=3:r=5",
+        "-f", "lavfi", "-i", "smptebars=s=320x240:d=3:r=5",
+        "-filter_complex", "[0:v][1:v][2:v]concat=n=3:v=1:a=0", "-c:v", "mpeg4", "-q:v", "3", video,
+    ])
+    assert result.returncode == 0
+
+    slides = extract_slides(video)
+    assert [seconds for _, seconds in slides] == [0.0, 3.0, 6.0]
+    assert all(os.path.getsize(path) > 0 for path, _ in slides)
+
+    # Повторный вызов берет готовые слайды, видео не декодируется
+    def no_decode(*args, **kwargs):
+        raise AssertionError("video decoded again")
+
+    monkeypatch.setattr(media, "detect_slide_changes", no_decode)
+    assert extract_slides(video) == slides
+    monkeypatch.undo()
+
+    # Больше max_count смен — равномерное прореживание
+    thinned = extract_slides(video, out_dir=str(tmp_path / "thinned"), max_count=2)
+    assert [seconds for _, seconds in thinned] == [0.0, 3.0]
@@ -0,0 +1,78 @@
+import os
+import re
+
+import pytest
+
+from steno import pipeline
+from steno.config import DEFAULT_CONFIG
+from steno.media import extract_speech_audio, probe_media, find_ffmpeg, _run_ffmpeg, MediaError, SPEECH_SAMPLE_RATE
+
+pytestmark = pytest.mark.skipif(find_ffmpeg() is None, reason="ffmpeg not found")
+
+
+def make_media(path, video=0, tones=()):
+    """Синтетическая запись: video секунд картинки и по звуковой дорожке на каждый (частота, секунды)."""
+    args = ["-y"]
+    if video:
+        args += ["-f", "lavfi", "-i", f"testsrc=s=640x360:r=10:d={video}"]
+    for frequency, seconds in tones:
+        args += ["-f", "lavfi", "-i", f"sine=frequency={frequency}:duration={seconds}"]
+    for i in range(len(tones) + bool(video)):
+        args += ["-map", str(i)]
+    if video:
+        args += ["-c:v", "mpeg4", "-q:v", "2"]
+    args += ["-c:a", "aac", "-b:a", "128k", str(path)]
+    assert _run_ffmpeg(args).returncode == 0
+    return str(path)
+
+
+def audio_format(path):
+    stream = re.search(r"Audio: (.*)", _run_ffmpeg(["-i", path]).stderr).group(1)
+    return f"{SPEECH_SAMPLE_RATE} Hz" in stream, "mono" in stream
+
+
+def test_speech_audio_mixes_main_and_mic(tmp_path):
+    video = make_media(tmp_path / "Meet_1.mp4", video=4, tones=[(440, 4)])
+    mic = make_media(tmp_path / "Meet_1_mic.m4a", tones=[(880, 7)])
+
+    speech = extract_speech_audio(video, mic)
+    assert speech == str(tmp_path / "Meet_1_speech.m4a")
+    info = probe_media(speech)
+    # Оба источника сведены: длина — по более длинному (микрофону), видео нет
+    assert info["duration"] == pytest.approx(7, abs=0.2)
+    assert not info["has_video"] and info["audio_streams"] == 1
+    assert audio_format(speech) == (True, True)
+    assert not os.path.exists(speech + ".tmp.m4a")
+
+    # Новее исходников — переиспользуется; исходник изменился — сводится заново
+    stamp = os.path.getmtime(speech)
+    assert extract_speech_audio(video, mic) == speech and os.path.getmtime(speech) == stamp
+    os.utime(mic, (stamp + 10, stamp + 10))
+    extract_speech_audio(video, mic)
+    assert os.path.getmtime(speech) > stamp
+
+
+def test_speech_audio_dual_track_file(tmp_path):
+    # Запись dual_track: системный звук и микрофон — две дорожки одного файла
+    video = make_media(tmp_path / "Meet_2.mp4", video=3, tones=[(440, 3), (880, 6)])
+    speech = extract_speech_audio(video)
+    assert probe_media(speech)["duration"] == pytest.approx(6, abs=0.2)
+
+
+def test_speech_audio_without_sound(tmp_path):
+    video = make_media(tmp_path / "Meet_3.mp4", video=2)
+    with pytest.raises(MediaError):
+        extract_speech_audio(video)
+
+
+def test_audio_mode_uploads_speech_instead_of_video(tmp_path):
+    video = make_media(tmp_path / "Meet_4.mp4", video=10, tones=[(440, 10)])
+    mic = make_media(tmp_path / "Meet_4_mic.m4a", tones=[(880, 10)])
+
+    paths, slides, mode = pipeline.prepare_media(video, dict(DEFAULT_CONFIG, processing_mode="audio"))
+    assert (paths, slides, mode) == ([str(tmp_path / "Meet_4_speech.m4a")], [], "audio")
+    assert os.path.getsize(paths[0]) * 5 < os.path.getsize(video) + os.path.getsize(mic)
+
+    # Видео — только по запросу
+    paths, _, mode = pipeline.prepare_media(video, dict(DEFAULT_CONFIG, processing_mode="video"))
+    assert (paths, mode) == ([video, mic], "video")
@@ -0,0 +1,53 @@
+import os
+
+from steno.streaming import ProtocolWriter, PARTIAL_NOTE, partial_path_for
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_partial_until_finished(tmp_path):
+    path = str(tmp_path / "Meet_x_protocol.txt")
+    writer = ProtocolWriter(path, interval=0)
+
+    writer.append("# Протокол\n")
+    writer.append("Саммари")
+
+    # Как после kill -9 посреди генерации: итогового файла нет
+    assert not os.path.exists(path)
+    assert read(partial_path_for(path)) == "# Протокол\nСаммари"
+
+    assert writer.finish() == path
+    assert read(path) == "# Протокол\nСаммари"
+    assert not os.path.exists(partial_path_for(path))
+
+
+def test_finish_with_full_text(tmp_path):
+    path = str(tmp_path / "Meet_x_protocol.txt")
+    writer = ProtocolWriter(path, interval=60)
+    writer.append("черновик")
+    writer.finish("итог")
+    assert read(path) == "итог"
+
+
+def test_abort_keeps_previous_protocol(tmp_path):
+    path = str(tmp_path / "Meet_x_protocol.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("прошлый протокол")
+    writer = ProtocolWriter(path, interval=0)
+    writer.append("новый, недописанный")
+
+    assert read(path) == "прошлый протокол"
+    assert writer.abort() == partial_path_for(path)
+    assert read(path) == "прошлый протокол"
+    assert read(partial_path_for(path)) == "новый, недописанный" + PARTIAL_NOTE
+
+
+def test_abort_without_text_leaves_nothing(tmp_path):
+    path = str(tmp_path / "Meet_x_protocol.txt")
+    writer = ProtocolWriter(path, interval=0)
+    writer.flush()
+    assert writer.abort() is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,169 @@
+import threading
+
+from steno.jobs import JOB_DONE, JOB_FAILED, JOB_RUNNING
+from steno.ui import (
+    UIStateMachine, ManualLoop, EV_START_REQUESTED, EV_STARTED, EV_START_FAILED, EV_STOP_REQUESTED,
+    EV_SAVED, EV_JOB_CHANGED, EV_FILES_CHANGED, EV_RECOVERED, EV_ALERT, TITLE_START, TITLE_STOP,
+    ICON_IDLE, ICON_RECORDING, ICON_PROCESSING, ICON_ERROR, FLASH_TOGGLES, FLASH_INTERVAL,
+)
+
+
+class FakeView:
+    """Отрисовка без rumps: запоминает вызовы и поток, из которого они пришли."""
+
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+
+    def _record(self, *call):
+        self.calls.append(call)
+        self.threads.add(threading.current_thread())
+
+    def show_icon(self, icon):
+        self._record("icon", icon)
+
+    def set_record_title(self, title):
+        self._record("title", title)
+
+    def refresh_queue(self):
+        self._record("queue")
+
+    def refresh_files(self):
+        self._record("files")
+
+    def update_tokens(self):
+        self._record("tokens")
+
+    def notify(self, title, subtitle, message):
+        self._record("notify", title, message)
+
+    def alert(self, title, message):
+        self._record("alert", title)
+
+    def take(self):
+        calls, self.calls = self.calls, []
+        return calls
+
+
+def make_ui():
+    loop = ManualLoop()
+    view = FakeView()
+    ui = UIStateMachine(loop, view)
+    ui.render()
+    assert view.take() == [("icon", ICON_IDLE), ("title", TITLE_START)]
+    return loop, view, ui
+
+
+def test_record_cycle():
+    loop, view, ui = make_ui()
+
+    ui.send(EV_START_REQUESTED)
+    assert ui.recording
+    assert view.take() == [("icon", ICON_RECORDING), ("title", TITLE_STOP)]
+    # Повторный клик, пока захват стартует, ничего не меняет
+    ui.send(EV_START_REQUESTED)
+    assert view.take() == []
+
+    ui.post(EV_STARTED)
+    assert view.take() == []
+    loop.run_pending()
+    assert view.take() == []
+
+    # Stop: кнопка сразу доступна, пока файлы дописываются — иконка обработки
+    ui.send(EV_STOP_REQUESTED, pending=True)
+    assert not ui.recording
+    assert view.take() == [("icon", ICON_PROCESSING), ("title", TITLE_START)]
+
+    ui.post(EV_SAVED, name="Meet_1.mp4", ok=True)
+    loop.run_pending()
+    assert view.take() == [("notify", "Готово", "Meet_1.mp4"), ("files", ), ("icon", ICON_IDLE)]
+
+
+def test_start_failed_alerts_once():
+    loop, view, ui = make_ui()
+    ui.send(EV_START_REQUESTED)
+    view.take()
+    ui.post(EV_START_FAILED, error="no permission")
+    ui.post(EV_START_FAILED, error="no permission")
+    loop.run_pending()
+    assert view.take() == [("alert", "Recording Error"), ("icon", ICON_IDLE), ("title", TITLE_START)]
+    # Запоздалый started после ошибки запись не включает
+    ui.post(EV_STARTED)
+    loop.run_pending()
+    assert not ui.recording
+
+
+def test_failed_job_flashes_icon():
+    loop, view, ui = make_ui()
+    ui.post(EV_JOB_CHANGED, state=JOB_RUNNING, name="Meet_1.mp4", active=1)
+    loop.run_pending()
+    assert ("icon", ICON_PROCESSING) in view.take()
+
+    ui.post(EV_JOB_CHANGED, state=JOB_FAILED, name="Meet_1.mp4", error="quota", active=0)
+    loop.run_pending()
+    calls = view.take()
+    assert ("notify", "AI Ошибка", "quota") in calls
+    assert ("icon", ICON_ERROR) in calls
+
+    icons = []
+    for _ in range(FLASH_TOGGLES):
+        loop.advance(FLASH_INTERVAL)
+        icons += [c[1] for c in view.take() if c[0] == "icon"]
+    # Иконка чередуется и в конце возвращается к обычной
+    assert icons[-1] == ICON_IDLE
+    assert all(a != b for a, b in zip(icons, icons[1:]))
+    assert ui.flash_left == 0
+    loop.advance(FLASH_INTERVAL * 4)
+    assert view.take() == []
+
+
+def test_job_progress_coalesced():
+    loop, view, ui = make_ui()
+    for i in range(50):
+        ui.post(EV_JOB_CHANGED, state=JOB_RUNNING, name="Meet_1.mp4", active=1)
+    ui.post(EV_JOB_CHANGED, state=JOB_DONE, name="Meet_1.mp4", result="Meet_1_protocol.txt", active=0)
+    loop.run_pending()
+    calls = view.take()
+    assert calls.count(("queue", )) == 1
+    assert ("notify", "Готово!", "Файл: Meet_1_protocol.txt") in calls
+    assert ("tokens", ) in calls
+
+
+def test_alert_from_background_work():
+    """Оценка стоимости считается в фоне, окно показывает цикл главного потока."""
+    loop, view, ui = make_ui()
+    worker = threading.Thread(target=ui.post, args=(EV_ALERT,), kwargs={"title": "Оценка стоимости", "message": "..."})
+    worker.start()
+    worker.join()
+    assert view.calls == []
+    loop.run_pending()
+    assert view.take() == [("alert", "Оценка стоимости")]
+
+
+def test_events_from_threads_render_on_loop():
+    """Колбэки рекордера, очереди и восстановления шлют события из своих потоков; view трогает только цикл."""
+    loop, view, ui = make_ui()
+    ui.send(EV_START_REQUESTED)
+    ui.send(EV_STOP_REQUESTED, pending=True)
+    view.take()
+
+    def worker(i):
+        ui.post(EV_JOB_CHANGED, state=JOB_RUNNING, name=f"Meet_{i}.mp4", active=1)
+        ui.post(EV_RECOVERED, name=f"Meet_{i}.mp4")
+        ui.post(EV_FILES_CHANGED)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    threads.append(threading.Thread(target=ui.post, args=(EV_SAVED,), kwargs={"name": "Meet_x.mp4"}))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert view.calls == []
+
+    loop.run_pending()
+    calls = view.take()
+    assert view.threads == {threading.current_thread()}
+    assert sum(1 for c in calls if c[:2] == ("notify", "Запись восстановлена")) == 8
+    assert calls.count(("queue", )) == 1
+    assert ui.saving == 0 and ui.active_jobs == 1
+    assert ui.icon == ICON_PROCESSING
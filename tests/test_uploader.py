@@ -0,0 +1,103 @@
+import os
+import threading
+
+import pytest
+
+from steno.uploader import ResumableUploader, UploadJournal, UploadError, CHUNK_GRANULARITY
+
+
+def make_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def received(state, path):
+    """Сколько байт файла приняла заглушка (по display_name)."""
+    name = os.path.basename(path)
+    return [u["received"] for u in state.uploads.values() if u["display_name"] == name]
+
+
+def test_upload_all_chunked(tmp_path, fake_api):
+    base_url, state = fake_api
+    paths = [make_file(tmp_path, f"part{i}.m4a", CHUNK_GRANULARITY * 3 + 1000 * i) for i in range(3)]
+    journal = UploadJournal(str(tmp_path / "journal.json"))
+    uploader = ResumableUploader("key", base_url=base_url, chunk_size=CHUNK_GRANULARITY, journal=journal)
+
+    remote_files, summary = uploader.upload_all(paths)
+
+    assert [f["displayName"] for f in remote_files] == [os.path.basename(p) for p in paths]
+    assert all(f["mimeType"] == "audio/mp4" for f in remote_files)
+    assert summary["sent"] == summary["bytes"] == sum(os.path.getsize(p) for p in paths)
+    for path in paths:
+        assert received(state, path) == [os.path.getsize(path)]
+    # Завершенные загрузки из журнала удаляются
+    assert journal.get(journal.key_for(paths[0])) is None
+
+
+def test_resume_from_journal_after_interrupt(tmp_path, fake_api):
+    base_url, state = fake_api
+    size = CHUNK_GRANULARITY * 5 + 123
+    path = make_file(tmp_path, "meeting.mp4", size)
+    journal_path = str(tmp_path / "journal.json")
+
+    # Прерываем загрузку после второго подтвержденного чанка
+    cancel = threading.Event()
+    journal = UploadJournal(journal_path)
+    update = journal.update
+
+    def update_and_cancel(key, **fields):
+        update(key, **fields)
+        if fields.get("offset", 0) >= 2 * CHUNK_GRANULARITY:
+            cancel.set()
+
+    journal.update = update_and_cancel
+    uploader = ResumableUploader("key", base_url=base_url, chunk_size=CHUNK_GRANULARITY, journal=journal, cancel_event=cancel)
+    with pytest.raises(UploadError):
+        uploader.upload(path)
+    assert received(state, path) == [2 * CHUNK_GRANULARITY]
+
+    # Новый процесс: журнал читается с диска, загрузка продолжается с того же смещения
+    uploader = ResumableUploader("key", base_url=base_url, chunk_size=CHUNK_GRANULARITY, journal=UploadJournal(journal_path))
+    remote_file, stats = uploader.upload(path)
+
+    assert remote_file["sizeBytes"] == str(size)
+    assert stats["resumed_from"] == 2 * CHUNK_GRANULARITY
+    assert stats["sent"] == size - 2 * CHUNK_GRANULARITY
+    # Вторая сессия не создавалась
+    assert received(state, path) == [size]
+
+
+def test_resume_after_final_chunk_was_accepted(tmp_path, fake_api):
+    base_url, state = fake_api
+    path = make_file(tmp_path, "done.m4a", CHUNK_GRANULARITY + 10)
+    journal = UploadJournal(str(tmp_path / "journal.json"))
+    uploader = ResumableUploader("key", base_url=base_url, chunk_size=CHUNK_GRANULARITY, journal=journal)
+    first, _ = uploader.upload(path)
+
+    # Ответ на последний чанк потерян: в журнале осталась сессия
+    upload_id = next(iter(state.uploads))
+    journal.update(journal.key_for(path), upload_url=f"{base_url}/upload/session/{upload_id}", offset=0)
+    remote_file, stats = uploader.upload(path)
+
+    assert remote_file["name"] == first["name"]
+    assert stats["sent"] == 0
+    assert len(state.uploads) == 1
+
+
+def test_expired_session_starts_over(tmp_path, fake_api):
+    base_url, state = fake_api
+    path = make_file(tmp_path, "old.m4a", CHUNK_GRANULARITY * 2)
+    journal = UploadJournal(str(tmp_path / "journal.json"))
+    journal.update(journal.key_for(path), upload_url=f"{base_url}/upload/session/gone", offset=CHUNK_GRANULARITY)
+    uploader = ResumableUploader("key", base_url=base_url, chunk_size=CHUNK_GRANULARITY, journal=journal)
+
+    _, stats = uploader.upload(path)
+
+    assert stats["resumed_from"] == 0
+    assert received(state, path) == [CHUNK_GRANULARITY * 2]
+
+
+def test_chunk_size_must_match_granularity(tmp_path):
+    with pytest.raises(ValueError):
+        ResumableUploader("key", chunk_size=CHUNK_GRANULARITY + 1, journal=UploadJournal(str(tmp_path / "journal.json")))
@@ -0,0 +1,105 @@
+import pytest
+
+from steno.vad import TimeMap, speech_spans, trim_settings, VAD_FRAME_SECONDS
+
+
+def make_map():
+    # Оставлены 10-20 и 50-70 секунд записи длиной 100 секунд
+    return TimeMap([(10, 20), (50, 70)], 100)
+
+
+def test_time_map_to_original():
+    time_map = make_map()
+    assert time_map.trimmed_duration == 30 and time_map.removed == 70
+    assert time_map.to_original(0) == 10
+    assert time_map.to_original(9.5) == 19.5
+    # Стык отрезков — начало следующего
+    assert time_map.to_original(10) == 50
+    assert time_map.to_original(29) == 69
+    # За концом обрезанной записи — от конца последнего отрезка
+    assert time_map.to_original(30) == 70
+    assert time_map.to_original(35) == 75
+    assert TimeMap([], 100).to_original(42) == 42
+
+
+def test_time_map_to_trimmed():
+    time_map = make_map()
+    assert time_map.to_trimmed(5) == 0
+    assert time_map.to_trimmed(10) == 0
+    assert time_map.to_trimmed(15) == 5
+    # Из вырезанной паузы — место склейки
+    assert time_map.to_trimmed(20) == 10
+    assert time_map.to_trimmed(30) == 10
+    assert time_map.to_trimmed(50) == 10
+    assert time_map.to_trimmed(60) == 20
+    assert time_map.to_trimmed(90) == 30
+    for t in (0, 5, 12.5, 25, 29.9):
+        assert time_map.to_trimmed(time_map.to_original(t)) == pytest.approx(t)
+
+
+def test_rewrite_timestamps():
+    time_map = make_map()
+    text = (
+        "00:00:05 Открытие встречи\n"
+        "[00:15] Обсуждение бюджета\n"
+        "[0:25] Итоги\n"
+        "| Отчет | Иван | 15:00 |\n"
+        "Версия 1:02:03:04 не таймкод\n"
+    )
+    assert time_map.rewrite_timestamps(text) == (
+        "00:00:15 Открытие встречи\n"
+        "[00:00:55] Обсуждение бюджета\n"
+        "[00:01:05] Итоги\n"
+        "| Отчет | Иван | 15:00 |\n"
+        "Версия 1:02:03:04 не таймкод\n"
+    )
+
+
+def test_time_map_round_trip(tmp_path):
+    path = str(tmp_path / "Meet_timemap.json")
+    make_map().save(path)
+    loaded = TimeMap.load(path)
+    assert loaded.spans == [(10, 20), (50, 70)] and loaded.duration == 100
+
+
+def test_trim_settings():
+    assert trim_settings({"trim_silence": False}) is None
+    assert trim_settings({})["min_silence"] == 10.0
+    assert trim_settings({"trim_min_silence_seconds": 20}) != trim_settings({})
+
+
+def energy(*parts):
+    """Синтетическая энергия кадров: [(секунды, дБ), ...] подряд."""
+    np = pytest.importorskip("numpy")
+    return np.concatenate([np.full(int(round(seconds / VAD_FRAME_SECONDS)), db, dtype=np.float32) for seconds, db in parts])
+
+
+SPEECH, SILENCE = -20.0, -80.0
+
+
+def assert_spans(actual, expected):
+    assert len(actual) == len(expected), actual
+    for (a, b), (c, d) in zip(actual, expected):
+        assert a == pytest.approx(c, abs=0.05) and b == pytest.approx(d, abs=0.05)
+
+
+def test_speech_spans_merge_and_padding():
+    meeting = energy((5, SPEECH), (25, SILENCE), (5, SPEECH), (5, SILENCE), (5, SPEECH), (15, SILENCE))
+    # Пауза 25 с вырезается, пауза 5 с (короче min_silence) остается; речь с запасом 1 с
+    assert_spans(speech_spans(meeting), [(0, 6), (29, 46)])
+    # Без запаса — ровно речь
+    assert_spans(speech_spans(meeting, pad=0), [(0, 5), (30, 45)])
+    # Минимальная пауза больше любой — один отрезок
+    assert_spans(speech_spans(meeting, min_silence=30), [(0, 46)])
+    # Пауза 25 с режется при min_silence чуть меньше ее и остается при чуть большем
+    assert_spans(speech_spans(meeting, pad=0, min_silence=24.9), [(0, 5), (30, 45)])
+    assert_spans(speech_spans(meeting, pad=0, min_silence=25.1), [(0, 45)])
+
+
+def test_speech_spans_silence_and_noise_floor():
+    np = pytest.importorskip("numpy")
+    assert speech_spans(np.array([], dtype=np.float32)) == []
+    assert speech_spans(energy((60, SILENCE))) == []
+    # Громкий фон: речь — только то, что заметно громче шумового пола
+    noisy = energy((20, -40.0), (5, -20.0), (20, -40.0))
+    assert_spans(speech_spans(noisy, pad=0), [(20, 25)])